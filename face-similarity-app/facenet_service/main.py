@@ -4,7 +4,17 @@ facenet_service/main.py
 Lightweight FastAPI microservice that returns Facenet512 face embeddings.
 
 Endpoints:
-  POST /embedding  — accepts image path or base64, returns 512-D embedding
+  POST /embedding      — accepts image path or base64, returns 512-D embedding
+  POST /embedding/raw  — binary protocol, no base64 / JSON on either side:
+                           request body  application/octet-stream: raw uint8
+                                           BGR pixels, shape in X-Image-Shape
+                                           ("H,W,C")
+                                         image/png | image/jpeg: encoded image
+                                         empty + X-Image-Name: .npy file in
+                                           FACENET_SHARED_DIR (same-host
+                                           handoff over a shared volume/tmpfs)
+                           response      512 little-endian float32
+                                           (application/octet-stream)
 
 Model is loaded ONCE at startup via lifespan event using a global singleton.
 DeepFace.represent() receives the pre-loaded MODEL object — never reloads.
@@ -17,11 +27,13 @@ import tempfile
 from contextlib import asynccontextmanager
 from typing import Optional
 
+import cv2
 import numpy as np
 import uvicorn
 from deepface import DeepFace
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Response
 from pydantic import BaseModel
+from starlette.concurrency import run_in_threadpool
 
 # ---------------------------------------------------------------------------
 # Logging
@@ -40,6 +52,11 @@ log = logging.getLogger("facenet_service")
 MODEL       = None   # DeepFace Facenet512 model object (Keras model)
 MODEL_READY = False  # True after successful warmup inference
 
+# Directory shared with the backend (docker volume / tmpfs) for the
+# X-Image-Name handoff of /embedding/raw; unset disables it
+SHARED_DIR     = os.environ.get("FACENET_SHARED_DIR") or None
+MAX_RAW_PIXELS = 4096 * 4096
+
 
 def _load_model() -> bool:
     """
@@ -162,6 +179,70 @@ def _resolve_image(req: EmbeddingRequest) -> str:
     )
 
 
+def _decode_raw_request(body: bytes, headers) -> np.ndarray:
+    """/embedding/raw body (pixels, PNG/JPEG, or shared-dir reference) → uint8 BGR image."""
+    name = headers.get("x-image-name")
+    if name:
+        if not SHARED_DIR:
+            raise HTTPException(status_code=400, detail="Shared-dir handoff disabled (FACENET_SHARED_DIR unset)")
+        if os.path.basename(name) != name or not name.endswith(".npy"):
+            raise HTTPException(status_code=400, detail=f"Invalid X-Image-Name: {name}")
+        try:
+            img = np.load(os.path.join(SHARED_DIR, name), allow_pickle=False)
+        except (OSError, ValueError) as exc:
+            raise HTTPException(status_code=400, detail=f"Cannot read shared image {name}: {exc}")
+        if img.dtype != np.uint8 or img.ndim not in (2, 3):
+            raise HTTPException(status_code=400, detail=f"Shared image must be uint8 HxW[xC], got {img.dtype} {img.shape}")
+        return img
+
+    content_type = headers.get("content-type", "").split(";")[0].strip()
+    if content_type in ("image/png", "image/jpeg"):
+        img = cv2.imdecode(np.frombuffer(body, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if img is None:
+            raise HTTPException(status_code=400, detail=f"Cannot decode {content_type} body")
+        return img
+
+    if content_type == "application/octet-stream":
+        try:
+            shape = tuple(int(v) for v in headers.get("x-image-shape", "").split(","))
+        except ValueError:
+            shape = ()
+        if len(shape) not in (2, 3) or min(shape) <= 0 or shape[0] * shape[1] > MAX_RAW_PIXELS:
+            raise HTTPException(status_code=400, detail="X-Image-Shape must be 'H,W' or 'H,W,C'")
+        if int(np.prod(shape)) != len(body):
+            raise HTTPException(
+                status_code=400,
+                detail=f"Body is {len(body)} bytes, X-Image-Shape {shape} needs {int(np.prod(shape))}",
+            )
+        return np.frombuffer(body, dtype=np.uint8).reshape(shape).copy()   # writable for DeepFace
+
+    raise HTTPException(status_code=415, detail=f"Unsupported Content-Type: {content_type or 'none'}")
+
+
+def _embed(img) -> np.ndarray:
+    """Facenet512 embedding (L2-normalized float32) for an image path or uint8 BGR array."""
+    # Pass "Facenet512" string — DeepFace resolves the already-loaded model
+    # from its internal registry. Passing the object directly is not supported.
+    result = DeepFace.represent(
+        img_path=img,
+        model_name="Facenet512",
+        enforce_detection=False,
+        align=True,
+        detector_backend="opencv",
+    )
+
+    if not result or "embedding" not in result[0]:
+        raise HTTPException(
+            status_code=422,
+            detail="DeepFace returned empty result — no face detected",
+        )
+
+    raw  = np.array(result[0]["embedding"], dtype=np.float32)
+    norm = np.linalg.norm(raw)
+    log.info("Embedding extracted — dim=%d, norm=%.4f", len(raw), norm)
+    return raw / norm if norm > 0 else raw
+
+
 # ---------------------------------------------------------------------------
 # Endpoints
 # ---------------------------------------------------------------------------
@@ -172,6 +253,8 @@ def health():
         "status":       "ready" if MODEL_READY else "initializing",
         "model":        "Facenet512",
         "model_loaded": MODEL_READY,
+        "raw_protocol": True,
+        "shared_dir":   SHARED_DIR is not None,
     }
 
 
@@ -205,30 +288,7 @@ def get_embedding(req: EmbeddingRequest):
 
     try:
         log.info("Running Facenet512 inference on: %s", os.path.basename(image_path))
-
-        # Pass "Facenet512" string — DeepFace resolves the already-loaded model
-        # from its internal registry. Passing the object directly is not supported.
-        result = DeepFace.represent(
-            img_path=image_path,
-            model_name="Facenet512",
-            enforce_detection=False,
-            align=True,
-            detector_backend="opencv",
-        )
-
-        if not result or "embedding" not in result[0]:
-            raise HTTPException(
-                status_code=422,
-                detail="DeepFace returned empty result — no face detected",
-            )
-
-        raw = np.array(result[0]["embedding"], dtype=np.float32)
-
-        # L2 normalize
-        norm      = np.linalg.norm(raw)
-        embedding = (raw / norm if norm > 0 else raw).tolist()
-
-        log.info("Embedding extracted — dim=%d, norm=%.4f", len(embedding), norm)
+        embedding = _embed(image_path).tolist()
 
         return EmbeddingResponse(
             embedding=embedding,
@@ -245,6 +305,38 @@ def get_embedding(req: EmbeddingRequest):
             os.remove(tmp_path)
 
 
+@app.post("/embedding/raw")
+async def get_embedding_raw(request: Request):
+    """
+    Binary twin of /embedding: pixels (or PNG/JPEG, or a shared-dir .npy) in,
+    512 little-endian float32 out. Skips base64, JSON and the temp file.
+    """
+    if not MODEL_READY:
+        raise HTTPException(
+            status_code=503,
+            detail="Model is still initializing. Retry in a moment.",
+        )
+
+    body = await request.body()
+    img  = _decode_raw_request(body, request.headers)
+
+    try:
+        log.info("Running Facenet512 inference on raw %s input", "x".join(str(d) for d in img.shape))
+        # Inference blocks; keep it off the event loop like the sync endpoint
+        embedding = await run_in_threadpool(_embed, img)
+    except HTTPException:
+        raise
+    except Exception as exc:
+        log.error("Inference failed: %s", exc)
+        raise HTTPException(status_code=500, detail=str(exc))
+
+    return Response(
+        content=embedding.astype("<f4").tobytes(),
+        media_type="application/octet-stream",
+        headers={"X-Embedding-Dim": str(len(embedding))},
+    )
+
+
 # ---------------------------------------------------------------------------
 # Entry point
 # ---------------------------------------------------------------------------
@@ -34,13 +34,11 @@ from datetime import datetime, timezone
 
 # Import utility functions from modular structure
 from utils.file_utils import (
-    generate_temp_filepath,
-    cleanup_temp_file,
     get_file_hash,
-    save_temp_file,
-    save_bytes_to_temp,
+    read_upload_image,
     set_temp_uploads_dir
 )
+from utils.image_context import ImageContext
 from utils.similarity_utils import cosine_similarity
 from utils.cache_utils import (
     RESULT_CACHE,
@@ -48,13 +46,16 @@ from utils.cache_utils import (
     get_cached_result,
     set_cached_result,
     clear_cache as clear_result_cache,
-    get_cache_stats
+    get_cache_stats,
+    clear_image_cache,
+    get_image_cache_stats,
 )
 
 # Import preprocessing functions from modular structure
 from preprocessing.sketch_photo_preprocess import (
     is_sketch_image,
     preprocess_for_edge_based_matching,
+    preprocess_for_edge_based_matching_array,
     preprocess_for_cross_domain_matching,
     preprocess_with_adaptive_canny
 )
@@ -63,9 +64,11 @@ from preprocessing.sketch_photo_preprocess import (
 from services.s3_service import upload_criminal_photo, delete_criminal_photo, get_signed_url
 from services.embedding_service import (
     initialize_models,
+    ensure_insightface_session,
     is_models_initialized,
     extract_embedding,
     extract_dual_embeddings,
+    join_dual_embeddings,
     extract_embedding_with_tta,
     generate_tta_augmentations
 )
@@ -82,6 +85,8 @@ from services.face_comparison_service import (
 
 # Import S3 model loader
 from utils.s3_model_loader import setup_models
+from models.insightface_model import get_model_file_hash
+from models.model_registry import get_registry_stats
 
 app = Flask(__name__)
 CORS(app)
@@ -123,18 +128,54 @@ from services.faiss_service import (
     clear_embedding_cache,
     get_cache_size,
     build_faiss_index,
+    add_embedding,
+    remove_embedding,
     is_faiss_index_ready,
     get_faiss_index_stats,
     search_top_k_candidates,
+    search_top_k_candidates_batch,
+    aggregate_batch_candidates,
+    search_range_candidates,
+    model_weights,
+    RANGE_SEARCH_MAX_RESULTS,
     EMBEDDING_CACHE,
-    EMBEDDING_VERSION,
     FAISS_INDEX_DIRTY
 )
+from services.filter_service import set_criminal_attributes, set_case_links, compile_filter
+from services.snapshot_service import load_or_build_faiss_index, shared_gallery_write, GalleryPublishError
+from services.reranking_service import rerank_candidates
+
+# Upper bound on sketch variants accepted by /api/criminals/search/batch
+MAX_BATCH_SKETCHES = 50
 
 # File-based readiness flag — visible to all processes on the same host
 STARTUP_FLAG_PATH = os.path.join(os.path.dirname(__file__), 'startup_complete.flag')
 
 
+def _gallery_write(write, *args, **kwargs):
+    """
+    Apply a search-side gallery write that follows a DB commit.
+
+    The commit has already happened, so a write that cannot be published to
+    the other workers (GalleryPublishError) must not turn into a 500: it
+    stays live in this worker and goes out with the next write's snapshot.
+    Returns a warning for the response, or None.
+    """
+    try:
+        with shared_gallery_write():
+            write(*args, **kwargs)
+    except GalleryPublishError as e:
+        print(f"[WARN] Gallery write not published to other workers: {e}", flush=True)
+        return "Saved. Other server workers may serve stale search results until the next gallery write."
+    return None
+
+
+def _with_warning(payload: dict, warning):
+    if warning:
+        payload["warning"] = warning
+    return payload
+
+
 # ============================================================================
 # PRECOMPUTE DATABASE EMBEDDINGS
 # ============================================================================
@@ -145,17 +186,22 @@ STARTUP_FLAG_PATH = os.path.join(os.path.dirname(__file__), 'startup_complete.fl
 def precompute_database_embeddings():
     """
     Precompute and cache dual embeddings (InsightFace + Facenet) for all criminals in database.
-    Called at startup. Persists embeddings to DB so they survive server restarts.
+    Called at startup. Persists embeddings to DB so they survive server restarts;
+    stored embeddings from another InsightFace model file are recomputed.
     Uses enforce_detection=False so imperfect/sketch-style photos don't cause failures.
     """
     print("\n" + "="*60)
     print("PRECOMPUTING DATABASE DUAL EMBEDDINGS (InsightFace + Facenet)")
     print("="*60)
 
+    # Stored embeddings are only reused if they came from the current model file
+    embedding_version = get_embedding_version(get_model_file_hash())
+
     db = next(get_db())
     try:
         criminals = db.query(Criminal).all()
         print(f"Found {len(criminals)} criminals in database")
+        print(f"Embedding version: {embedding_version}")
 
         updated_count = 0
         cached_count  = 0
@@ -163,12 +209,21 @@ def precompute_database_embeddings():
 
         for criminal in criminals:
             try:
+                # ── Filterable metadata (sex / nationality / status / cases) ──
+                set_criminal_attributes(
+                    criminal.criminal_id,
+                    sex=criminal.sex,
+                    nationality=criminal.nationality,
+                    status=criminal.status,
+                    case_id=[case.id for case in criminal.cases],
+                )
+
                 # ── Fast path: valid embedding already in DB ──────────────
                 if (
                     criminal.face_embedding
                     and isinstance(criminal.face_embedding, dict)
                     and 'insightface' in criminal.face_embedding
-                    and criminal.embedding_version == EMBEDDING_VERSION
+                    and criminal.embedding_version == embedding_version
                 ):
                     ins_emb  = np.array(criminal.face_embedding['insightface'])
                     face_emb = np.array(criminal.face_embedding['facenet']) \
@@ -194,70 +249,64 @@ def precompute_database_embeddings():
                     failed_count += 1
                     continue
 
-                temp_path = generate_temp_filepath(
-                    original_filename=criminal.photo_filename or 'criminal.jpg',
-                    prefix='criminal'
-                )
+                # Download into memory and decode once (no temp file)
+                import urllib.request as _urlreq
+                with _urlreq.urlopen(signed_url, timeout=60) as resp:
+                    photo_bytes = resp.read()
+
                 try:
-                    import urllib.request as _urlreq
-                    _urlreq.urlretrieve(signed_url, temp_path)
-
-                    if not os.path.exists(temp_path):
-                        print(f"  [ERROR] Temp file not created for {criminal.criminal_id} — skipping")
-                        failed_count += 1
-                        continue
-
-                    test_img = cv2.imread(temp_path)
-                    if test_img is None:
-                        print(f"  [ERROR] cv2.imread() failed for {criminal.criminal_id} — skipping")
-                        failed_count += 1
-                        continue
-
-                    # enforce_detection=False — tolerate imperfect/non-frontal photos
-                    embeddings = extract_dual_embeddings(
-                        temp_path,
-                        is_sketch=False,
-                        use_adaptive_canny=False
-                    )
-
-                    if not embeddings or not embeddings.get('success'):
-                        print(f"  [ERROR] extract_dual_embeddings failed for {criminal.criminal_id}: "
-                              f"{embeddings.get('error') if embeddings else 'None returned'}")
-                        failed_count += 1
-                        continue
-
-                    insightface_emb = embeddings['insightface']
-                    facenet_emb     = embeddings['facenet']
-
-                    # Mirror missing slot (one model may be unavailable)
-                    if insightface_emb is None and facenet_emb is not None:
-                        insightface_emb = facenet_emb
-                        print(f"  [INFO] InsightFace unavailable — mirroring Facenet for {criminal.criminal_id}")
-                    elif facenet_emb is None and insightface_emb is not None:
-                        facenet_emb = insightface_emb
-                        print(f"  [INFO] Facenet unavailable — mirroring InsightFace for {criminal.criminal_id}")
-
-                    if insightface_emb is None or facenet_emb is None:
-                        print(f"  [ERROR] Both embeddings None for {criminal.criminal_id} — skipping")
-                        failed_count += 1
-                        continue
-
-                    # ── Persist to DB (critical — survives restarts) ──────
-                    criminal.face_embedding = {
-                        'insightface': insightface_emb.tolist(),
-                        'facenet':     facenet_emb.tolist() if facenet_emb is not None else None,
-                    }
-                    criminal.embedding_version = EMBEDDING_VERSION
-                    db.commit()
+                    photo_img = ImageContext(photo_bytes, filename=criminal.photo_filename or criminal.criminal_id)
+                except IOError:
+                    print(f"  [ERROR] Image decode failed for {criminal.criminal_id} — skipping")
+                    failed_count += 1
+                    continue
 
-                    # ── Populate in-memory cache ──────────────────────────
-                    set_cached_embedding(criminal.criminal_id, insightface_emb, facenet_emb)
+                # Under gunicorn the master defers the session; load it only now
+                ensure_insightface_session()
 
-                    updated_count += 1
-                    print(f"  [CACHE LOAD] {criminal.criminal_id} — computed + persisted + loaded into memory cache")
+                # enforce_detection=False — tolerate imperfect/non-frontal photos
+                embeddings = extract_dual_embeddings(
+                    photo_img,
+                    is_sketch=False,
+                    use_adaptive_canny=False
+                )
+
+                if not embeddings or not embeddings.get('success'):
+                    print(f"  [ERROR] extract_dual_embeddings failed for {criminal.criminal_id}: "
+                          f"{embeddings.get('error') if embeddings else 'None returned'}")
+                    failed_count += 1
+                    continue
+
+                insightface_emb = embeddings['insightface']
+                facenet_emb     = embeddings['facenet']
+
+                # Mirror missing slot (one model may be unavailable)
+                if insightface_emb is None and facenet_emb is not None:
+                    insightface_emb = facenet_emb
+                    print(f"  [INFO] InsightFace unavailable — mirroring Facenet for {criminal.criminal_id}")
+                elif facenet_emb is None and insightface_emb is not None:
+                    facenet_emb = insightface_emb
+                    print(f"  [INFO] Facenet unavailable — mirroring InsightFace for {criminal.criminal_id}")
+
+                if insightface_emb is None or facenet_emb is None:
+                    print(f"  [ERROR] Both embeddings None for {criminal.criminal_id} — skipping")
+                    failed_count += 1
+                    continue
+
+                # ── Persist to DB (critical — survives restarts) ──────
+                criminal.face_embedding = {
+                    'insightface': insightface_emb.tolist(),
+                    'facenet':     facenet_emb.tolist() if facenet_emb is not None else None,
+                }
+                criminal.embedding_version = embedding_version
+                db.commit()
+
+                # ── Populate in-memory cache ──────────────────────────
+                set_cached_embedding(criminal.criminal_id, insightface_emb, facenet_emb)
+
+                updated_count += 1
+                print(f"  [CACHE LOAD] {criminal.criminal_id} — computed + persisted + loaded into memory cache")
 
-                finally:
-                    cleanup_temp_file(temp_path)
 
             except Exception as e:
                 print(f"  [ERROR] Unexpected error for {criminal.criminal_id}: {e}")
@@ -276,8 +325,8 @@ def precompute_database_embeddings():
         print(f"  Total in memory cache             : {get_cache_size()}")
         print("="*60 + "\n")
 
-        # Build FAISS index after all embeddings are in cache
-        build_faiss_index()
+        # Load the FAISS snapshot (replaying the delta) or build from the cache
+        load_or_build_faiss_index(model_hash=get_model_file_hash())
 
     except Exception as e:
         print(f"[ERROR] precompute_database_embeddings() failed: {e}")
@@ -397,7 +446,7 @@ _run_startup()
 # Keep these for testing and validation purposes
 # ============================================================================
 
-def compare_with_edge_preprocessing(sketch_path: str, photo_path: str) -> dict:
+def compare_with_edge_preprocessing(sketch_path, photo_path) -> dict:
     """
     STEP 2: Compare two images using edge-based preprocessing + ArcFace
     
@@ -407,8 +456,8 @@ def compare_with_edge_preprocessing(sketch_path: str, photo_path: str) -> dict:
     Applies edge preprocessing to both images, then uses ArcFace for comparison.
     
     Args:
-        sketch_path: Path to sketch image
-        photo_path: Path to photo image
+        sketch_path: ImageContext (or path) of the sketch image
+        photo_path: ImageContext (or path) of the photo image
     
     Returns:
         dict with similarity score and metadata
@@ -424,9 +473,9 @@ def compare_with_edge_preprocessing(sketch_path: str, photo_path: str) -> dict:
     processed_img2 = None
     
     try:
-        # Apply edge-based preprocessing
-        processed_img1 = preprocess_for_edge_based_matching(sketch_path, is_sketch=is_img1_sketch)
-        processed_img2 = preprocess_for_edge_based_matching(photo_path, is_sketch=is_img2_sketch)
+        # Apply edge-based preprocessing (in memory - nothing to clean up)
+        processed_img1 = preprocess_for_edge_based_matching_array(sketch_path, is_sketch=is_img1_sketch)
+        processed_img2 = preprocess_for_edge_based_matching_array(photo_path, is_sketch=is_img2_sketch)
         
         # Run ArcFace on preprocessed images
         print("  [STEP 2] DeepFace removed — test endpoint disabled")
@@ -449,19 +498,6 @@ def compare_with_edge_preprocessing(sketch_path: str, photo_path: str) -> dict:
             'model_verified': False,
             'error': str(e)
         }
-    
-    finally:
-        # Cleanup preprocessed images
-        if processed_img1 and processed_img1 != sketch_path:
-            try:
-                os.remove(processed_img1)
-            except:
-                pass
-        if processed_img2 and processed_img2 != photo_path:
-            try:
-                os.remove(processed_img2)
-            except:
-                pass
 
 
 # ============================================================================
@@ -1118,77 +1154,76 @@ def add_criminal():
         # ================================================================
         # AUTOMATIC FAISS INDEX UPDATE
         # ================================================================
-        # Extract embeddings and rebuild FAISS index so the new criminal
-        # becomes searchable immediately without server restart
+        # Extract embeddings and add them to the FAISS indexes in place so
+        # the new criminal becomes searchable immediately (no full rebuild)
 
         try:
             print(f"\n[EMBEDDING EXTRACTION] Processing new criminal: {new_criminal.full_name}")
 
-            # Save photo to temporary file for embedding extraction
-            temp_photo_path = save_bytes_to_temp(photo_data, photo_file.filename or 'criminal.jpg')
+            # Decode the photo bytes already in memory (no temp file)
+            photo_img = ImageContext(photo_data, filename=photo_file.filename or 'criminal.jpg')
 
-            try:
-                # Extract dual embeddings (InsightFace + Facenet)
-                embeddings = extract_dual_embeddings(
-                    image_path=temp_photo_path,
-                    is_sketch=False,
-                    use_adaptive_canny=False
-                )
+            # Extract dual embeddings (InsightFace + Facenet)
+            embeddings = extract_dual_embeddings(
+                image_path=photo_img,
+                is_sketch=False,
+                use_adaptive_canny=False
+            )
 
-                if embeddings and embeddings.get('success'):
-                    insightface_emb = embeddings['insightface']
-                    facenet_emb     = embeddings['facenet']
-
-                    # Mirror missing slot if one model is unavailable
-                    if insightface_emb is None and facenet_emb is not None:
-                        insightface_emb = facenet_emb
-                        print(f"  [INFO] InsightFace unavailable — mirroring Facenet")
-                    elif facenet_emb is None and insightface_emb is not None:
-                        facenet_emb = insightface_emb
-                        print(f"  [INFO] Facenet unavailable — mirroring InsightFace")
-
-                    if insightface_emb is not None and facenet_emb is not None:
-                        # ── Persist embeddings to DB (survives restarts) ──
-                        db2 = next(get_db())
-                        try:
-                            db_criminal = db2.query(Criminal).filter(
-                                Criminal.criminal_id == new_criminal.criminal_id
-                            ).first()
-                            if db_criminal:
-                                db_criminal.face_embedding = {
-                                    'insightface': insightface_emb.tolist(),
-                                    'facenet':     facenet_emb.tolist()
-                                }
-                                db_criminal.embedding_version = EMBEDDING_VERSION
-                                db2.commit()
-                                print(f"  [OK] Embeddings persisted to DB for: {new_criminal.criminal_id}")
-                        except Exception as db_err:
-                            db2.rollback()
-                            print(f"  [WARNING] Failed to persist embeddings to DB: {db_err}")
-                        finally:
-                            db2.close()
-
-                        # ── Populate in-memory cache ──────────────────────
-                        set_cached_embedding(
+            if embeddings and embeddings.get('success'):
+                insightface_emb = embeddings['insightface']
+                facenet_emb     = embeddings['facenet']
+
+                # Mirror missing slot if one model is unavailable
+                if insightface_emb is None and facenet_emb is not None:
+                    insightface_emb = facenet_emb
+                    print(f"  [INFO] InsightFace unavailable — mirroring Facenet")
+                elif facenet_emb is None and insightface_emb is not None:
+                    facenet_emb = insightface_emb
+                    print(f"  [INFO] Facenet unavailable — mirroring InsightFace")
+
+                if insightface_emb is not None and facenet_emb is not None:
+                    # ── Persist embeddings to DB (survives restarts) ──
+                    db2 = next(get_db())
+                    try:
+                        db_criminal = db2.query(Criminal).filter(
+                            Criminal.criminal_id == new_criminal.criminal_id
+                        ).first()
+                        if db_criminal:
+                            db_criminal.face_embedding = {
+                                'insightface': insightface_emb.tolist(),
+                                'facenet':     facenet_emb.tolist()
+                            }
+                            db_criminal.embedding_version = get_embedding_version(get_model_file_hash())
+                            db2.commit()
+                            print(f"  [OK] Embeddings persisted to DB for: {new_criminal.criminal_id}")
+                    except Exception as db_err:
+                        db2.rollback()
+                        print(f"  [WARNING] Failed to persist embeddings to DB: {db_err}")
+                    finally:
+                        db2.close()
+
+                    # ── Populate cache + add to FAISS in place ────────
+                    with shared_gallery_write():
+                        add_embedding(
                             criminal_id=new_criminal.criminal_id,
                             insightface_embedding=insightface_emb,
                             facenet_embedding=facenet_emb
                         )
-                        print(f"  [CACHE LOAD] {new_criminal.criminal_id} — new criminal loaded into memory cache")
-
-                        # ── Rebuild FAISS index ───────────────────────────
-                        print(f"  [FAISS] Rebuilding index to include new criminal...")
-                        build_faiss_index()
-                        print(f"  [OK] FAISS index rebuilt — new criminal is now searchable")
-                    else:
-                        print(f"  [WARNING] Both embeddings None — criminal saved but not searchable")
+                        set_criminal_attributes(
+                            new_criminal.criminal_id,
+                            sex=new_criminal.sex,
+                            nationality=new_criminal.nationality,
+                            status=new_criminal.status,
+                            case_id=[],
+                        )
+                    print(f"  [OK] {new_criminal.criminal_id} — added to memory cache + FAISS, now searchable")
                 else:
-                    err = embeddings.get('error') if embeddings else 'None returned'
-                    print(f"  [WARNING] Embedding extraction failed: {err}")
-                    print(f"  [WARNING] Criminal saved but not immediately searchable")
-
-            finally:
-                cleanup_temp_file(temp_photo_path)
+                    print(f"  [WARNING] Both embeddings None — criminal saved but not searchable")
+            else:
+                err = embeddings.get('error') if embeddings else 'None returned'
+                print(f"  [WARNING] Embedding extraction failed: {err}")
+                print(f"  [WARNING] Criminal saved but not immediately searchable")
 
         except Exception as e:
             # Log error but don't fail the request — criminal record is already saved
@@ -1315,10 +1350,14 @@ def delete_criminal(criminal_id):
             print(f"[S3] No photo_key for {criminal.criminal_id}, skipping S3 delete", flush=True)
 
         # --- DB delete ---
+        criminal_id_str = criminal.criminal_id
         db.delete(criminal)
         db.commit()
 
-        return jsonify({"message": "Criminal deleted successfully"}), 200
+        # --- Evict from embedding cache + FAISS so it stops matching ---
+        warning = _gallery_write(remove_embedding, criminal_id_str)
+
+        return jsonify(_with_warning({"message": "Criminal deleted successfully"}, warning)), 200
 
     except Exception as e:
         if db:
@@ -1359,517 +1398,440 @@ def search_criminals():
         sketch_file = request.files['sketch']
         threshold = float(request.form.get('threshold', 0.2))  # Lowered for sketch matching
 
+        # search_mode=range: every candidate whose fused calibrated score is
+        # >= min_score (no default - a loose bound would prune nothing), up to
+        # max_results, returned as one capped list instead of a fixed Top-K
+        search_mode = request.form.get('search_mode', 'topk').lower()
+        if search_mode not in ('topk', 'range'):
+            return jsonify({"error": f"Unknown search_mode: {search_mode}"}), 400
+        min_score = None
+        if search_mode == 'range':
+            if not request.form.get('min_score'):
+                return jsonify({"error": "search_mode=range requires min_score"}), 400
+            try:
+                min_score = float(request.form['min_score'])
+                max_results = int(request.form.get('max_results', RANGE_SEARCH_MAX_RESULTS))
+            except ValueError as e:
+                return jsonify({"error": f"Invalid range parameters: {e}"}), 400
+            max_results = min(max(max_results, 1), RANGE_SEARCH_MAX_RESULTS)
+
+        # Optional metadata filter, e.g. {"sex": "Male", "status": ["Suspect"], "case_id": 12}
+        filters = None
+        if request.form.get('filters'):
+            try:
+                filters = json.loads(request.form['filters'])
+                compile_filter(filters)   # validate attribute names up front
+            except (ValueError, TypeError, AttributeError) as e:
+                return jsonify({"error": f"Invalid filters: {e}"}), 400
+            print(f"Metadata filters: {filters}")
+
         print(f"Sketch file received: {sketch_file.filename}")
         print(f"Distance threshold: {threshold}")
 
-        # Save sketch to temporary file
-        sketch_path = save_temp_file(sketch_file)
-        print(f"Sketch saved to: {sketch_path}")
+        # Decode the sketch once, in memory (no temp file)
+        sketch_img = read_upload_image(sketch_file)
+        print(f"Sketch decoded: {sketch_img}")
 
-        try:
-            # Extract DUAL embeddings for query sketch ONCE
-            print(f"\n[QUERY DUAL EMBEDDING] Extracting dual embeddings (InsightFace + Facenet) for sketch...")
-            query_embeddings = extract_dual_embeddings(sketch_path, is_sketch=True)
+        # Extract DUAL embeddings for query sketch ONCE
+        print(f"\n[QUERY DUAL EMBEDDING] Extracting dual embeddings (InsightFace + Facenet) for sketch...")
+        # Same sketch submitted again (or already compared) → per-image cache hit, no inference
+        query_embeddings = extract_dual_embeddings(sketch_img, is_sketch=True, use_cache=True)
 
-            if query_embeddings is None or not query_embeddings['success']:
-                return jsonify({"error": "Failed to extract dual embeddings from sketch"}), 400
+        if query_embeddings is None or not query_embeddings['success']:
+            return jsonify({"error": "Failed to extract dual embeddings from sketch"}), 400
 
-            print(f"  [OK] Query dual embeddings extracted:")
-            if query_embeddings['insightface'] is not None:
-                print(f"    InsightFace: length={len(query_embeddings['insightface'])}, normalized")
-            else:
-                print(f"    InsightFace: unavailable (model not loaded)")
-            if query_embeddings['facenet'] is not None:
-                print(f"    Facenet: length={len(query_embeddings['facenet'])}, normalized")
-            else:
-                print(f"    Facenet: unavailable (model not loaded)")
+        print(f"  [OK] Query dual embeddings extracted:")
+        if query_embeddings['insightface'] is not None:
+            print(f"    InsightFace: length={len(query_embeddings['insightface'])}, normalized")
+        else:
+            print(f"    InsightFace: unavailable (model not loaded)")
+        if query_embeddings['facenet'] is not None:
+            print(f"    Facenet: length={len(query_embeddings['facenet'])}, normalized")
+        else:
+            print(f"    Facenet: unavailable (model not loaded)")
             
-            # Get all criminals from database
-            db = next(get_db())
-            criminals = db.query(Criminal).all()
+        # Get all criminals from database
+        db = next(get_db())
+        criminals = db.query(Criminal).all()
             
-            # ================================================================
-            # STAGE 1: FAST RETRIEVAL - Dual FAISS (InsightFace + Facenet)
-            # ================================================================
-            print(f"\n[STAGE 1: FAST RETRIEVAL]")
-
-            # Detect if query is a sketch for adaptive weighting
-            from preprocessing.sketch_photo_preprocess import is_sketch_image
-            is_sketch_query = is_sketch_image(sketch_path)
-            print(f"  Query type: {'SKETCH' if is_sketch_query else 'PHOTO'}")
-
-            # Adaptive fusion weights (same used in Stage 1 and Stage 2)
-            if is_sketch_query:
-                W_FACE = 0.9
-                W_INS  = 0.1
-            else:
-                W_FACE = 0.5
-                W_INS  = 0.5
-            print(f"  Fusion weights: InsightFace={W_INS:.2f}, Facenet={W_FACE:.2f}")
+        # ================================================================
+        # STAGE 1: FAST RETRIEVAL - Dual FAISS (InsightFace + Facenet)
+        # ================================================================
+        print(f"\n[STAGE 1: FAST RETRIEVAL]")
+
+        # Detect if query is a sketch for adaptive weighting (classified once per upload)
+        is_sketch_query = sketch_img.is_sketch
+        print(f"  Query type: {'SKETCH' if is_sketch_query else 'PHOTO'}")
+
+        # Adaptive fusion weights from the model registry (same used in Stage 1 and Stage 2)
+        weights = model_weights(is_sketch_query)
+        print("  Fusion weights: " + ", ".join(f"{model}={w:.2f}" for model, w in weights.items()))
 
-            top_k = int(request.form.get('top_k', 10))
-            top_k = min(max(top_k, 1), 50)
+        top_k = int(request.form.get('top_k', 10))
+        top_k = min(max(top_k, 1), 50)
 
-            criminal_ids = [c.criminal_id for c in criminals]
+        criminal_ids = [c.criminal_id for c in criminals]
 
-            query_insightface = query_embeddings['insightface']
-            query_facenet     = query_embeddings.get('facenet')
+        query_insightface = query_embeddings['insightface']
+        query_facenet     = query_embeddings.get('facenet')
 
-            # Mirror missing model so fusion still works
-            if query_insightface is None and query_facenet is not None:
-                query_insightface = query_facenet
-                print("  [WARN] InsightFace unavailable - mirroring Facenet")
-            elif query_facenet is None and query_insightface is not None:
-                query_facenet = query_insightface
-                print("  [WARN] Facenet unavailable - mirroring InsightFace")
+        # Mirror missing model so fusion still works
+        if query_insightface is None and query_facenet is not None:
+            query_insightface = query_facenet
+            print("  [WARN] InsightFace unavailable - mirroring Facenet")
+        elif query_facenet is None and query_insightface is not None:
+            query_facenet = query_insightface
+            print("  [WARN] Facenet unavailable - mirroring InsightFace")
 
+        range_pruned = False
+        if search_mode == 'range':
+            search_results, range_pruned = search_range_candidates(
+                query_insightface,
+                query_facenet,
+                min_score=min_score,
+                is_sketch=is_sketch_query,
+                max_results=max_results,
+                filters=filters,
+            )
+            use_faiss = is_faiss_index_ready()
+            print(f"  Range search: {len(search_results)} candidates, pruned={range_pruned}")
+            known_ids = set(criminal_ids)
+            search_results = [r for r in search_results if r['criminal_id'] in known_ids]
+        else:
             search_results, use_faiss = search_top_k_candidates(
                 query_insightface,
                 query_facenet,
                 criminal_ids,
                 top_k,
                 is_sketch=is_sketch_query,
+                filters=filters,
             )
 
-            # ── Calibration helper (mirrors faiss_service) ──────────────────
-            def _cal(sim):
-                """Raw cosine [-1,1] -> calibrated [0,1]."""
-                return (float(sim) + 1.0) / 2.0
-
-            # Normalize query vectors once
-            q_ins_n  = query_insightface / (np.linalg.norm(query_insightface) + 1e-10) \
-                       if query_insightface is not None else None
-            q_face_n = query_facenet / (np.linalg.norm(query_facenet) + 1e-10) \
-                       if query_facenet is not None else None
+        # ================================================================
+        # STAGE 2: RE-RANKING — uses cached embeddings, NO S3 download,
+        # NO TTA recomputation. Query embedding computed once above;
+        # scoring, ranking and annotation run vectorised over the shortlist.
+        # ================================================================
+        criminal_dict  = {c.criminal_id: c for c in criminals}
+        shortlist      = [r for r in search_results if r['criminal_id'] in criminal_dict]
 
-            criminal_dict   = {c.criminal_id: c for c in criminals}
-            top_k_candidates = []
+        def _criminal_record(criminal_id):
+            criminal = criminal_dict[criminal_id]
+            return {
+                "id": criminal.id,
+                "criminal_id": criminal.criminal_id,
+                "status": criminal.status,
+                "full_name": criminal.full_name,
+                "aliases": criminal.aliases,
+                "dob": criminal.dob,
+                "sex": criminal.sex,
+                "nationality": criminal.nationality,
+                "ethnicity": criminal.ethnicity,
+                "appearance": criminal.appearance,
+                "locations": criminal.locations,
+                "summary": criminal.summary,
+                "forensics": criminal.forensics,
+                "evidence": criminal.evidence,
+                "witness": criminal.witness,
+                "created_at": criminal.created_at.isoformat()
+            }
 
-            for result in search_results:
-                criminal_id = result['criminal_id']
-                if criminal_id not in criminal_dict:
-                    continue
+        matches, distribution_stats = rerank_candidates(
+            query_embeddings,
+            shortlist,
+            weights,
+            _criminal_record,
+            is_sketch=is_sketch_query,
+        )
 
-                cached = get_cached_embedding(criminal_id)
-                if cached is not None:
-                    # Recompute calibrated scores from cache for consistency
-                    s_ins = 0.5
-                    if cached.get("insightface") is not None and q_ins_n is not None:
-                        c_ins_n = cached["insightface"] / (np.linalg.norm(cached["insightface"]) + 1e-10)
-                        s_ins   = _cal(float(np.dot(q_ins_n, c_ins_n)))
+        print(f"\n[RE-RANKING COMPLETE]")
+        print(f"  Final ranking:")
+        for idx, match in enumerate(matches, 1):
+            print(f"    Rank {idx}: {match['criminal']['full_name']} (Score: {match['raw_similarity_score']:.4f}, Stage1 Rank: {match['stage1_rank']})")
 
-                    s_face = 0.5
-                    if cached.get("facenet") is not None and q_face_n is not None:
-                        c_face_n = cached["facenet"] / (np.linalg.norm(cached["facenet"]) + 1e-10)
-                        s_face   = min(_cal(float(np.dot(q_face_n, c_face_n))), 0.875)  # clamp
+        # ================================================================
+        # SIMILARITY DISTRIBUTION ANALYSIS
+        # ================================================================
+        mean_similarity = distribution_stats.get("mean", 0.0)
+        std_similarity  = distribution_stats.get("std_dev", 0.0)
+
+        if len(matches) > 0:
+            print(f"\n[SIMILARITY DISTRIBUTION]")
+            print(f"  Total candidates: {len(matches)}")
+            print(f"  Mean similarity: {mean_similarity:.4f} ({mean_similarity*100:.1f}%)")
+            print(f"  Std deviation: {std_similarity:.4f}")
+            print(f"  Range: [{distribution_stats['min']:.4f}, {distribution_stats['max']:.4f}]")
+            print(f"  Median: {distribution_stats['median']:.4f}")
+
+        if search_mode == 'range':
+            top_matches = matches   # already >= min_score and capped at max_results
+        else:
+            top_n = int(request.form.get('top_n', 5))
+            top_n = min(max(top_n, 1), 10)
+            top_matches = matches[:top_n]
 
-                    fused = W_INS * s_ins + W_FACE * s_face
+        for idx, match in enumerate(top_matches, 1):
+            match['rank'] = idx
+            match['database_mean_similarity']  = float(mean_similarity)
+            match['similarity_above_average']  = bool(match.get('statistical_analysis', {}).get('above_average', False))
+            match['similarity_z_score']        = float(match.get('statistical_analysis', {}).get('z_score', 0.0))
+
+            z_score = match.get('statistical_analysis', {}).get('z_score', 0.0)
+            if idx == 1:
+                if z_score >= 1.5:
+                    rank_explanation = f"Rank #{idx} candidate - similarity significantly above database average (top match with strong statistical confidence)"
+                elif z_score >= 0.5:
+                    rank_explanation = f"Rank #{idx} candidate - similarity above database average (top match, moderate confidence)"
+                else:
+                    rank_explanation = f"Rank #{idx} candidate - highest similarity in database (but near or below average, requires careful verification)"
+            elif idx <= 3:
+                if z_score >= 1.5:
+                    rank_explanation = f"Rank #{idx} candidate - similarity significantly above database average (strong candidate for investigation)"
+                elif z_score >= 0.5:
+                    rank_explanation = f"Rank #{idx} candidate - similarity above database average (worth investigating)"
+                else:
+                    rank_explanation = f"Rank #{idx} candidate - near or below database average (lower priority)"
+            else:
+                if z_score >= 1.5:
+                    rank_explanation = f"Rank #{idx} candidate - similarity significantly above database average"
+                elif z_score >= 0.5:
+                    rank_explanation = f"Rank #{idx} candidate - similarity above database average"
+                elif z_score >= -0.5:
+                    rank_explanation = f"Rank #{idx} candidate - similarity near database average"
                 else:
-                    # Cache miss — use FAISS scores directly
-                    s_ins  = result['insightface_similarity']
-                    s_face = result['facenet_similarity']
-                    fused  = result['embedding_fusion']
-
-                top_k_candidates.append({
-                    'criminal':               criminal_dict[criminal_id],
-                    'embedding_fusion':       fused,
-                    'insightface_similarity': s_ins,
-                    'facenet_similarity':     s_face,
-                })
-
-            top_k_candidates.sort(key=lambda x: x['embedding_fusion'], reverse=True)
-            print(f"\n[STAGE 1 FUSED RANKING]")
-            for i, c in enumerate(top_k_candidates, 1):
-                face_str = f"{c['facenet_similarity']:.4f}" if c['facenet_similarity'] is not None else "N/A"
-                print(f"  {i}. {c['criminal'].criminal_id}: fused={c['embedding_fusion']:.6f} "
-                      f"(ins={c['insightface_similarity']:.4f}, face={face_str})")
+                    rank_explanation = f"Rank #{idx} candidate - similarity below database average"
+
+            match['rank_explanation'] = rank_explanation
+
+        print(f"\n[RESULTS]")
+        print(f"  Total matches: {len(matches)}")
+        print(f"  Returning top: {len(top_matches)}")
+        if len(matches) > 0:
+            print(f"  Database mean similarity: {mean_similarity:.4f} ({mean_similarity*100:.1f}%)")
+            print(f"  Candidates above average: {sum(1 for m in matches if m.get('statistical_analysis', {}).get('above_average', False))}")
+
+        print(f"[API] Returning response with {len(top_matches)} results", flush=True)
             
-            # ================================================================
-            # STAGE 2: RE-RANKING — uses cached embeddings, NO S3 download,
-            # NO TTA recomputation. Query embedding computed once above.
-            # ================================================================
-            print(f"\n[STAGE 2: RE-RANKING]")
-            print(f"  Re-ranking Top-{len(top_k_candidates)} candidates using cached embeddings...")
+        response_payload = {
+            "matches":      top_matches,
+            "total_matches": len(matches),
+            "showing_top":  len(top_matches),
+            "threshold_used": float(threshold),
+            "search_mode":    search_mode,
+            "min_score":      min_score,
+            "range_pruned":   bool(range_pruned),
+            "filters_applied": filters or {},
+            "distribution_analysis": distribution_stats,
+            "database_comparison": {
+                "mean_similarity":    float(mean_similarity),
+                "std_deviation":      float(std_similarity),
+                "candidates_above_average": sum(
+                    1 for m in matches
+                    if m.get('statistical_analysis', {}).get('above_average', False)
+                ),
+                "candidates_significantly_above_average": sum(
+                    1 for m in matches
+                    if m.get('statistical_analysis', {}).get('z_score', 0.0) >= 1.5
+                ),
+                "total_candidates_searched": len(search_results),
+                "interpretation": "Candidates with z-score >= 1.5 are significantly above average and should be prioritized for investigation."
+            },
+            "two_stage_pipeline": {
+                "stage1_method":    "FAISS-accelerated fast retrieval" if use_faiss else "Linear search with cached embeddings",
+                "stage1_candidates": len(search_results),
+                "stage1_top_k":     len(matches),
+                "stage2_method":    "Detailed re-ranking with geometric and region similarities",
+                "stage2_formula":   "60% embedding + 25% geometric + 15% region",
+                "reranking_applied": True,
+                "faiss_enabled":    bool(use_faiss),
+                "faiss_available":  bool(is_faiss_index_ready())
+            },
+            "search_method": (
+                "Two-Stage Top-K Re-Ranking with FAISS" if use_faiss
+                else "Two-Stage Top-K Re-Ranking (Linear Search fallback)"
+            ),
+            "forensic_note": (
+                "Cross-domain sketch-to-photo matching. Use as investigation leads, "
+                "not absolute identification. Manual verification required."
+            ),
+            "interpretation_guide": {
+                "HIGH":   "Score > 0.4 — Strong candidate, priority investigation",
+                "MEDIUM": "Score 0.25–0.4 — Possible match, worth investigating",
+                "LOW":    "Score < 0.25 — Unlikely match, lower priority"
+            }
+        }
 
-            matches = []
+        print("[API] RESPONSE SENT SUCCESSFULLY", flush=True)
+        return jsonify(response_payload), 200
 
-            for candidate in top_k_candidates:
-                try:
-                    criminal          = candidate['criminal']
-                    embedding_fusion  = candidate['embedding_fusion']
-                    insightface_sim   = candidate['insightface_similarity']
-                    facenet_sim       = candidate['facenet_similarity']
-
-                    # ── CACHE HIT: calibrated fusion with adaptive weights ──────
-                    # Same W_INS / W_FACE as Stage 1 for consistent ranking.
-                    # Facenet calibrated score clamped to 0.875 (raw 0.75 -> cal 0.875).
-                    cached = get_cached_embedding(criminal.criminal_id)
-                    if cached is not None and cached.get("insightface") is not None:
-                        print(f"  [CACHE HIT] {criminal.criminal_id} — using stored embeddings")
-
-                        q_ins  = query_embeddings['insightface']
-                        q_face = query_embeddings.get('facenet')
-
-                        c_ins   = cached["insightface"]
-                        q_ins_n2 = q_ins / (np.linalg.norm(q_ins) + 1e-10)
-                        c_ins_n2 = c_ins / (np.linalg.norm(c_ins) + 1e-10)
-                        raw_ins     = float(np.dot(q_ins_n2, c_ins_n2))
-                        sim_insight = _cal(raw_ins)
-
-                        c_face = cached.get("facenet")
-                        if q_face is not None and c_face is not None:
-                            q_face_n2   = q_face / (np.linalg.norm(q_face) + 1e-10)
-                            c_face_n2   = c_face / (np.linalg.norm(c_face) + 1e-10)
-                            raw_face    = float(np.dot(q_face_n2, c_face_n2))
-                            sim_facenet = min(_cal(raw_face), 0.875)  # clamp
-                            embedding_fusion = W_INS * sim_insight + W_FACE * sim_facenet
-                        else:
-                            sim_facenet      = None
-                            embedding_fusion = sim_insight
-
-                        insightface_sim = sim_insight
-                        facenet_sim     = sim_facenet
-                        final_score     = embedding_fusion
-
-                        face_dbg = f"{sim_facenet:.6f}" if sim_facenet is not None else "N/A"
-                        print(f"  [DEBUG] Insight(cal): {sim_insight:.6f}, "
-                              f"Facenet(cal): {face_dbg}, "
-                              f"Final: {final_score:.6f}")
-                    else:
-                        print(f"  [WARN] {criminal.criminal_id} — no cached embedding, using Stage 1 score")
-                        final_score = embedding_fusion
-
-                    embedding_confidence = 1.0
-
-                    print(f"  {criminal.full_name}:")
-                    print(f"    Final Score: {final_score:.6f}")
-
-                    matches.append({
-                        "criminal": {
-                            "id": criminal.id,
-                            "criminal_id": criminal.criminal_id,
-                            "status": criminal.status,
-                            "full_name": criminal.full_name,
-                            "aliases": criminal.aliases,
-                            "dob": criminal.dob,
-                            "sex": criminal.sex,
-                            "nationality": criminal.nationality,
-                            "ethnicity": criminal.ethnicity,
-                            "appearance": criminal.appearance,
-                            "locations": criminal.locations,
-                            "summary": criminal.summary,
-                            "forensics": criminal.forensics,
-                            "evidence": criminal.evidence,
-                            "witness": criminal.witness,
-                            "created_at": criminal.created_at.isoformat()
-                        },
-                        "similarity_score":       float(final_score),
-                        "embedding_fusion":       float(embedding_fusion),
-                        "embedding_confidence":   float(embedding_confidence),
-                        "insightface_similarity": float(insightface_sim) if insightface_sim is not None else None,
-                        "facenet_similarity":     float(facenet_sim) if facenet_sim is not None else None,
-                        "geometric_similarity":   0.0,  # not computed in fast re-ranking path
-                        "distance":               float(1.0 - final_score),
-                        "model_used":             f"InsightFace + Facenet (adaptive {'sketch' if is_sketch_query else 'photo'} weights {W_INS:.2f}/{W_FACE:.2f}, calibrated)",
-                        "metric_used":            f"final = {W_INS:.2f}*cal(cosine(insight)) + {W_FACE:.2f}*min(cal(cosine(facenet)), 0.875)",
-                        "is_cross_domain":        True,
-                        "stage1_rank":            top_k_candidates.index(candidate) + 1,
-                        "reranking_applied":      True,
-                        "cache_hit":              cached is not None,
-                    })
-
-                except Exception as e:
-                    print(f"  [ERROR] Error re-ranking criminal {candidate['criminal'].id}: {e}")
-                    traceback.print_exc()
+    except Exception as e:
+        print(f"[API] /api/criminals/search UNHANDLED ERROR:\n{traceback.format_exc()}", flush=True)
+        return jsonify({"success": False, "error": str(e)}), 500
+    finally:
+        if db:
+            db.close()
+
+
+@app.route('/api/criminals/search/batch', methods=['POST'])
+@authenticated
+def search_criminals_batch():
+    """Search with several sketch variants of the same suspect in one request"""
+    if not _is_startup_complete():
+        print(f"[search_criminals_batch] Startup flag missing — system not ready.", flush=True)
+        return jsonify({
+            "error": "Face recognition models are still initializing. Please retry in a moment."
+        }), 503
+
+    print("\n" + "="*60, flush=True)
+    print("BATCH CRIMINAL SEARCH STARTED", flush=True)
+    print("="*60, flush=True)
+
+    db = None
+    try:
+        sketch_files = request.files.getlist('sketches')
+        if not sketch_files:
+            return jsonify({"error": "At least one file is required in 'sketches'"}), 400
+        if len(sketch_files) > MAX_BATCH_SKETCHES:
+            return jsonify({"error": f"At most {MAX_BATCH_SKETCHES} sketches per batch"}), 400
+
+        top_k = int(request.form.get('top_k', 10))
+        top_k = min(max(top_k, 1), 50)
+
+        # ── Extract one query per sketch ──────────────────────────────────
+        queries_ins, queries_face, sketch_flags = [], [], []
+        query_info = []
+        pending = []
+        for idx, sketch_file in enumerate(sketch_files):
+            info = {"index": idx, "filename": sketch_file.filename, "success": False}
+            query_info.append(info)
+            try:
+                sketch_img = read_upload_image(sketch_file)
+
+                # Facenet requests of all sketches stay in flight while the
+                # next sketches run through InsightFace; joined below
+                embeddings = extract_dual_embeddings(
+                    sketch_img, is_sketch=True, use_cache=True, join_facenet=False
+                )
+                if embeddings is None or not embeddings['success']:
+                    info["error"] = "Failed to extract dual embeddings"
                     continue
-            
-            # Sort by final re-ranked score (highest first)
-            matches.sort(key=lambda x: x['similarity_score'], reverse=True)
-            
-            print(f"\n[RE-RANKING COMPLETE]")
-            print(f"  Final ranking:")
-            for idx, match in enumerate(matches, 1):
-                print(f"    Rank {idx}: {match['criminal']['full_name']} (Score: {match['similarity_score']:.4f}, Stage1 Rank: {match['stage1_rank']})")
-            
-            # ================================================================
-            # SIMILARITY DISTRIBUTION ANALYSIS
-            # ================================================================
-
-            # Safe defaults — used even when matches is empty
-            mean_similarity   = 0.0
-            std_similarity    = 0.0
-            min_similarity    = 0.0
-            max_similarity    = 0.0
-            median_similarity = 0.0
-            distribution_stats = {}
-
-            def _safe_float(v):
-                """Convert any numeric value (including np types) to Python float. None -> 0.0."""
-                if v is None:
-                    return 0.0
-                try:
-                    return float(v)
-                except (TypeError, ValueError):
-                    return 0.0
-
-            def normalize_for_display(raw_score):
-                """
-                Convert raw cosine similarity to display percentage.
-                display = raw * 100  (no inflation, no offset)
-                Expected: same person 50-80%, different person 0-40%
-                """
-                v = _safe_float(raw_score)
-                return min(100.0, max(0.0, v * 100.0))
-
-            if len(matches) > 0:
-                similarities     = [m['similarity_score'] for m in matches]
-                embedding_fusions = [m['embedding_fusion'] for m in matches]
-                insightface_sims = [m['insightface_similarity'] for m in matches]
-                facenet_sims     = [m['facenet_similarity'] for m in matches]
-                geometric_sims   = [m['geometric_similarity'] for m in matches]
-
-                mean_similarity   = float(np.mean(similarities))
-                std_similarity    = float(np.std(similarities))
-                min_similarity    = float(np.min(similarities))
-                max_similarity    = float(np.max(similarities))
-                median_similarity = float(np.median(similarities))
-
-                distribution_stats = {
-                    "mean":                  mean_similarity,
-                    "std_dev":               std_similarity,
-                    "min":                   min_similarity,
-                    "max":                   max_similarity,
-                    "median":                median_similarity,
-                    "total_candidates":      len(matches),
-                    "mean_embedding_fusion": float(np.mean(embedding_fusions)),
-                    "mean_arcface":          float(np.mean([s for s in insightface_sims if s is not None])) if any(s is not None for s in insightface_sims) else None,
-                    "mean_facenet":          float(np.mean([s for s in facenet_sims if s is not None])) if any(s is not None for s in facenet_sims) else None,
-                    "mean_geometric":        float(np.mean(geometric_sims))
-                }
+                pending.append((idx, sketch_file, info, sketch_img, embeddings))
+            except Exception as e:
+                print(f"  [ERROR] Sketch {idx} ({sketch_file.filename}): {e}")
+                info["error"] = str(e)
 
-                print(f"\n[SIMILARITY DISTRIBUTION]")
-                print(f"  Total candidates: {len(matches)}")
-                print(f"  Mean similarity: {mean_similarity:.4f} ({mean_similarity*100:.1f}%)")
-                print(f"  Std deviation: {std_similarity:.4f}")
-                print(f"  Range: [{min_similarity:.4f}, {max_similarity:.4f}]")
-                print(f"  Median: {median_similarity:.4f}")
-
-                above_avg_threshold = mean_similarity + std_similarity
-
-                for match in matches:
-                    raw_similarity = _safe_float(match['similarity_score'])
-                    raw_fusion     = _safe_float(match['embedding_fusion'])
-                    raw_arcface    = _safe_float(match['insightface_similarity'])
-                    raw_facenet    = _safe_float(match['facenet_similarity'])
-                    raw_geometric  = _safe_float(match['geometric_similarity'])
-
-                    z_score = (raw_similarity - mean_similarity) / std_similarity if std_similarity > 0 else 0.0
-                    is_above_average = raw_similarity > above_avg_threshold
-
-                    match['statistical_analysis'] = {
-                        "z_score":             float(z_score),
-                        "above_average":       bool(is_above_average),
-                        "deviation_from_mean": float(raw_similarity - mean_similarity),
-                        "percentile":          float((matches.index(match) + 1) / len(matches) * 100)
-                    }
+        for idx, sketch_file, info, sketch_img, embeddings in pending:
+            try:
+                join_dual_embeddings(embeddings)
+                q_ins  = embeddings['insightface']
+                q_face = embeddings.get('facenet')
+                # Mirror missing model so fusion still works
+                if q_ins is None:
+                    q_ins = q_face
+                elif q_face is None:
+                    q_face = q_ins
+
+                is_sketch_query = sketch_img.is_sketch
+                info.update({"success": True, "is_sketch": bool(is_sketch_query)})
+                queries_ins.append(q_ins)
+                queries_face.append(q_face)
+                sketch_flags.append(is_sketch_query)
+            except Exception as e:
+                print(f"  [ERROR] Sketch {idx} ({sketch_file.filename}): {e}")
+                info["error"] = str(e)
 
-                    # Absolute threshold classification — calibrated for new scoring formula
-                    # (0.5*fusion + 0.3*multi_region + 0.2*geometric, Facenet clamped@0.75)
-                    if raw_similarity > 0.55:
-                        match['similarity_category'] = 'HIGH'
-                        match['confidence_level']    = 'high_similarity'
-                        match['confidence_score']    = 85.0
-                        match['match_quality']       = 'High similarity - Strong candidate for investigation'
-                    elif raw_similarity > 0.40:
-                        match['similarity_category'] = 'MEDIUM'
-                        match['confidence_level']    = 'medium_similarity'
-                        match['confidence_score']    = 60.0
-                        match['match_quality']       = 'Medium similarity - Possible match, worth investigating'
-                    else:
-                        match['similarity_category'] = 'LOW'
-                        match['confidence_level']    = 'low_similarity'
-                        match['confidence_score']    = 30.0
-                        match['match_quality']       = 'Low similarity - Unlikely match'
-
-                    # Normalize all scores for display
-                    display_hybrid    = normalize_for_display(raw_similarity)
-                    display_fusion    = normalize_for_display(raw_fusion)
-                    display_arcface   = normalize_for_display(raw_arcface)
-                    display_facenet   = normalize_for_display(raw_facenet)
-                    display_geometric = normalize_for_display(raw_geometric)
-
-                    match['similarity_score']          = float(display_hybrid)
-                    match['raw_similarity_score']      = float(raw_similarity)
-                    match['display_similarity']        = float(display_hybrid)
-                    match['embedding_fusion']          = float(display_fusion)
-                    match['raw_embedding_fusion']      = float(raw_fusion)
-                    match['insightface_similarity']    = float(display_arcface)
-                    match['raw_insightface_similarity'] = float(raw_arcface)
-                    match['facenet_similarity']        = float(display_facenet)
-                    match['raw_facenet_similarity']    = float(raw_facenet)
-                    match['geometric_similarity']      = float(display_geometric)
-                    match['raw_geometric_similarity']  = float(raw_geometric)
-
-                    if 'region_similarity' in match:
-                        raw_region = _safe_float(match['region_similarity'])
-                        match['region_similarity']     = float(normalize_for_display(raw_region))
-                        match['raw_region_similarity'] = float(raw_region)
-
-                    match['score_normalization'] = (
-                        'No normalization applied. display_similarity = raw_similarity * 100.'
-                    )
-
-                    match['explanation'] = {
-                        "final_score": {
-                            "value":       float(display_hybrid),
-                            "percentage":  f"{display_hybrid:.1f}%",
-                            "raw_value":   float(raw_similarity),
-                            "description": "Two-stage re-ranking score: 60% embedding + 25% geometric + 15% region"
-                        },
-                        "embedding_fusion": {
-                            "value":       float(display_fusion),
-                            "percentage":  f"{display_fusion:.1f}%",
-                            "raw_value":   float(raw_fusion),
-                            "description": "Fused embedding similarity: Max(ArcFace, Facenet512)",
-                            "weight":      "100%"
-                        },
-                        "insightface_similarity": {
-                            "value":       float(display_arcface),
-                            "percentage":  f"{display_arcface:.1f}%",
-                            "raw_value":   float(raw_arcface),
-                            "description": "ArcFace model similarity",
-                            "weight":      "Considered in Max Fusion"
-                        },
-                        "facenet_similarity": {
-                            "value":       float(display_facenet),
-                            "percentage":  f"{display_facenet:.1f}%",
-                            "raw_value":   float(raw_facenet),
-                            "description": "Facenet512 model similarity",
-                            "weight":      "Considered in Max Fusion"
-                        },
-                        "geometric_similarity": {
-                            "value":       float(display_geometric),
-                            "percentage":  f"{display_geometric:.1f}%",
-                            "raw_value":   float(raw_geometric),
-                            "description": "Facial structure and landmark similarity",
-                            "weight":      "25%"
-                        },
-                        "statistical_position": {
-                            "z_score":     float(z_score),
-                            "description": f"{'Above' if z_score > 0 else 'Below'} average by {abs(z_score):.2f} standard deviations"
-                        }
-                    }
+        if not queries_ins:
+            return jsonify({"error": "No usable sketches in batch", "queries": query_info}), 400
 
-                    if 'region_similarity' in match:
-                        match['explanation']['region_similarity'] = {
-                            "value":       float(match['region_similarity']),
-                            "percentage":  f"{match['region_similarity']:.1f}%",
-                            "raw_value":   float(match['raw_region_similarity']),
-                            "description": "Multi-region similarity (eyes, nose, mouth)",
-                            "weight":      "15%"
-                        }
-            
-            top_n = int(request.form.get('top_n', 5))
-            top_n = min(max(top_n, 1), 10)
+        print(f"  {len(queries_ins)}/{len(sketch_files)} sketches embedded, Top-{top_k}")
 
-            top_matches = matches[:top_n]
+        # ── One FAISS call for the whole query matrix ─────────────────────
+        batch, use_faiss = search_top_k_candidates_batch(
+            np.vstack(queries_ins),
+            np.vstack(queries_face),
+            top_k=top_k,
+            is_sketch=sketch_flags,
+        )
+        aggregated = aggregate_batch_candidates(batch, top_k)
 
-            for idx, match in enumerate(top_matches, 1):
-                match['rank'] = idx
-                match['database_mean_similarity']  = float(mean_similarity)
-                match['similarity_above_average']  = bool(match.get('statistical_analysis', {}).get('above_average', False))
-                match['similarity_z_score']        = float(match.get('statistical_analysis', {}).get('z_score', 0.0))
-
-                z_score = match.get('statistical_analysis', {}).get('z_score', 0.0)
-                if idx == 1:
-                    if z_score >= 1.5:
-                        rank_explanation = f"Rank #{idx} candidate - similarity significantly above database average (top match with strong statistical confidence)"
-                    elif z_score >= 0.5:
-                        rank_explanation = f"Rank #{idx} candidate - similarity above database average (top match, moderate confidence)"
-                    else:
-                        rank_explanation = f"Rank #{idx} candidate - highest similarity in database (but near or below average, requires careful verification)"
-                elif idx <= 3:
-                    if z_score >= 1.5:
-                        rank_explanation = f"Rank #{idx} candidate - similarity significantly above database average (strong candidate for investigation)"
-                    elif z_score >= 0.5:
-                        rank_explanation = f"Rank #{idx} candidate - similarity above database average (worth investigating)"
-                    else:
-                        rank_explanation = f"Rank #{idx} candidate - near or below database average (lower priority)"
-                else:
-                    if z_score >= 1.5:
-                        rank_explanation = f"Rank #{idx} candidate - similarity significantly above database average"
-                    elif z_score >= 0.5:
-                        rank_explanation = f"Rank #{idx} candidate - similarity above database average"
-                    elif z_score >= -0.5:
-                        rank_explanation = f"Rank #{idx} candidate - similarity near database average"
-                    else:
-                        rank_explanation = f"Rank #{idx} candidate - similarity below database average"
-
-                match['rank_explanation'] = rank_explanation
-
-            print(f"\n[RESULTS]")
-            print(f"  Total matches: {len(matches)}")
-            print(f"  Returning top: {len(top_matches)}")
-            if len(matches) > 0:
-                print(f"  Database mean similarity: {mean_similarity:.4f} ({mean_similarity*100:.1f}%)")
-                print(f"  Candidates above average: {sum(1 for m in matches if m.get('statistical_analysis', {}).get('above_average', False))}")
-
-            print(f"[API] Returning response with {len(top_matches)} results", flush=True)
-            
-            response_payload = {
-                "matches":      top_matches,
-                "total_matches": len(matches),
-                "showing_top":  len(top_matches),
-                "threshold_used": float(threshold),
-                "distribution_analysis": distribution_stats,
-                "database_comparison": {
-                    "mean_similarity":    float(mean_similarity),
-                    "std_deviation":      float(std_similarity),
-                    "candidates_above_average": sum(
-                        1 for m in matches
-                        if m.get('statistical_analysis', {}).get('above_average', False)
-                    ),
-                    "candidates_significantly_above_average": sum(
-                        1 for m in matches
-                        if m.get('statistical_analysis', {}).get('z_score', 0.0) >= 1.5
-                    ),
-                    "total_candidates_searched": len(search_results),
-                    "interpretation": "Candidates with z-score >= 1.5 are significantly above average and should be prioritized for investigation."
-                },
-                "two_stage_pipeline": {
-                    "stage1_method":    "FAISS-accelerated fast retrieval" if use_faiss else "Linear search with cached embeddings",
-                    "stage1_candidates": len(search_results),
-                    "stage1_top_k":     len(top_k_candidates),
-                    "stage2_method":    "Detailed re-ranking with geometric and region similarities",
-                    "stage2_formula":   "60% embedding + 25% geometric + 15% region",
-                    "reranking_applied": True,
-                    "faiss_enabled":    bool(use_faiss),
-                    "faiss_available":  bool(is_faiss_index_ready())
-                },
-                "search_method": (
-                    "Two-Stage Top-K Re-Ranking with FAISS" if use_faiss
-                    else "Two-Stage Top-K Re-Ranking (Linear Search fallback)"
-                ),
-                "forensic_note": (
-                    "Cross-domain sketch-to-photo matching. Use as investigation leads, "
-                    "not absolute identification. Manual verification required."
-                ),
-                "interpretation_guide": {
-                    "HIGH":   "Score > 0.4 — Strong candidate, priority investigation",
-                    "MEDIUM": "Score 0.25–0.4 — Possible match, worth investigating",
-                    "LOW":    "Score < 0.25 — Unlikely match, lower priority"
-                }
+        # ── Resolve criminal records once for every returned id ───────────
+        returned_ids = {c['criminal_id'] for results in batch for c in results}
+        db = next(get_db())
+        criminal_dict = {
+            c.criminal_id: c
+            for c in db.query(Criminal).filter(Criminal.criminal_id.in_(returned_ids)).all()
+        } if returned_ids else {}
+
+        def _criminal_summary(cid):
+            criminal = criminal_dict.get(cid)
+            if criminal is None:
+                return None
+            return {
+                "id":          criminal.id,
+                "criminal_id": criminal.criminal_id,
+                "full_name":   criminal.full_name,
+                "status":      criminal.status,
+                "sex":         criminal.sex,
+                "nationality": criminal.nationality,
             }
 
-            print("[API] RESPONSE SENT SUCCESSFULLY", flush=True)
-            return jsonify(response_payload), 200
+        per_query = []
+        successful = [info for info in query_info if info["success"]]
+        for info, results in zip(successful, batch):
+            per_query.append({
+                **info,
+                "matches": [
+                    {
+                        "rank":                   rank,
+                        "criminal":               _criminal_summary(c['criminal_id']),
+                        "similarity_score":       float(c['embedding_fusion']),
+                        "insightface_similarity": float(c['insightface_similarity']) if c['insightface_similarity'] is not None else None,
+                        "facenet_similarity":     float(c['facenet_similarity']) if c['facenet_similarity'] is not None else None,
+                    }
+                    for rank, c in enumerate(results, 1)
+                    if c['criminal_id'] in criminal_dict
+                ],
+            })
+
+        aggregated_ranking = []
+        for rank, a in enumerate((a for a in aggregated if a['criminal_id'] in criminal_dict), 1):
+            aggregated_ranking.append({
+                "rank":            rank,
+                "criminal":        _criminal_summary(a['criminal_id']),
+                "aggregate_score": a['aggregate_score'],
+                "best_score":      a['best_score'],
+                "query_hits":      a['hits'],
+                "best_rank":       a['best_rank'],
+                "query_ranks":     a['query_ranks'],
+            })
 
-        finally:
-            # Clean up sketch temp file
-            cleanup_temp_file(sketch_path)
+        print(f"\n[BATCH RESULTS] Aggregated ranking:")
+        for a in aggregated_ranking[:5]:
+            print(f"  {a['rank']}. {a['criminal']['criminal_id']}: "
+                  f"aggregate={a['aggregate_score']:.4f} hits={a['query_hits']}/{len(successful)}")
+
+        return jsonify({
+            "queries":            per_query,
+            "failed_queries":     [info for info in query_info if not info["success"]],
+            "aggregated_ranking": aggregated_ranking,
+            "total_queries":      len(sketch_files),
+            "successful_queries": len(successful),
+            "top_k":              top_k,
+            "search_method": (
+                "Batched FAISS search" if use_faiss else "Linear search fallback"
+            ),
+            "aggregation": (
+                "Mean fused score across queries; a query that did not retrieve "
+                "a candidate contributes its lowest returned score."
+            ),
+            "forensic_note": (
+                "Cross-domain sketch-to-photo matching. Use as investigation leads, "
+                "not absolute identification. Manual verification required."
+            ),
+        }), 200
 
     except Exception as e:
-        print(f"[API] /api/criminals/search UNHANDLED ERROR:\n{traceback.format_exc()}", flush=True)
+        print(f"[API] /api/criminals/search/batch UNHANDLED ERROR:\n{traceback.format_exc()}", flush=True)
         return jsonify({"success": False, "error": str(e)}), 500
     finally:
         if db:
@@ -1900,55 +1862,51 @@ def compare_faces():
         sketch_file = request.files['sketch']
         photo_file = request.files['photo']
 
-        sketch_path = save_temp_file(sketch_file)
-        photo_path = save_temp_file(photo_file)
+        # Decode both uploads once, in memory (no temp files)
+        sketch_img = read_upload_image(sketch_file)
+        photo_img = read_upload_image(photo_file)
 
-        try:
-            # Use forensic face comparison
-            result = forensic_face_comparison(sketch_path, photo_path, use_cache=True)
+        # Use forensic face comparison (each upload decoded once)
+        result = forensic_face_comparison(sketch_img, photo_img, use_cache=True)
 
-            # Return the complete result with all normalized scores
-            return jsonify({
-                "distance": result.get('distance', 1.0),
-                "similarity": result.get('similarity', 0.0),
-                "raw_similarity": result.get('raw_similarity', 0.0),
-                "display_similarity": result.get('display_similarity', 0.0),
-                "final_embedding_similarity": result.get('final_embedding_similarity', 0.0),
-                "embedding_fusion": result.get('embedding_fusion', 0.0),
-                "insightface_similarity": result.get('insightface_similarity', 0.0),
-                "facenet_similarity": result.get('facenet_similarity', 0.0),
-                "geometric_similarity": result.get('geometric_similarity', 0.0),
-                "multi_region_similarity": result.get('multi_region_similarity', 0.0),
-                "raw_final_embedding_similarity": result.get('raw_final_embedding_similarity', 0.0),
-                "raw_embedding_fusion": result.get('raw_embedding_fusion', 0.0),
-                "raw_insightface_similarity": result.get('raw_insightface_similarity', 0.0),
-                "raw_facenet_similarity": result.get('raw_facenet_similarity', 0.0),
-                "raw_geometric_similarity": result.get('raw_geometric_similarity', 0.0),
-                "raw_multi_region_similarity": result.get('raw_multi_region_similarity', 0.0),
-                "eyes_similarity": result.get('region_details', {}).get('eyes') or result.get('eyes_similarity', 0.0),
-                "nose_similarity": result.get('region_details', {}).get('nose') or result.get('nose_similarity', 0.0),
-                "mouth_similarity": result.get('region_details', {}).get('mouth') or result.get('mouth_similarity', 0.0),
-                "full_face_similarity": result.get('region_details', {}).get('full_face') or result.get('full_face_similarity', 0.0),
-                "region_details": result.get('region_details'),
-                "confidence_level": result.get('confidence_level', 'uncertain'),
-                "confidence_score": result.get('confidence_score', 0.0),
-                "match_quality": result.get('match_quality', 'Unknown'),
-                "similarity_category": result.get('similarity_category', 'UNKNOWN'),
-                "is_cross_domain": result.get('is_cross_domain', False),
-                "comparison_type": result.get('comparison_type', 'unknown'),
-                "model_verified": result.get('model_verified', False),
-                "model_threshold": result.get('model_threshold', 0.4),
-                "model_used": result.get('model_used', 'ArcFace'),
-                "metric_used": result.get('metric_used', 'cosine'),
-                "processing_time": result.get('processing_time', 0),
-                "from_cache": result.get('from_cache', False),
-                "forensic_note": result.get('forensic_note', ''),
-                "success": True
-            })
-        finally:
-            # Cleanup temp files
-            cleanup_temp_file(sketch_path)
-            cleanup_temp_file(photo_path)
+        # Return the complete result with all normalized scores
+        return jsonify({
+            "distance": result.get('distance', 1.0),
+            "similarity": result.get('similarity', 0.0),
+            "raw_similarity": result.get('raw_similarity', 0.0),
+            "display_similarity": result.get('display_similarity', 0.0),
+            "final_embedding_similarity": result.get('final_embedding_similarity', 0.0),
+            "embedding_fusion": result.get('embedding_fusion', 0.0),
+            "insightface_similarity": result.get('insightface_similarity', 0.0),
+            "facenet_similarity": result.get('facenet_similarity', 0.0),
+            "geometric_similarity": result.get('geometric_similarity', 0.0),
+            "multi_region_similarity": result.get('multi_region_similarity', 0.0),
+            "raw_final_embedding_similarity": result.get('raw_final_embedding_similarity', 0.0),
+            "raw_embedding_fusion": result.get('raw_embedding_fusion', 0.0),
+            "raw_insightface_similarity": result.get('raw_insightface_similarity', 0.0),
+            "raw_facenet_similarity": result.get('raw_facenet_similarity', 0.0),
+            "raw_geometric_similarity": result.get('raw_geometric_similarity', 0.0),
+            "raw_multi_region_similarity": result.get('raw_multi_region_similarity', 0.0),
+            "eyes_similarity": result.get('region_details', {}).get('eyes') or result.get('eyes_similarity', 0.0),
+            "nose_similarity": result.get('region_details', {}).get('nose') or result.get('nose_similarity', 0.0),
+            "mouth_similarity": result.get('region_details', {}).get('mouth') or result.get('mouth_similarity', 0.0),
+            "full_face_similarity": result.get('region_details', {}).get('full_face') or result.get('full_face_similarity', 0.0),
+            "region_details": result.get('region_details'),
+            "confidence_level": result.get('confidence_level', 'uncertain'),
+            "confidence_score": result.get('confidence_score', 0.0),
+            "match_quality": result.get('match_quality', 'Unknown'),
+            "similarity_category": result.get('similarity_category', 'UNKNOWN'),
+            "is_cross_domain": result.get('is_cross_domain', False),
+            "comparison_type": result.get('comparison_type', 'unknown'),
+            "model_verified": result.get('model_verified', False),
+            "model_threshold": result.get('model_threshold', 0.4),
+            "model_used": result.get('model_used', 'ArcFace'),
+            "metric_used": result.get('metric_used', 'cosine'),
+            "processing_time": result.get('processing_time', 0),
+            "from_cache": result.get('from_cache', False),
+            "forensic_note": result.get('forensic_note', ''),
+            "success": True
+        })
     except Exception as e:
         print("/api/compare error:\n" + traceback.format_exc())
         return jsonify({"error": str(e)}), 500
@@ -1973,37 +1931,23 @@ def test_edge_preprocessing():
         image_file = request.files['image']
         is_sketch = request.form.get('is_sketch', 'false').lower() == 'true'
         
-        image_path = save_temp_file(image_file)
-        
-        try:
-            print(f"\n[TEST STEP 2] Edge preprocessing: {image_file.filename} (is_sketch={is_sketch})")
-            
-            # Apply edge preprocessing
-            processed_path = preprocess_for_edge_based_matching(image_path, is_sketch=is_sketch)
-            
-            # Read processed image
-            with open(processed_path, 'rb') as f:
-                processed_data = f.read()
-            
-            # Cleanup
-            if processed_path != image_path:
-                try:
-                    os.remove(processed_path)
-                except:
-                    pass
-            
-            # Return processed image
-            return send_file(
-                io.BytesIO(processed_data),
-                mimetype='image/jpeg',
-                as_attachment=False
-            )
-            
-        finally:
-            try:
-                os.remove(image_path)
-            except:
-                pass
+        image = read_upload_image(image_file)
+        print(f"\n[TEST STEP 2] Edge preprocessing: {image_file.filename} (is_sketch={is_sketch})")
+        
+        # Apply edge preprocessing in memory and encode the result once for the response
+        processed = preprocess_for_edge_based_matching_array(image, is_sketch=is_sketch)
+        if processed is None:
+            return jsonify({"error": "Edge preprocessing failed"}), 400
+        ok, encoded = cv2.imencode('.jpg', processed, [cv2.IMWRITE_JPEG_QUALITY, 95])
+        if not ok:
+            return jsonify({"error": "Failed to encode preprocessed image"}), 500
+        
+        # Return processed image
+        return send_file(
+            io.BytesIO(encoded.tobytes()),
+            mimetype='image/jpeg',
+            as_attachment=False
+        )
                 
     except Exception as e:
         print(f"/api/test/edge-preprocessing error: {e}")
@@ -2023,41 +1967,33 @@ def test_compare_edges():
         image1_file = request.files['image1']
         image2_file = request.files['image2']
         
-        image1_path = save_temp_file(image1_file)
-        image2_path = save_temp_file(image2_file)
+        image1 = read_upload_image(image1_file)
+        image2 = read_upload_image(image2_file)
         
-        try:
-            print(f"\n[TEST STEP 2] Comparing with edge preprocessing:")
-            print(f"  Image 1: {image1_file.filename}")
-            print(f"  Image 2: {image2_file.filename}")
-            
-            # Compare using edge preprocessing
-            result = compare_with_edge_preprocessing(image1_path, image2_path)
+        print(f"\n[TEST STEP 2] Comparing with edge preprocessing:")
+        print(f"  Image 1: {image1_file.filename}")
+        print(f"  Image 2: {image2_file.filename}")
+        
+        # Compare using edge preprocessing
+        result = compare_with_edge_preprocessing(image1, image2)
+        
+        if result['success']:
+            print(f"  Deep similarity (edge-based): {result['similarity']:.3f}")
             
-            if result['success']:
-                print(f"  Deep similarity (edge-based): {result['similarity']:.3f}")
-                
-                return jsonify({
-                    "success": True,
-                    "deep_similarity": result['similarity'],
-                    "distance": result['distance'],
-                    "threshold": result['threshold'],
-                    "model_verified": result['model_verified'],
-                    "message": f"Deep similarity (edge-based): {result['similarity']:.1%}"
-                })
-            else:
-                return jsonify({
-                    "success": False,
-                    "error": result['error']
-                }), 400
+            return jsonify({
+                "success": True,
+                "deep_similarity": result['similarity'],
+                "distance": result['distance'],
+                "threshold": result['threshold'],
+                "model_verified": result['model_verified'],
+                "message": f"Deep similarity (edge-based): {result['similarity']:.1%}"
+            })
+        else:
+            return jsonify({
+                "success": False,
+                "error": result['error']
+            }), 400
             
-        finally:
-            try:
-                os.remove(image1_path)
-                os.remove(image2_path)
-            except:
-                pass
-                
     except Exception as e:
         print(f"/api/test/compare-edges error: {e}")
         traceback.print_exc()
@@ -2068,10 +2004,13 @@ def test_compare_edges():
 def clear_cache():
     """Clear all caches"""
     result_count = len(RESULT_CACHE)
+    image_count = get_image_cache_stats()['size']
     clear_result_cache()
+    clear_image_cache()
     return jsonify({
         "message": "Caches cleared successfully",
-        "result_cache_cleared": result_count
+        "result_cache_cleared": result_count,
+        "image_cache_cleared": image_count
     })
 
 
@@ -2082,6 +2021,7 @@ def cache_stats_endpoint():
     return jsonify({
         "result_cache_size": stats['size'],
         "max_cache_size": stats['max_size'],
+        "image_cache": get_image_cache_stats(),
         "model_initialized": MODEL_INITIALIZED
     })
 
@@ -2219,18 +2159,22 @@ def create_case():
 
         # Link criminals via association table
         criminal_ids = data.get('linked_criminals', [])
+        criminals = []
         if criminal_ids:
             criminals = db.query(Criminal).filter(Criminal.criminal_id.in_(criminal_ids)).all()
             new_case.criminals.extend(criminals)
 
         db.commit()
         db.refresh(new_case)
+
+        # Keep the search-side case filter in step with the association table
+        warning = _gallery_write(set_case_links, new_case.id, [c.criminal_id for c in criminals])
         
-        return jsonify({
+        return jsonify(_with_warning({
             "message": "Case created successfully",
             "case_id": new_case.id,
             "case_number": new_case.case_number
-        }), 201
+        }, warning)), 201
         
     except Exception as e:
         if db:
@@ -2278,8 +2222,12 @@ def update_case(case_id):
         case.updated_at = datetime.now(timezone.utc)
         
         db.commit()
+
+        warning = None
+        if 'linked_criminals' in data:
+            warning = _gallery_write(set_case_links, case_id, [c.criminal_id for c in criminals])
         
-        return jsonify({"message": "Case updated successfully"}), 200
+        return jsonify(_with_warning({"message": "Case updated successfully"}, warning)), 200
         
     except Exception as e:
         if db:
@@ -2305,8 +2253,10 @@ def delete_case(case_id):
             
         db.delete(case)
         db.commit()
+
+        warning = _gallery_write(set_case_links, case_id, [])
         
-        return jsonify({"message": "Case deleted successfully"}), 200
+        return jsonify(_with_warning({"message": "Case deleted successfully"}, warning)), 200
         
     except Exception as e:
         if db:
@@ -2422,6 +2372,7 @@ def health_check():
         "model_initialized": is_models_initialized(),
         "faiss_ready": is_faiss_index_ready(),
         "embedding_cache_size": get_cache_size(),
+        "models": get_registry_stats(),
         "service": "FaceFind Forensics API v2",
         "timestamp": datetime.now(timezone.utc).isoformat()
     }), 200
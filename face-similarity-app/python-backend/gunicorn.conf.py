@@ -0,0 +1,57 @@
+"""
+gunicorn.conf.py
+================
+Gunicorn settings for the backend (used by the Dockerfile CMD).
+
+The app is preloaded in the master, which downloads the models, builds the
+gallery and writes the FAISS snapshot once. ONNX sessions do not survive
+fork(), so the master does not create one (INSIGHTFACE_DEFER_SESSION) unless
+precompute has photos to embed; stored embeddings are enough otherwise.
+Workers are then forked:
+  - pre_fork  : the master drops its ONNX session, if it had to load one
+  - post_fork : each worker creates and warms its own ONNX session in the
+                model registry and, in shared gallery mode, attaches the
+                snapshot read-only via mmap
+
+So with one worker and an up-to-date gallery, the model is loaded and
+warmed once per boot. The latency benchmark only runs with
+INSIGHTFACE_BENCHMARK=1.
+
+With GUNICORN_WORKERS > 1, FAISS_SHARED_GALLERY defaults to on so the
+gallery is held once per host instead of once per worker.
+
+Usage:
+  gunicorn -c gunicorn.conf.py app_v2:app
+"""
+
+import os
+
+bind             = f"0.0.0.0:{os.environ.get('PORT', '5001')}"
+workers          = int(os.environ.get("GUNICORN_WORKERS", "1"))
+threads          = int(os.environ.get("GUNICORN_THREADS", "4"))
+worker_class     = "gthread"
+timeout          = 600    # face comparison + model init can be slow
+graceful_timeout = 120    # let in-flight requests finish on shutdown
+preload_app      = True   # run startup once in the master, before forking
+
+# Must be set before the app (and services.snapshot_service) is imported
+os.environ.setdefault("FAISS_SHARED_GALLERY", "1" if workers > 1 else "0")
+os.environ.setdefault("INSIGHTFACE_DEFER_SESSION", "1")
+
+
+def pre_fork(server, worker):
+    from models.insightface_model import release_insightface_session
+    release_insightface_session()
+
+
+def post_fork(server, worker):
+    from models import model_registry
+    from models.insightface_model import reinitialize_insightface_after_fork
+    from services.snapshot_service import sync_shared_gallery
+
+    model_registry.reset_after_fork()
+    try:
+        reinitialize_insightface_after_fork()
+    except RuntimeError as e:
+        server.log.error(f"[InsightFace] Worker {worker.pid} session init failed: {e}")
+    sync_shared_gallery(force=True)
@@ -0,0 +1,251 @@
+"""
+Face detector - cached detector instances with downscaled detection.
+
+Backends (FACE_DETECTOR_BACKEND):
+  haar  (default) OpenCV Haar cascade. CascadeClassifier is not safe to share
+        across threads, so each thread parses the XML once and keeps its own
+        instance (threading.local) instead of building one per call.
+  onnx  Optional ONNX detector in the UltraFace layout (e.g. version-RFB-320):
+          input   N x 3 x H x W, RGB, (x - 127) / 128
+          outputs scores N x K x 2 (background, face), boxes N x K x 4
+                  (normalised x1, y1, x2, y2)
+        One session, owned by models.model_registry, shared by all threads;
+        detect_faces_batch() sends several images in one run when the graph
+        has a dynamic batch dim. A missing or broken model falls back to haar.
+
+Detection runs on a proxy whose longest side is at most FACE_DETECT_MAX_SIDE
+(load_image accepts up to 10000x10000) and boxes are mapped back to the
+full-resolution image, so callers always get full-resolution (x, y, w, h).
+"""
+
+import os
+import threading
+import traceback
+
+import cv2
+import numpy as np
+
+from models import model_registry
+
+# ---------------------------------------------------------------------------
+# Constants
+# ---------------------------------------------------------------------------
+
+DETECTOR_BACKEND  = os.environ.get("FACE_DETECTOR_BACKEND", "haar").lower()   # haar | onnx
+DETECT_MAX_SIDE   = int(os.environ.get("FACE_DETECT_MAX_SIDE", "800"))        # 0 = detect at full resolution
+HAAR_CASCADE_PATH = cv2.data.haarcascades + "haarcascade_frontalface_default.xml"
+
+ONNX_DETECTOR_PATH  = os.environ.get("FACE_DETECTOR_ONNX", os.path.join(
+    os.path.expanduser("~"), ".insightface", "models", "detector", "version-RFB-320.onnx"))
+ONNX_SCORE_THRESHOLD = float(os.environ.get("FACE_DETECTOR_SCORE", "0.7"))
+ONNX_NMS_THRESHOLD   = 0.3
+ONNX_DEFAULT_INPUT   = (240, 320)   # (H, W) when the graph leaves them dynamic
+REGISTRY_NAME        = "face_detector"
+
+# ---------------------------------------------------------------------------
+# Singleton state
+# ---------------------------------------------------------------------------
+
+_LOCAL = threading.local()   # per-thread CascadeClassifier
+_LOCK  = threading.Lock()
+_ONNX_LOAD_FAILED = False
+
+
+# ---------------------------------------------------------------------------
+# Proxy scaling
+# ---------------------------------------------------------------------------
+
+def _proxy_scale(shape: tuple) -> float:
+    """Factor (<= 1) that brings the longest side down to DETECT_MAX_SIDE."""
+    longest = max(shape[:2])
+    if DETECT_MAX_SIDE <= 0 or longest <= DETECT_MAX_SIDE:
+        return 1.0
+    return DETECT_MAX_SIDE / float(longest)
+
+
+def _to_full_resolution(boxes, scale: float, shape: tuple) -> np.ndarray:
+    """Map proxy (x, y, w, h) boxes back to the original image, clipped to it."""
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    if len(boxes) == 0:
+        return np.empty((0, 4), dtype=np.int32)
+    h_img, w_img = shape[:2]
+    x1 = np.clip(np.floor(boxes[:, 0] / scale), 0, w_img - 1)
+    y1 = np.clip(np.floor(boxes[:, 1] / scale), 0, h_img - 1)
+    x2 = np.clip(np.ceil((boxes[:, 0] + boxes[:, 2]) / scale), x1 + 1, w_img)
+    y2 = np.clip(np.ceil((boxes[:, 1] + boxes[:, 3]) / scale), y1 + 1, h_img)
+    return np.stack([x1, y1, x2 - x1, y2 - y1], axis=1).astype(np.int32)
+
+
+def _proxy_min_size(min_size: tuple, scale: float) -> tuple:
+    """Full-resolution min_size on the proxy; (0, 0) stays "no minimum"."""
+    return tuple(0 if v <= 0 else max(1, int(round(v * scale))) for v in min_size)
+
+
+# ---------------------------------------------------------------------------
+# Haar backend
+# ---------------------------------------------------------------------------
+
+def _haar():
+    """This thread's cascade (parsed once per thread)."""
+    cascade = getattr(_LOCAL, "cascade", None)
+    if cascade is None:
+        cascade = cv2.CascadeClassifier(HAAR_CASCADE_PATH)
+        if cascade.empty():
+            raise RuntimeError(f"Haar cascade failed to load: {HAAR_CASCADE_PATH}")
+        _LOCAL.cascade = cascade
+    return cascade
+
+
+def _detect_haar(img: np.ndarray, scale_factor: float, min_neighbors: int, min_size: tuple) -> np.ndarray:
+    scale = _proxy_scale(img.shape)
+    proxy = img if scale == 1.0 else cv2.resize(
+        img, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA
+    )
+    gray = cv2.cvtColor(proxy, cv2.COLOR_BGR2GRAY) if proxy.ndim == 3 else proxy
+    boxes = _haar().detectMultiScale(
+        gray, scaleFactor=scale_factor, minNeighbors=min_neighbors,
+        minSize=_proxy_min_size(min_size, scale),
+    )
+    return _to_full_resolution(boxes, scale, img.shape)
+
+
+# ---------------------------------------------------------------------------
+# ONNX backend
+# ---------------------------------------------------------------------------
+
+def _onnx_record():
+    """Registry record of the ONNX detector, loading it on first use (None → use haar)."""
+    global _ONNX_LOAD_FAILED
+
+    record = model_registry.get_record(REGISTRY_NAME)
+    if record is not None or _ONNX_LOAD_FAILED:
+        return record
+    with _LOCK:
+        record = model_registry.get_record(REGISTRY_NAME)
+        if record is not None or _ONNX_LOAD_FAILED:
+            return record
+        try:
+            import onnxruntime as ort
+
+            def _load():
+                opts = ort.SessionOptions()
+                opts.log_severity_level = 2
+                session = ort.InferenceSession(
+                    ONNX_DETECTOR_PATH, sess_options=opts, providers=["CPUExecutionProvider"]
+                )
+                return session, ONNX_DETECTOR_PATH
+
+            if not os.path.exists(ONNX_DETECTOR_PATH):
+                raise FileNotFoundError(ONNX_DETECTOR_PATH)
+            probe_h, probe_w = ONNX_DEFAULT_INPUT
+            record = model_registry.load_session(REGISTRY_NAME, _load, (3, probe_h, probe_w))
+            shape = record.session.get_inputs()[0].shape
+            if isinstance(shape[2], int) and isinstance(shape[3], int):
+                record.sample_shape = (3, shape[2], shape[3])
+            model_registry.warmup(REGISTRY_NAME, [1])
+            print(f"[FaceDetector] ONNX detector ready: {ONNX_DETECTOR_PATH} "
+                  f"input={record.sample_shape}, batched={not record.fixed_batch}")
+        except Exception as e:
+            _ONNX_LOAD_FAILED = True
+            print(f"[FaceDetector] [WARN] ONNX detector unavailable ({e}) - falling back to haar")
+            return None
+    return record
+
+
+def _onnx_input(img: np.ndarray, size: tuple) -> np.ndarray:
+    h, w = size
+    bgr = img if img.ndim == 3 else cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+    rgb = cv2.cvtColor(cv2.resize(bgr, (w, h), interpolation=cv2.INTER_AREA), cv2.COLOR_BGR2RGB)
+    return ((rgb.astype(np.float32) - 127.0) / 128.0).transpose(2, 0, 1)
+
+
+def _decode_onnx(scores: np.ndarray, boxes: np.ndarray, shape: tuple, min_size: tuple) -> np.ndarray:
+    """One image's UltraFace outputs → NMS'd full-resolution (x, y, w, h)."""
+    h_img, w_img = shape[:2]
+    keep = scores[:, 1] >= ONNX_SCORE_THRESHOLD
+    if not keep.any():
+        return np.empty((0, 4), dtype=np.int32)
+    conf = scores[keep, 1]
+    xyxy = boxes[keep] * np.array([w_img, h_img, w_img, h_img], dtype=np.float32)
+    xywh = np.stack([xyxy[:, 0], xyxy[:, 1], xyxy[:, 2] - xyxy[:, 0], xyxy[:, 3] - xyxy[:, 1]], axis=1)
+    # Already thresholded above (NMSBoxes' own score test is strict and would drop ties)
+    idx = cv2.dnn.NMSBoxes(xywh.tolist(), conf.tolist(), 0.0, ONNX_NMS_THRESHOLD)
+    xywh = xywh[np.asarray(idx, dtype=np.int64).reshape(-1)]
+    xywh = xywh[(xywh[:, 2] >= min_size[0]) & (xywh[:, 3] >= min_size[1])]
+    return _to_full_resolution(xywh, 1.0, shape)
+
+
+def _detect_onnx_batch(record, images: list, min_size: tuple) -> list:
+    size  = record.sample_shape[1:]
+    batch = np.stack([_onnx_input(img, size) for img in images])
+    step  = record.fixed_batch or len(batch)
+    results = []
+    for i in range(0, len(batch), step):
+        chunk = batch[i:i + step]
+        count = len(chunk)
+        if count < step:
+            # A static batch dim only accepts full batches: pad the tail with
+            # blank frames and drop their outputs
+            chunk = np.concatenate([chunk, np.zeros((step - count, *chunk.shape[1:]), dtype=chunk.dtype)])
+        scores, boxes = record.session.run(None, {record.input_name: chunk})[:2]
+        for j in range(count):
+            results.append(_decode_onnx(scores[j], boxes[j], images[i + j].shape, min_size))
+    return results
+
+
+# ---------------------------------------------------------------------------
+# Public API
+# ---------------------------------------------------------------------------
+
+def detect_faces_batch(
+    images: list,
+    scale_factor: float = 1.1,
+    min_neighbors: int = 5,
+    min_size: tuple = (30, 30),
+) -> list:
+    """
+    Detect faces in several BGR (or grayscale) images.
+
+    scale_factor / min_neighbors only apply to the haar backend; min_size is
+    in full-resolution pixels for both.
+
+    Returns:
+        list of (K, 4) int32 arrays of full-resolution (x, y, w, h), one per image.
+    """
+    if DETECTOR_BACKEND == "onnx" and images:
+        record = _onnx_record()
+        if record is not None:
+            try:
+                return _detect_onnx_batch(record, images, min_size)
+            except Exception as e:
+                print(f"[FaceDetector] [WARN] ONNX detection failed ({e}) - using haar for this call")
+                traceback.print_exc()
+    return [_detect_haar(img, scale_factor, min_neighbors, min_size) for img in images]
+
+
+def detect_faces(
+    img: np.ndarray,
+    scale_factor: float = 1.1,
+    min_neighbors: int = 5,
+    min_size: tuple = (30, 30),
+) -> np.ndarray:
+    """Detect faces in one BGR (or grayscale) image; (K, 4) full-resolution (x, y, w, h)."""
+    return detect_faces_batch([img], scale_factor, min_neighbors, min_size)[0]
+
+
+def largest_face(boxes):
+    """Largest (x, y, w, h) by area, or None when nothing was detected."""
+    if len(boxes) == 0:
+        return None
+    return tuple(int(v) for v in max(boxes, key=lambda b: int(b[2]) * int(b[3])))
+
+
+def get_detector_status() -> dict:
+    record = model_registry.get_record(REGISTRY_NAME)
+    return {
+        "backend": "onnx" if DETECTOR_BACKEND == "onnx" and record is not None else "haar",
+        "backend_requested": DETECTOR_BACKEND,
+        "max_side": DETECT_MAX_SIDE,
+        "onnx_path": ONNX_DETECTOR_PATH if DETECTOR_BACKEND == "onnx" else None,
+        "onnx_load_failed": _ONNX_LOAD_FAILED,
+    }
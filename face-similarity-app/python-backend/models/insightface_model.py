@@ -14,6 +14,9 @@ Detection: Uses DeepFace opencv detector (already installed) for face alignment,
 """
 
 import os
+import json
+import time
+import hashlib
 import threading
 import traceback
 import urllib.request
@@ -23,6 +26,8 @@ import shutil
 import cv2
 import numpy as np
 
+from models import model_registry
+
 # ---------------------------------------------------------------------------
 # Constants
 # ---------------------------------------------------------------------------
@@ -33,6 +38,31 @@ ONNX_MIN_SIZE = 160 * 1024 * 1024   # ~166 MB complete file
 
 EMBEDDING_DIM = 512
 INPUT_SIZE    = 112   # ArcFace R50 expects 112x112
+MAX_BATCH     = int(os.environ.get("INSIGHTFACE_MAX_BATCH", "32"))   # faces per session.run()
+
+# Recognition model variant: fp32 is the downloaded w600k_r50.onnx, the others
+# are produced next to it by quantize_arcface.py (validate them there first)
+MODEL_VARIANTS = ("fp32", "fp16", "int8-dynamic", "int8-static")
+MODEL_VARIANT  = os.environ.get("INSIGHTFACE_VARIANT", "fp32").lower()
+
+# ONNX Runtime session options (tune per host; the opt-in startup benchmark
+# below reports per-batch latency for the chosen settings)
+ORT_INTER_OP_THREADS = int(os.environ.get("INSIGHTFACE_INTER_OP_THREADS", "2"))
+ORT_INTRA_OP_THREADS = int(os.environ.get("INSIGHTFACE_INTRA_OP_THREADS", "4"))
+ORT_EXECUTION_MODE   = os.environ.get("INSIGHTFACE_EXECUTION_MODE", "sequential").lower()   # sequential | parallel
+ORT_GRAPH_OPT        = os.environ.get("INSIGHTFACE_GRAPH_OPT", "all").lower()   # disable | basic | extended | all
+ORT_MEM_ARENA        = os.environ.get("INSIGHTFACE_MEM_ARENA", "1") == "1"
+ORT_MEM_PATTERN      = os.environ.get("INSIGHTFACE_MEM_PATTERN", "1") == "1"
+# Persist the optimised graph next to ONNX_PATH and load it on later boots
+ORT_CACHE_OPTIMIZED  = os.environ.get("INSIGHTFACE_CACHE_OPTIMIZED", "1") == "1"
+# Time session.run() per batch size after loading; off by default since it
+# would run in every gunicorn worker (quantize_arcface.py uses the sizes too)
+INSIGHTFACE_BENCHMARK = os.environ.get("INSIGHTFACE_BENCHMARK", "0") == "1"
+BENCH_BATCH_SIZES    = [int(b) for b in os.environ.get("INSIGHTFACE_BENCH_BATCHES", "1,4,16").split(",") if b.strip()]
+BENCH_RUNS           = 3
+# Batch shapes the pipeline sends, warmed on the serving session at load:
+# single face, 3 TTA views / Canny candidates, 4 regions, 4 regions x 3 TTA
+WARMUP_BATCH_SIZES   = [int(b) for b in os.environ.get("INSIGHTFACE_WARMUP_BATCHES", "1,3,4,12").split(",") if b.strip()]
 
 # Download sources tried in order (most reliable first)
 _DOWNLOAD_SOURCES = [
@@ -60,12 +90,15 @@ _DOWNLOAD_SOURCES = [
 # Singleton state
 # ---------------------------------------------------------------------------
 
-_SESSION     = None
-_INPUT_NAME  = None
-_OUTPUT_NAME = None
+REGISTRY_NAME = "insightface"   # the session itself is owned by models.model_registry
 _INSIGHTFACE_INITIALIZED = False
 _INSIGHTFACE_LOAD_FAILED = False
 _LOCK = threading.Lock()
+_MODEL_HASH_CACHE = None   # ((path, size, mtime), sha256 hex) of the active model file
+_ACTIVE_VARIANT   = None   # variant actually loaded (falls back to fp32)
+_ACTIVE_PATH      = None   # model file the session was built from
+_SESSION_SOURCE   = None   # "optimized-cache" | "optimized-now" | "source"
+_LATENCY_PROFILE  = {}     # batch size -> {"batch_ms", "per_face_ms"}
 
 
 # ---------------------------------------------------------------------------
@@ -187,6 +220,165 @@ def _ensure_model() -> bool:
     return False
 
 
+# ---------------------------------------------------------------------------
+# Model variants
+# ---------------------------------------------------------------------------
+
+def variant_path(variant: str) -> str:
+    """File for a recognition model variant (fp32 is ONNX_PATH itself)."""
+    if variant not in MODEL_VARIANTS:
+        raise ValueError(f"Unknown InsightFace variant '{variant}' (expected one of {MODEL_VARIANTS})")
+    if variant == "fp32":
+        return ONNX_PATH
+    root, ext = os.path.splitext(ONNX_PATH)
+    return f"{root}.{variant}{ext}"
+
+
+def _resolve_variant(verbose: bool = False) -> tuple:
+    """
+    (variant, path) to load for INSIGHTFACE_VARIANT.
+
+    An unknown name or a variant that has not been built yet falls back to
+    fp32 so a misconfigured worker still serves (at full-precision cost).
+    """
+    variant = MODEL_VARIANT
+    if variant not in MODEL_VARIANTS:
+        if verbose:
+            print(f"[InsightFace] [WARN] Unknown INSIGHTFACE_VARIANT '{variant}', using fp32")
+        return "fp32", ONNX_PATH
+    path = variant_path(variant)
+    if variant != "fp32" and not (os.path.exists(path) and os.path.getsize(path) > 0):
+        if verbose:
+            print(f"[InsightFace] [WARN] Variant '{variant}' not found at {path} - using fp32. "
+                  f"Build it with: python quantize_arcface.py build --variants {variant}")
+        return "fp32", ONNX_PATH
+    return variant, path
+
+
+def active_model_path() -> str:
+    """Model file in use (or that would be used by the next initialisation)."""
+    return _ACTIVE_PATH or _resolve_variant()[1]
+
+
+# ---------------------------------------------------------------------------
+# Session options + optimised graph cache
+# ---------------------------------------------------------------------------
+
+_GRAPH_OPT_LEVELS = {
+    "disable":  "ORT_DISABLE_ALL",
+    "basic":    "ORT_ENABLE_BASIC",
+    "extended": "ORT_ENABLE_EXTENDED",
+    "all":      "ORT_ENABLE_ALL",
+}
+
+
+def _optimized_path() -> str:
+    """Where the optimised graph is cached (one file per variant and optimisation level)."""
+    root, ext = os.path.splitext(active_model_path())
+    return f"{root}.opt-{ORT_GRAPH_OPT}{ext}"
+
+
+def _optimized_stamp(ort) -> dict:
+    """What the cached graph was built from; any change invalidates it."""
+    return {
+        "source_sha256": get_model_file_hash(),
+        "ort_version":   ort.__version__,
+        "graph_opt":     ORT_GRAPH_OPT,
+    }
+
+
+def _optimized_cache_valid(ort) -> bool:
+    path = _optimized_path()
+    try:
+        with open(path + ".json") as f:
+            return os.path.getsize(path) > 0 and json.load(f) == _optimized_stamp(ort)
+    except (OSError, ValueError):
+        return False
+
+
+def _session_options(ort, graph_opt: str, optimized_out: str = None):
+    """SessionOptions from the INSIGHTFACE_* settings."""
+    opts = ort.SessionOptions()
+    opts.inter_op_num_threads = ORT_INTER_OP_THREADS
+    opts.intra_op_num_threads = ORT_INTRA_OP_THREADS
+    opts.execution_mode = (
+        ort.ExecutionMode.ORT_PARALLEL if ORT_EXECUTION_MODE == "parallel"
+        else ort.ExecutionMode.ORT_SEQUENTIAL
+    )
+    if graph_opt not in _GRAPH_OPT_LEVELS:
+        print(f"[InsightFace] [WARN] Unknown graph optimisation level '{graph_opt}', using 'all'")
+        graph_opt = "all"
+    opts.graph_optimization_level = getattr(ort.GraphOptimizationLevel, _GRAPH_OPT_LEVELS[graph_opt])
+    opts.enable_cpu_mem_arena = ORT_MEM_ARENA
+    opts.enable_mem_pattern   = ORT_MEM_PATTERN
+    opts.log_severity_level   = 2  # suppress verbose ONNX logs
+    if optimized_out:
+        opts.optimized_model_filepath = optimized_out
+    return opts
+
+
+def _create_session(ort):
+    """
+    InferenceSession for the active model variant.
+
+    With INSIGHTFACE_CACHE_OPTIMIZED=1 the graph optimised on a previous boot
+    is loaded as-is (optimisation disabled); otherwise the source model is
+    optimised and the result written next to it for the next boot. Returns
+    (session, source) where source says which path was taken.
+    """
+    providers = ["CPUExecutionProvider"]
+    src_path  = active_model_path()
+    opt_path  = _optimized_path()
+
+    if ORT_CACHE_OPTIMIZED and ORT_GRAPH_OPT != "disable" and _optimized_cache_valid(ort):
+        try:
+            session = ort.InferenceSession(
+                opt_path, sess_options=_session_options(ort, "disable"), providers=providers
+            )
+            return session, "optimized-cache"
+        except Exception as e:
+            print(f"[InsightFace] [WARN] Cached optimised graph unusable ({e}), re-optimising")
+
+    if not ORT_CACHE_OPTIMIZED or ORT_GRAPH_OPT == "disable":
+        opts = _session_options(ort, ORT_GRAPH_OPT)
+        return ort.InferenceSession(src_path, sess_options=opts, providers=providers), "source"
+
+    tmp = f"{opt_path}.{os.getpid()}.tmp"
+    opts = _session_options(ort, ORT_GRAPH_OPT, optimized_out=tmp)
+    session = ort.InferenceSession(src_path, sess_options=opts, providers=providers)
+    try:
+        # Rename into place so a concurrent boot never reads a half-written graph
+        os.replace(tmp, opt_path)
+        with open(opt_path + ".json", "w") as f:
+            json.dump(_optimized_stamp(ort), f)
+        print(f"[InsightFace]   Optimised graph cached: {opt_path}")
+    except OSError as e:
+        print(f"[InsightFace] [WARN] Could not cache optimised graph ({e})")
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return session, "optimized-now"
+
+
+def _benchmark_session(record) -> dict:
+    """Median latency of one session.run() per batch size in BENCH_BATCH_SIZES."""
+    profile = {}
+    for size in BENCH_BATCH_SIZES:
+        if size < 1 or (record.fixed_batch and size > 1):
+            continue
+        dummy = np.zeros((size, 3, INPUT_SIZE, INPUT_SIZE), dtype=np.float32)
+        record.run(dummy)   # first run allocates buffers
+        timings = []
+        for _ in range(BENCH_RUNS):
+            start = time.perf_counter()
+            record.run(dummy)
+            timings.append((time.perf_counter() - start) * 1000.0)
+        batch_ms = float(np.median(timings))
+        profile[size] = {"batch_ms": round(batch_ms, 2), "per_face_ms": round(batch_ms / size, 2)}
+        print(f"[InsightFace]   Latency batch={size:>3}: {batch_ms:8.1f} ms/batch, "
+              f"{batch_ms / size:6.1f} ms/face")
+    return profile
+
+
 # ---------------------------------------------------------------------------
 # Public API
 # ---------------------------------------------------------------------------
@@ -198,8 +390,8 @@ def initialize_insightface_model() -> bool:
     Returns True if model loaded successfully.
     Raises RuntimeError on failure (fail loudly).
     """
-    global _SESSION, _INPUT_NAME, _OUTPUT_NAME
-    global _INSIGHTFACE_INITIALIZED, _INSIGHTFACE_LOAD_FAILED
+    global _SESSION_SOURCE, _LATENCY_PROFILE
+    global _INSIGHTFACE_INITIALIZED, _INSIGHTFACE_LOAD_FAILED, _ACTIVE_VARIANT, _ACTIVE_PATH
 
     if _INSIGHTFACE_INITIALIZED:
         print("[InsightFace] Already initialized [OK]")
@@ -250,36 +442,39 @@ def initialize_insightface_model() -> bool:
                 raise RuntimeError(f"InsightFace init failed: {msg}")
             print(f"[InsightFace]   Size check: PASSED [OK]")
 
+            _ACTIVE_VARIANT, _ACTIVE_PATH = _resolve_variant(verbose=True)
+            if _ACTIVE_VARIANT != "fp32":
+                print(f"[InsightFace]   Variant: {_ACTIVE_VARIANT} -> {_ACTIVE_PATH} "
+                      f"({os.path.getsize(_ACTIVE_PATH) // (1024*1024)} MB)")
+
             # Step 3: Create ONNX session
             print("[InsightFace] Step 3: Creating ONNX inference session...")
-            sess_opts = ort.SessionOptions()
-            sess_opts.inter_op_num_threads = 2
-            sess_opts.intra_op_num_threads = 4
-            sess_opts.log_severity_level = 2  # suppress verbose ONNX logs
-
-            _SESSION = ort.InferenceSession(
-                ONNX_PATH,
-                sess_options=sess_opts,
-                providers=["CPUExecutionProvider"],
+            print(f"[InsightFace]   Threads: inter_op={ORT_INTER_OP_THREADS}, intra_op={ORT_INTRA_OP_THREADS}, "
+                  f"mode={ORT_EXECUTION_MODE}, graph_opt={ORT_GRAPH_OPT}, "
+                  f"mem_arena={ORT_MEM_ARENA}, mem_pattern={ORT_MEM_PATTERN}")
+            record = model_registry.load_session(
+                REGISTRY_NAME, lambda: _create_session(ort), (3, INPUT_SIZE, INPUT_SIZE)
             )
+            _SESSION_SOURCE = record.source
+            print(f"[InsightFace]   Graph loaded from: {_SESSION_SOURCE}")
 
-            # Step 4: Inspect session I/O
-            _INPUT_NAME  = _SESSION.get_inputs()[0].name
-            _OUTPUT_NAME = _SESSION.get_outputs()[0].name
-            input_shape  = _SESSION.get_inputs()[0].shape
-            output_shape = _SESSION.get_outputs()[0].shape
+            # Inspect session I/O
+            input_shape  = record.session.get_inputs()[0].shape
+            output_shape = record.session.get_outputs()[0].shape
 
             print(f"[InsightFace]   Session created [OK]")
-            print(f"[InsightFace]   Input  name:  {_INPUT_NAME}")
+            print(f"[InsightFace]   Input  name:  {record.input_name}")
             print(f"[InsightFace]   Input  shape: {input_shape}")
-            print(f"[InsightFace]   Output name:  {_OUTPUT_NAME}")
+            print(f"[InsightFace]   Output name:  {record.output_name}")
             print(f"[InsightFace]   Output shape: {output_shape}")
+            print(f"[InsightFace]   Batching:     {'off (static batch dim)' if record.fixed_batch else f'up to {MAX_BATCH} faces per run'}")
 
-            # Step 5: Smoke test with a dummy input
-            print("[InsightFace] Step 4: Running smoke test (dummy inference)...")
+            # Step 4: Warm the serving session at every batch shape we send,
+            # then smoke-test its output
+            print("[InsightFace] Step 4: Warming up session + smoke test (dummy inference)...")
+            model_registry.warmup(REGISTRY_NAME, [1, *WARMUP_BATCH_SIZES])
             dummy = np.zeros((1, 3, INPUT_SIZE, INPUT_SIZE), dtype=np.float32)
-            out = _SESSION.run([_OUTPUT_NAME], {_INPUT_NAME: dummy})
-            emb_shape = out[0].shape
+            emb_shape = record.run(dummy).shape
             print(f"[InsightFace]   Smoke test output shape: {emb_shape}")
             if emb_shape[-1] != EMBEDDING_DIM:
                 _INSIGHTFACE_LOAD_FAILED = True
@@ -288,6 +483,10 @@ def initialize_insightface_model() -> bool:
                 raise RuntimeError(f"InsightFace init failed: {msg}")
             print(f"[InsightFace]   Smoke test: PASSED [OK] (output dim={emb_shape[-1]})")
 
+            if INSIGHTFACE_BENCHMARK and BENCH_BATCH_SIZES:
+                print("[InsightFace] Step 5: Measuring per-batch latency...")
+                _LATENCY_PROFILE = _benchmark_session(record)
+
             _INSIGHTFACE_INITIALIZED = True
             print("[InsightFace] ============================================================")
             print("[InsightFace] [OK] InsightFace ArcFace R50 FULLY INITIALIZED AND READY")
@@ -303,21 +502,111 @@ def initialize_insightface_model() -> bool:
             raise RuntimeError(f"InsightFace init failed: {e}") from e
 
 
+def ensure_insightface_weights() -> bool:
+    """
+    Download / verify the weights without creating a session (the gunicorn
+    master, when sessions are left to the workers). Returns False if they
+    cannot be obtained.
+    """
+    with _LOCK:
+        if not _ensure_model():
+            print(f"[InsightFace] [ERROR] Could not obtain w600k_r50.onnx - place it at: {ONNX_PATH}")
+            return False
+    _resolve_variant(verbose=True)
+    return True
+
+
+def release_insightface_session():
+    """
+    Drop the ONNX session (gunicorn pre_fork, in the master).
+
+    onnxruntime thread pools do not survive fork(), so every worker builds
+    its own session in post_fork via reinitialize_insightface_after_fork().
+    """
+    global _INSIGHTFACE_INITIALIZED
+
+    with _LOCK:
+        if not model_registry.release(REGISTRY_NAME):
+            return
+        _INSIGHTFACE_INITIALIZED = False
+    print("[InsightFace] Session released before fork")
+
+
+def reinitialize_insightface_after_fork() -> bool:
+    """Create this worker's own ONNX session (gunicorn post_fork)."""
+    global _LOCK, _INSIGHTFACE_INITIALIZED
+
+    _LOCK = threading.Lock()   # may have been held by a master thread at fork time
+    model_registry.release(REGISTRY_NAME)
+    _INSIGHTFACE_INITIALIZED = False
+    print(f"[InsightFace] Creating session in worker pid={os.getpid()}")
+    return initialize_insightface_model()
+
+
+def warmup_insightface_session() -> dict:
+    """
+    Warm the live session at WARMUP_BATCH_SIZES (no-op for shapes already
+    warmed during initialisation). Returns {batch size: ms} newly warmed.
+    """
+    return model_registry.warmup(REGISTRY_NAME, [1, *WARMUP_BATCH_SIZES])
+
+
+def get_model_file_hash() -> str:
+    """
+    sha256 of the active ONNX weights file (cached per path/size/mtime); '' if missing.
+
+    Quantised variants hash differently from fp32, so switching
+    INSIGHTFACE_VARIANT invalidates both the embeddings stored per criminal
+    (see faiss_service.get_embedding_version) and FAISS snapshots.
+    """
+    global _MODEL_HASH_CACHE
+    path = active_model_path()
+    if not os.path.exists(path):
+        return ""
+    stat = os.stat(path)
+    key  = (path, stat.st_size, stat.st_mtime)
+    if _MODEL_HASH_CACHE is None or _MODEL_HASH_CACHE[0] != key:
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                h.update(chunk)
+        _MODEL_HASH_CACHE = (key, h.hexdigest())
+    return _MODEL_HASH_CACHE[1]
+
+
 def is_insightface_initialized() -> bool:
     return _INSIGHTFACE_INITIALIZED
 
 
 def get_insightface_status() -> dict:
     """Return a status dict for diagnostics."""
+    record = model_registry.get_record(REGISTRY_NAME)
     return {
         "initialized": _INSIGHTFACE_INITIALIZED,
         "load_failed": _INSIGHTFACE_LOAD_FAILED,
         "model_path": ONNX_PATH,
         "model_exists": os.path.exists(ONNX_PATH),
         "model_size_mb": os.path.getsize(ONNX_PATH) // (1024 * 1024) if os.path.exists(ONNX_PATH) else 0,
-        "session_active": _SESSION is not None,
-        "input_name": _INPUT_NAME,
-        "output_name": _OUTPUT_NAME,
+        "variant": _ACTIVE_VARIANT or _resolve_variant()[0],
+        "variant_requested": MODEL_VARIANT,
+        "active_model_path": active_model_path(),
+        "session_active": record is not None,
+        "input_name": record.input_name if record else None,
+        "output_name": record.output_name if record else None,
+        "batched": not (record and record.fixed_batch),
+        "max_batch": 1 if record and record.fixed_batch else MAX_BATCH,
+        "registry": record.stats() if record else None,
+        "graph_source": _SESSION_SOURCE,
+        "optimized_path": _optimized_path(),
+        "session_options": {
+            "inter_op_threads": ORT_INTER_OP_THREADS,
+            "intra_op_threads": ORT_INTRA_OP_THREADS,
+            "execution_mode": ORT_EXECUTION_MODE,
+            "graph_opt": ORT_GRAPH_OPT,
+            "mem_arena": ORT_MEM_ARENA,
+            "mem_pattern": ORT_MEM_PATTERN,
+        },
+        "latency_ms": dict(_LATENCY_PROFILE),
     }
 
 
@@ -342,6 +631,52 @@ def _preprocess_for_arcface(face_bgr: np.ndarray) -> np.ndarray:
     return img
 
 
+def _require_session():
+    """The registry's live record for the InsightFace session; raises if unavailable."""
+    record = model_registry.get_record(REGISTRY_NAME)
+    if not _INSIGHTFACE_INITIALIZED or record is None:
+        status = get_insightface_status()
+        raise RuntimeError(
+            f"InsightFace model not initialized. "
+            f"Status: initialized={status['initialized']}, "
+            f"load_failed={status['load_failed']}, "
+            f"model_exists={status['model_exists']} ({status['model_size_mb']} MB), "
+            f"session_active={status['session_active']}"
+        )
+    return record
+
+
+def extract_insightface_embeddings(faces: list) -> np.ndarray:
+    """
+    Extract 512-D L2-normalized embeddings for several BGR face crops at once.
+
+    The crops are preprocessed and stacked into one NCHW batch, so N faces
+    cost one session.run() (per MAX_BATCH chunk) instead of N.
+
+    Args:
+        faces: list of uint8 BGR numpy arrays (any size - each resized to 112x112).
+
+    Returns:
+        np.ndarray: (N, 512) float32, one L2-normalized row per face, in order.
+
+    Raises:
+        RuntimeError: If model not initialized.
+    """
+    record = _require_session()
+    if len(faces) == 0:
+        return np.empty((0, EMBEDDING_DIM), dtype=np.float32)
+
+    batch = np.concatenate([_preprocess_for_arcface(face) for face in faces])   # (N, 3, 112, 112)
+    step  = 1 if record.fixed_batch else max(1, MAX_BATCH)
+    embs  = np.concatenate([
+        record.run(batch[i:i + step]) for i in range(0, len(batch), step)
+    ])
+
+    norms = np.linalg.norm(embs, axis=1, keepdims=True)
+    embs  = embs / np.where(norms > 0, norms, 1.0)   # zero rows stay zero
+    return embs.astype(np.float32)
+
+
 def extract_insightface_embedding(face_bgr: np.ndarray) -> np.ndarray:
     """
     Extract a 512-D L2-normalized embedding from a BGR face crop.
@@ -355,25 +690,7 @@ def extract_insightface_embedding(face_bgr: np.ndarray) -> np.ndarray:
     Raises:
         RuntimeError: If model not initialized.
     """
-    if not _INSIGHTFACE_INITIALIZED or _SESSION is None:
-        status = get_insightface_status()
-        raise RuntimeError(
-            f"InsightFace model not initialized. "
-            f"Status: initialized={status['initialized']}, "
-            f"load_failed={status['load_failed']}, "
-            f"model_exists={status['model_exists']} ({status['model_size_mb']} MB), "
-            f"session_active={status['session_active']}"
-        )
-
-    inp = _preprocess_for_arcface(face_bgr)
-    outputs = _SESSION.run([_OUTPUT_NAME], {_INPUT_NAME: inp})
-    emb = outputs[0][0]  # shape (512,)
-
-    norm = np.linalg.norm(emb)
-    if norm > 0:
-        emb = emb / norm
-
-    return emb.astype(np.float32)
+    return extract_insightface_embeddings([face_bgr])[0]
 
 
 def normalize_embedding(embedding: np.ndarray) -> np.ndarray:
@@ -0,0 +1,168 @@
+"""
+Model registry - the single owner of every inference session in the process.
+
+Model wrappers (models/insightface_model.py today) hand the registry a loader
+instead of keeping their own session. The registry:
+  - builds the session once and times it (load_ms) with the RSS growth it caused
+  - warms THAT session at every batch shape the pipeline actually sends, so the
+    first real request of each shape does not pay the allocation cost
+  - exposes per-model load time, warmup time and resident memory for /api/health
+
+Nothing else should create an InferenceSession for a registered model; a second
+copy doubles load time and memory and is never the session that serves requests.
+
+Gunicorn: the master releases every session before fork (onnxruntime thread
+pools do not survive fork) and each worker loads + warms its own in post_fork.
+"""
+
+import os
+import time
+import threading
+
+import numpy as np
+
+# ---------------------------------------------------------------------------
+# State
+# ---------------------------------------------------------------------------
+
+_MODELS = {}               # name -> ModelRecord
+_LOCK   = threading.Lock()
+
+
+class ModelRecord:
+    """One registered session plus what it cost to load and warm."""
+
+    __slots__ = (
+        "name", "session", "source", "input_name", "output_name", "sample_shape",
+        "fixed_batch", "load_ms", "load_rss_mb", "warmup_ms", "warmup_rss_mb", "pid",
+    )
+
+    def __init__(self, name: str, session, source: str, sample_shape: tuple):
+        inp = session.get_inputs()[0]
+        self.name         = name
+        self.session      = session
+        self.source       = source
+        self.input_name   = inp.name
+        self.output_name  = session.get_outputs()[0].name
+        self.sample_shape = tuple(sample_shape)   # one sample, without the batch dim
+        # A graph exported with a static batch dim only accepts that batch size
+        self.fixed_batch  = inp.shape[0] if isinstance(inp.shape[0], int) and inp.shape[0] > 0 else None
+        self.load_ms       = 0.0
+        self.load_rss_mb   = 0.0
+        self.warmup_ms     = {}    # batch size -> first-run ms
+        self.warmup_rss_mb = 0.0
+        self.pid           = os.getpid()
+
+    def run(self, batch: np.ndarray) -> np.ndarray:
+        return self.session.run([self.output_name], {self.input_name: batch})[0]
+
+    def stats(self) -> dict:
+        return {
+            "source": self.source,
+            "input_shape": [self.fixed_batch or "N", *self.sample_shape],
+            "load_ms": round(self.load_ms, 1),
+            "load_rss_mb": round(self.load_rss_mb, 1),
+            "warmup_ms": {size: round(ms, 1) for size, ms in sorted(self.warmup_ms.items())},
+            "warmup_rss_mb": round(self.warmup_rss_mb, 1),
+            "warm": bool(self.warmup_ms),
+            "pid": self.pid,
+        }
+
+
+def _rss_mb() -> float:
+    """Resident set size of this process in MB (Linux; 0 elsewhere)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        return 0.0
+
+
+# ---------------------------------------------------------------------------
+# Public API
+# ---------------------------------------------------------------------------
+
+def load_session(name: str, loader, sample_shape: tuple) -> ModelRecord:
+    """
+    Build and register the session for `name`, replacing any previous one.
+
+    Args:
+        loader:       callable returning (session, source) - source is a short
+                      label for where the graph came from (e.g. "optimized-cache").
+        sample_shape: input shape of one sample, without the batch dim.
+    """
+    rss_before = _rss_mb()
+    start = time.perf_counter()
+    session, source = loader()
+    record = ModelRecord(name, session, source, sample_shape)
+    record.load_ms     = (time.perf_counter() - start) * 1000.0
+    record.load_rss_mb = max(0.0, _rss_mb() - rss_before)
+    with _LOCK:
+        _MODELS[name] = record
+    print(f"[ModelRegistry] {name}: loaded in {record.load_ms:.0f} ms "
+          f"(+{record.load_rss_mb:.0f} MB RSS, source={source})")
+    return record
+
+
+def warmup(name: str, batch_sizes) -> dict:
+    """
+    Run the registered session once at each batch size (skipping shapes a
+    static-batch graph cannot take) and record the first-run latency.
+
+    Already-warm sizes are skipped, so calling this again is cheap.
+    Returns {batch size: ms} for the sizes warmed by this call.
+    """
+    record = get_record(name)
+    if record is None:
+        print(f"[ModelRegistry] {name}: not loaded - nothing to warm")
+        return {}
+    sizes = sorted({int(s) for s in batch_sizes if int(s) > 0})
+    if record.fixed_batch:
+        sizes = [record.fixed_batch]
+
+    warmed = {}
+    rss_before = _rss_mb()
+    for size in sizes:
+        if size in record.warmup_ms:
+            continue
+        dummy = np.zeros((size, *record.sample_shape), dtype=np.float32)
+        start = time.perf_counter()
+        record.run(dummy)
+        warmed[size] = record.warmup_ms[size] = (time.perf_counter() - start) * 1000.0
+    if warmed:
+        record.warmup_rss_mb += max(0.0, _rss_mb() - rss_before)
+        shapes = ", ".join(f"{size}: {ms:.0f} ms" for size, ms in warmed.items())
+        print(f"[ModelRegistry] {name}: warmed batch sizes {{{shapes}}} "
+              f"(+{record.warmup_rss_mb:.0f} MB RSS)")
+    return warmed
+
+
+def get_record(name: str):
+    """The live ModelRecord for `name` (None if not loaded in this process)."""
+    return _MODELS.get(name)
+
+
+def get_session(name: str):
+    record = _MODELS.get(name)
+    return record.session if record is not None else None
+
+
+def release(name: str) -> bool:
+    """Drop the session for `name` (gunicorn pre_fork). True if one was held."""
+    with _LOCK:
+        return _MODELS.pop(name, None) is not None
+
+
+def reset_after_fork():
+    """Fresh lock and no inherited records (gunicorn post_fork, before loading)."""
+    global _LOCK
+    _LOCK = threading.Lock()   # may have been held by a master thread at fork time
+    _MODELS.clear()
+
+
+def get_registry_stats() -> dict:
+    """Per-model load time, warmup time and resident memory, plus process RSS."""
+    return {
+        "process_rss_mb": round(_rss_mb(), 1),
+        "models": {name: record.stats() for name, record in list(_MODELS.items())},
+    }
@@ -3,14 +3,24 @@ Image preprocessing utilities for face recognition
 Handles basic image operations like loading, conversion, and resizing
 """
 import os
+import uuid
 import cv2
 import numpy as np
 import traceback
 
+from utils.image_context import ImageContext
 
-def load_image(image_path: str) -> np.ndarray:
+# Intermediates stay in memory; set this to also write them out (lossless PNG)
+# for debugging. Nothing is written when it is unset.
+PREPROCESS_DEBUG_DIR = os.environ.get("PREPROCESS_DEBUG_DIR", "")
+
+
+def load_image(image_path) -> np.ndarray:
     """
-    Load image from file path with robust validation
+    Load image from file path (or take it from an ImageContext) with robust validation
+    
+    An ImageContext is already decoded, so steps 1-3 are skipped and its
+    decoded array is returned as-is (copy before modifying in place).
     
     Performs comprehensive validation:
     1. Checks if file exists
@@ -19,19 +29,23 @@ def load_image(image_path: str) -> np.ndarray:
     4. Validates image has valid dimensions
     
     Args:
-        image_path: Path to image file
+        image_path: Path to image file, or ImageContext
     
     Returns:
         np.ndarray: Loaded image or None if failed
     """
     try:
-        # Step 1: Check if file exists
-        if not os.path.exists(image_path):
-            print(f"  [ERROR] Image file does not exist: {image_path}")
-            return None
-        
-        # Step 2: Attempt to read image
-        img = cv2.imread(image_path)
+        if isinstance(image_path, ImageContext):
+            img = image_path.bgr
+            image_path = image_path.filename
+        else:
+            # Step 1: Check if file exists
+            if not os.path.exists(image_path):
+                print(f"  [ERROR] Image file does not exist: {image_path}")
+                return None
+            
+            # Step 2: Attempt to read image
+            img = cv2.imread(image_path)
         
         # Step 3: Verify image is not None
         if img is None:
@@ -196,15 +210,10 @@ def save_image(img: np.ndarray, output_path: str, quality: int = 95) -> bool:
             print(f"  [ERROR] Failed to write image to: {output_path}")
             return False
         
-        # Validate file exists
-        if not os.path.exists(output_path):
-            print(f"  [ERROR] Image file does not exist after write: {output_path}")
-            return False
-        
-        # Validate file can be read
-        test_img = cv2.imread(output_path)
-        if test_img is None:
-            print(f"  [ERROR] cv2.imread() failed on saved file: {output_path}")
+        # Validate file exists (imwrite already reported encode/write failures,
+        # so the file is not read back)
+        if not os.path.exists(output_path) or os.path.getsize(output_path) == 0:
+            print(f"  [ERROR] Image file missing or empty after write: {output_path}")
             return False
         
         return True
@@ -213,3 +222,25 @@ def save_image(img: np.ndarray, output_path: str, quality: int = 95) -> bool:
         print(f"  [ERROR] Exception saving image: {e}")
         traceback.print_exc()
         return False
+
+
+def save_debug_artifact(img: np.ndarray, name: str) -> str:
+    """
+    Write an intermediate image to PREPROCESS_DEBUG_DIR, if set
+    
+    Args:
+        img: Image to save
+        name: File name stem (a unique suffix and .png are added)
+    
+    Returns:
+        str: Path written, or None when debug output is off or the write failed
+    """
+    if not PREPROCESS_DEBUG_DIR or img is None:
+        return None
+    try:
+        os.makedirs(PREPROCESS_DEBUG_DIR, exist_ok=True)
+        path = os.path.join(PREPROCESS_DEBUG_DIR, f"{name}_{uuid.uuid4().hex[:8]}.png")
+        return path if cv2.imwrite(path, img) else None
+    except Exception as e:
+        print(f"  [WARNING] Debug artefact not written ({name}): {e}")
+        return None
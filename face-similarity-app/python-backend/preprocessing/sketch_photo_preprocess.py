@@ -18,13 +18,45 @@ from preprocessing.image_preprocessing import (
     apply_canny_edge_detection,
     apply_bilateral_filter,
     apply_histogram_equalization,
-    save_image
+    save_image,
+    save_debug_artifact,
 )
 from utils.file_utils import generate_temp_filepath, cleanup_temp_file
+from utils.image_context import ImageContext
 from utils.similarity_utils import cosine_similarity
 
 
-def is_sketch_image(image_path: str) -> bool:
+def _source_path(image) -> str:
+    """File path behind a path or ImageContext (returned when preprocessing falls back)."""
+    return image.path if isinstance(image, ImageContext) else image
+
+
+def is_sketch_image(image_path) -> bool:
+    """
+    Classify an image file (path) or ImageContext as sketch or photo.
+
+    An ImageContext is classified once and the result reused; a path is read
+    and classified with classify_sketch().
+
+    Args:
+        image_path: Path to image file, or ImageContext
+
+    Returns:
+        bool: True if image is a sketch, False otherwise
+    """
+    if isinstance(image_path, ImageContext):
+        return image_path.is_sketch
+    try:
+        img = cv2.imread(image_path)
+        if img is None:
+            return False
+        return classify_sketch(img)
+    except Exception as e:
+        print(f"  [SKETCH DETECTION ERROR] {e}")
+        return False
+
+
+def classify_sketch(img: np.ndarray, gray: np.ndarray = None) -> bool:
     """
     Detect if an image is a sketch based on characteristics:
     - Low color saturation (mostly grayscale)
@@ -38,16 +70,13 @@ def is_sketch_image(image_path: str) -> bool:
     - Edge density: > 0.08 (was 0.05) - More strict to require clear sketch lines
     
     Args:
-        image_path: Path to image file
+        img: Decoded BGR image
+        gray: Its grayscale version, if already computed
     
     Returns:
         bool: True if image is a sketch, False otherwise
     """
     try:
-        img = cv2.imread(image_path)
-        if img is None:
-            return False
-        
         # Convert to HSV to check saturation
         hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
         saturation = hsv[:, :, 1]
@@ -59,7 +88,8 @@ def is_sketch_image(image_path: str) -> bool:
         is_low_saturation = avg_saturation < 25
         
         # Check edge density (sketches have more edges)
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        if gray is None:
+            gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
         edges = cv2.Canny(gray, 50, 150)
         edge_density = float(np.sum(edges > 0)) / float(edges.size)
         
@@ -108,7 +138,34 @@ def is_sketch_image(image_path: str) -> bool:
         return False
 
 
-def preprocess_for_edge_based_matching(image_path: str, is_sketch: bool = False) -> str:
+def preprocess_for_edge_based_matching(image_path, is_sketch: bool = False) -> str:
+    """
+    File-returning wrapper of preprocess_for_edge_based_matching_array()
+    
+    Writes the result to temp_uploads (caller deletes it). Prefer the array
+    version; this exists for callers that explicitly need a file.
+    
+    Args:
+        image_path: Path to image file, or ImageContext
+        is_sketch: True if image is a sketch, False if photo
+    
+    Returns:
+        str: Path to preprocessed image file (the input path on failure)
+    """
+    result_bgr = preprocess_for_edge_based_matching_array(image_path, is_sketch)
+    if result_bgr is None:
+        return _source_path(image_path)
+    
+    # Save to temp_uploads folder with unique filename
+    file_hash = uuid.uuid4().hex[:8]
+    mode = "sketch" if is_sketch else "photo"
+    processed_path = generate_temp_filepath(prefix=f'edge_{mode}_{file_hash}')
+    if not save_image(result_bgr, processed_path, quality=95):
+        return _source_path(image_path)
+    return processed_path
+
+
+def preprocess_for_edge_based_matching_array(image_path, is_sketch: bool = False) -> np.ndarray:
     """
     STEP 2: Edge-based preprocessing to reduce sketch-photo domain gap
     
@@ -121,16 +178,16 @@ def preprocess_for_edge_based_matching(image_path: str, is_sketch: bool = False)
     This reduces the domain gap by converting both to edge-based representations.
     
     Args:
-        image_path: Path to image file
+        image_path: Path to image file, or ImageContext
         is_sketch: True if image is a sketch, False if photo
     
     Returns:
-        str: Path to preprocessed image file
+        np.ndarray: Preprocessed BGR image (in memory), or None if failed
     """
     try:
         img = load_image(image_path)
         if img is None:
-            return image_path
+            return None
         
         # Convert to grayscale
         gray = convert_to_grayscale(img)
@@ -161,23 +218,44 @@ def preprocess_for_edge_based_matching(image_path: str, is_sketch: bool = False)
         
         # Convert back to BGR for DeepFace compatibility
         result_bgr = convert_to_bgr(result)
-        
-        # Save to temp_uploads folder with unique filename
-        file_hash = uuid.uuid4().hex[:8]
-        mode = "sketch" if is_sketch else "photo"
-        processed_path = generate_temp_filepath(prefix=f'edge_{mode}_{file_hash}')
-        cv2.imwrite(processed_path, result_bgr, [cv2.IMWRITE_JPEG_QUALITY, 95])
-        
-        return processed_path
+        save_debug_artifact(result_bgr, f"edge_{'sketch' if is_sketch else 'photo'}")
+        return result_bgr
         
     except Exception as e:
         print(f"Edge preprocessing error: {e}")
-        return image_path
+        return None
 
 
-def preprocess_for_cross_domain_matching(image_path: str, is_sketch: bool = False, 
+def preprocess_for_cross_domain_matching(image_path, is_sketch: bool = False, 
                                          canny_threshold: tuple = None) -> str:
     """
+    File-returning wrapper of preprocess_for_cross_domain_matching_array()
+    
+    Writes the 112x112 result to temp_uploads (caller deletes it). Prefer the
+    array version; this exists for callers that explicitly need a file.
+    
+    Returns:
+        str: Path to preprocessed image file, or None if failed
+    """
+    resized = preprocess_for_cross_domain_matching_array(image_path, is_sketch, canny_threshold)
+    if resized is None:
+        return None
+    
+    canny_threshold = canny_threshold or (50, 150)
+    file_hash = uuid.uuid4().hex[:8]
+    mode = "sketch" if is_sketch else "photo"
+    threshold_str = f"{canny_threshold[0]}_{canny_threshold[1]}"
+    processed_path = generate_temp_filepath(prefix=f'edge_preprocessed_{mode}_{threshold_str}_{file_hash}')
+    if not save_image(resized, processed_path, quality=95):
+        return None
+    
+    print(f"  [PREPROCESSING] Complete - saved to: {processed_path}")
+    return processed_path
+
+
+def preprocess_for_cross_domain_matching_array(image_path, is_sketch: bool = False,
+                                               canny_threshold: tuple = None) -> np.ndarray:
+    """
     EDGE-BASED: Preprocessing to reduce sketch-to-photo domain gap
     
     **USAGE:** Production endpoints (/api/compare, /api/criminals/search)
@@ -192,13 +270,13 @@ def preprocess_for_cross_domain_matching(image_path: str, is_sketch: bool = Fals
     while keeping original sketches intact, reducing the domain gap.
     
     Args:
-        image_path: Path to image file
+        image_path: Path to image file, or ImageContext
         is_sketch: True if image is a sketch, False if photo
         canny_threshold: Tuple of (threshold1, threshold2) for Canny edge detection
                         If None, uses default (50, 150)
     
     Returns:
-        str: Path to preprocessed image file, or None if failed
+        np.ndarray: 112x112 BGR preprocessed image (in memory), or None if failed
     
     DETERMINISTIC: All operations use fixed parameters for consistent results
     """
@@ -244,18 +322,8 @@ def preprocess_for_cross_domain_matching(image_path: str, is_sketch: bool = Fals
         print(f"    [OK] Step 4: Resized to {target_size}x{target_size} (ArcFace native size)")
         print(f"    [OK] Final output: {'Sketch (intact)' if is_sketch else 'Edge-based'} representation, size {resized.shape} (ready for ArcFace)")
         
-        # Save preprocessed image to temp_uploads folder
-        file_hash = uuid.uuid4().hex[:8]
-        mode = "sketch" if is_sketch else "photo"
-        threshold_str = f"{canny_threshold[0]}_{canny_threshold[1]}"
-        processed_path = generate_temp_filepath(prefix=f'edge_preprocessed_{mode}_{threshold_str}_{file_hash}')
-        
-        # Save and validate
-        if not save_image(resized, processed_path, quality=95):
-            return None
-        
-        print(f"  [PREPROCESSING] Complete - saved to: {processed_path}")
-        return processed_path
+        save_debug_artifact(resized, f"cross_domain_{'sketch' if is_sketch else 'photo'}_{canny_threshold[0]}_{canny_threshold[1]}")
+        return resized
         
     except Exception as e:
         print(f"  [PREPROCESSING ERROR] {e}")
@@ -263,13 +331,41 @@ def preprocess_for_cross_domain_matching(image_path: str, is_sketch: bool = Fals
         return None
 
 
-def preprocess_with_adaptive_canny(image_path: str, is_sketch: bool = False, 
+def preprocess_with_adaptive_canny(image_path, is_sketch: bool = False, 
                                    reference_embedding: np.ndarray = None) -> tuple:
     """
+    File-returning wrapper of preprocess_with_adaptive_canny_array()
+    
+    Writes only the best preprocessed image to temp_uploads (caller deletes it).
+    
+    Returns:
+        tuple: (best_preprocessed_path, best_threshold, threshold_results)
+    """
+    best_img, best_threshold, threshold_results = preprocess_with_adaptive_canny_array(
+        image_path, is_sketch, reference_embedding
+    )
+    if best_img is None:
+        return None, best_threshold, threshold_results
+    
+    file_hash = uuid.uuid4().hex[:8]
+    mode = "sketch" if is_sketch else "photo"
+    threshold_str = f"{best_threshold[0]}_{best_threshold[1]}"
+    best_path = generate_temp_filepath(prefix=f'edge_adaptive_{mode}_{threshold_str}_{file_hash}')
+    if not save_image(best_img, best_path, quality=95):
+        print(f"  [ERROR] Failed to save best preprocessed image")
+        return None, best_threshold, threshold_results
+    
+    print(f"  [SAVED] Best preprocessed image: {best_path}")
+    return best_path, best_threshold, threshold_results
+
+
+def preprocess_with_adaptive_canny_array(image_path, is_sketch: bool = False,
+                                         reference_embedding: np.ndarray = None) -> tuple:
+    """
     ADAPTIVE: Test multiple Canny thresholds and select the best one
     
     **USAGE:** Production endpoints when adaptive threshold selection is needed
-    **OPTIMIZED:** Extracts embeddings directly from numpy arrays (no disk I/O)
+    **OPTIMIZED:** Works on numpy arrays end to end (no disk I/O)
     
     Tests multiple Canny threshold combinations:
     - (30, 120) - More edges (sensitive)
@@ -280,12 +376,13 @@ def preprocess_with_adaptive_canny(image_path: str, is_sketch: bool = False,
     the highest embedding similarity. Otherwise, returns default (50, 150).
     
     Args:
-        image_path: Path to image file
+        image_path: Path to image file, or ImageContext
         is_sketch: True if image is a sketch, False if photo
         reference_embedding: Reference embedding to compare against (optional)
     
     Returns:
-        tuple: (best_preprocessed_path, best_threshold, threshold_results)
+        tuple: (best_preprocessed_img, best_threshold, threshold_results) -
+               the image is a 112x112 BGR array (None if preprocessing failed)
     """
     # Threshold combinations to test
     threshold_combinations = [
@@ -299,8 +396,8 @@ def preprocess_with_adaptive_canny(image_path: str, is_sketch: bool = False,
     # If no reference embedding, just use default
     if reference_embedding is None or is_sketch:
         print(f"  No reference embedding or is sketch - using default (50, 150)")
-        best_path = preprocess_for_cross_domain_matching(image_path, is_sketch, (50, 150))
-        return best_path, (50, 150), None
+        best_img = preprocess_for_cross_domain_matching_array(image_path, is_sketch, (50, 150))
+        return best_img, (50, 150), None
     
     threshold_results = []
     best_processed_img = None
@@ -310,8 +407,8 @@ def preprocess_with_adaptive_canny(image_path: str, is_sketch: bool = False,
         img = load_image(image_path)
         if img is None:
             print(f"  [ERROR] Failed to load image: {image_path}")
-            best_path = preprocess_for_cross_domain_matching(image_path, is_sketch, (50, 150))
-            return best_path, (50, 150), None
+            best_img = preprocess_for_cross_domain_matching_array(image_path, is_sketch, (50, 150))
+            return best_img, (50, 150), None
         
         # Convert to grayscale once
         gray = convert_to_grayscale(img)
@@ -364,29 +461,17 @@ def preprocess_with_adaptive_canny(image_path: str, is_sketch: bool = False,
             
             print(f"\n  [BEST THRESHOLD] {best_threshold} with similarity {best_similarity:.4f} ({best_similarity*100:.1f}%)")
             
-            # Save only the best preprocessed image to disk
-            file_hash = uuid.uuid4().hex[:8]
-            mode = "photo"  # Only photos use adaptive Canny
-            threshold_str = f"{best_threshold[0]}_{best_threshold[1]}"
-            best_path = generate_temp_filepath(prefix=f'edge_adaptive_{mode}_{threshold_str}_{file_hash}')
-            
-            if not save_image(best_processed_img, best_path, quality=95):
-                print(f"  [ERROR] Failed to save best preprocessed image")
-                best_path = preprocess_for_cross_domain_matching(image_path, is_sketch, (50, 150))
-                return best_path, (50, 150), None
-            
-            print(f"  [SAVED] Best preprocessed image: {best_path}")
-            
-            return best_path, best_threshold, threshold_results
+            save_debug_artifact(best_processed_img, f"adaptive_photo_{best_threshold[0]}_{best_threshold[1]}")
+            return best_processed_img, best_threshold, threshold_results
         else:
             print(f"  [ERROR] All thresholds failed, using default")
-            best_path = preprocess_for_cross_domain_matching(image_path, is_sketch, (50, 150))
-            return best_path, (50, 150), None
+            best_img = preprocess_for_cross_domain_matching_array(image_path, is_sketch, (50, 150))
+            return best_img, (50, 150), None
             
     except Exception as e:
         print(f"  [ADAPTIVE CANNY ERROR] {e}")
         traceback.print_exc()
         
         # Fallback to default
-        best_path = preprocess_for_cross_domain_matching(image_path, is_sketch, (50, 150))
-        return best_path, (50, 150), None
+        best_img = preprocess_for_cross_domain_matching_array(image_path, is_sketch, (50, 150))
+        return best_img, (50, 150), None
@@ -0,0 +1,409 @@
+"""
+quantize_arcface.py
+===================
+Builds reduced-precision variants of the InsightFace recognition model
+(w600k_r50.onnx) and measures what they cost in accuracy.
+
+Variants (written next to w600k_r50.onnx, selected with INSIGHTFACE_VARIANT):
+  fp16          weights and activations in float16, float32 I/O
+                (needs onnxconverter-common; halves the file, rarely faster on CPU)
+  int8-dynamic  INT8 weights, activations quantised per batch at runtime
+                (no calibration data needed)
+  int8-static   INT8 weights and activations (QDQ), ranges calibrated on a
+                folder of aligned face crops, preprocessed as the backend
+                does - usually the fastest on CPU
+
+The validation harness embeds the same faces with fp32 and every built
+variant and reports, per variant:
+  - cosine drift      cos(fp32, variant) per face: mean / p5 / min
+  - rank agreement    horizontally flipped faces queried against the
+                      originals; top-1 agreement and top-k overlap with fp32,
+                      plus flip->original recall@1
+  - latency           median ms per session.run() per batch size
+  - memory            model file size and RSS growth when the session loads
+
+Use aligned 112x112-ish face crops. ArcFace never sees them as-is in the
+backend: embedding_service._preprocess_face turns photos into Canny edge
+maps and sketches into grayscale-as-BGR. Calibration and validation run
+every crop through it in both modes (photo and sketch), and the report has
+one accuracy block per mode. A few hundred faces are enough for both
+calibration and validation, but calibrate and validate on different folders
+if you can.
+
+USAGE:
+    python quantize_arcface.py build --faces /data/aligned_faces
+    python quantize_arcface.py build --variants int8-dynamic
+    python quantize_arcface.py validate --faces /data/holdout_faces
+    python quantize_arcface.py validate --faces /data/holdout_faces --json report.json
+
+Then set INSIGHTFACE_VARIANT=<variant> and restart the backend. The stored
+embedding version carries the model hash, so the gallery is re-embedded with
+the new variant on startup (expect one full pass over the criminal photos),
+followed by a fresh FAISS snapshot.
+"""
+
+import argparse
+import gc
+import json
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from models.insightface_model import (
+    BENCH_BATCH_SIZES,
+    BENCH_RUNS,
+    MAX_BATCH,
+    MODEL_VARIANTS,
+    ONNX_PATH,
+    ORT_GRAPH_OPT,
+    _preprocess_for_arcface,
+    _session_options,
+    variant_path,
+)
+from services.embedding_service import _preprocess_face
+
+IMAGE_EXTS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+CALIBRATION_LIMIT = 300   # faces fed to static calibration
+VALIDATION_LIMIT  = 500   # faces embedded per variant
+TOP_K = 10
+# How the backend preprocesses a face before ArcFace (is_sketch=...)
+PREPROCESS_MODES = {"photo": False, "sketch": True}
+
+
+# ---------------------------------------------------------------------------
+# Face folder
+# ---------------------------------------------------------------------------
+
+def load_faces(folder: str, limit: int) -> list:
+    """BGR uint8 crops from an image folder (sorted, unreadable files skipped)."""
+    if not folder or not os.path.isdir(folder):
+        print(f"ERROR: face folder not found: {folder}")
+        sys.exit(1)
+    names = sorted(n for n in os.listdir(folder) if n.lower().endswith(IMAGE_EXTS))
+    faces = []
+    for name in names:
+        img = cv2.imread(os.path.join(folder, name), cv2.IMREAD_COLOR)
+        if img is not None:
+            faces.append(img)
+        if len(faces) >= limit:
+            break
+    print(f"[Faces] Loaded {len(faces)} face(s) from {folder}")
+    if not faces:
+        print("ERROR: no readable images in the face folder")
+        sys.exit(1)
+    return faces
+
+
+def backend_inputs(faces: list, mode: str) -> list:
+    """The crops as the backend feeds them to ArcFace in one preprocessing mode."""
+    return [_preprocess_face(face, is_sketch=PREPROCESS_MODES[mode]) for face in faces]
+
+
+def _input_name(model_path: str) -> str:
+    import onnx
+    model = onnx.load(model_path, load_external_data=False)
+    initializers = {init.name for init in model.graph.initializer}
+    return next(i.name for i in model.graph.input if i.name not in initializers)
+
+
+# ---------------------------------------------------------------------------
+# Build
+# ---------------------------------------------------------------------------
+
+def _replace_atomically(tmp: str, dest: str):
+    # Running backends pick variants up on boot; never leave a half-written file
+    os.replace(tmp, dest)
+    size = os.path.getsize(dest)
+    print(f"  [OK] {dest} ({size / 1024 / 1024:.1f} MB)")
+
+
+def _preprocessed_source(tmp_dir: str) -> str:
+    """Shape-inferred / folded copy of the source model (recommended before quantising)."""
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+    out = os.path.join(tmp_dir, "w600k_r50.preproc.onnx")
+    try:
+        quant_pre_process(ONNX_PATH, out, skip_symbolic_shape=True)
+        return out
+    except Exception as e:
+        print(f"  [WARN] Pre-processing failed ({e}); quantising the raw model")
+        return ONNX_PATH
+
+
+def build_int8_dynamic(src: str):
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    dest = variant_path("int8-dynamic")
+    tmp  = f"{dest}.{os.getpid()}.tmp"
+    print("\n[Build] int8-dynamic")
+    quantize_dynamic(src, tmp, weight_type=QuantType.QInt8, per_channel=True)
+    _replace_atomically(tmp, dest)
+
+
+class _FaceCalibrationReader:
+    """
+    CalibrationDataReader feeding faces one at a time, each in every backend
+    preprocessing mode, so activation ranges cover edge maps and sketches.
+    """
+
+    def __init__(self, faces: list, input_name: str):
+        self._input_name = input_name
+        self._batches = iter([
+            _preprocess_for_arcface(crop)
+            for mode in PREPROCESS_MODES
+            for crop in backend_inputs(faces, mode)
+        ])
+
+    def get_next(self):
+        batch = next(self._batches, None)
+        return None if batch is None else {self._input_name: batch}
+
+
+def build_int8_static(src: str, faces: list, method: str):
+    from onnxruntime.quantization import CalibrationMethod, QuantFormat, QuantType, quantize_static
+    dest = variant_path("int8-static")
+    tmp  = f"{dest}.{os.getpid()}.tmp"
+    print(f"\n[Build] int8-static (calibration: {len(faces)} faces x "
+          f"{'/'.join(PREPROCESS_MODES)} preprocessing, {method})")
+    quantize_static(
+        src, tmp,
+        calibration_data_reader=_FaceCalibrationReader(faces, _input_name(src)),
+        quant_format=QuantFormat.QDQ,
+        activation_type=QuantType.QUInt8,
+        weight_type=QuantType.QInt8,
+        per_channel=True,
+        calibrate_method=getattr(CalibrationMethod, method),
+    )
+    _replace_atomically(tmp, dest)
+
+
+def build_fp16():
+    print("\n[Build] fp16")
+    try:
+        import onnx
+        from onnxconverter_common import float16
+    except ImportError as e:
+        print(f"  [SKIP] fp16 needs onnxconverter-common ({e}): pip install onnxconverter-common")
+        return
+    dest  = variant_path("fp16")
+    tmp   = f"{dest}.{os.getpid()}.tmp"
+    model = float16.convert_float_to_float16(onnx.load(ONNX_PATH), keep_io_types=True)
+    onnx.save(model, tmp)
+    _replace_atomically(tmp, dest)
+
+
+def cmd_build(args):
+    import tempfile
+
+    variants = args.variants or [v for v in MODEL_VARIANTS if v != "fp32"]
+    if not os.path.exists(ONNX_PATH):
+        print(f"ERROR: source model not found at {ONNX_PATH} - start the backend once to download it")
+        sys.exit(1)
+    if "int8-static" in variants and not args.faces:
+        print("ERROR: int8-static needs --faces (a folder of aligned face crops for calibration)")
+        sys.exit(1)
+
+    with tempfile.TemporaryDirectory(prefix="arcface-quant-") as tmp_dir:
+        src = _preprocessed_source(tmp_dir) if any(v.startswith("int8") for v in variants) else ONNX_PATH
+        if "int8-dynamic" in variants:
+            build_int8_dynamic(src)
+        if "int8-static" in variants:
+            build_int8_static(src, load_faces(args.faces, args.limit), args.calibration)
+    if "fp16" in variants:
+        build_fp16()
+    print("\nNext: python quantize_arcface.py validate --faces <holdout folder>")
+
+
+# ---------------------------------------------------------------------------
+# Validate
+# ---------------------------------------------------------------------------
+
+def _rss_bytes() -> int:
+    """Resident set size of this process (Linux; 0 elsewhere)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def _embed(session, batch: np.ndarray, step: int) -> np.ndarray:
+    inp, out = session.get_inputs()[0].name, session.get_outputs()[0].name
+    embs = np.concatenate([
+        session.run([out], {inp: batch[i:i + step]})[0] for i in range(0, len(batch), step)
+    ]).astype(np.float32)
+    norms = np.linalg.norm(embs, axis=1, keepdims=True)
+    return embs / np.where(norms > 0, norms, 1.0)
+
+
+def _latency(session, batch: np.ndarray, fixed_batch: bool) -> dict:
+    inp, out = session.get_inputs()[0].name, session.get_outputs()[0].name
+    profile = {}
+    for size in BENCH_BATCH_SIZES:
+        if size < 1 or size > len(batch) or (fixed_batch and size > 1):
+            continue
+        chunk = batch[:size]
+        session.run([out], {inp: chunk})   # warm-up
+        timings = []
+        for _ in range(BENCH_RUNS):
+            start = time.perf_counter()
+            session.run([out], {inp: chunk})
+            timings.append((time.perf_counter() - start) * 1000.0)
+        batch_ms = float(np.median(timings))
+        profile[size] = {"batch_ms": round(batch_ms, 2), "per_face_ms": round(batch_ms / size, 2)}
+    return profile
+
+
+def measure_variant(ort, variant: str, inputs: dict) -> dict:
+    """
+    Embeddings, latency and memory for one variant's model file; `inputs` is
+    {mode: (originals, flipped)} and embeddings come back per mode.
+    """
+    path = variant_path(variant)
+    gc.collect()
+    rss_before = _rss_bytes()
+    session = ort.InferenceSession(
+        path, sess_options=_session_options(ort, ORT_GRAPH_OPT), providers=["CPUExecutionProvider"]
+    )
+    batch_dim   = session.get_inputs()[0].shape[0]
+    fixed_batch = isinstance(batch_dim, int) and batch_dim > 0
+    step        = 1 if fixed_batch else max(1, MAX_BATCH)
+
+    gallery = {mode: _embed(session, originals, step) for mode, (originals, _) in inputs.items()}
+    queries = {mode: _embed(session, flipped, step) for mode, (_, flipped) in inputs.items()}
+    first   = next(iter(inputs.values()))[0]
+    result = {
+        "path": path,
+        "file_mb": round(os.path.getsize(path) / 1024 / 1024, 1),
+        "rss_mb": round((_rss_bytes() - rss_before) / 1024 / 1024, 1) if rss_before else None,
+        "latency_ms": _latency(session, first, fixed_batch),
+        "gallery": gallery,
+        "queries": queries,
+    }
+    del session
+    gc.collect()
+    return result
+
+
+def _top_k(queries: np.ndarray, gallery: np.ndarray, k: int) -> np.ndarray:
+    scores = queries @ gallery.T
+    return np.argsort(-scores, axis=1, kind="stable")[:, :k]
+
+
+def accuracy_report(base: dict, run: dict, k: int, mode: str) -> dict:
+    """Cosine drift and rank agreement of one variant against fp32 in one preprocessing mode."""
+    base_gallery, run_gallery = base["gallery"][mode], run["gallery"][mode]
+    cos = np.sum(base_gallery * run_gallery, axis=1)
+    k = min(k, len(base_gallery))
+    base_top = _top_k(base["queries"][mode], base_gallery, k)
+    run_top  = _top_k(run["queries"][mode], run_gallery, k)
+    overlap = [len(set(a) & set(b)) / k for a, b in zip(base_top, run_top)]
+    return {
+        "cosine_mean": round(float(cos.mean()), 5),
+        "cosine_p5":   round(float(np.percentile(cos, 5)), 5),
+        "cosine_min":  round(float(cos.min()), 5),
+        "top1_agreement": round(float(np.mean(base_top[:, 0] == run_top[:, 0])), 4),
+        f"top{k}_overlap": round(float(np.mean(overlap)), 4),
+        "flip_recall_at_1": round(float(np.mean(run_top[:, 0] == np.arange(len(run_top)))), 4),
+    }
+
+
+def cmd_validate(args):
+    import onnxruntime as ort
+
+    variants = ["fp32"] + [v for v in (args.variants or MODEL_VARIANTS) if v != "fp32"]
+    missing  = [v for v in variants if not os.path.exists(variant_path(v))]
+    if "fp32" in missing:
+        print(f"ERROR: source model not found at {ONNX_PATH}")
+        sys.exit(1)
+    for v in missing:
+        print(f"[Validate] {v}: not built - skipping (python quantize_arcface.py build --variants {v})")
+    variants = [v for v in variants if v not in missing]
+
+    faces   = load_faces(args.faces, args.limit)
+    mirrors = [cv2.flip(f, 1) for f in faces]
+    inputs  = {
+        mode: (
+            np.concatenate([_preprocess_for_arcface(c) for c in backend_inputs(faces, mode)]),
+            np.concatenate([_preprocess_for_arcface(c) for c in backend_inputs(mirrors, mode)]),
+        )
+        for mode in PREPROCESS_MODES
+    }
+
+    runs = {}
+    for v in variants:
+        print(f"[Validate] Measuring {v}...")
+        runs[v] = measure_variant(ort, v, inputs)
+
+    report = {"faces": len(faces), "onnxruntime": ort.__version__, "variants": {}}
+    for v, run in runs.items():
+        report["variants"][v] = {
+            "file_mb": run["file_mb"],
+            "rss_mb": run["rss_mb"],
+            "latency_ms": run["latency_ms"],
+            "modes": {mode: accuracy_report(runs["fp32"], run, args.top_k, mode) for mode in PREPROCESS_MODES},
+        }
+    _print_report(report, args.top_k)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nReport written to {args.json}")
+
+
+def _print_report(report: dict, k: int):
+    print("\n" + "=" * 60)
+    print(f"ArcFace variants vs fp32 ({report['faces']} faces, onnxruntime {report['onnxruntime']})")
+    print("=" * 60)
+    base = report["variants"]["fp32"]["latency_ms"]
+    for v, r in report["variants"].items():
+        print(f"\n{v}")
+        print(f"  file {r['file_mb']} MB, session RSS +{r['rss_mb']} MB")
+        for mode, acc in r["modes"].items():
+            print(f"  [{mode}] cosine vs fp32   mean={acc['cosine_mean']:.5f}  "
+                  f"p5={acc['cosine_p5']:.5f}  min={acc['cosine_min']:.5f}")
+            topk = next(key for key in acc if key.startswith("top") and key.endswith("_overlap"))
+            print(f"  [{mode}] rank agreement   top1={acc['top1_agreement']:.2%}  {topk}={acc[topk]:.2%}  "
+                  f"flip recall@1={acc['flip_recall_at_1']:.2%}")
+        for size, lat in r["latency_ms"].items():
+            speedup = base[size]["batch_ms"] / lat["batch_ms"] if size in base and lat["batch_ms"] else 0.0
+            print(f"  batch={size:>3}  {lat['batch_ms']:8.1f} ms/batch  "
+                  f"{lat['per_face_ms']:6.1f} ms/face  x{speedup:.2f} vs fp32")
+
+
+# ---------------------------------------------------------------------------
+# CLI
+# ---------------------------------------------------------------------------
+
+def main():
+    parser = argparse.ArgumentParser(description="Quantise and validate the InsightFace recognition model")
+    sub = parser.add_subparsers(dest="command", required=True)
+    quantised = [v for v in MODEL_VARIANTS if v != "fp32"]
+
+    build = sub.add_parser("build", help="Write quantised variants next to w600k_r50.onnx")
+    build.add_argument("--variants", nargs="+", choices=quantised,
+                       help="Variants to build (default: all)")
+    build.add_argument("--faces", help="Folder of aligned face crops (required for int8-static)")
+    build.add_argument("--limit", type=int, default=CALIBRATION_LIMIT,
+                       help=f"Calibration faces (default {CALIBRATION_LIMIT})")
+    build.add_argument("--calibration", default="MinMax", choices=["MinMax", "Entropy", "Percentile"],
+                       help="Static calibration method (default MinMax)")
+    build.set_defaults(func=cmd_build)
+
+    validate = sub.add_parser("validate", help="Compare built variants against fp32")
+    validate.add_argument("--faces", required=True, help="Folder of aligned face crops")
+    validate.add_argument("--variants", nargs="+", choices=quantised,
+                          help="Variants to compare (default: every built one)")
+    validate.add_argument("--limit", type=int, default=VALIDATION_LIMIT,
+                          help=f"Faces to embed (default {VALIDATION_LIMIT})")
+    validate.add_argument("--top-k", type=int, default=TOP_K, help=f"Rank agreement depth (default {TOP_K})")
+    validate.add_argument("--json", help="Also write the report to this file")
+    validate.set_defaults(func=cmd_validate)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -7,28 +7,47 @@ Model:
 Key guarantees:
   - Model loaded ONCE at startup (singleton, thread-safe)
   - Failure → controlled error dict (no unhandled exception)
-  - TTA: 3 augmentations averaged
+  - TTA: 3 augmentations averaged, all run as one ONNX batch
+  - Facenet HTTP request runs concurrently with local InsightFace inference
   - All steps logged for debugging
 """
 
 import os
 import base64
+import hashlib
 import threading
 import traceback
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
 
 import cv2
 import numpy as np
 import requests
+from requests.adapters import HTTPAdapter
 
 from models.insightface_model import (
     initialize_insightface_model,
     extract_insightface_embedding,
+    extract_insightface_embeddings,
     normalize_embedding as normalize_insightface,
     is_insightface_initialized,
+    ensure_insightface_weights,
+    warmup_insightface_session,
+    get_model_file_hash,
 )
+from models.model_registry import get_registry_stats
+from models.face_detector import detect_faces, largest_face
 
-from utils.file_utils import generate_temp_filepath, cleanup_temp_file
+from utils.file_utils import generate_temp_filepath
+from utils.image_context import ImageContext
+from preprocessing.image_preprocessing import save_debug_artifact
 from utils.similarity_utils import cosine_similarity
+from utils.cache_utils import (
+    make_image_cache_key,
+    get_cached_image_entry,
+    set_cached_image_entry,
+    update_cached_image_entry,
+)
 
 # ---------------------------------------------------------------------------
 # Global initialization state
@@ -37,6 +56,11 @@ from utils.similarity_utils import cosine_similarity
 MODEL_INITIALIZED = False
 _INIT_LOCK = threading.Lock()
 
+# gunicorn.conf.py sets this: the preloading master only fetches the weights,
+# every worker creates its own session after fork, and the master loads one
+# itself only if precompute has photos to embed (ensure_insightface_session)
+DEFER_INSIGHTFACE_SESSION = os.environ.get("INSIGHTFACE_DEFER_SESSION", "0") == "1"
+
 
 # ---------------------------------------------------------------------------
 # Startup model initialization
@@ -60,18 +84,28 @@ def initialize_models() -> bool:
         print("  INITIALIZING FACE RECOGNITION MODEL")
         print("=" * 60)
 
-        insightface_ok = _init_insightface_safe()
+        if DEFER_INSIGHTFACE_SESSION:
+            insightface_ok = ensure_insightface_weights()
+            status = "[OK] weights ready, session deferred to workers" if insightface_ok else "[FAIL] unavailable"
+        else:
+            insightface_ok = _init_insightface_safe()
+            status = "[OK] ready" if insightface_ok else "[FAIL] unavailable"
 
         if not insightface_ok:
             print("[EmbeddingService] [FAIL] CRITICAL: InsightFace failed to load.")
 
         MODEL_INITIALIZED = True
         print("=" * 60)
-        print(f"  InsightFace : {'[OK] ready' if insightface_ok else '[FAIL] unavailable'}")
+        print(f"  InsightFace : {status}")
         print("=" * 60 + "\n")
         return insightface_ok
 
 
+def ensure_insightface_session() -> bool:
+    """Create the InsightFace session now if initialisation deferred it."""
+    return is_insightface_initialized() or _init_insightface_safe()
+
+
 def is_models_initialized() -> bool:
     return MODEL_INITIALIZED
 
@@ -82,10 +116,11 @@ def is_models_initialized() -> bool:
 
 def warmup_models() -> dict:
     """
-    Run a dummy inference through InsightFace to ensure the ONNX graph is
-    compiled before the first real request arrives.
+    Warm the serving InsightFace session (owned by models.model_registry) at
+    every batch shape the pipeline uses, before the first real request.
 
-    Never raises — all failures are caught and logged.
+    Initialisation already warms it, so this normally only reports; it never
+    builds a second session. Never raises — all failures are caught and logged.
 
     Returns:
         dict: {'insightface': bool}
@@ -93,29 +128,17 @@ def warmup_models() -> dict:
     results = {"insightface": False}
 
     print("\n" + "=" * 60)
-    print("  MODEL WARMUP — preloading InsightFace ONNX graph")
+    print("  MODEL WARMUP — warming the serving InsightFace session")
     print("=" * 60)
 
     if is_insightface_initialized():
         print("[Warmup] Warming up InsightFace (ArcFace)...")
         try:
-            import onnxruntime as ort
-            from models.insightface_model import ONNX_PATH
-
-            sess_opts = ort.SessionOptions()
-            sess_opts.log_severity_level = 3
-            sess = ort.InferenceSession(
-                ONNX_PATH,
-                sess_options=sess_opts,
-                providers=["CPUExecutionProvider"],
-            )
-            input_name  = sess.get_inputs()[0].name
-            output_name = sess.get_outputs()[0].name
-
-            dummy = np.zeros((1, 3, 112, 112), dtype=np.float32)
-            out = sess.run([output_name], {input_name: dummy})
-
-            print(f"[Warmup] [OK] InsightFace ready — output shape: {out[0].shape}")
+            warmed = warmup_insightface_session()
+            stats  = get_registry_stats()["models"].get("insightface", {})
+            print(f"[Warmup] [OK] InsightFace ready — newly warmed: {sorted(warmed) or 'none'}, "
+                  f"load {stats.get('load_ms')} ms, warmup {stats.get('warmup_ms')} ms, "
+                  f"+{stats.get('load_rss_mb')} MB RSS")
             results["insightface"] = True
 
         except Exception as e:
@@ -199,6 +222,31 @@ def _extract_insightface_single(face_arr: np.ndarray) -> np.ndarray:
     return normalize_insightface(emb)
 
 
+def _extract_insightface_batch(face_arrs: list) -> list:
+    """
+    InsightFace embeddings for several face arrays in one ONNX batch.
+
+    Returns one entry per face, None where extraction failed: if the batch
+    run fails, the faces are retried one by one so a single bad crop does
+    not cost the others.
+    """
+    if not is_insightface_initialized():
+        raise RuntimeError("InsightFace model not initialized")
+    try:
+        return list(extract_insightface_embeddings(face_arrs))
+    except Exception as e:
+        print(f"    [Batch] InsightFace batch of {len(face_arrs)} failed ({e}), retrying one by one")
+
+    embeddings = []
+    for face_arr in face_arrs:
+        try:
+            embeddings.append(_extract_insightface_single(face_arr))
+        except Exception as e:
+            print(f"    [Batch] InsightFace face skipped - {e}")
+            embeddings.append(None)
+    return embeddings
+
+
 # ---------------------------------------------------------------------------
 # External Facenet microservice
 # ---------------------------------------------------------------------------
@@ -209,16 +257,129 @@ def _extract_insightface_single(face_arr: np.ndarray) -> np.ndarray:
 FACENET_API_URL  = os.environ.get("FACENET_API_URL", "http://localhost:8001")
 _FACENET_TIMEOUT = 10   # seconds per attempt
 _FACENET_RETRIES = 1    # one retry on failure
+# Facenet requests in flight at once per process (they overlap local InsightFace inference)
+FACENET_CONCURRENCY = int(os.environ.get("FACENET_CONCURRENCY", "4"))
+# Body of POST /embedding/raw: jpeg | png | raw (uint8 pixels); json = legacy base64 /embedding.
+# jpeg feeds Facenet the same pixels as the legacy protocol the stored gallery
+# was embedded with; png / raw / FACENET_SHARED_DIR are lossless and shift scores.
+FACENET_WIRE_FORMAT = os.environ.get("FACENET_WIRE_FORMAT", "jpeg").lower()
+# Same-host handoff: directory mounted in both containers (ideally tmpfs); the
+# face is written there as .npy and only its name goes over HTTP
+FACENET_SHARED_DIR  = os.environ.get("FACENET_SHARED_DIR") or None
+_FACENET_DIM        = 512
+
+_FACENET_POOL = None
+_FACENET_SESSION = None
+_FACENET_POOL_LOCK = threading.Lock()
+_RAW_PROTOCOL_OK = True   # cleared when the service predates /embedding/raw
+
+
+def _reset_facenet_pool_after_fork():
+    """Pool threads and pooled sockets do not survive fork; a forked worker builds its own on first use."""
+    global _FACENET_POOL, _FACENET_SESSION, _FACENET_POOL_LOCK
+    _FACENET_POOL, _FACENET_SESSION, _FACENET_POOL_LOCK = None, None, threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_facenet_pool_after_fork)
+
+print(f"[FacenetAPI] Using URL: {FACENET_API_URL} (wire format: {FACENET_WIRE_FORMAT}"
+      f"{', shared dir ' + FACENET_SHARED_DIR if FACENET_SHARED_DIR else ''})", flush=True)
+
+
+def _facenet_session() -> requests.Session:
+    """Keep-alive session sized to the Facenet pool, so calls reuse TCP connections."""
+    global _FACENET_SESSION
+
+    with _FACENET_POOL_LOCK:
+        if _FACENET_SESSION is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(1, FACENET_CONCURRENCY))
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _FACENET_SESSION = session
+        return _FACENET_SESSION
+
+
+def facenet_input_encoding() -> str:
+    """How faces reach Facenet: 'jpeg' (as the legacy protocol) or 'lossless'."""
+    if FACENET_WIRE_FORMAT == "json" or not _RAW_PROTOCOL_OK:
+        return "jpeg"
+    if FACENET_SHARED_DIR or FACENET_WIRE_FORMAT != "jpeg":
+        return "lossless"
+    return "jpeg"
+
+
+def _post_facenet_raw(session: requests.Session, face: np.ndarray) -> requests.Response:
+    """POST /embedding/raw with the face as pixels, PNG/JPEG or a shared-dir reference."""
+    url = f"{FACENET_API_URL}/embedding/raw"
+    if FACENET_SHARED_DIR:
+        name = f"face-{os.getpid()}-{uuid.uuid4().hex}.npy"
+        path = os.path.join(FACENET_SHARED_DIR, name)
+        np.save(path, np.ascontiguousarray(face))
+        try:
+            return session.post(url, headers={"X-Image-Name": name}, timeout=_FACENET_TIMEOUT)
+        finally:
+            try:
+                os.remove(path)
+            except OSError as e:
+                print(f"[FacenetAPI] [WARN] Could not remove shared-dir face {path}: {e}")
+
+    if FACENET_WIRE_FORMAT in ("png", "jpeg"):
+        ok, buf = cv2.imencode(".png" if FACENET_WIRE_FORMAT == "png" else ".jpg", face)
+        if not ok:
+            raise ValueError(f"cv2.imencode ({FACENET_WIRE_FORMAT}) failed")
+        body, headers = buf.tobytes(), {"Content-Type": f"image/{FACENET_WIRE_FORMAT}"}
+    else:
+        body = np.ascontiguousarray(face, dtype=np.uint8).tobytes()
+        headers = {
+            "Content-Type":  "application/octet-stream",
+            "X-Image-Shape": ",".join(str(d) for d in face.shape),
+        }
+    return session.post(url, data=body, headers=headers, timeout=_FACENET_TIMEOUT)
+
+
+def _post_facenet_json(session: requests.Session, face: np.ndarray) -> np.ndarray:
+    """Legacy POST /embedding: base64 JPEG in a JSON body, JSON list back."""
+    ok, buf = cv2.imencode(".jpg", face)
+    if not ok:
+        raise ValueError("cv2.imencode failed")
+    image_b64 = base64.b64encode(buf.tobytes()).decode("utf-8")
+    resp = session.post(
+        f"{FACENET_API_URL}/embedding",
+        json={"image_base64": image_b64},
+        timeout=_FACENET_TIMEOUT,
+    )
+    resp.raise_for_status()
+    return np.array(resp.json()["embedding"], dtype=np.float32)
 
-print(f"[FacenetAPI] Using URL: {FACENET_API_URL}", flush=True)
+
+def _request_facenet_embedding(face: np.ndarray) -> np.ndarray:
+    """One attempt: binary protocol unless disabled or unsupported, else legacy JSON."""
+    global _RAW_PROTOCOL_OK
+
+    session = _facenet_session()
+    if FACENET_WIRE_FORMAT != "json" and _RAW_PROTOCOL_OK:
+        resp = _post_facenet_raw(session, face)
+        if resp.status_code != 404:
+            resp.raise_for_status()
+            return np.frombuffer(resp.content, dtype="<f4").astype(np.float32)
+        print("[Facenet API] /embedding/raw not found (older service) - using JSON /embedding", flush=True)
+        _RAW_PROTOCOL_OK = False
+    return _post_facenet_json(session, face)
 
 
 def get_facenet_embedding_from_service(face_arr: np.ndarray) -> np.ndarray:
     """
-    Call the external Facenet microservice (POST /embedding) and return
-    a 512-D L2-normalized embedding.
-
-    - Sends the face as a base64-encoded JPEG
+    Call the external Facenet microservice and return a 512-D L2-normalized
+    embedding.
+
+    - Pooled keep-alive session (no new TCP connection per call)
+    - POST /embedding/raw: the 160x160 face in FACENET_WIRE_FORMAT - JPEG by
+      default (the pixels the gallery was embedded with), or lossless PNG /
+      raw uint8 pixels - with 512 float32 back, no base64 or JSON. With
+      FACENET_SHARED_DIR only a file name is sent (lossless).
+    - Falls back to the base64-JSON /embedding of older services
     - Timeout: 10s per attempt
     - Retries: 1 (2 total attempts)
     - Returns None on failure — caller continues with InsightFace only
@@ -228,31 +389,15 @@ def get_facenet_embedding_from_service(face_arr: np.ndarray) -> np.ndarray:
         [Facenet API] success
         [Facenet API] failed - fallback
     """
-    # Resize to 160x160 (Facenet input size) before encoding
+    # Resize to 160x160 (Facenet input size) before sending
     resized = cv2.resize(face_arr, (160, 160), interpolation=cv2.INTER_LANCZOS4)
 
-    ok, buf = cv2.imencode(".jpg", resized)
-    if not ok:
-        print("[Facenet API] failed - fallback (cv2.imencode failed)", flush=True)
-        return None
-
-    image_b64 = base64.b64encode(buf.tobytes()).decode("utf-8")
-    url = f"{FACENET_API_URL}/embedding"
-
     for attempt in range(1, _FACENET_RETRIES + 2):   # 1 + 1 retry = 2 total
         try:
             print(f"[Facenet API] calling... (attempt {attempt})", flush=True)
-            resp = requests.post(
-                url,
-                json={"image_base64": image_b64},
-                timeout=_FACENET_TIMEOUT,
-            )
-            resp.raise_for_status()
-
-            data = resp.json()
-            emb  = np.array(data["embedding"], dtype=np.float32)
+            emb = _request_facenet_embedding(resized)
 
-            if emb.shape[0] != 512:
+            if emb.shape[0] != _FACENET_DIM:
                 raise ValueError(f"Unexpected embedding dim: {emb.shape[0]}")
 
             # L2 normalize
@@ -271,35 +416,72 @@ def get_facenet_embedding_from_service(face_arr: np.ndarray) -> np.ndarray:
     return None
 
 
+def submit_facenet_embedding(face_arr: np.ndarray) -> Future:
+    """
+    Start get_facenet_embedding_from_service() on the Facenet pool and return
+    its future, so the HTTP round trip overlaps local InsightFace inference.
+    The future resolves to the embedding or None (it never raises).
+    """
+    global _FACENET_POOL
+
+    with _FACENET_POOL_LOCK:
+        if _FACENET_POOL is None:
+            _FACENET_POOL = ThreadPoolExecutor(
+                max_workers=max(1, FACENET_CONCURRENCY), thread_name_prefix="facenet"
+            )
+        pool = _FACENET_POOL
+    return pool.submit(get_facenet_embedding_from_service, face_arr.copy())
+
+
 # ---------------------------------------------------------------------------
 # TTA-averaged extraction (public)
 # ---------------------------------------------------------------------------
 
-def extract_embedding_with_tta(processed_face: np.ndarray, model_name: str) -> np.ndarray:
+def extract_embeddings_with_tta(processed_faces: list, model_name: str) -> list:
     """
-    Extract InsightFace embedding with TTA averaging.
-    model_name must be 'InsightFace'.
+    TTA-averaged InsightFace embeddings for several faces.
+
+    Every augmentation of every face goes through a single ONNX batch; the
+    per-face average is L2-normalized. Returns one embedding per face (None
+    if every augmentation of that face failed).
     """
     if model_name != "InsightFace":
         raise ValueError(f"Unsupported model: {model_name}. Only InsightFace is supported.")
 
-    augmented_faces = generate_tta_augmentations(processed_face)
-    embeddings = []
-
-    for idx, aug_face in enumerate(augmented_faces):
-        try:
-            emb = _extract_insightface_single(aug_face)
+    augmented = [generate_tta_augmentations(face) for face in processed_faces]
+    flat = [aug_face for augs in augmented for aug_face in augs]
+    flat_embeddings = _extract_insightface_batch(flat)
+
+    results, offset = [], 0
+    for augs in augmented:
+        embeddings = []
+        for idx, emb in enumerate(flat_embeddings[offset:offset + len(augs)]):
+            if emb is None:
+                print(f"    [TTA] InsightFace aug {idx}: [WARN] skipped")
+                continue
             embeddings.append(emb)
             print(f"    [TTA] InsightFace aug {idx}: [OK] ({len(emb)}-D)")
-        except Exception as e:
-            print(f"    [TTA] InsightFace aug {idx}: [WARN] skipped - {e}")
+        offset += len(augs)
+
+        if embeddings:
+            avg = np.mean(embeddings, axis=0)
+            norm = np.linalg.norm(avg)
+            avg = avg / norm if norm > 0 else avg
+            print(f"    [TTA] InsightFace: averaged {len(embeddings)} augmentation(s)")
+            results.append(avg)
+        else:
+            results.append(None)
+    return results
 
-    if embeddings:
-        avg = np.mean(embeddings, axis=0)
-        norm = np.linalg.norm(avg)
-        avg = avg / norm if norm > 0 else avg
-        print(f"    [TTA] InsightFace: averaged {len(embeddings)} augmentation(s)")
-        return avg
+
+def extract_embedding_with_tta(processed_face: np.ndarray, model_name: str) -> np.ndarray:
+    """
+    Extract InsightFace embedding with TTA averaging (one batched ONNX run).
+    model_name must be 'InsightFace'.
+    """
+    emb = extract_embeddings_with_tta([processed_face], model_name)[0]
+    if emb is not None:
+        return emb
 
     # All TTA failed — try plain extraction once
     print("    [TTA] InsightFace: all augmentations failed, trying plain extraction...")
@@ -310,29 +492,28 @@ def extract_embedding_with_tta(processed_face: np.ndarray, model_name: str) -> n
 # Face detection + alignment
 # ---------------------------------------------------------------------------
 
-def _detect_and_align_face(image_path: str, enforce_detection: bool = False) -> np.ndarray:
+def _detect_and_align_face(image, enforce_detection: bool = False) -> np.ndarray:
     """
-    Detect and align the largest face using OpenCV Haar cascade.
+    Detect and align the largest face (models.face_detector: cached per-thread
+    detector, run on a downscaled proxy, box mapped back to full resolution).
     Returns uint8 BGR face crop resized to 112x112 (InsightFace native size).
     Falls back to full image if no face detected (enforce_detection=False).
     No DeepFace / TensorFlow dependency.
+
+    `image` is an ImageContext (its decoded array is reused) or a file path.
     """
-    img = cv2.imread(image_path)
-    if img is None:
-        raise ValueError(f"cv2.imread() failed: {image_path}")
+    ctx = ImageContext.of(image)
+    img = ctx.bgr
 
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-    cascade_path = cv2.data.haarcascades + "haarcascade_frontalface_default.xml"
-    detector = cv2.CascadeClassifier(cascade_path)
-    faces = detector.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5, minSize=(30, 30))
+    face = largest_face(detect_faces(img, scale_factor=1.1, min_neighbors=5, min_size=(30, 30)))
 
-    if len(faces) == 0:
+    if face is None:
         if enforce_detection:
-            raise ValueError(f"No face detected in: {image_path}")
-        print(f"    [Detect] No face detected — using full image as fallback: {image_path}")
+            raise ValueError(f"No face detected in: {ctx.filename}")
+        print(f"    [Detect] No face detected — using full image as fallback: {ctx.filename}")
         aligned = img
     else:
-        x, y, w, h = max(faces, key=lambda f: f[2] * f[3])
+        x, y, w, h = face
         pad = int(min(w, h) * 0.2)
         x1 = max(0, x - pad)
         y1 = max(0, y - pad)
@@ -400,11 +581,21 @@ def _select_best_canny_threshold(
         else aligned_face
     )
 
-    for thresh in candidates:
+    # One ONNX batch for all candidate edge maps
+    edge_maps = [
+        cv2.cvtColor(cv2.Canny(gray, threshold1=t[0], threshold2=t[1]), cv2.COLOR_GRAY2BGR)
+        for t in candidates
+    ]
+    try:
+        embeddings = _extract_insightface_batch(edge_maps)
+    except Exception as e:
+        print(f"    [AdaptiveCanny] extraction failed - {e}, using default (50, 150)")
+        return (50, 150)
+
+    for thresh, emb in zip(candidates, embeddings):
         try:
-            edges = cv2.Canny(gray, threshold1=thresh[0], threshold2=thresh[1])
-            edges_bgr = cv2.cvtColor(edges, cv2.COLOR_GRAY2BGR)
-            emb = _extract_insightface_single(edges_bgr)
+            if emb is None:
+                raise ValueError("no embedding")
             sim = cosine_similarity(emb, reference_embedding)
             print(f"    [AdaptiveCanny] threshold={thresh}: similarity={sim*100:.1f}%")
             if sim > best_similarity:
@@ -421,23 +612,126 @@ def _select_best_canny_threshold(
 # Main public API
 # ---------------------------------------------------------------------------
 
+# Bump when detection/alignment/preprocessing changes what gets embedded
+IMAGE_PIPELINE_VERSION = "align-edge-v1"
+
+
+def image_cache_key(
+    image: ImageContext,
+    is_sketch: bool,
+    use_adaptive_canny: bool = False,
+    reference_embedding: np.ndarray = None,
+    use_tta: bool = True,
+) -> str:
+    """
+    Per-image cache key for extract_dual_embeddings() with these arguments.
+
+    The adaptive Canny threshold is chosen against reference_embedding, so
+    that embedding's digest is part of the key whenever it is used. The
+    Facenet input encoding is too: lossless and JPEG faces embed differently.
+    """
+    if not is_sketch and use_adaptive_canny and reference_embedding is not None:
+        ref = np.ascontiguousarray(reference_embedding, dtype=np.float32).tobytes()
+        canny = "adaptive-" + hashlib.md5(ref).hexdigest()[:12]
+    else:
+        canny = "canny50-150"
+    params = (
+        "tta" if use_tta else "notta",
+        canny,
+        "facenet-" + facenet_input_encoding(),
+        IMAGE_PIPELINE_VERSION,
+    )
+    return make_image_cache_key(image.hash, is_sketch, params, get_model_file_hash()[:16])
+
+
+def _result_from_cache(entry: dict, result: dict, cache_key: str) -> dict:
+    """Fill an extract_dual_embeddings() result from a cached entry (arrays copied)."""
+    result.update({
+        "success":        True,
+        "insightface":    entry["insightface"].copy(),
+        "facenet":        entry["facenet"].copy() if entry["facenet"] is not None else None,
+        "aligned_face":   entry["aligned_face"].copy(),
+        "tta_applied":    entry["use_tta"],
+        "best_threshold": entry["best_threshold"],
+        "cache_key":      cache_key,
+        "from_cache":     True,
+    })
+    if result["facenet"] is None:
+        # The service was down when this entry was stored - try it again
+        result["facenet_pending"] = submit_facenet_embedding(entry["aligned_face"])
+    return result
+
+
+def _store_extracted(result: dict):
+    """
+    Cache the InsightFace half of a fresh extract_dual_embeddings() result.
+
+    Stored before Facenet is joined so the costly part survives a caller that
+    never joins; join_dual_embeddings() adds 'facenet' to the entry later.
+    """
+    set_cached_image_entry(result["cache_key"], {
+        "aligned_face":   result["aligned_face"].copy(),
+        "insightface":    result["insightface"].copy(),
+        "facenet":        None,
+        "best_threshold": result["best_threshold"],
+        "use_tta":        result["tta_applied"],
+    })
+
+
+def join_dual_embeddings(result: dict) -> dict:
+    """
+    Wait for the Facenet request started by extract_dual_embeddings(join_facenet=False),
+    fill result['facenet'] and add it to the per-image cache entry.
+
+    Safe to call on any result (no pending request → returned unchanged).
+    """
+    future = result.get("facenet_pending")
+    if future is None:
+        return result
+    result["facenet_pending"] = None
+
+    facenet_emb = future.result()
+    if facenet_emb is not None:
+        result["facenet"] = facenet_emb
+        print(f"    [OK] Facenet (API): {len(facenet_emb)}-D, normalized")
+    else:
+        print("    [INFO] Facenet unavailable — continuing with InsightFace only")
+
+    # The entry was stored by extract_dual_embeddings(); if it has been evicted
+    # meanwhile it stays gone
+    if facenet_emb is not None and result["cache_key"] is not None:
+        update_cached_image_entry(result["cache_key"], facenet=facenet_emb.copy())
+    return result
+
+
 def extract_dual_embeddings(
-    image_path: str,
+    image_path,
     is_sketch: bool = False,
     use_adaptive_canny: bool = False,
     reference_embedding: np.ndarray = None,
     use_tta: bool = True,
+    use_cache: bool = False,
+    join_facenet: bool = True,
 ) -> dict:
     """
     Extract InsightFace embedding from an image.
 
     Args:
+        image_path: ImageContext (decoded once by the caller and reused here)
+                    or a path to the image file.
         use_tta: If True, apply TTA (3 augmentations averaged). Set False for
                  database/reference images to speed up processing.
+        use_cache: Consult / fill the per-image embedding cache
+                   (utils.cache_utils) keyed by image_cache_key().
+        join_facenet: The Facenet request is sent as soon as the face is
+                   aligned and runs while InsightFace does. If False, return
+                   without waiting for it - result['facenet_pending'] holds
+                   the request and join_dual_embeddings() completes the result.
 
     Returns dict with keys:
         success, insightface, facenet (always None), aligned_face,
-        tta_applied, tta_augmentations, best_threshold, error
+        tta_applied, tta_augmentations, best_threshold, error,
+        cache_key (None unless use_cache), from_cache, facenet_pending
 
     Note: 'facenet' key is kept for API compatibility but is always None.
     """
@@ -450,6 +744,9 @@ def extract_dual_embeddings(
         "tta_augmentations": 3,
         "best_threshold":   None,
         "error":            None,
+        "cache_key":        None,
+        "from_cache":       False,
+        "facenet_pending":  None,
     }
 
     if not is_insightface_initialized():
@@ -458,30 +755,44 @@ def extract_dual_embeddings(
         result["error"] = msg
         return result
 
-    if not os.path.exists(image_path):
+    if not isinstance(image_path, ImageContext) and not os.path.exists(image_path):
         result["error"] = f"Input image not found: {image_path}"
         print(f"[EmbeddingService] [FAIL] {result['error']}")
         return result
 
-    img_check = cv2.imread(image_path)
-    if img_check is None:
-        result["error"] = f"cv2.imread() failed: {image_path}"
+    try:
+        image = ImageContext.of(image_path)
+    except (OSError, IOError) as e:
+        result["error"] = f"Image decode failed: {e}"
         print(f"[EmbeddingService] [FAIL] {result['error']}")
         return result
 
-    print(f"[EmbeddingService] Processing: {os.path.basename(image_path)} "
+    if use_cache:
+        cache_key = image_cache_key(image, is_sketch, use_adaptive_canny, reference_embedding, use_tta)
+        entry = get_cached_image_entry(cache_key)
+        if entry is not None:
+            print(f"[EmbeddingService] [CACHE] {image.filename}: embeddings reused, no inference")
+            result = _result_from_cache(entry, result, cache_key)
+            return join_dual_embeddings(result) if join_facenet else result
+        result["cache_key"] = cache_key
+
+    print(f"[EmbeddingService] Processing: {image.filename} "
           f"({'sketch' if is_sketch else 'photo'})")
 
     # Step 1: Face detection + alignment
     try:
         print("  [Step 1] Detecting and aligning face...")
-        aligned_face = _detect_and_align_face(image_path, enforce_detection=False)
+        aligned_face = _detect_and_align_face(image, enforce_detection=False)
         result["aligned_face"] = aligned_face.copy()
     except Exception as e:
         result["error"] = f"Face detection failed: {e}"
         print(f"[EmbeddingService] [FAIL] {result['error']}")
         return result
 
+    # Facenet only needs the aligned face: send it now, collect it after Step 3
+    print("  [Step 1b] Facenet request sent (runs alongside InsightFace)")
+    facenet_future = submit_facenet_embedding(aligned_face)
+
     # Step 2: Preprocessing
     try:
         print("  [Step 2] Preprocessing face...")
@@ -494,9 +805,13 @@ def extract_dual_embeddings(
 
         processed_face = _preprocess_face(aligned_face, is_sketch, canny_threshold=best_thresh)
         print(f"    Preprocessed shape: {processed_face.shape}")
+        # Only written when PREPROCESS_DEBUG_DIR is set
+        save_debug_artifact(aligned_face, f"{image.hash[:12]}_aligned")
+        save_debug_artifact(processed_face, f"{image.hash[:12]}_processed")
     except Exception as e:
         result["error"] = f"Preprocessing failed: {e}"
         print(f"[EmbeddingService] [FAIL] {result['error']}")
+        facenet_future.cancel()
         return result
 
     # Step 3: InsightFace embedding (with optional TTA)
@@ -514,23 +829,23 @@ def extract_dual_embeddings(
         result["error"] = f"InsightFace embedding extraction failed: {e}"
         print(f"  [Step 3] [FAIL] InsightFace failed: {e}")
         traceback.print_exc()
+        facenet_future.cancel()
         return result
 
-    # Step 4: Facenet embedding via external microservice (optional — never blocks)
-    facenet_emb = get_facenet_embedding_from_service(aligned_face)
-    if facenet_emb is not None:
-        result["facenet"] = facenet_emb
-        print(f"    [OK] Facenet (API): {len(facenet_emb)}-D, normalized")
-    else:
-        print("    [INFO] Facenet unavailable — continuing with InsightFace only")
-
-    result["success"]     = True
-    result["tta_applied"] = True
+    # Step 4: Facenet embedding via external microservice (optional — never fails the result)
+    result["success"]         = True
+    result["facenet_pending"] = facenet_future
+    if result["cache_key"] is not None:
+        _store_extracted(result)
+    if not join_facenet:
+        print("[EmbeddingService] [OK] InsightFace done; Facenet still in flight")
+        return result
+    join_dual_embeddings(result)
     print("[EmbeddingService] [OK] Embedding extraction complete")
     return result
 
 
-def extract_embedding(image_path: str, is_sketch: bool = False) -> np.ndarray:
+def extract_embedding(image_path, is_sketch: bool = False) -> np.ndarray:
     """Legacy single-embedding API. Returns InsightFace embedding."""
     res = extract_dual_embeddings(image_path, is_sketch)
     if res and res["success"]:
@@ -0,0 +1,310 @@
+"""
+Embedding Store — array-backed embedding cache behind faiss_service.
+
+EMBEDDING_CACHE (faiss_service) is an EmbeddingStore: one growable
+contiguous matrix per registered model plus an id -> row map, rather than a
+dict of per-criminal arrays. Index builds, snapshots, the linear fallback
+and Stage-2 re-ranking take its matrices as-is.
+
+Storage dtype (EMBEDDING_STORE_DTYPE env var):
+  - float32 → 4 bytes/dim (default)
+  - float16 → 2 bytes/dim
+
+The store takes the model registry it serves (faiss_service.MODEL_REGISTRY)
+and follows it: the model set may only change while the store is empty.
+"""
+
+import os
+import threading
+
+import numpy as np
+from typing import Dict, Iterator, List, Tuple, Optional
+
+
+# ============================================================================
+# EMBEDDING STORE
+# ============================================================================
+
+EMBEDDING_STORE_DTYPE = os.environ.get("EMBEDDING_STORE_DTYPE", "float32").lower()   # float32 | float16
+_STORE_MIN_CAPACITY   = 64
+
+
+class _StoreState:
+    """
+    Row layout of an EmbeddingStore.
+
+    Rows are append-only: a row is written once, then published in `rows`.
+    Growth and compaction build a new state, so a reader holding the old one
+    keeps seeing consistent rows.
+    """
+
+    __slots__ = ("ids", "rows", "data", "present", "size", "dead")
+
+    def __init__(self, ids, rows, data, present, size, dead=0):
+        self.ids     = ids        # row -> criminal_id (None once tombstoned)
+        self.rows    = rows       # criminal_id -> live row
+        self.data    = data       # model -> (capacity, d) matrix, d = 0 until the first vector
+        self.present = present    # model -> (capacity,) bool, row has a vector for the model
+        self.size    = size       # rows in use (live + tombstoned)
+        self.dead    = dead
+
+
+class EmbeddingStore:
+    """
+    Array-backed embedding cache: {criminal_id: {model: vector}} over the
+    models in the registry it is given.
+
+    Each model's vectors live in one growable contiguous matrix (float32, or
+    float16 with EMBEDDING_STORE_DTYPE=float16) with an id -> row map:
+      - put()    → O(1) amortised append; re-putting an id tombstones its old row
+      - remove() → tombstone; rows are reclaimed when the matrices are compacted
+      - export() → (ids, {model: (matrix, present)}) — zero-copy views when
+                   there are no tombstones, otherwise one gather per model
+
+    The mapping interface (get, [], in, items, ...) is kept, so entries still
+    look like dicts; their vectors are read-only views into the matrices.
+    """
+
+    def __init__(self, registry: Dict[str, object], dtype: str = None):
+        self._registry = registry    # name -> ModelSpec, read live: the model set may change while empty
+        self.dtype = np.dtype(dtype or EMBEDDING_STORE_DTYPE)
+        self._lock = threading.Lock()
+        self._state = self._empty_state()
+
+    def _empty_state(self) -> _StoreState:
+        return _StoreState(
+            ids=[None] * _STORE_MIN_CAPACITY,
+            rows={},
+            data={model: np.zeros((_STORE_MIN_CAPACITY, 0), dtype=self.dtype) for model in self.models},
+            present={model: np.zeros(_STORE_MIN_CAPACITY, dtype=bool) for model in self.models},
+            size=0,
+        )
+
+    @property
+    def models(self) -> Tuple[str, ...]:
+        """Registered model names, in registry order."""
+        return tuple(self._registry)
+
+    def reset_lock(self):
+        """Fresh lock in a forked worker."""
+        self._lock = threading.Lock()
+
+    # ── mapping interface ───────────────────────────────────────────────────
+
+    def _entry(self, state: _StoreState, row: int) -> dict:
+        entry = {}
+        for model in self.models:
+            if state.present[model][row]:
+                view = state.data[model][row]
+                view.flags.writeable = False
+                entry[model] = view
+            else:
+                entry[model] = None
+        return entry
+
+    def get(self, criminal_id: str, default=None) -> Optional[dict]:
+        state = self._state
+        row = state.rows.get(criminal_id)
+        return default if row is None else self._entry(state, row)
+
+    def __getitem__(self, criminal_id: str) -> dict:
+        entry = self.get(criminal_id)
+        if entry is None:
+            raise KeyError(criminal_id)
+        return entry
+
+    def __setitem__(self, criminal_id: str, entry: dict):
+        self.put(criminal_id, **{model: entry.get(model) for model in self.models})
+
+    def __contains__(self, criminal_id) -> bool:
+        return criminal_id in self._state.rows
+
+    def __len__(self) -> int:
+        return len(self._state.rows)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(list(self._state.rows))
+
+    def keys(self) -> List[str]:
+        return list(self._state.rows)
+
+    def items(self) -> Iterator[Tuple[str, dict]]:
+        state = self._state
+        for cid, row in list(state.rows.items()):
+            yield cid, self._entry(state, row)
+
+    def pop(self, criminal_id: str, default=None) -> Optional[dict]:
+        with self._lock:
+            state = self._state
+            row = state.rows.get(criminal_id)
+            if row is None:
+                return default
+            entry = self._entry(state, row)
+            del state.rows[criminal_id]
+            state.ids[row] = None
+            state.dead += 1
+            self._maybe_compact(state)
+        return entry
+
+    # ── writes ──────────────────────────────────────────────────────────────
+
+    def put(self, criminal_id: str, insightface_embedding=None, facenet_embedding=None, **embeddings):
+        """
+        Append a criminal's vectors (replacing any previous row); vectors of
+        models registered beyond the built-in two are passed by name.
+        """
+        vectors = {
+            "insightface": insightface_embedding,
+            "facenet":     facenet_embedding,
+            **embeddings,
+        }
+        for model, vec in vectors.items():
+            if vec is None:
+                continue
+            spec = self._registry.get(model)
+            if spec is None:
+                raise ValueError(f"Unknown embedding model '{model}'")
+            if np.asarray(vec).size != spec.dim:
+                raise ValueError(f"{model} embedding has {np.asarray(vec).size} dims, expected {spec.dim}")
+        with self._lock:
+            state = self._state
+            if state.size == len(state.ids) or not self._writable(state, vectors):
+                state = self._resize(state, vectors)
+            row = state.size
+            for model, vec in vectors.items():
+                if vec is not None:
+                    state.data[model][row] = np.asarray(vec, dtype=self.dtype).ravel()
+                    state.present[model][row] = True
+            state.ids[row] = criminal_id
+            state.size += 1
+            old = state.rows.get(criminal_id)
+            state.rows[criminal_id] = row     # published last: readers only see finished rows
+            if old is not None:
+                state.ids[old] = None
+                state.dead += 1
+                self._maybe_compact(state)
+
+    def remove(self, criminal_id: str) -> bool:
+        return self.pop(criminal_id) is not None
+
+    def clear(self):
+        with self._lock:
+            self._state = self._empty_state()
+
+    def _maybe_compact(self, state: _StoreState):
+        """Reclaim tombstoned rows once they outnumber the live ones."""
+        if state.dead > _STORE_MIN_CAPACITY and state.dead > len(state.rows):
+            self._resize(state, {})
+
+    def _writable(self, state: _StoreState, vectors: dict) -> bool:
+        """Can the next row go into the current matrices in place?"""
+        for model, vec in vectors.items():
+            if vec is None:
+                continue
+            matrix = state.data[model]
+            if not matrix.flags.writeable or matrix.shape[1] != np.asarray(vec).size:
+                return False
+        return True
+
+    def _resize(self, state: _StoreState, vectors: dict) -> _StoreState:
+        """
+        Copy the live rows into fresh matrices (tombstones dropped), with room
+        to grow 2x; also fixes a model's width on its first vector and moves
+        read-only (memory-mapped) matrices onto the heap before a write.
+        """
+        live_ids  = [cid for cid in state.ids[:state.size] if cid is not None]
+        live_rows = np.array([state.rows[cid] for cid in live_ids], dtype=np.int64)
+        capacity  = max(_STORE_MIN_CAPACITY, 2 * (len(live_ids) + 1))
+
+        data, present = {}, {}
+        for model in self.models:
+            old = state.data[model]
+            dim = old.shape[1]
+            vec = vectors.get(model)
+            if vec is not None:
+                if dim and np.asarray(vec).size != dim:
+                    raise ValueError(
+                        f"{model} embedding has {np.asarray(vec).size} dims, store holds {dim}"
+                    )
+                dim = np.asarray(vec).size
+            data[model] = np.zeros((capacity, dim), dtype=self.dtype)
+            present[model] = np.zeros(capacity, dtype=bool)
+            if old.shape[1]:
+                data[model][:len(live_rows)] = old[live_rows]
+            present[model][:len(live_rows)] = state.present[model][live_rows]
+
+        new = _StoreState(
+            ids=live_ids + [None] * (capacity - len(live_ids)),
+            rows={cid: row for row, cid in enumerate(live_ids)},
+            data=data,
+            present=present,
+            size=len(live_ids),
+        )
+        self._state = new
+        return new
+
+    # ── bulk access ─────────────────────────────────────────────────────────
+
+    def attach(self, ids: List[str], matrices: Dict[str, Tuple[np.ndarray, np.ndarray]]):
+        """
+        Serve existing (N, d) matrices as-is, e.g. read-only memory maps of a
+        snapshot; row i belongs to ids[i]. The first write copies to the heap.
+        """
+        n = len(ids)
+        data, present = {}, {}
+        for model in self.models:
+            matrix, mask = matrices.get(model, (None, None))
+            if matrix is None or matrix.shape[1] == 0:
+                matrix, mask = np.zeros((n, 0), dtype=self.dtype), np.zeros(n, dtype=bool)
+            data[model]    = matrix
+            present[model] = np.asarray(mask, dtype=bool)
+        with self._lock:
+            self._state = _StoreState(
+                ids=list(ids),
+                rows={cid: row for row, cid in enumerate(ids)},
+                data=data,
+                present=present,
+                size=n,
+            )
+
+    def export(self, criminal_ids: List[str] = None) -> Tuple[List[str], Dict[str, Tuple[np.ndarray, np.ndarray]]]:
+        """
+        (ids, {model: (matrix, present)}) for the given ids (default: all, in
+        row order); unknown ids are skipped. Without tombstones the full
+        export is a view of the stored matrices, otherwise one gather.
+        """
+        with self._lock:
+            state = self._state
+            if criminal_ids is None:
+                ids = list(state.rows)
+                contiguous = state.dead == 0
+            else:
+                ids = [cid for cid in criminal_ids if cid in state.rows]
+                contiguous = False
+            rows = np.fromiter((state.rows[cid] for cid in ids), dtype=np.int64, count=len(ids))
+
+        matrices = {}
+        for model in self.models:
+            if contiguous:
+                matrices[model] = (state.data[model][:len(ids)], state.present[model][:len(ids)])
+            else:
+                matrices[model] = (state.data[model][rows], state.present[model][rows])
+        return ids, matrices
+
+    def missing(self, model: str) -> List[str]:
+        """Criminal ids without a vector for the model."""
+        state = self._state
+        present = state.present[model]
+        return [cid for cid, row in list(state.rows.items()) if not present[row]]
+
+    def memory_stats(self) -> dict:
+        state = self._state
+        return {
+            "dtype":      self.dtype.name,
+            "live":       len(state.rows),
+            "tombstoned": state.dead,
+            "capacity":   len(state.ids),
+            "bytes":      int(sum(state.data[m].nbytes + state.present[m].nbytes for m in self.models)),
+            "mmapped":    any(isinstance(state.data[m], np.memmap) for m in self.models),
+        }
+
@@ -13,13 +13,20 @@ import traceback
 from services.embedding_service import (
     initialize_models,
     extract_dual_embeddings,
-    extract_embedding_with_tta
+    join_dual_embeddings,
+    extract_embeddings_with_tta
 )
 from models.insightface_model import is_insightface_initialized
+from models.face_detector import detect_faces_batch, largest_face
 from preprocessing.sketch_photo_preprocess import is_sketch_image
-from utils.file_utils import get_file_hash
+from utils.image_context import ImageContext
 from utils.similarity_utils import cosine_similarity
-from utils.cache_utils import get_cached_result, set_cached_result
+from utils.cache_utils import (
+    get_cached_result,
+    set_cached_result,
+    get_cached_image_entry,
+    update_cached_image_entry,
+)
 
 
 def extract_facial_regions(aligned_face: np.ndarray) -> dict:
@@ -116,13 +123,14 @@ def extract_region_embeddings(aligned_face: np.ndarray, is_sketch: bool = False,
             print(f"  [WARNING] Region extraction failed, using full face only")
         
         region_embeddings = {}
+        processed = {}
         
-        # Process each region
+        # Preprocess each region
         for region_name in ['full_face', 'eyes', 'nose', 'mouth']:
             region_img = regions.get(region_name)
+            region_embeddings[region_name] = None
             
             if region_img is None or region_img.size == 0:
-                region_embeddings[region_name] = None
                 continue
             
             try:
@@ -136,30 +144,29 @@ def extract_region_embeddings(aligned_face: np.ndarray, is_sketch: bool = False,
                     
                     # Apply Canny edge detection
                     edges = cv2.Canny(gray, threshold1=50, threshold2=150)
-                    processed_region = cv2.cvtColor(edges, cv2.COLOR_GRAY2BGR)
+                    processed[region_name] = cv2.cvtColor(edges, cv2.COLOR_GRAY2BGR)
                 else:
                     # Sketch - keep as is
                     if len(region_img.shape) == 3:
                         gray = cv2.cvtColor(region_img, cv2.COLOR_BGR2GRAY)
                     else:
                         gray = region_img
-                    processed_region = cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR)
-                
-                # Extract embedding with or without TTA
-                if use_tta:
-                    embedding = extract_embedding_with_tta(
-                        processed_region, 
-                        'InsightFace'
-                    )
-                else:
-                    from services.embedding_service import _extract_insightface_single
-                    embedding = _extract_insightface_single(processed_region)
-                
-                region_embeddings[region_name] = embedding
+                    processed[region_name] = cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR)
                     
             except Exception as e:
-                print(f"  [WARNING] Failed to extract {region_name} embedding with TTA: {e}")
-                region_embeddings[region_name] = None
+                print(f"  [WARNING] Failed to preprocess {region_name} region: {e}")
+        
+        # All regions (x TTA augmentations) in one batched ONNX run
+        names = list(processed)
+        try:
+            if use_tta:
+                embeddings = extract_embeddings_with_tta([processed[n] for n in names], 'InsightFace')
+            else:
+                from services.embedding_service import _extract_insightface_batch
+                embeddings = _extract_insightface_batch([processed[n] for n in names])
+            region_embeddings.update(zip(names, embeddings))
+        except Exception as e:
+            print(f"  [WARNING] Failed to extract region embeddings: {e}")
         
         # Check if at least full face succeeded
         success = region_embeddings.get('full_face') is not None
@@ -184,6 +191,29 @@ def extract_region_embeddings(aligned_face: np.ndarray, is_sketch: bool = False,
         }
 
 
+def cached_region_embeddings(embeddings: dict, is_sketch: bool = False, use_tta: bool = True) -> dict:
+    """
+    extract_region_embeddings() for an extract_dual_embeddings() result, reusing
+    the regions stored in its per-image cache entry when there is one.
+
+    Regions inherit the entry's key (same image, mode, TTA and model version)
+    and are only stored when extraction succeeded.
+    """
+    cache_key = embeddings.get('cache_key')
+    if cache_key:
+        entry = get_cached_image_entry(cache_key)
+        if entry is not None and entry.get('regions') is not None:
+            print(f"  [CACHE] Region embeddings reused")
+            return dict(entry['regions'])
+
+    regions = extract_region_embeddings(embeddings['aligned_face'], is_sketch=is_sketch, use_tta=use_tta)
+    if cache_key and regions['success']:
+        update_cached_image_entry(cache_key, regions={
+            name: (emb.copy() if isinstance(emb, np.ndarray) else emb) for name, emb in regions.items()
+        })
+    return regions
+
+
 def compute_multi_region_similarity(regions1: dict, regions2: dict) -> dict:
     """
     Compute similarity scores for multiple facial regions and combine them.
@@ -290,23 +320,17 @@ def compute_geometric_similarity(img1_path: str, img2_path: str) -> float:
         if img1 is None or img2 is None:
             return 0.5  # Neutral score if can't read
         
-        # Convert to grayscale
-        gray1 = cv2.cvtColor(img1, cv2.COLOR_BGR2GRAY)
-        gray2 = cv2.cvtColor(img2, cv2.COLOR_BGR2GRAY)
-        
-        # Detect faces using Haar Cascade (lightweight)
-        face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+        # Detect faces (cached detector, downscaled proxy, full-resolution boxes);
+        # no minimum size, as the original detectMultiScale call had none
+        faces1, faces2 = detect_faces_batch([img1, img2], scale_factor=1.1, min_neighbors=4, min_size=(0, 0))
         
-        faces1 = face_cascade.detectMultiScale(gray1, 1.1, 4)
-        faces2 = face_cascade.detectMultiScale(gray2, 1.1, 4)
+        # Get largest face (assume it's the main face)
+        face1 = largest_face(faces1)  # (x, y, w, h)
+        face2 = largest_face(faces2)
         
-        if len(faces1) == 0 or len(faces2) == 0:
+        if face1 is None or face2 is None:
             return 0.5  # Neutral score if no face detected
         
-        # Get largest face (assume it's the main face)
-        face1 = max(faces1, key=lambda f: f[2] * f[3])  # (x, y, w, h)
-        face2 = max(faces2, key=lambda f: f[2] * f[3])
-        
         # Extract face regions
         x1, y1, w1, h1 = face1
         x2, y2, w2, h2 = face2
@@ -328,8 +352,8 @@ def compute_geometric_similarity(img1_path: str, img2_path: str) -> float:
         center2_y = y2 + h2 / 2
         
         # Normalize by image size
-        h_img1, w_img1 = gray1.shape
-        h_img2, w_img2 = gray2.shape
+        h_img1, w_img1 = img1.shape[:2]
+        h_img2, w_img2 = img2.shape[:2]
         
         center1_x_norm = center1_x / w_img1 if w_img1 > 0 else 0.5
         center1_y_norm = center1_y / h_img1 if h_img1 > 0 else 0.5
@@ -428,7 +452,7 @@ def compute_geometric_similarity_from_aligned(aligned_face1: np.ndarray, aligned
 
 
 
-def forensic_face_comparison(sketch_path: str, photo_path: str, use_cache: bool = True) -> dict:
+def forensic_face_comparison(sketch_path, photo_path, use_cache: bool = True) -> dict:
     """
     HYBRID: Forensic-grade face comparison with hybrid scoring
     
@@ -442,9 +466,14 @@ def forensic_face_comparison(sketch_path: str, photo_path: str, use_cache: bool
     - Multi-region: 55% full + 20% eyes + 15% nose + 10% mouth
     
     Args:
-        sketch_path: Path to sketch/query image
-        photo_path: Path to photo/reference image
-        use_cache: Whether to use result caching
+        sketch_path: ImageContext (or path) of the sketch/query image
+        photo_path: ImageContext (or path) of the photo/reference image
+        use_cache: Whether to use result caching (pair results and the
+                   per-image embedding cache, so a sketch compared against
+                   many photos is only extracted once)
+    
+    Each image is decoded once: the same ImageContext supplies the sketch
+    classification, the cache hash and the pixels for embedding extraction.
     
     Returns:
         dict: Comprehensive comparison results with all similarity scores
@@ -458,12 +487,14 @@ def forensic_face_comparison(sketch_path: str, photo_path: str, use_cache: bool
     print(f"\n{'='*60}")
     print("FORENSIC FACE COMPARISON - HYBRID SCORING")
     print(f"{'='*60}")
-    print(f"  Query Image: {os.path.basename(sketch_path)}")
-    print(f"  Reference Image: {os.path.basename(photo_path)}")
+    sketch_img = ImageContext.of(sketch_path)
+    photo_img = ImageContext.of(photo_path)
+    print(f"  Query Image: {sketch_img.filename}")
+    print(f"  Reference Image: {photo_img.filename}")
     
     # Detect if images are sketches
-    is_img1_sketch = is_sketch_image(sketch_path)
-    is_img2_sketch = is_sketch_image(photo_path)
+    is_img1_sketch = is_sketch_image(sketch_img)
+    is_img2_sketch = is_sketch_image(photo_img)
     
     print(f"  Query is sketch: {is_img1_sketch}")
     print(f"  Reference is sketch: {is_img2_sketch}")
@@ -476,8 +507,8 @@ def forensic_face_comparison(sketch_path: str, photo_path: str, use_cache: bool
     # Check result cache
     cache_key = None
     if use_cache:
-        hash1 = get_file_hash(sketch_path)
-        hash2 = get_file_hash(photo_path)
+        hash1 = sketch_img.hash
+        hash2 = photo_img.hash
         if hash1 and hash2:
             cache_key = f"{hash1}_{hash2}_{is_img1_sketch}_{is_img2_sketch}_hybrid_v1"
             cached_result = get_cached_result(cache_key)
@@ -489,13 +520,17 @@ def forensic_face_comparison(sketch_path: str, photo_path: str, use_cache: bool
                 print(f"{'='*60}\n")
                 return cached_result
     
+    embeddings1 = None
     try:
         # Extract DUAL embeddings (InsightFace + Facenet) using align-then-edge approach
         print(f"[DUAL EMBEDDING EXTRACTION] Extracting dual embeddings (InsightFace + Facenet)...")
         
         # Extract dual embeddings for image 1 (query) - TTA enabled for robustness
         print(f"\n  Extracting dual embeddings 1 (query, TTA enabled)...")
-        embeddings1 = extract_dual_embeddings(sketch_path, is_sketch=is_img1_sketch, use_adaptive_canny=False, use_tta=True)
+        embeddings1 = extract_dual_embeddings(
+            sketch_img, is_sketch=is_img1_sketch, use_adaptive_canny=False, use_tta=True,
+            use_cache=use_cache, join_facenet=False,   # Facenet 1 keeps running during image 2
+        )
         
         if embeddings1 is None or not embeddings1['success']:
             return {
@@ -526,14 +561,17 @@ def forensic_face_comparison(sketch_path: str, photo_path: str, use_cache: bool
         reference_emb = embeddings1['insightface'] if (use_adaptive and insightface_available) else None
         
         embeddings2 = extract_dual_embeddings(
-            photo_path, 
+            photo_img,
             is_sketch=is_img2_sketch,
             use_adaptive_canny=use_adaptive,
             reference_embedding=reference_emb,
             use_tta=False,  # No TTA for reference/database images — use cached embeddings
+            use_cache=use_cache,
+            join_facenet=False,
         )
         
         if embeddings2 is None or not embeddings2['success']:
+            join_dual_embeddings(embeddings1)   # image 1's Facenet result still goes to the cache
             return {
                 'distance': 1.0,
                 'similarity': 0.0,
@@ -555,6 +593,11 @@ def forensic_face_comparison(sketch_path: str, photo_path: str, use_cache: bool
                 'forensic_note': 'Dual embedding extraction failed for image 2.'
             }
         
+        # Both InsightFace passes are done; collect the two Facenet requests that
+        # ran alongside them
+        join_dual_embeddings(embeddings1)
+        join_dual_embeddings(embeddings2)
+
         # Determine which models are available
         insightface_available = embeddings1.get('insightface') is not None and embeddings2.get('insightface') is not None
         facenet_available = embeddings1.get('facenet') is not None and embeddings2.get('facenet') is not None
@@ -640,8 +683,8 @@ def forensic_face_comparison(sketch_path: str, photo_path: str, use_cache: bool
         else:
             print(f"  Extracting region embeddings for enhanced matching...")
             try:
-                regions1 = extract_region_embeddings(embeddings1['aligned_face'], is_sketch=is_img1_sketch, use_tta=True)
-                regions2 = extract_region_embeddings(embeddings2['aligned_face'], is_sketch=is_img2_sketch, use_tta=False)
+                regions1 = cached_region_embeddings(embeddings1, is_sketch=is_img1_sketch, use_tta=True)
+                regions2 = cached_region_embeddings(embeddings2, is_sketch=is_img2_sketch, use_tta=False)
 
                 if regions1['success'] and regions2['success']:
                     region_results = compute_multi_region_similarity(regions1, regions2)
@@ -873,6 +916,11 @@ def forensic_face_comparison(sketch_path: str, photo_path: str, use_cache: bool
         print(f"[ERROR] Comparison failed: {e}")
         traceback.print_exc()
         print(f"{'='*60}\n")
+        if embeddings1 is not None and embeddings1.get('facenet_pending') is not None:
+            try:
+                join_dual_embeddings(embeddings1)   # e.g. image 2 raised while Facenet 1 was in flight
+            except Exception as join_error:
+                print(f"[WARNING] Facenet join for image 1 failed: {join_error}")
         
         elapsed_time = time.time() - start_time
         return {
@@ -1,66 +1,371 @@
 """
-FAISS Service — dual-index similarity search (InsightFace + Facenet).
-
-Two independent IndexFlatIP indexes are maintained:
-  - FAISS_INDEX_INSIGHTFACE  (512-D ArcFace embeddings)
-  - FAISS_INDEX_FACENET      (512-D Facenet512 embeddings)
+FAISS Service — multi-index similarity search (InsightFace + Facenet + ...).
+
+One ID-mapped index per registered embedding model is maintained per snapshot:
+  - "insightface"  (512-D ArcFace embeddings)
+  - "facenet"      (512-D Facenet512 embeddings)
+  - any model added with register_model()
+
+All indexes share one int64 label space (IndexSnapshot.labels / id_map), so
+a criminal can be added or removed without rebuilding:
+  - add_embedding()    → appended to the model's delta: a short list of
+                         small exact segments merged pairwise when equal in
+                         size (each vector is copied O(log n) times, never
+                         the whole delta per write); deltas are merged into
+                         the main indexes by a background rebuild
+  - remove_embedding() → label dropped from the id map (tombstoned) and the
+                         cache entry evicted; the vectors are physically
+                         removed later by a background compaction pass
+
+Concurrency:
+  Everything a search needs (indexes, deltas, label maps, tombstones) lives
+  in one immutable IndexSnapshot. Writers serialise on _INDEX_LOCK, build a
+  new snapshot copy-on-write and publish it with a single reference
+  assignment to FAISS_SNAPSHOT; searches read FAISS_SNAPSHOT once and never
+  take the lock, so they neither block on a rebuild nor see torn state.
+
+Index type (FAISS_INDEX_TYPE env var):
+  - flat  → exact IndexFlatIP (default below FAISS_ANN_THRESHOLD vectors)
+  - ivf   → IndexIVFFlat, tuned via nprobe; centroids retrained in the
+            background whenever the gallery grows FAISS_RETRAIN_GROWTH×
+  - hnsw  → IndexHNSWFlat, tuned via efSearch
+  - auto  → flat below FAISS_ANN_THRESHOLD, FAISS_ANN_KIND above it
+  Every ANN build logs a recall@10 check against exact search.
+
+Compressed storage (FAISS_COMPRESSION env var):
+  - none  → float32 vectors in the index (4 bytes/dim)
+  - fp16  → float16 scalar quantizer (2 bytes/dim)
+  - sq8   → 8-bit scalar quantizer (1 byte/dim)
+  - pq    → IVF-PQ product quantizer (FAISS_PQ_M bytes/vector)
+  Stage-1 retrieval runs on the compressed codes; the over-fetched shortlist
+  is re-scored exactly against the vectors in EMBEDDING_CACHE.
+
+Embedding store:
+  EMBEDDING_CACHE is an EmbeddingStore (services/embedding_store.py) — one
+  growable contiguous matrix per model plus an id -> row map. Index builds,
+  snapshots and the linear fallback take its matrices as-is.
+
+Snapshots and shared gallery:
+  Persistence lives in services/snapshot_service.py: versioned snapshot
+  directories loaded at boot with load_or_build_faiss_index(), and the
+  journal / file lock behind FAISS_SHARED_GALLERY. It installs indexes
+  through the SNAPSHOT SUPPORT functions below and hooks into writes and
+  searches via set_write_hook() / set_search_hook().
+
+Joint mode (FAISS_JOINT_INDEX=1):
+  A single "joint" index holds [insightface | facenet] per criminal, each
+  half L2-normalised (a missing half is zeros → neutral 0.5 once calibrated).
+  The query halves are scaled by the per-query model weights, so one search
+  ranks by w_ins·cos_ins + w_face·cos_face; the shortlist is then re-scored
+  exactly with the usual calibration and Facenet clamp.
+
+Metadata filters:
+  services/filter_service.py keeps per-attribute inverted sets (sex,
+  nationality, status, case_id → criminal ids). A compiled filter becomes an
+  IDSelectorBatch applied inside the FAISS scan; narrow filters (at most
+  FAISS_FILTER_BRUTE_FORCE criminals) skip FAISS and are scored exactly.
+
+Model registry:
+  MODEL_REGISTRY maps each model name to a ModelSpec declaring its dimension,
+  index kind override, calibration, clamp and per-domain (sketch / photo)
+  fusion weight. Store layout, index builds, snapshots, search, fusion and
+  range bounds all iterate the registry; register_model() adds a model at
+  startup, before the gallery is loaded.
 
 Search strategy:
   - Sketch query  → Facenet index primary, InsightFace secondary
   - Photo  query  → InsightFace index primary, Facenet secondary
-  - Results from both indexes are merged (union) and deduplicated before
-    passing to Stage-2 re-ranking.
+  - Every model's index is scanned concurrently (FAISS_SCAN_WORKERS threads;
+    FAISS releases the GIL), then the results are merged (union) and
+    deduplicated before passing to Stage-2 re-ranking (or, in joint mode,
+    come from one search).
 
 Cosine similarity calibration:
   sim_calibrated = (raw_cosine + 1) / 2   → maps [-1,1] to [0,1]
   This prevents extreme negative values from distorting fusion scores.
 """
 
+import os
+import heapq
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
 import faiss
-import traceback
-from typing import Dict, List, Tuple, Optional
+from typing import Callable, Dict, Iterable, List, Tuple, Optional, Set
 from utils.similarity_utils import cosine_similarity
+from services import filter_service
+from services.embedding_store import EmbeddingStore
+
+
+# ============================================================================
+# MODEL REGISTRY
+# ============================================================================
+
+class ModelSpec:
+    """
+    One embedding model served by the gallery.
+
+    name        : key in the store, indexes, snapshots and results
+                  ("<name>_similarity")
+    dim         : embedding width; vectors of any other width are rejected
+    weights     : {"sketch": w, "photo": w} fusion weight per query domain
+    index_kind  : flat | ivf | hnsw, or None to follow FAISS_INDEX_TYPE
+    clamp       : ceiling on the calibrated score (None = unclamped)
+    calibration : raw cosine -> [0, 1], on floats or arrays; (cos + 1) / 2
+                  when None
+    """
+
+    __slots__ = ("name", "label", "dim", "weights", "index_kind", "clamp", "calibration")
+
+    def __init__(
+        self,
+        name: str,
+        dim: int,
+        weights: Dict[str, float],
+        label: str = None,
+        index_kind: str = None,
+        clamp: float = None,
+        calibration=None,
+    ):
+        self.name        = name
+        self.label       = label or name
+        self.dim         = int(dim)
+        self.weights     = {"sketch": float(weights["sketch"]), "photo": float(weights["photo"])}
+        self.index_kind  = index_kind
+        self.clamp       = clamp
+        self.calibration = calibration
+
+    def calibrate(self, raw):
+        """Calibrated score(s) of raw cosine(s), before the clamp."""
+        if self.calibration is not None:
+            return self.calibration(raw)
+        if np.ndim(raw) == 0:
+            return (float(raw) + 1.0) / 2.0
+        return (np.asarray(raw, dtype=np.float64) + 1.0) / 2.0
+
+    def cap(self, score):
+        """Apply the clamp to calibrated score(s)."""
+        if self.clamp is None:
+            return score
+        if np.ndim(score) == 0:
+            return min(score, self.clamp)
+        return np.minimum(score, self.clamp)
+
+    def weight(self, is_sketch: bool) -> float:
+        return self.weights["sketch" if is_sketch else "photo"]
+
+
+# name -> ModelSpec, in fusion / storage order. Extend with register_model()
+# before embeddings are loaded.
+MODEL_REGISTRY: Dict[str, ModelSpec] = {
+    spec.name: spec for spec in (
+        ModelSpec("insightface", 512, {"sketch": 0.1, "photo": 0.5}, label="InsightFace"),
+        # raw Facenet cosine 0.75 → calibrated 0.875
+        ModelSpec("facenet", 512, {"sketch": 0.9, "photo": 0.5}, label="Facenet", clamp=0.875),
+    )
+}
+EMBEDDING_MODELS  = tuple(MODEL_REGISTRY)
+FACENET_CAL_CLAMP = MODEL_REGISTRY["facenet"].clamp
 
 
 # ============================================================================
 # GLOBAL STATE
 # ============================================================================
 
-# {criminal_id: {'insightface': np.ndarray, 'facenet': np.ndarray}}
-EMBEDDING_CACHE: Dict[str, dict] = {}
+# {criminal_id: {model: np.ndarray}} over MODEL_REGISTRY, array-backed
+EMBEDDING_CACHE = EmbeddingStore(MODEL_REGISTRY)
 EMBEDDING_VERSION = "dual_v1"
 
-FAISS_INDEX_INSIGHTFACE = None
-FAISS_INDEX_FACENET     = None
-FAISS_IDS_INSIGHTFACE: List[str] = []   # criminal_id order for InsightFace index
-FAISS_IDS_FACENET:     List[str] = []   # criminal_id order for Facenet index
 FAISS_INDEX_DIRTY = True
+_CACHE_EPOCH = 0                        # bumped on every cache write; detects writes during a build
+_NEXT_LABEL = 0
+_LABEL_EPOCH = 0                        # bumped whenever the label space is replaced (build / load / attach)
+
+# Serialises writers (add / remove / build / compaction). Searches never take
+# it: they read FAISS_SNAPSHOT once and only touch that immutable object.
+_INDEX_LOCK = threading.RLock()
+
+# Background compaction kicks in once tombstones reach both thresholds.
+COMPACTION_MIN_TOMBSTONES = 64
+COMPACTION_RATIO          = 0.10
+_COMPACTION_THREAD: Optional[threading.Thread] = None
+
+
+# ============================================================================
+# INDEX CONFIGURATION
+# ============================================================================
+
+FAISS_INDEX_TYPE           = os.environ.get("FAISS_INDEX_TYPE", "auto").lower()
+FAISS_ANN_KIND             = os.environ.get("FAISS_ANN_KIND", "hnsw").lower()
+FAISS_ANN_THRESHOLD        = int(os.environ.get("FAISS_ANN_THRESHOLD", "200000"))
+FAISS_IVF_NPROBE           = int(os.environ.get("FAISS_IVF_NPROBE", "16"))
+FAISS_IVF_MIN_TRAIN        = 1000    # below this IVF falls back to flat
+FAISS_HNSW_M               = int(os.environ.get("FAISS_HNSW_M", "32"))
+FAISS_HNSW_EF_SEARCH       = int(os.environ.get("FAISS_HNSW_EF_SEARCH", "64"))
+FAISS_HNSW_EF_CONSTRUCTION = int(os.environ.get("FAISS_HNSW_EF_CONSTRUCTION", "80"))
+FAISS_RETRAIN_GROWTH       = float(os.environ.get("FAISS_RETRAIN_GROWTH", "2.0"))
+FAISS_RECALL_SAMPLE        = 200     # queries used for the recall@k check
+FAISS_RECALL_K             = 10
+
+FAISS_COMPRESSION          = os.environ.get("FAISS_COMPRESSION", "none").lower()
+FAISS_PQ_M                 = int(os.environ.get("FAISS_PQ_M", "64"))   # bytes per vector
+FAISS_RESCORE_FACTOR       = int(os.environ.get("FAISS_RESCORE_FACTOR", "4"))
+
+FAISS_JOINT_INDEX          = os.environ.get("FAISS_JOINT_INDEX", "0") == "1"
+FAISS_SCAN_WORKERS         = int(os.environ.get("FAISS_SCAN_WORKERS", "4"))   # concurrent per-model scans
+
+FAISS_DELTA_MAX            = int(os.environ.get("FAISS_DELTA_MAX", "4096"))  # merge deltas past this
+# Filters selecting at most this many criminals are scored exactly without FAISS
+FAISS_FILTER_BRUTE_FORCE   = int(os.environ.get("FAISS_FILTER_BRUTE_FORCE", "2048"))
+_REBUILD_THREAD: Optional[threading.Thread] = None
+
+
+# ============================================================================
+# INDEX SNAPSHOT
+# ============================================================================
+
+class IndexSnapshot:
+    """
+    Immutable, self-consistent view of the searchable gallery.
+
+    indexes  : model -> bulk-built main index (never written once published;
+               may be a read-only mmap of an on-disk snapshot)
+    deltas   : model -> tuple of small exact segment indexes holding vectors
+               added since the main indexes were built (oldest first; each
+               segment is immutable once published)
+    id_map   : live label -> criminal_id (tombstoned labels never resolve)
+    labels   : criminal_id -> live label
+    tombstones: dead labels still physically present in indexes / deltas
+    """
+
+    __slots__ = (
+        "indexes", "deltas", "id_map", "labels", "tombstones",
+        "kind", "compression", "recall", "trained_size", "mmapped", "generation",
+    )
+
+    def __init__(
+        self,
+        indexes: Dict[str, faiss.Index] = None,
+        deltas: Dict[str, Tuple[faiss.Index, ...]] = None,
+        id_map: Dict[int, str] = None,
+        labels: Dict[str, int] = None,
+        tombstones: frozenset = frozenset(),
+        kind: str = "flat",
+        compression: str = "none",
+        recall: Dict[str, float] = None,
+        trained_size: int = 0,
+        mmapped: bool = False,
+        generation: int = 0,
+    ):
+        self.indexes      = indexes or {}
+        self.deltas       = deltas or {}
+        self.id_map       = id_map or {}
+        self.labels       = labels or {}
+        self.tombstones   = frozenset(tombstones)
+        self.kind         = kind
+        self.compression  = compression
+        self.recall       = recall or {}
+        self.trained_size = trained_size
+        self.mmapped      = mmapped
+        self.generation   = generation
+
+    def replace(self, **changes) -> "IndexSnapshot":
+        """Copy with some fields swapped (unchanged fields are shared, not copied)."""
+        fields = {name: getattr(self, name) for name in self.__slots__}
+        fields.update(changes)
+        return IndexSnapshot(**fields)
+
+    def has(self, model: str) -> bool:
+        return model in self.indexes or model in self.deltas
+
+    def parts(self, model: str) -> List[faiss.Index]:
+        """Main index and delta segments of one model, whichever exist."""
+        main = [self.indexes[model]] if model in self.indexes else []
+        return main + list(self.deltas.get(model, ()))
+
+    def ntotal(self, model: str) -> int:
+        return sum(index.ntotal for index in self.parts(model))
+
+    def delta_size(self) -> int:
+        return max([sum(seg.ntotal for seg in segments) for segments in self.deltas.values()] + [0])
+
+    def is_searchable(self) -> bool:
+        return bool(self.indexes or self.deltas)
+
+
+# The published snapshot; replaced wholesale, never mutated
+FAISS_SNAPSHOT = IndexSnapshot()
+
+
+def _reset_locks_after_fork():
+    """Fresh locks in a forked worker (one held by a master thread would never be released)."""
+    global _INDEX_LOCK, _SCAN_POOL, _SCAN_POOL_LOCK
+    _INDEX_LOCK  = threading.RLock()
+    _SCAN_POOL, _SCAN_POOL_LOCK = None, threading.Lock()   # pool threads do not survive fork
+    EMBEDDING_CACHE.reset_lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_locks_after_fork)
+
+
+# ============================================================================
+# GALLERY HOOKS
+# ============================================================================
+
+# Installed by snapshot_service (shared multi-worker gallery): _ON_WRITE is
+# told the criminal_id of every vector write, _BEFORE_SEARCH runs ahead of
+# each search. This module never touches the snapshot directory itself.
+_ON_WRITE: Optional[Callable[[str], None]] = None
+_BEFORE_SEARCH: Optional[Callable[[], object]] = None
+
+
+def set_write_hook(on_write: Optional[Callable[[str], None]]):
+    """Install the callback told about every add / remove (None removes it)."""
+    global _ON_WRITE
+    _ON_WRITE = on_write
+
+
+def set_search_hook(before_search: Optional[Callable[[], object]]):
+    """Install the callback run before every search (None removes it)."""
+    global _BEFORE_SEARCH
+    _BEFORE_SEARCH = before_search
+
+
+def _touch(criminal_id: str):
+    if _ON_WRITE is not None:
+        _ON_WRITE(criminal_id)
 
 
 # ============================================================================
 # EMBEDDING CACHE MANAGEMENT
 # ============================================================================
 
-def get_embedding_cache() -> dict:
+def get_embedding_cache() -> EmbeddingStore:
     return EMBEDDING_CACHE
 
 
-def get_embedding_version() -> str:
-    return EMBEDDING_VERSION
+def get_embedding_version(model_hash: str = "") -> str:
+    """
+    Version tag stored with a criminal's embeddings: EMBEDDING_VERSION plus
+    the InsightFace weights hash, so vectors from another model file (e.g.
+    a different INSIGHTFACE_VARIANT) never pass as current.
+    """
+    return f"{EMBEDDING_VERSION}+{model_hash[:12]}" if model_hash else EMBEDDING_VERSION
 
 
 def set_cached_embedding(
     criminal_id: str,
     insightface_embedding: np.ndarray,
     facenet_embedding: np.ndarray = None,
+    **embeddings: np.ndarray,
 ):
-    """Store InsightFace and Facenet embeddings for a criminal."""
-    global EMBEDDING_CACHE, FAISS_INDEX_DIRTY
-    EMBEDDING_CACHE[criminal_id] = {
-        "insightface": insightface_embedding,
-        "facenet":     facenet_embedding,
-    }
+    """Store InsightFace and Facenet (and any registered extra model) embeddings for a criminal."""
+    global FAISS_INDEX_DIRTY, _CACHE_EPOCH
+    EMBEDDING_CACHE.put(criminal_id, insightface_embedding, facenet_embedding, **embeddings)
+    _CACHE_EPOCH += 1
     FAISS_INDEX_DIRTY = True
 
 
@@ -69,313 +374,1370 @@ def get_cached_embedding(criminal_id: str) -> Optional[dict]:
 
 
 def clear_embedding_cache():
-    global EMBEDDING_CACHE, FAISS_INDEX_DIRTY
-    EMBEDDING_CACHE = {}
-    FAISS_INDEX_DIRTY = True
+    global FAISS_INDEX_DIRTY, _CACHE_EPOCH
+    with _INDEX_LOCK:
+        EMBEDDING_CACHE.clear()
+        _CACHE_EPOCH += 1
+        FAISS_INDEX_DIRTY = True
 
 
 def get_cache_size() -> int:
     return len(EMBEDDING_CACHE)
 
 
+def _set_models(models: Dict[str, ModelSpec]):
+    """Swap the registry in; only while the gallery is empty (store, indexes and snapshots follow it)."""
+    global EMBEDDING_MODELS, FAISS_INDEX_DIRTY
+
+    with _INDEX_LOCK:
+        if len(EMBEDDING_CACHE):
+            raise RuntimeError("Embedding models can only change while the gallery is empty")
+        MODEL_REGISTRY.clear()
+        MODEL_REGISTRY.update(models)
+        EMBEDDING_MODELS = tuple(models)
+        EMBEDDING_CACHE.clear()      # re-lays the store out for the new model set
+        _new_label_space()
+        _publish(IndexSnapshot())
+        FAISS_INDEX_DIRTY = True
+
+
+def register_model(spec: ModelSpec) -> ModelSpec:
+    """
+    Add (or replace) an embedding model at startup, before embeddings are
+    loaded. Its vectors are then cached via set_cached_embedding(cid, ...,
+    <name>=vec), indexed alongside the others and fused with its weights.
+    """
+    if FAISS_JOINT_INDEX:
+        raise RuntimeError("FAISS_JOINT_INDEX covers InsightFace + Facenet only")
+    models = dict(MODEL_REGISTRY)
+    models[spec.name] = spec
+    _set_models(models)
+    print(f"  [FAISS] Registered embedding model {spec.label} ({spec.dim}-D, "
+          f"sketch={spec.weights['sketch']:.2f}, photo={spec.weights['photo']:.2f})")
+    return spec
+
+
+def unregister_model(name: str):
+    """Drop a model added by register_model() (the built-in two stay)."""
+    if name in ("insightface", "facenet"):
+        raise ValueError(f"'{name}' is a built-in embedding model")
+    models = dict(MODEL_REGISTRY)
+    if models.pop(name, None) is not None:
+        _set_models(models)
+
+
+def get_model_registry() -> Dict[str, ModelSpec]:
+    return MODEL_REGISTRY
+
+
 # ============================================================================
 # HELPERS
 # ============================================================================
 
-def _calibrate(sim: float) -> float:
-    """Map raw cosine similarity [-1, 1] -> [0, 1]."""
-    return (float(sim) + 1.0) / 2.0
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """L2-normalize each row of a float32 matrix (zero rows left untouched)."""
+    matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+    norms  = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms  = np.where(norms == 0, 1.0, norms)
+    return matrix / norms
+
 
+def model_weights(is_sketch: bool) -> Dict[str, float]:
+    """{model: fusion weight} of every registered model for a sketch / photo query."""
+    return {name: spec.weight(is_sketch) for name, spec in MODEL_REGISTRY.items()}
 
-def _build_index_from_embeddings(
-    embeddings: List[np.ndarray],
-) -> Optional[faiss.IndexFlatIP]:
-    """Build a normalized FAISS IndexFlatIP from a list of 512-D vectors."""
-    if not embeddings:
+
+def _model_weights(is_sketch: bool) -> Tuple[float, float]:
+    """(w_ins, w_face) fusion weights for a query."""
+    weights = model_weights(is_sketch)
+    return weights["insightface"], weights["facenet"]
+
+
+def _active_models() -> Tuple[str, ...]:
+    return ("joint",) if FAISS_JOINT_INDEX else EMBEDDING_MODELS
+
+
+def _joint_vector(
+    insightface_embedding: np.ndarray,
+    facenet_embedding: np.ndarray,
+    w_ins: float = 1.0,
+    w_face: float = 1.0,
+) -> Optional[np.ndarray]:
+    """[w_ins·ins | w_face·face] with each half unit-norm; a missing half is zeros."""
+    if insightface_embedding is None and facenet_embedding is None:
         return None
-    matrix = np.array(embeddings, dtype=np.float32)
-    norms  = np.linalg.norm(matrix, axis=1, keepdims=True)
-    norms  = np.where(norms == 0, 1.0, norms)
-    matrix = matrix / norms
-    dim    = matrix.shape[1]
-    idx    = faiss.IndexFlatIP(dim)
-    idx.add(matrix)
-    return idx
+    halves = []
+    for vec, other, weight in (
+        (insightface_embedding, facenet_embedding, w_ins),
+        (facenet_embedding, insightface_embedding, w_face),
+    ):
+        if vec is None:
+            halves.append(np.zeros(np.asarray(other).size, dtype=np.float32))
+        else:
+            halves.append(weight * _normalize_rows(np.asarray(vec, dtype=np.float32).reshape(1, -1))[0])
+    return np.concatenate(halves).reshape(1, -1)
+
+
+def _model_vector(model: str, entry: dict) -> Optional[np.ndarray]:
+    """Row to store in the given index for one criminal's {model: vector}, or None to skip."""
+    if model == "joint":
+        return _joint_vector(entry.get("insightface"), entry.get("facenet"))
+    vec = entry.get(model)
+    if vec is None:
+        return None
+    return _normalize_rows(np.asarray(vec, dtype=np.float32).reshape(1, -1))
+
+
+def _resolve_index_kind(n: int) -> str:
+    """Pick the index kind for a gallery of n vectors."""
+    kind = FAISS_INDEX_TYPE
+    if kind == "auto":
+        kind = FAISS_ANN_KIND if n >= FAISS_ANN_THRESHOLD else "flat"
+    if kind not in ("flat", "ivf", "hnsw"):
+        print(f"  [WARN] Unknown FAISS index type '{kind}', using flat")
+        kind = "flat"
+    if kind == "ivf" and n < FAISS_IVF_MIN_TRAIN:
+        kind = "flat"
+    return kind
+
+
+def _resolve_compression(n: int) -> str:
+    """Pick the vector compression for a gallery of n vectors."""
+    compression = FAISS_COMPRESSION
+    if compression not in ("none", "fp16", "sq8", "pq"):
+        print(f"  [WARN] Unknown FAISS compression '{compression}', storing float32")
+        compression = "none"
+    if compression == "pq" and n < FAISS_IVF_MIN_TRAIN:
+        compression = "sq8"   # too few vectors to train PQ codebooks
+    return compression
+
+
+def _resolve_layout(n: int) -> Tuple[str, str]:
+    """(index kind, compression) for a gallery of n vectors; PQ always rides on IVF."""
+    kind, compression = _resolve_index_kind(n), _resolve_compression(n)
+    if compression == "pq":
+        kind = "ivf"
+    return kind, compression
+
+
+_SQ_TYPES = {
+    "fp16": faiss.ScalarQuantizer.QT_fp16,
+    "sq8":  faiss.ScalarQuantizer.QT_8bit,
+}
+
+
+def _create_index(
+    dim: int,
+    kind: str,
+    train_matrix: np.ndarray = None,
+    compression: str = "none",
+):
+    """Index factory: empty, trained, ID-mapped index of the requested kind."""
+    qtype = _SQ_TYPES.get(compression)
+
+    if kind == "ivf":
+        n      = train_matrix.shape[0]
+        nlist  = max(1, min(int(4 * np.sqrt(n)), n // 39))
+        quant  = faiss.IndexFlatIP(dim)
+        if compression == "pq":
+            base = faiss.IndexIVFPQ(quant, dim, nlist, FAISS_PQ_M, 8, faiss.METRIC_INNER_PRODUCT)
+        elif qtype is not None:
+            base = faiss.IndexIVFScalarQuantizer(quant, dim, nlist, qtype, faiss.METRIC_INNER_PRODUCT)
+        else:
+            base = faiss.IndexIVFFlat(quant, dim, nlist, faiss.METRIC_INNER_PRODUCT)
+        base.train(train_matrix)
+        base.nprobe = FAISS_IVF_NPROBE
+        index = faiss.IndexIDMap2(base)
+        index.referenced_objects = [quant, base]
+        return index
+
+    if kind == "hnsw":
+        if qtype is not None:
+            base = faiss.IndexHNSWSQ(dim, qtype, FAISS_HNSW_M, faiss.METRIC_INNER_PRODUCT)
+            base.train(train_matrix)
+        else:
+            base = faiss.IndexHNSWFlat(dim, FAISS_HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        base.hnsw.efConstruction = FAISS_HNSW_EF_CONSTRUCTION
+        base.hnsw.efSearch       = FAISS_HNSW_EF_SEARCH
+        index = faiss.IndexIDMap2(base)
+        index.referenced_objects = [base]
+        return index
+
+    if qtype is not None:
+        base = faiss.IndexScalarQuantizer(dim, qtype, faiss.METRIC_INNER_PRODUCT)
+        base.train(train_matrix)
+        index = faiss.IndexIDMap2(base)
+        index.referenced_objects = [base]
+        return index
+
+    return faiss.IndexIDMap2(faiss.IndexFlatIP(dim))
+
+
+def _new_index(dim: int):
+    """
+    Empty exact index, used when the first vector lands in an empty gallery.
+
+    Stays float32 until the background rebuild has enough vectors to train
+    the configured compression.
+    """
+    return _create_index(dim, "flat")
+
+
+def _measure_recall(index, matrix: np.ndarray, labels: np.ndarray) -> float:
+    """recall@k of an ANN index against exact inner-product search."""
+    n = matrix.shape[0]
+    k = min(FAISS_RECALL_K, n)
+    rng    = np.random.default_rng(0)
+    sample = rng.choice(n, size=min(FAISS_RECALL_SAMPLE, n), replace=False)
+
+    hits = 0
+    for start in range(0, len(sample), 16):
+        queries = matrix[sample[start:start + 16]]
+        scores  = queries @ matrix.T
+        exact   = labels[np.argpartition(-scores, k - 1, axis=1)[:, :k]]
+        _, ann  = index.search(queries, k)
+        for a, e in zip(ann, exact):
+            hits += len(set(a.tolist()) & set(e.tolist()))
+    return hits / float(len(sample) * k)
+
+
+def _build_index_from_embeddings(
+    matrix: np.ndarray,
+    labels: np.ndarray,
+    kind: str = "flat",
+    compression: str = "none",
+    normalize: bool = True,
+) -> Tuple[Optional[faiss.IndexIDMap2], Optional[float]]:
+    """Build a normalized, ID-mapped index from (N, d) rows; returns (index, recall@k or None)."""
+    if len(matrix) == 0 or matrix.shape[1] == 0:
+        return None, None
+    matrix = _normalize_rows(matrix) if normalize else np.ascontiguousarray(matrix, dtype=np.float32)
+    ids    = np.asarray(labels, dtype=np.int64)
+    idx    = _create_index(matrix.shape[1], kind, matrix, compression)
+    idx.add_with_ids(matrix, ids)
+    exact  = kind == "flat" and compression == "none"
+    recall = None if exact else _measure_recall(idx, matrix, ids)
+    return idx, recall
+
+
+def _joint_matrix(matrices: Dict[str, Tuple[np.ndarray, np.ndarray]]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    [insightface | facenet] rows with each half unit-norm (a missing half is
+    zeros, as in _joint_vector), plus the mask of rows having either half.
+    """
+    dims = {model: matrices[model][0].shape[1] for model in EMBEDDING_MODELS}
+    halves, any_present = [], None
+    for model, other in (("insightface", "facenet"), ("facenet", "insightface")):
+        matrix, present = matrices[model]
+        if dims[model] == 0:
+            matrix = np.zeros((len(present), dims[other]), dtype=np.float32)
+        halves.append(np.where(present[:, None], _normalize_rows(matrix), 0.0).astype(np.float32))
+        any_present = present if any_present is None else any_present | present
+    return np.hstack(halves), any_present
+
+
+def _build_indexes(
+    cids: List[str],
+    labels: np.ndarray,
+    matrices: Dict[str, Tuple[np.ndarray, np.ndarray]],
+) -> dict:
+    """Build one index per registered model from EmbeddingStore.export() rows labelled `labels`."""
+    kind, compression = _resolve_layout(len(cids))
+    labels = np.asarray(labels, dtype=np.int64)
+
+    if FAISS_JOINT_INDEX:
+        joint, keep = _joint_matrix(matrices)
+        for row in np.flatnonzero(~keep):
+            print(f"  [WARN] {cids[row]}: both embeddings missing — skipped from joint index")
+        joint_index, joint_recall = _build_index_from_embeddings(
+            joint[keep], labels[keep], kind, compression, normalize=False
+        )
+        return {
+            "kind":        kind,
+            "compression": compression,
+            "insightface": None,
+            "facenet":     None,
+            "joint":       joint_index,
+            "recall":      {"joint": joint_recall} if joint_recall is not None else {},
+            "size":        len(cids),
+        }
+
+    built = {"kind": kind, "compression": compression, "joint": None, "recall": {}, "size": len(cids)}
+    for model, spec in MODEL_REGISTRY.items():
+        matrix, present = matrices[model]
+        for row in np.flatnonzero(~present):
+            print(f"  [WARN] {cids[row]}: {spec.label} embedding missing — "
+                  f"skipped from {spec.label} index")
+        if not present.all():
+            matrix, model_labels = matrix[present], labels[present]
+        else:
+            model_labels = labels    # whole store view goes to FAISS as-is
+        model_kind = kind
+        if spec.index_kind and compression != "pq":   # PQ always rides on IVF
+            model_kind = spec.index_kind
+            if model_kind == "ivf" and len(matrix) < FAISS_IVF_MIN_TRAIN:
+                model_kind = "flat"
+        built[model], recall = _build_index_from_embeddings(matrix, model_labels, model_kind, compression)
+        if recall is not None:
+            built["recall"][model] = recall
+    return built
+
+
+def _search_base(index):
+    """Underlying ANN index of an IndexIDMap2 wrapper."""
+    return faiss.downcast_index(index.index)
+
+
+def _apply_search_params(index):
+    if index is None:
+        return
+    base = _search_base(index)
+    if isinstance(base, faiss.IndexIVF):
+        base.nprobe = FAISS_IVF_NPROBE
+    elif isinstance(base, faiss.IndexHNSW):
+        base.hnsw.efSearch = FAISS_HNSW_EF_SEARCH
+
+
+def set_search_params(nprobe: int = None, ef_search: int = None):
+    """Tune ANN search knobs at runtime (applies to the published indexes)."""
+    global FAISS_IVF_NPROBE, FAISS_HNSW_EF_SEARCH
+    with _INDEX_LOCK:
+        if nprobe is not None:
+            FAISS_IVF_NPROBE = max(1, int(nprobe))
+        if ef_search is not None:
+            FAISS_HNSW_EF_SEARCH = max(1, int(ef_search))
+        for index in FAISS_SNAPSHOT.indexes.values():
+            _apply_search_params(index)
+    print(f"  [FAISS] Search params: nprobe={FAISS_IVF_NPROBE}, efSearch={FAISS_HNSW_EF_SEARCH}")
 
 
 # ============================================================================
 # FAISS INDEX BUILDING
 # ============================================================================
 
+def _publish(snapshot: IndexSnapshot):
+    """Make snapshot the one searches see (caller holds _INDEX_LOCK)."""
+    global FAISS_SNAPSHOT
+    FAISS_SNAPSHOT = snapshot.replace(generation=FAISS_SNAPSHOT.generation + 1)
+
+
+def _install_indexes(
+    built: dict,
+    labels: Dict[str, int],
+    tombstones: Set[int] = frozenset(),
+    deltas: Dict[str, Tuple[faiss.Index, ...]] = None,
+):
+    """Publish freshly built indexes as the new snapshot (caller holds _INDEX_LOCK)."""
+    _publish(IndexSnapshot(
+        indexes={
+            model: built[model]
+            for model in EMBEDDING_MODELS + ("joint",)
+            if built.get(model) is not None
+        },
+        deltas=deltas,
+        id_map={label: cid for cid, label in labels.items()},
+        labels=dict(labels),
+        tombstones=frozenset(tombstones),
+        kind=built["kind"],
+        compression=built["compression"],
+        recall=built["recall"],
+        trained_size=built["size"],
+        mmapped=built.get("mmapped", False),
+    ))
+
+    snap = FAISS_SNAPSHOT
+    print(f"  Index type: {snap.kind} (compression={snap.compression})")
+    names = {name: spec.label for name, spec in MODEL_REGISTRY.items()}
+    names["joint"] = "Joint"
+    for model in _active_models():
+        if snap.has(model):
+            print(f"  [OK] {names[model]} index: {snap.ntotal(model)} vectors")
+        else:
+            print(f"  [WARN] {names[model]} index: no valid embeddings")
+    for model, recall in snap.recall.items():
+        print(f"  [RECALL] {model} recall@{FAISS_RECALL_K} vs exact: {recall:.3f}")
+
+
+def _new_label_space():
+    """Labels are about to be renumbered (caller holds _INDEX_LOCK); stale background builds must not install."""
+    global _LABEL_EPOCH, _NEXT_LABEL
+    _LABEL_EPOCH += 1
+    _NEXT_LABEL = 0
+
+
 def build_faiss_index():
-    """Build dual FAISS indexes (InsightFace + Facenet) from the embedding cache."""
-    global FAISS_INDEX_INSIGHTFACE, FAISS_INDEX_FACENET
-    global FAISS_IDS_INSIGHTFACE, FAISS_IDS_FACENET, FAISS_INDEX_DIRTY
+    """Build one FAISS index per registered model from the embedding cache."""
+    global FAISS_INDEX_DIRTY, _NEXT_LABEL
 
     print("\n" + "=" * 60)
-    print("BUILDING DUAL FAISS INDEXES (InsightFace + Facenet)")
+    print(f"BUILDING FAISS INDEXES ({' + '.join(spec.label for spec in MODEL_REGISTRY.values())})")
     print("=" * 60)
 
-    try:
-        if len(EMBEDDING_CACHE) == 0:
-            print("[WARNING] No embeddings in cache, skipping FAISS index build")
-            FAISS_INDEX_DIRTY = False
+    with _INDEX_LOCK:
+        try:
+            epoch = _CACHE_EPOCH
+            _new_label_space()
+
+            cids, matrices = EMBEDDING_CACHE.export()
+            if not cids:
+                print("[WARNING] No embeddings in cache, skipping FAISS index build")
+                _publish(IndexSnapshot())
+                FAISS_INDEX_DIRTY = _CACHE_EPOCH != epoch
+                return
+
+            # Labels follow store rows, so the store matrices feed FAISS directly
+            _NEXT_LABEL = len(cids)
+            labels = {cid: label for label, cid in enumerate(cids)}
+            _install_indexes(_build_indexes(cids, np.arange(len(cids)), matrices), labels)
+            # set_cached_embedding() does not take the lock; stay dirty if it ran meanwhile
+            FAISS_INDEX_DIRTY = _CACHE_EPOCH != epoch
+            print("=" * 60 + "\n")
+
+        except Exception as e:
+            print(f"[ERROR] FAISS dual index build failed: {e}")
+            traceback.print_exc()
+            _publish(IndexSnapshot())
+            FAISS_INDEX_DIRTY = True
+
+
+def rebuild_faiss_index_background():
+    """
+    Rebuild (and retrain) the main indexes off the request path, keeping labels.
+
+    The new indexes are built from the published snapshot without holding
+    the lock; writes that land meanwhile go into fresh deltas before the swap.
+    The build is discarded if the label space was replaced meanwhile (full
+    build, snapshot load or shared-gallery attach renumber labels).
+    """
+    with _INDEX_LOCK:
+        if FAISS_INDEX_DIRTY:
+            return
+        label_epoch = _LABEL_EPOCH
+        live = FAISS_SNAPSHOT.labels
+        cids, matrices = EMBEDDING_CACHE.export(list(live))
+        labels = np.array([live[cid] for cid in cids], dtype=np.int64)
+
+    print(f"  [FAISS] Background rebuild started ({len(cids)} vectors)")
+    built = _build_indexes(cids, labels, matrices)
+    rebuilt = set(labels.tolist())
+
+    with _INDEX_LOCK:
+        if FAISS_INDEX_DIRTY:
+            return   # a full rebuild superseded this one
+        if _LABEL_EPOCH != label_epoch:
+            print("  [FAISS] Background rebuild discarded: labels were renumbered while it ran")
             return
 
-        ins_embs, ins_ids   = [], []
-        face_embs, face_ids = [], []
-
-        for cid in sorted(EMBEDDING_CACHE.keys()):
-            entry = EMBEDDING_CACHE[cid]
-            ins  = entry.get("insightface")
-            face = entry.get("facenet")
-
-            if ins is not None:
-                ins_embs.append(np.array(ins, dtype=np.float32))
-                ins_ids.append(cid)
-            else:
-                print(f"  [WARN] {cid}: InsightFace embedding missing — skipped from InsightFace index")
-
-            if face is not None:
-                face_embs.append(np.array(face, dtype=np.float32))
-                face_ids.append(cid)
-            else:
-                print(f"  [WARN] {cid}: Facenet embedding missing — skipped from Facenet index")
-
-        # InsightFace index
-        if ins_embs:
-            FAISS_INDEX_INSIGHTFACE = _build_index_from_embeddings(ins_embs)
-            FAISS_IDS_INSIGHTFACE   = ins_ids
-            print(f"  [OK] InsightFace index: {FAISS_INDEX_INSIGHTFACE.ntotal} vectors")
-        else:
-            FAISS_INDEX_INSIGHTFACE = None
-            FAISS_IDS_INSIGHTFACE   = []
-            print("  [WARN] InsightFace index: no valid embeddings")
-
-        # Facenet index
-        if face_embs:
-            FAISS_INDEX_FACENET = _build_index_from_embeddings(face_embs)
-            FAISS_IDS_FACENET   = face_ids
-            print(f"  [OK] Facenet index: {FAISS_INDEX_FACENET.ntotal} vectors")
+        # Replay writes that happened while building
+        current = FAISS_SNAPSHOT
+        deltas: Dict[str, Tuple[faiss.Index, ...]] = {}
+        for label, cid in current.id_map.items():
+            if label in rebuilt:
+                continue
+            _delta_add(deltas, label, EMBEDDING_CACHE.get(cid, {}))
+
+        tombstones = {label for label in rebuilt if label not in current.id_map}
+        _install_indexes(built, current.labels, tombstones, deltas)
+
+    print("  [FAISS] Background rebuild complete")
+
+
+def _rebuild_worker():
+    try:
+        with _INDEX_LOCK:
+            dirty = FAISS_INDEX_DIRTY
+        if dirty:
+            build_faiss_index()
         else:
-            FAISS_INDEX_FACENET = None
-            FAISS_IDS_FACENET   = []
-            print("  [WARN] Facenet index: no valid embeddings")
+            rebuild_faiss_index_background()
+    except Exception as e:
+        print(f"[ERROR] FAISS background rebuild failed: {e}")
+        traceback.print_exc()
+
+
+def _maybe_schedule_rebuild(force: bool = False):
+    """Retrain / merge deltas in the background when the main indexes fall behind."""
+    global _REBUILD_THREAD
+
+    if not force:
+        snap = FAISS_SNAPSHOT
+        live = len(snap.id_map)
+        kind_changed = _resolve_layout(live) != (snap.kind, snap.compression)
+        # Trained quantizers (IVF centroids, SQ ranges, PQ codebooks) go stale as the gallery grows
+        trained  = snap.kind == "ivf" or snap.compression in ("sq8", "pq")
+        outgrown = trained and live >= FAISS_RETRAIN_GROWTH * max(snap.trained_size, 1)
+        delta_full = snap.delta_size() >= FAISS_DELTA_MAX
+        if not (kind_changed or outgrown or delta_full):
+            return
+    if _REBUILD_THREAD is not None and _REBUILD_THREAD.is_alive():
+        return
+
+    _REBUILD_THREAD = threading.Thread(
+        target=_rebuild_worker, name="faiss-rebuild", daemon=True
+    )
+    _REBUILD_THREAD.start()
 
-        FAISS_INDEX_DIRTY = False
-        print("=" * 60 + "\n")
 
+# ============================================================================
+# INCREMENTAL UPDATES
+# ============================================================================
+
+def _segment_vectors(segment) -> Tuple[np.ndarray, np.ndarray]:
+    """(vectors, labels) held by one exact delta segment."""
+    n = segment.ntotal
+    if n == 0:
+        return np.empty((0, segment.d), dtype=np.float32), np.empty(0, dtype=np.int64)
+    vectors = faiss.downcast_index(segment.index).reconstruct_n(0, n)
+    return vectors, faiss.vector_to_array(segment.id_map).astype(np.int64)
+
+
+def _merge_segments(segments) -> faiss.Index:
+    """One new exact index holding every vector of `segments` (inputs untouched)."""
+    merged = _new_index(segments[0].d)
+    for segment in segments:
+        vectors, ids = _segment_vectors(segment)
+        if len(ids):
+            merged.add_with_ids(vectors, ids)
+    return merged
+
+
+def _append_segment(segments: tuple, vec: np.ndarray, label: int) -> tuple:
+    """
+    segments plus one vector, without touching the published segments.
+
+    The vector lands in a new 1-row segment; trailing segments are then
+    merged while the older one is no larger (binary-counter LSM), so a model
+    keeps O(log n) segments and each vector is copied O(log n) times in all.
+    """
+    segment = _new_index(vec.shape[1])
+    segment.add_with_ids(vec, np.array([label], dtype=np.int64))
+    out = list(segments) + [segment]
+    while len(out) >= 2 and out[-2].ntotal <= out[-1].ntotal:
+        out[-2:] = [_merge_segments(out[-2:])]
+    return tuple(out)
+
+
+def _delta_add(deltas: Dict[str, tuple], label: int, entry: dict):
+    """Append one label's {model: vector} to the (unpublished) delta map."""
+    for model in _active_models():
+        vec = _model_vector(model, entry)
+        if vec is None:
+            continue
+        deltas[model] = _append_segment(deltas.get(model, ()), vec, label)
+
+
+class _SnapshotWriter:
+    """
+    Copy-on-write edit of the published snapshot (caller holds _INDEX_LOCK).
+
+    Label maps are copied; delta segments are shared and only appended to
+    (published segments are never written). The main indexes are shared
+    untouched. publish() swaps the result in.
+    """
+
+    def __init__(self, base: IndexSnapshot):
+        self.base       = base
+        self.id_map     = dict(base.id_map)
+        self.labels     = dict(base.labels)
+        self.tombstones = set(base.tombstones)
+        self.deltas     = None
+
+    def retire(self, criminal_id: str) -> Optional[int]:
+        """Tombstone criminal_id's current label, if any."""
+        label = self.labels.pop(criminal_id, None)
+        if label is not None:
+            self.id_map.pop(label, None)
+            self.tombstones.add(label)
+        return label
+
+    def add(self, criminal_id: str, entry: dict) -> int:
+        """Index criminal_id under a fresh label, tombstoning any previous one."""
+        global _NEXT_LABEL
+
+        if self.deltas is None:
+            self.deltas = dict(self.base.deltas)
+        self.retire(criminal_id)
+        label = _NEXT_LABEL
+        _NEXT_LABEL += 1
+        self.labels[criminal_id] = label
+        self.id_map[label] = criminal_id
+        _delta_add(self.deltas, label, entry)
+        return label
+
+    def publish(self):
+        _publish(self.base.replace(
+            id_map=self.id_map,
+            labels=self.labels,
+            tombstones=frozenset(self.tombstones),
+            deltas=self.deltas if self.deltas is not None else self.base.deltas,
+        ))
+
+
+def add_embedding(
+    criminal_id: str,
+    insightface_embedding: np.ndarray,
+    facenet_embedding: np.ndarray = None,
+    **embeddings: np.ndarray,
+):
+    """
+    Cache a criminal's embeddings and make them searchable without a rebuild.
+
+    Re-adding an existing criminal_id replaces its vectors (the old label is
+    tombstoned). If a full rebuild is already pending, the vectors are only
+    cached and picked up by that rebuild.
+    """
+    global _CACHE_EPOCH
+
+    _touch(criminal_id)
+    with _INDEX_LOCK:
+        EMBEDDING_CACHE.put(criminal_id, insightface_embedding, facenet_embedding, **embeddings)
+        _CACHE_EPOCH += 1
+        if FAISS_INDEX_DIRTY:
+            return
+        writer = _SnapshotWriter(FAISS_SNAPSHOT)
+        label  = writer.add(criminal_id, EMBEDDING_CACHE.get(criminal_id))
+        writer.publish()
+
+    print(f"  [FAISS] Added {criminal_id} (label={label})")
+    _maybe_schedule_compaction()
+    _maybe_schedule_rebuild()
+
+
+def remove_embedding(criminal_id: str) -> bool:
+    """
+    Evict a criminal from the cache and make it unsearchable immediately.
+
+    The label is dropped from the id map so search results skip it; the
+    vectors stay in the indexes until compaction. Returns True if anything
+    was removed.
+    """
+    global _CACHE_EPOCH
+
+    _touch(criminal_id)
+    with _INDEX_LOCK:
+        writer = _SnapshotWriter(FAISS_SNAPSHOT)
+        label  = writer.retire(criminal_id)
+        if label is not None:
+            writer.publish()
+        cached = EMBEDDING_CACHE.pop(criminal_id, None)
+        _CACHE_EPOCH += 1
+        filter_service.remove_criminal_attributes(criminal_id)
+
+    if cached is None and label is None:
+        return False
+
+    print(f"  [FAISS] Removed {criminal_id} (tombstones={len(FAISS_SNAPSHOT.tombstones)})")
+    _maybe_schedule_compaction()
+    return True
+
+
+def _purged_copy(index, dead: np.ndarray):
+    """In-memory copy of a published index without the dead labels."""
+    index = faiss.clone_index(index)
+    index.remove_ids(dead)
+    _apply_search_params(index)
+    return index
+
+
+def compact_faiss_index() -> int:
+    """Physically remove tombstoned vectors from every index. Returns labels purged."""
+    with _INDEX_LOCK:
+        snap = FAISS_SNAPSHOT
+        if not snap.tombstones:
+            return 0
+        dead_count = len(snap.tombstones)
+        if snap.kind != "hnsw":
+            # Published indexes are never edited: purge copies and swap them in
+            dead = np.array(sorted(snap.tombstones), dtype=np.int64)
+            _publish(snap.replace(
+                indexes={model: _purged_copy(index, dead) for model, index in snap.indexes.items()},
+                deltas={
+                    model: (_purged_copy(_merge_segments(segments), dead),)
+                    for model, segments in snap.deltas.items() if segments
+                },
+                tombstones=frozenset(),
+                mmapped=False,
+            ))
+            print(f"  [FAISS] Compaction purged {dead_count} tombstoned label(s)")
+            return dead_count
+
+    # HNSW graphs (flat or SQ) do not support removal — rebuild without the dead labels
+    rebuild_faiss_index_background()
+    print(f"  [FAISS] Compaction rebuilt HNSW index, purged {dead_count} tombstoned label(s)")
+    return dead_count
+
+
+def _compaction_worker():
+    try:
+        compact_faiss_index()
     except Exception as e:
-        print(f"[ERROR] FAISS dual index build failed: {e}")
+        print(f"[ERROR] FAISS compaction failed: {e}")
         traceback.print_exc()
-        FAISS_INDEX_INSIGHTFACE = None
-        FAISS_INDEX_FACENET     = None
-        FAISS_IDS_INSIGHTFACE   = []
-        FAISS_IDS_FACENET       = []
-        FAISS_INDEX_DIRTY       = True
 
 
-def is_faiss_index_ready() -> bool:
-    return (
-        not FAISS_INDEX_DIRTY
-        and (FAISS_INDEX_INSIGHTFACE is not None or FAISS_INDEX_FACENET is not None)
+def _maybe_schedule_compaction():
+    """Start a background compaction once enough tombstones have piled up."""
+    global _COMPACTION_THREAD
+
+    snap = FAISS_SNAPSHOT
+    total = max([snap.ntotal(model) for model in EMBEDDING_MODELS + ("joint",)] + [1])
+    dead = len(snap.tombstones)
+    if dead < COMPACTION_MIN_TOMBSTONES or dead / total < COMPACTION_RATIO:
+        return
+    if _COMPACTION_THREAD is not None and _COMPACTION_THREAD.is_alive():
+        return
+
+    _COMPACTION_THREAD = threading.Thread(
+        target=_compaction_worker, name="faiss-compaction", daemon=True
     )
+    _COMPACTION_THREAD.start()
+
+
+def get_index_snapshot() -> IndexSnapshot:
+    """The currently published snapshot (safe to hold and search without locking)."""
+    return FAISS_SNAPSHOT
+
+
+def is_faiss_index_ready() -> bool:
+    return not FAISS_INDEX_DIRTY and FAISS_SNAPSHOT.is_searchable()
 
 
 def get_faiss_index_stats() -> dict:
+    snap = FAISS_SNAPSHOT
     return {
-        "is_ready":            is_faiss_index_ready(),
+        "is_ready":            not FAISS_INDEX_DIRTY and snap.is_searchable(),
         "is_dirty":            FAISS_INDEX_DIRTY,
-        "insightface_vectors": FAISS_INDEX_INSIGHTFACE.ntotal if FAISS_INDEX_INSIGHTFACE else 0,
-        "facenet_vectors":     FAISS_INDEX_FACENET.ntotal if FAISS_INDEX_FACENET else 0,
-        "criminal_ids_count":  len(set(FAISS_IDS_INSIGHTFACE) | set(FAISS_IDS_FACENET)),
+        "insightface_vectors": snap.ntotal("insightface"),
+        "facenet_vectors":     snap.ntotal("facenet"),
+        "joint_vectors":       snap.ntotal("joint"),
+        "models":              {model: snap.ntotal(model) for model in EMBEDDING_MODELS},
+        "joint_mode":          FAISS_JOINT_INDEX,
+        "criminal_ids_count":  len(snap.id_map),
+        "tombstones":          len(snap.tombstones),
+        "delta_vectors":       snap.delta_size(),
+        "generation":          snap.generation,
+        "index_type":          snap.kind,
+        "compression":         snap.compression,
+        "nprobe":              FAISS_IVF_NPROBE,
+        "ef_search":           FAISS_HNSW_EF_SEARCH,
+        "recall_at_k":         dict(snap.recall),
+        "mmapped":             snap.mmapped,
         "cache_size":          len(EMBEDDING_CACHE),
+        "embedding_store":     EMBEDDING_CACHE.memory_stats(),
         "synchronized":        not FAISS_INDEX_DIRTY,
     }
 
 
+# ============================================================================
+# SNAPSHOT SUPPORT
+# ============================================================================
+# What snapshot_service needs to persist the index and install it again.
+
+def index_lock() -> threading.RLock:
+    """The writer lock (re-created after fork, so fetch it per use)."""
+    return _INDEX_LOCK
+
+
+def get_next_label() -> int:
+    return _NEXT_LABEL
+
+
+def install_snapshot_indexes(
+    built: dict,
+    labels: Dict[str, int],
+    tombstones: Set[int],
+    deltas: Dict[str, Tuple[faiss.Index, ...]],
+    next_label: int,
+):
+    """
+    Publish indexes read back from a snapshot as a fresh label space and
+    mark the index clean (caller holds _INDEX_LOCK).
+    """
+    global FAISS_INDEX_DIRTY, _NEXT_LABEL
+
+    _new_label_space()
+    _NEXT_LABEL = next_label
+    for model in EMBEDDING_MODELS + ("joint",):
+        if built.get(model) is not None:
+            _apply_search_params(built[model])
+    _install_indexes(built, labels, tombstones, deltas)
+    FAISS_INDEX_DIRTY = False
+
+
+def reindex_criminals(criminal_ids: Iterable[str], removed_ids: Iterable[str] = ()):
+    """
+    Re-index cached criminals under fresh labels and drop removed ones, in
+    one publish (caller holds _INDEX_LOCK); used to replay the difference
+    between a loaded snapshot and EMBEDDING_CACHE.
+    """
+    writer = _SnapshotWriter(FAISS_SNAPSHOT)
+    for cid in removed_ids:
+        writer.retire(cid)
+    for cid in criminal_ids:
+        writer.add(cid, EMBEDDING_CACHE[cid])
+    writer.publish()
+
+
+def attach_embedding_store(ids: List[str], matrices: Dict[str, Tuple[np.ndarray, np.ndarray]]):
+    """Serve snapshot matrices as EMBEDDING_CACHE (caller holds _INDEX_LOCK)."""
+    global _CACHE_EPOCH
+    EMBEDDING_CACHE.attach(ids, matrices)
+    _CACHE_EPOCH += 1
+
+
 # ============================================================================
 # SINGLE-INDEX SEARCH HELPER
 # ============================================================================
 
-def _search_single_index(
-    index: faiss.IndexFlatIP,
-    id_list: List[str],
-    query: np.ndarray,
+def _search_params(index, selector):
+    """SearchParameters of the right subclass carrying the id selector."""
+    base = _search_base(index)
+    if isinstance(base, faiss.IndexIVF):
+        params = faiss.SearchParametersIVF()
+        params.nprobe = FAISS_IVF_NPROBE
+    elif isinstance(base, faiss.IndexHNSW):
+        params = faiss.SearchParametersHNSW()
+        params.efSearch = FAISS_HNSW_EF_SEARCH
+    else:
+        params = faiss.SearchParameters()
+    params.sel = selector
+    return params
+
+
+def _rescore_exact(results: List[dict], q: np.ndarray, model_label: str) -> List[dict]:
+    """Replace approximate scores with exact cosine against the cached float32 vectors."""
+    spec = MODEL_REGISTRY[model_label]
+    for r in results:
+        vec = EMBEDDING_CACHE.get(r["criminal_id"], {}).get(model_label)
+        if vec is None:
+            continue
+        vec = np.asarray(vec, dtype=np.float32)
+        n   = np.linalg.norm(vec)
+        raw = float(np.dot(q, vec) / n) if n > 0 else 0.0
+        r["raw_score"] = raw
+        r["cal_score"] = spec.calibrate(raw)
+    results.sort(key=lambda r: r["raw_score"], reverse=True)
+    return results
+
+
+def _snapshot_search(
+    snap: IndexSnapshot,
+    model: str,
+    q: np.ndarray,
+    k: int,
+    selector=None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """k-NN over one model's main index and delta, merged best-first."""
+    found = []
+    for index in snap.parts(model):
+        if index.ntotal == 0:
+            continue
+        params = _search_params(index, selector) if selector is not None else None
+        found.append(index.search(q, min(k, index.ntotal), params=params))
+    if not found:
+        return np.empty((q.shape[0], 0), dtype=np.float32), np.empty((q.shape[0], 0), dtype=np.int64)
+    if len(found) == 1:
+        return found[0]
+
+    dists  = np.hstack([d for d, _ in found])
+    labels = np.hstack([l for _, l in found])
+    order  = np.argsort(-dists, axis=1, kind="stable")[:, :k]
+    return np.take_along_axis(dists, order, axis=1), np.take_along_axis(labels, order, axis=1)
+
+
+def _search_index_batch(
+    snap: IndexSnapshot,
+    queries: np.ndarray,
     top_k: int,
     model_label: str,
-) -> List[dict]:
-    """Search one FAISS index, return calibrated candidates."""
-    q = query.reshape(1, -1).astype(np.float32)
-    n = np.linalg.norm(q)
-    if n > 0:
-        q = q / n
+    selector=None,
+    selected: int = None,
+) -> List[List[dict]]:
+    """
+    Search one model's indexes with an (N, d) query matrix in a single call.
 
-    k = min(top_k, len(id_list))
-    dists, idxs = index.search(q, k)
-    dists = dists[0]
-    idxs  = idxs[0]
+    selector restricts the scan to `selected` labels (tombstones excluded).
+    """
+    q = _normalize_rows(np.atleast_2d(np.asarray(queries, dtype=np.float32)))
 
-    results = []
-    for idx, raw_dist in zip(idxs, dists):
-        if 0 <= idx < len(id_list):
-            cal = _calibrate(raw_dist)
+    # Compressed codes only rank approximately: over-fetch, then re-score exactly
+    compressed = snap.compression != "none"
+    want = top_k * FAISS_RESCORE_FACTOR if compressed else top_k
+
+    # Over-fetch by the tombstone count so removed labels never shrink the result
+    total = snap.ntotal(model_label)
+    if selector is None:
+        k = min(want + len(snap.tombstones), total)
+    else:
+        k = min(want, selected, total)
+    if k <= 0:
+        return [[] for _ in range(q.shape[0])]
+    dists, labels = _snapshot_search(snap, model_label, q, k, selector)
+    cal = MODEL_REGISTRY[model_label].calibrate(dists)
+
+    batch = []
+    for row in range(q.shape[0]):
+        results = []
+        for label, raw_dist, cal_score in zip(labels[row], dists[row], cal[row]):
+            if label < 0:
+                continue
+            cid = snap.id_map.get(int(label))
+            if cid is None:
+                continue
             results.append({
-                "criminal_id":  id_list[idx],
+                "criminal_id":  cid,
                 "raw_score":    float(raw_dist),
-                "cal_score":    cal,
+                "cal_score":    float(cal_score),
                 "source_model": model_label,
             })
-    return results
+            if len(results) >= want:
+                break
+
+        if compressed:
+            results = _rescore_exact(results, q[row], model_label)
+        batch.append(results[:top_k])
+    return batch
+
+
+def _search_single_index(
+    snap: IndexSnapshot,
+    query: np.ndarray,
+    top_k: int,
+    model_label: str,
+    selector=None,
+    selected: int = None,
+) -> List[dict]:
+    """Search one model's indexes, return calibrated candidates (tombstones skipped)."""
+    return _search_index_batch(snap, query.reshape(1, -1), top_k, model_label, selector, selected)[0]
+
+
+def _fused_score(similarities: dict, weights: Dict[str, float]) -> float:
+    """
+    Weighted sum of {"<model>_similarity": calibrated score} over the
+    registry; a missing (None) score counts as the neutral 0.5, clamped.
+    """
+    fused = 0.0
+    for model, spec in MODEL_REGISTRY.items():
+        score = similarities.get(f"{model}_similarity")
+        fused += weights[model] * spec.cap(0.5 if score is None else score)
+    return fused
+
+
+def _fuse_candidates(
+    per_model: Dict[str, List[dict]],
+    top_k: int,
+    weights: Dict[str, float],
+) -> Tuple[List[dict], int]:
+    """
+    Union the per-model lists and fuse; returns (top_k, unique count).
+
+    A model that did not retrieve a criminal scores the neutral 0.5 there
+    and reports None for "<model>_similarity".
+    """
+    # Build per-criminal score maps
+    maps = {
+        model: {r["criminal_id"]: r["cal_score"] for r in results}
+        for model, results in per_model.items()
+    }
+
+    # Union of all candidates
+    all_ids = set().union(*maps.values())
+
+    candidates = []
+    for cid in all_ids:
+        candidate = {"criminal_id": cid}
+        for model, spec in MODEL_REGISTRY.items():
+            score = maps.get(model, {}).get(cid)
+            candidate[f"{model}_similarity"] = None if score is None else spec.cap(score)
+        candidate["embedding_fusion"] = _fused_score(candidate, weights)
+        candidates.append(candidate)
+
+    candidates.sort(key=lambda x: x["embedding_fusion"], reverse=True)
+    return candidates[:top_k], len(all_ids)
+
+
+def _exact_fused_scores(
+    cid: str,
+    queries: Dict[str, np.ndarray],
+    weights: Dict[str, float],
+) -> Optional[dict]:
+    """Exact calibrated + clamped fusion for one cached criminal ({model: query})."""
+    cached = EMBEDDING_CACHE.get(cid)
+    if cached is None:
+        return None
+
+    result = {"criminal_id": cid}
+    for model, spec in MODEL_REGISTRY.items():
+        vec, query = cached.get(model), queries.get(model)
+        score = 0.5   # neutral calibrated score if missing
+        if vec is not None and query is not None:
+            score = spec.cap(spec.calibrate(cosine_similarity(query, vec)))
+        result[f"{model}_similarity"] = score if vec is not None else None
+    result["embedding_fusion"] = _fused_score(result, weights)
+    return result
+
+
+def _search_joint_index_batch(
+    snap: IndexSnapshot,
+    queries: List[Dict[str, np.ndarray]],
+    top_k: int,
+    weights: List[Dict[str, float]],
+    selector=None,
+    selected: int = None,
+) -> List[List[dict]]:
+    """Weighted-cosine search of N {model: query} maps over the joint index in one call."""
+    n = len(weights)
+    rows = [
+        _joint_vector(
+            queries[i].get("insightface"), queries[i].get("facenet"),
+            weights[i]["insightface"], weights[i]["facenet"],
+        )
+        for i in range(n)
+    ]
+    valid = [i for i, row in enumerate(rows) if row is not None]
+    batch: List[List[dict]] = [[] for _ in range(n)]
+
+    # Over-fetch: the Facenet clamp and compression can reorder the tail
+    want = top_k * FAISS_RESCORE_FACTOR
+    total = snap.ntotal("joint")
+    if selector is None:
+        k = min(want + len(snap.tombstones), total)
+    else:
+        k = min(want, selected, total)
+    if k <= 0 or not valid:
+        return batch
+    q = np.vstack([rows[i] for i in valid]).astype(np.float32)
+    _, labels = _snapshot_search(snap, "joint", q, k, selector)
+
+    for row, i in enumerate(valid):
+        candidates = []
+        for label in labels[row]:
+            cid = snap.id_map.get(int(label)) if label >= 0 else None
+            if cid is None:
+                continue
+            scored = _exact_fused_scores(cid, queries[i], weights[i])
+            if scored is not None:
+                candidates.append(scored)
+            if len(candidates) >= want:
+                break
+        candidates.sort(key=lambda x: x["embedding_fusion"], reverse=True)
+        batch[i] = candidates[:top_k]
+    return batch
+
+
+def _search_joint_index(
+    snap: IndexSnapshot,
+    queries: Dict[str, np.ndarray],
+    top_k: int,
+    weights: Dict[str, float],
+    selector=None,
+    selected: int = None,
+) -> List[dict]:
+    """One weighted-cosine search over the joint index, shortlist re-scored exactly."""
+    return _search_joint_index_batch(snap, [queries], top_k, [weights], selector, selected)[0]
 
 
 # ============================================================================
-# DUAL FAISS SEARCH
+# MULTI-MODEL FAISS SEARCH
 # ============================================================================
 
+_SCAN_POOL: Optional[ThreadPoolExecutor] = None
+_SCAN_POOL_LOCK = threading.Lock()
+
+
+def _scan_models(scan, models: List[str]) -> dict:
+    """
+    {model: scan(model)} for the given models. With several models the scans
+    run concurrently on a shared pool — FAISS releases the GIL while it
+    searches, so the per-query latency is the slowest scan, not the sum.
+    """
+    global _SCAN_POOL
+
+    if len(models) < 2 or FAISS_SCAN_WORKERS < 2:
+        return {model: scan(model) for model in models}
+    with _SCAN_POOL_LOCK:
+        if _SCAN_POOL is None:
+            _SCAN_POOL = ThreadPoolExecutor(max_workers=FAISS_SCAN_WORKERS, thread_name_prefix="faiss-scan")
+        pool = _SCAN_POOL
+    futures = {model: pool.submit(scan, model) for model in models}
+    return {model: future.result() for model, future in futures.items()}
+
+
+def _query_map(
+    query_insightface: np.ndarray,
+    query_facenet: np.ndarray,
+    extra_queries: Dict[str, np.ndarray] = None,
+) -> Dict[str, np.ndarray]:
+    """{model: query vector} for the registered models the query has a vector for."""
+    queries = {"insightface": query_insightface, "facenet": query_facenet, **(extra_queries or {})}
+    return {model: q for model, q in queries.items() if q is not None and model in MODEL_REGISTRY}
+
+
+def _format_weights(weights: Dict[str, float]) -> str:
+    return ", ".join(f"{MODEL_REGISTRY[model].label}={w:.2f}" for model, w in weights.items())
+
+
+def _print_fused(top: List[dict]):
+    for i, c in enumerate(top, 1):
+        scores = ", ".join(
+            f"{model}={c[f'{model}_similarity']:.4f}" if c[f"{model}_similarity"] is not None else f"{model}=N/A"
+            for model in MODEL_REGISTRY
+        )
+        print(f"    {i}. {c['criminal_id']}: fused={c['embedding_fusion']:.4f} ({scores})")
+
+
+def _ensure_index_built() -> Optional[IndexSnapshot]:
+    """
+    Snapshot to search, or None. A dirty index is rebuilt in the background;
+    until it is published, searches keep using the previous snapshot.
+    """
+    if _BEFORE_SEARCH is not None:
+        _BEFORE_SEARCH()
+    if FAISS_INDEX_DIRTY:
+        print("  [AUTO-REBUILD] FAISS index is dirty, rebuilding in the background...")
+        _maybe_schedule_rebuild(force=True)
+
+    snap = FAISS_SNAPSHOT
+    if not snap.is_searchable():
+        print("  FAISS index not available")
+        return None
+    return snap
+
+
 def search_faiss_index(
     query_insightface: np.ndarray,
     query_facenet: np.ndarray = None,
     top_k: int = 10,
     is_sketch: bool = False,
+    allowed_ids: Set[str] = None,
+    extra_queries: Dict[str, np.ndarray] = None,
 ) -> Tuple[bool, List[dict]]:
     """
-    Dual-index FAISS search.
+    Multi-index FAISS search over every registered model with a query vector
+    (extra_queries: {model: vector} for models beyond InsightFace / Facenet).
 
-    Strategy:
+    Each model's index is scanned concurrently for 2·top_k candidates and the
+    lists are fused with the models' domain weights (see MODEL_REGISTRY):
       - Sketch: Facenet primary (weight 0.9), InsightFace secondary (weight 0.1)
       - Photo:  InsightFace primary (weight 0.5), Facenet secondary (weight 0.5)
 
+    allowed_ids (from compile_filter) restricts the scan via an IDSelector.
     Returns merged, deduplicated, fused-score candidates sorted best-first.
     """
-    global FAISS_INDEX_DIRTY
-
-    if FAISS_INDEX_DIRTY:
-        print("  [AUTO-REBUILD] FAISS index is dirty, rebuilding...")
-        build_faiss_index()
-
-    if not is_faiss_index_ready():
-        print("  FAISS index not available")
+    snap = _ensure_index_built()
+    if snap is None:
         return False, []
 
+    selector, selected = None, None
+    if allowed_ids is not None:
+        labels = np.array(
+            [snap.labels[cid] for cid in allowed_ids if cid in snap.labels], dtype=np.int64
+        )
+        selector, selected = faiss.IDSelectorBatch(labels), len(labels)
+        print(f"  Filter selects {selected} criminals")
+
     # Adaptive weights
-    if is_sketch:
-        w_face = 0.9
-        w_ins  = 0.1
-    else:
-        w_face = 0.5
-        w_ins  = 0.5
+    weights = model_weights(is_sketch)
+    queries = _query_map(query_insightface, query_facenet, extra_queries)
+
+    joint = snap.has("joint")
+    print(f"  FAISS {'joint' if joint else 'multi-index'} search: "
+          f"{len(snap.id_map)} criminals, Top-{top_k}, is_sketch={is_sketch}")
+    print(f"  Weights: {_format_weights(weights)}")
 
-    print(f"  FAISS dual search: {len(set(FAISS_IDS_INSIGHTFACE) | set(FAISS_IDS_FACENET))} criminals, "
-          f"Top-{top_k}, is_sketch={is_sketch}")
-    print(f"  Weights: InsightFace={w_ins:.2f}, Facenet={w_face:.2f}")
+    if joint:
+        top = _search_joint_index(snap, queries, top_k, weights, selector, selected)
+        print(f"  [OK] Joint search: Top-{len(top)} selected")
+        _print_fused(top)
+        return True, top
 
     # Retrieve from each index
-    ins_results  = []
-    face_results = []
+    per_model = _scan_models(
+        lambda model: _search_single_index(snap, queries[model], top_k * 2, model, selector, selected),
+        [model for model in queries if snap.has(model)],
+    )
+    for model, results in per_model.items():
+        if results:
+            print(f"  {MODEL_REGISTRY[model].label} top scores: {[round(r['cal_score'], 3) for r in results[:5]]}")
 
-    if FAISS_INDEX_INSIGHTFACE is not None and query_insightface is not None:
-        ins_results = _search_single_index(
-            FAISS_INDEX_INSIGHTFACE, FAISS_IDS_INSIGHTFACE,
-            query_insightface, top_k * 2, "insightface"
-        )
-        print(f"  InsightFace top scores: {[round(r['cal_score'], 3) for r in ins_results[:5]]}")
+    top, unique = _fuse_candidates(per_model, top_k, weights)
 
-    if FAISS_INDEX_FACENET is not None and query_facenet is not None:
-        face_results = _search_single_index(
-            FAISS_INDEX_FACENET, FAISS_IDS_FACENET,
-            query_facenet, top_k * 2, "facenet"
-        )
-        print(f"  Facenet top scores: {[round(r['cal_score'], 3) for r in face_results[:5]]}")
+    print(f"  [OK] Merged {unique} unique candidates, Top-{len(top)} selected")
+    _print_fused(top)
+    return True, top
 
-    # Build per-criminal score maps
-    ins_map  = {r["criminal_id"]: r["cal_score"] for r in ins_results}
-    face_map = {r["criminal_id"]: r["cal_score"] for r in face_results}
 
-    # Union of all candidates
-    all_ids = set(ins_map.keys()) | set(face_map.keys())
+def _as_query_rows(queries, n: int) -> List[Optional[np.ndarray]]:
+    """Split an (N, d) matrix / list of vectors into N rows (None allowed)."""
+    if queries is None:
+        return [None] * n
+    return [None if q is None else np.asarray(q, dtype=np.float32).ravel() for q in queries]
 
-    candidates = []
-    for cid in all_ids:
-        s_ins  = ins_map.get(cid, 0.5)   # 0.5 = neutral calibrated score if missing
-        s_face = face_map.get(cid, 0.5)
 
-        # Clamp Facenet to max calibrated 0.875 (raw 0.75 -> cal 0.875)
-        s_face = min(s_face, 0.875)
+def _query_rows(
+    queries_insightface,
+    queries_facenet,
+    extra_queries: Dict[str, object] = None,
+) -> Tuple[int, Dict[str, List[Optional[np.ndarray]]]]:
+    """(N, {model: N query rows}) for the registered models of a query batch."""
+    matrices = {"insightface": queries_insightface, "facenet": queries_facenet, **(extra_queries or {})}
+    matrices = {model: m for model, m in matrices.items() if m is not None and model in MODEL_REGISTRY}
+    n = len(next(iter(matrices.values()))) if matrices else 0
+    return n, {model: _as_query_rows(m, n) for model, m in matrices.items()}
 
-        fused = w_ins * s_ins + w_face * s_face
 
-        candidates.append({
-            "criminal_id":            cid,
-            "insightface_similarity": s_ins,
-            "facenet_similarity":     s_face if cid in face_map else None,
-            "embedding_fusion":       fused,
-        })
+def _sketch_flags(is_sketch, n: int) -> List[bool]:
+    flags = list(is_sketch) if isinstance(is_sketch, (list, tuple, np.ndarray)) else [is_sketch] * n
+    return [bool(flag) for flag in flags]
 
-    candidates.sort(key=lambda x: x["embedding_fusion"], reverse=True)
-    top = candidates[:top_k]
 
-    print(f"  [OK] Merged {len(all_ids)} unique candidates, Top-{len(top)} selected")
-    for i, c in enumerate(top, 1):
-        face_str = f"{c['facenet_similarity']:.4f}" if c['facenet_similarity'] is not None else "N/A"
-        print(f"    {i}. {c['criminal_id']}: fused={c['embedding_fusion']:.4f} "
-              f"(ins={c['insightface_similarity']:.4f}, face={face_str})")
+def search_faiss_index_batch(
+    queries_insightface,
+    queries_facenet=None,
+    top_k: int = 10,
+    is_sketch=False,
+    extra_queries: Dict[str, object] = None,
+) -> Tuple[bool, List[List[dict]]]:
+    """
+    Batched multi-index FAISS search.
 
-    return True, top
+    queries_insightface / queries_facenet (and extra_queries values) are
+    (N, d) matrices or lists of N vectors, entries may be None; is_sketch is
+    one flag or N flags. Each index is searched once with the whole query
+    matrix so the scan is shared across queries, and the per-model scans
+    run concurrently. Returns one fused, best-first candidate list per query.
+    """
+    n, rows = _query_rows(queries_insightface, queries_facenet, extra_queries)
+    snap = _ensure_index_built()
+    if snap is None:
+        return False, []
+
+    weights = [model_weights(flag) for flag in _sketch_flags(is_sketch, n)]
+
+    print(f"  FAISS batch search: {n} queries, {len(snap.id_map)} criminals, Top-{top_k}")
+
+    if snap.has("joint"):
+        queries = [{model: model_rows[i] for model, model_rows in rows.items()} for i in range(n)]
+        return True, _search_joint_index_batch(snap, queries, top_k, weights)
+
+    def _batched(model):
+        """Per-query results; rows with a missing vector get an empty list."""
+        out = [[] for _ in range(n)]
+        present = [i for i, row in enumerate(rows[model]) if row is not None]
+        if not present:
+            return out
+        matrix = np.vstack([rows[model][i] for i in present])
+        for i, results in zip(present, _search_index_batch(snap, matrix, top_k * 2, model)):
+            out[i] = results
+        return out
+
+    per_model = _scan_models(_batched, [model for model in rows if snap.has(model)])
+
+    results = []
+    for i in range(n):
+        top, _ = _fuse_candidates(
+            {model: batch[i] for model, batch in per_model.items()}, top_k, weights[i]
+        )
+        results.append(top)
+
+    print(f"  [OK] Batch search: {sum(len(r) for r in results)} candidates across {n} queries")
+    return True, results
 
 
 # ============================================================================
 # LINEAR SEARCH (FALLBACK)
 # ============================================================================
 
+_LINEAR_GALLERY: Optional[Tuple[int, dict]] = None   # (cache epoch, matrices) for the exact fallback
+
+
+def _linear_gallery() -> dict:
+    """
+    Pre-normalised (N, d) matrix per model over EMBEDDING_CACHE.
+
+    Rebuilt from the store matrices only when _CACHE_EPOCH has moved; missing
+    vectors are zero rows flagged False in the per-model presence mask.
+    Published as one tuple so concurrent searches never see a half-built
+    matrix.
+    """
+    global _LINEAR_GALLERY
+
+    epoch  = _CACHE_EPOCH
+    cached = _LINEAR_GALLERY
+    if cached is not None and cached[0] == epoch:
+        return cached[1]
+
+    ids, matrices = EMBEDDING_CACHE.export()
+    gallery = {"ids": ids, "rows": {cid: row for row, cid in enumerate(ids)}}
+    for model in EMBEDDING_MODELS:
+        matrix, present = matrices[model]
+        gallery[model] = (_normalize_rows(matrix), np.array(present, dtype=bool))
+
+    _LINEAR_GALLERY = (epoch, gallery)
+    return gallery
+
+
+def _linear_model_scores(gallery: dict, model: str, query: np.ndarray, rows) -> Tuple[np.ndarray, np.ndarray]:
+    """(calibrated, clamped scores, presence mask) of one model for the selected rows."""
+    spec = MODEL_REGISTRY[model]
+    matrix, present = gallery[model]
+    if rows is not None:
+        matrix, present = matrix[rows], present[rows]
+    if query is None or matrix.shape[1] == 0:
+        return np.full(len(present), 0.5), present
+    q   = _normalize_rows(np.asarray(query, dtype=np.float32).reshape(1, -1))[0]
+    raw = (matrix @ q).astype(np.float64)
+    return spec.cap(np.where(present, spec.calibrate(raw), 0.5)), present
+
+
 def linear_search_embeddings(
     query_insightface: np.ndarray,
     query_facenet: np.ndarray = None,
     criminal_ids: List[str] = None,
     top_k: int = 10,
     is_sketch: bool = False,
+    extra_queries: Dict[str, np.ndarray] = None,
 ) -> List[dict]:
-    """Linear search fallback when FAISS is unavailable."""
-    if criminal_ids is None:
-        criminal_ids = list(EMBEDDING_CACHE.keys())
+    """
+    Exact search fallback when FAISS is unavailable (also used for narrow filters).
 
-    w_face = 0.9 if is_sketch else 0.5
-    w_ins  = 0.1 if is_sketch else 0.5
+    One matrix-vector product per registered model over the pre-normalised
+    gallery; calibration, clamps and fusion are vectorised and the top-k
+    comes from argpartition, so only the winners become dicts.
+    """
+    gallery = _linear_gallery()
+    rows = None
+    if criminal_ids is not None:
+        rows = np.array(
+            [gallery["rows"][cid] for cid in criminal_ids if cid in gallery["rows"]], dtype=np.int64
+        )
+    n = len(gallery["ids"]) if rows is None else len(rows)
 
-    print(f"  Linear search over {len(criminal_ids)} criminals "
-          f"(ins={w_ins:.2f}, face={w_face:.2f})...")
+    weights = model_weights(is_sketch)
+    queries = _query_map(query_insightface, query_facenet, extra_queries)
 
-    candidates = []
-    for cid in criminal_ids:
-        cached = EMBEDDING_CACHE.get(cid)
-        if cached is None:
-            continue
-        try:
-            s_ins  = 0.5
-            s_face = 0.5
-
-            if cached.get("insightface") is not None and query_insightface is not None:
-                raw   = cosine_similarity(query_insightface, cached["insightface"])
-                s_ins = _calibrate(raw)
-
-            if cached.get("facenet") is not None and query_facenet is not None:
-                raw    = cosine_similarity(query_facenet, cached["facenet"])
-                s_face = min(_calibrate(raw), 0.875)  # clamp
-
-            fused = w_ins * s_ins + w_face * s_face
-            candidates.append({
-                "criminal_id":            cid,
-                "insightface_similarity": s_ins,
-                "facenet_similarity":     s_face if cached.get("facenet") is not None else None,
-                "embedding_fusion":       fused,
-            })
-        except Exception as e:
-            print(f"  [ERROR] Comparing {cid}: {e}")
+    print(f"  Linear search over {n} criminals ({_format_weights(weights)})...")
 
-    candidates.sort(key=lambda x: x["embedding_fusion"], reverse=True)
-    top = candidates[:top_k]
+    scores = {}
+    fused  = np.zeros(n)
+    for model in MODEL_REGISTRY:
+        scores[model] = _linear_model_scores(gallery, model, queries.get(model), rows)
+        fused += weights[model] * scores[model][0]
+
+    k = min(top_k, n)
+    best = np.argpartition(-fused, k - 1)[:k] if 0 < k < n else np.arange(n)
+    best = best[np.argsort(-fused[best], kind="stable")][:k]
+
+    top = []
+    for i in best:
+        row = int(i) if rows is None else int(rows[i])
+        candidate = {"criminal_id": gallery["ids"][row]}
+        for model, (model_scores, present) in scores.items():
+            candidate[f"{model}_similarity"] = float(model_scores[i]) if present[i] else None
+        candidate["embedding_fusion"] = float(fused[i])
+        top.append(candidate)
 
-    print(f"  [OK] Linear search: {len(candidates)} evaluated, Top-{len(top)} selected")
+    print(f"  [OK] Linear search: {n} evaluated, Top-{len(top)} selected")
     for i, c in enumerate(top, 1):
         print(f"    {i}. {c['criminal_id']}: fused={c['embedding_fusion']:.4f}")
 
@@ -392,14 +1754,264 @@ def search_top_k_candidates(
     criminal_ids: List[str] = None,
     top_k: int = 10,
     is_sketch: bool = False,
+    filters: dict = None,
+    extra_queries: Dict[str, np.ndarray] = None,
 ) -> Tuple[List[dict], bool]:
-    """Search Top-K via FAISS (preferred) or linear search (fallback)."""
+    """
+    Search Top-K via FAISS (preferred) or linear search (fallback).
+
+    filters (see compile_filter) constrain retrieval itself. A filter that
+    selects at most FAISS_FILTER_BRUTE_FORCE criminals is scored exactly
+    over just those rows, so narrower filters are cheaper. extra_queries
+    carries {model: vector} for registered models beyond the built-in two.
+    """
+    allowed = filter_service.compile_filter(filters, EMBEDDING_CACHE)
+    if allowed is not None:
+        if criminal_ids is not None:
+            allowed &= set(criminal_ids)
+        if not allowed:
+            print("  Filter matches no criminals")
+            return [], False
+        if len(allowed) <= FAISS_FILTER_BRUTE_FORCE:
+            print(f"  Filter selects {len(allowed)} criminals — exact scan of the subset")
+            return linear_search_embeddings(
+                query_insightface, query_facenet, sorted(allowed), top_k, is_sketch, extra_queries
+            ), False
+
     success, candidates = search_faiss_index(
-        query_insightface, query_facenet, top_k, is_sketch
+        query_insightface, query_facenet, top_k, is_sketch, allowed, extra_queries
     )
     if success:
+        if allowed is not None and len(candidates) < min(top_k, len(allowed)):
+            # Probed lists / graph neighbourhood held too few matching rows
+            print("  Filtered FAISS search under-filled — exact scan of the subset")
+            return linear_search_embeddings(
+                query_insightface, query_facenet, sorted(allowed), top_k, is_sketch, extra_queries
+            ), False
         return candidates, True
+    if allowed is not None:
+        criminal_ids = sorted(allowed)
     candidates = linear_search_embeddings(
-        query_insightface, query_facenet, criminal_ids, top_k, is_sketch
+        query_insightface, query_facenet, criminal_ids, top_k, is_sketch, extra_queries
     )
     return candidates, False
+
+
+def search_top_k_candidates_batch(
+    queries_insightface,
+    queries_facenet=None,
+    criminal_ids: List[str] = None,
+    top_k: int = 10,
+    is_sketch=False,
+    extra_queries: Dict[str, object] = None,
+) -> Tuple[List[List[dict]], bool]:
+    """Batched search_top_k_candidates: one ranked list per query row."""
+    success, batch = search_faiss_index_batch(
+        queries_insightface, queries_facenet, top_k, is_sketch, extra_queries
+    )
+    if success:
+        return batch, True
+
+    n, rows = _query_rows(queries_insightface, queries_facenet, extra_queries)
+    flags = _sketch_flags(is_sketch, n)
+    batch = []
+    for i in range(n):
+        queries = {model: model_rows[i] for model, model_rows in rows.items()}
+        batch.append(linear_search_embeddings(
+            queries.pop("insightface", None), queries.pop("facenet", None),
+            criminal_ids, top_k, flags[i], queries,
+        ))
+    return batch, False
+
+
+def aggregate_batch_candidates(batch: List[List[dict]], top_k: int = 10) -> List[dict]:
+    """
+    Cross-query ranking for a batch of sketch variants of the same suspect.
+
+    A criminal's aggregate score is its mean fused score over all queries;
+    a query that did not retrieve it contributes that query's cut-off
+    (lowest returned) score. Ties break on how many queries hit it.
+    """
+    n = len(batch)
+    if n == 0:
+        return []
+
+    cutoffs = [min(c["embedding_fusion"] for c in results) if results else 0.0 for results in batch]
+    stats: Dict[str, dict] = {}
+    for q, results in enumerate(batch):
+        for rank, c in enumerate(results, 1):
+            entry = stats.setdefault(c["criminal_id"], {"scores": {}, "ranks": {}})
+            entry["scores"][q] = c["embedding_fusion"]
+            entry["ranks"][q]  = rank
+
+    aggregated = []
+    for cid, entry in stats.items():
+        scores = [entry["scores"].get(q, cutoffs[q]) for q in range(n)]
+        aggregated.append({
+            "criminal_id":     cid,
+            "aggregate_score": float(np.mean(scores)),
+            "best_score":      float(max(entry["scores"].values())),
+            "hits":            len(entry["scores"]),
+            "best_rank":       min(entry["ranks"].values()),
+            "query_ranks":     [entry["ranks"].get(q) for q in range(n)],
+        })
+
+    aggregated.sort(key=lambda x: (x["aggregate_score"], x["hits"]), reverse=True)
+    return aggregated[:top_k]
+
+
+# ============================================================================
+# RANGE SEARCH
+# ============================================================================
+
+RANGE_SEARCH_MAX_RESULTS = int(os.environ.get("RANGE_SEARCH_MAX_RESULTS", "200"))
+RANGE_SEARCH_SLACK       = 0.02   # raw-cosine margin when index scores are approximate
+
+
+def _range_bounds(min_score: float, weights: Dict[str, float]) -> Dict[str, Optional[float]]:
+    """
+    Per-model calibrated lower bounds implied by fused >= min_score.
+
+    Each other model o contributes at most w_o·top_o (top_o = its clamp, or
+    1), so a candidate can only reach min_score if
+    s_m >= (T - Σ_o w_o·top_o) / w_m. A bound at or below 0 prunes nothing,
+    and neither does a model with a custom calibration (no inverse): None.
+    """
+    tops = {model: spec.clamp if spec.clamp is not None else 1.0 for model, spec in MODEL_REGISTRY.items()}
+    best = sum(weights[model] * tops[model] for model in MODEL_REGISTRY)
+    bounds = {}
+    for model, spec in MODEL_REGISTRY.items():
+        w = weights[model]
+        bound = (min_score - (best - w * tops[model])) / w if w > 0 else None
+        if spec.calibration is not None or bound is None or bound <= 0:
+            bound = None
+        bounds[model] = bound
+    return bounds
+
+
+def _range_search_index(
+    snap: IndexSnapshot,
+    model: str,
+    query: np.ndarray,
+    cal_bound: float,
+    selector=None,
+) -> Optional[Set[str]]:
+    """Criminal ids whose calibrated score may exceed cal_bound (None if unsupported)."""
+    radius = 2.0 * cal_bound - 1.0
+    q = _normalize_rows(np.asarray(query, dtype=np.float32).reshape(1, -1))
+    found = set()
+    for index in snap.parts(model):
+        # kinds are per model (ModelSpec.index_kind), so ask the index itself
+        exact = type(_search_base(index)) is faiss.IndexFlatIP
+        params = _search_params(index, selector) if selector is not None else None
+        try:
+            lims, _, labels = index.range_search(
+                q, float(radius if exact else radius - RANGE_SEARCH_SLACK), params=params
+            )
+        except RuntimeError as e:
+            print(f"  [RANGE] range_search unsupported by this index ({e}), using top-k fallback")
+            return None
+        for label in labels[lims[0]:lims[1]]:
+            cid = snap.id_map.get(int(label))
+            if cid is not None:
+                found.add(cid)
+    return found
+
+
+def _range_candidate_ids(
+    snap: IndexSnapshot,
+    queries: Dict[str, np.ndarray],
+    min_score: float,
+    weights: Dict[str, float],
+    allowed: Optional[Set[str]],
+) -> Optional[Set[str]]:
+    """Superset of criminal ids that can reach min_score; None = cannot prune."""
+    selector = None
+    if allowed is not None:
+        selector = faiss.IDSelectorBatch(
+            np.array([snap.labels[c] for c in allowed if c in snap.labels], dtype=np.int64)
+        )
+
+    if snap.has("joint"):
+        # joint IP = w_ins·cos_ins + w_face·cos_face, and the unclamped fused
+        # score (IP + 1)/2 is an upper bound of the clamped one
+        q = _joint_vector(
+            queries.get("insightface"), queries.get("facenet"), weights["insightface"], weights["facenet"]
+        )
+        if q is None:
+            return set()
+        return _range_search_index(snap, "joint", q[0], min_score, selector)
+
+    bounds = _range_bounds(min_score, weights)
+    found = None
+    for model, query in queries.items():
+        bound = bounds[model]
+        if not snap.has(model) or bound is None:
+            continue
+        ids = _range_search_index(snap, model, query, bound, selector)
+        if ids is None:
+            return None
+        # Criminals with no vector in this index score the neutral 0.5 there
+        some_missing = snap.ntotal(model) - len(snap.tombstones) < len(snap.id_map)
+        if bound <= 0.5 and some_missing:
+            ids |= set(EMBEDDING_CACHE.missing(model))
+        found = ids if found is None else found & ids
+    return found
+
+
+def search_range_candidates(
+    query_insightface: np.ndarray,
+    query_facenet: np.ndarray = None,
+    min_score: float = 0.5,
+    is_sketch: bool = False,
+    max_results: int = None,
+    filters: dict = None,
+    extra_queries: Dict[str, np.ndarray] = None,
+) -> Tuple[List[dict], bool]:
+    """
+    Every candidate with fused calibrated score >= min_score, best first, cut
+    to max_results (hard cap, default RANGE_SEARCH_MAX_RESULTS).
+
+    FAISS range search on per-model bounds derived from min_score prunes the
+    gallery; only the survivors are scored exactly (calibration + clamp).
+
+    Returns:
+        (candidates, pruned) - pruned is True when the range bounds dropped
+        part of the (filtered) gallery before exact scoring, or the cap cut
+        qualifying candidates.
+    """
+    cap = max_results or RANGE_SEARCH_MAX_RESULTS
+    weights = model_weights(is_sketch)
+    queries = _query_map(query_insightface, query_facenet, extra_queries)
+    allowed = filter_service.compile_filter(filters, EMBEDDING_CACHE)
+    if allowed is not None and not allowed:
+        return [], False
+    pool_size = len(allowed) if allowed is not None else len(EMBEDDING_CACHE)
+
+    candidate_ids = None
+    snap = _ensure_index_built()
+    index_ready = snap is not None
+    if index_ready:
+        candidate_ids = _range_candidate_ids(snap, queries, min_score, weights, allowed)
+    if candidate_ids is None and index_ready:
+        # Threshold too low to prune (or range search unsupported): the cap
+        # bounds the answer, so the best `cap` by top-k search suffice
+        _, top = search_faiss_index(query_insightface, query_facenet, cap, is_sketch, allowed, extra_queries)
+        candidate_ids = {c["criminal_id"] for c in top}
+    elif candidate_ids is None:
+        # No FAISS index — score the (filtered) gallery exactly
+        candidate_ids = allowed if allowed is not None else set(EMBEDDING_CACHE.keys())
+    elif allowed is not None:
+        candidate_ids &= allowed
+
+    print(f"  [RANGE] min_score={min_score:.3f}: {len(candidate_ids)}/{pool_size} candidates survive pruning "
+          f"(cap {cap})")
+
+    scored = []
+    for cid in candidate_ids:
+        result = _exact_fused_scores(cid, queries, weights)
+        if result is not None and result["embedding_fusion"] >= min_score:
+            scored.append(result)
+
+    pruned = len(candidate_ids) < pool_size or len(scored) > cap
+    return heapq.nlargest(cap, scored, key=lambda x: x["embedding_fusion"]), pruned
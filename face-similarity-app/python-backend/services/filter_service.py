@@ -0,0 +1,188 @@
+"""
+Filter Service — metadata filters for criminal search.
+
+Per-attribute inverted sets (sex, nationality, status, case_id → criminal
+ids) are kept in step with gallery writes. A filter such as
+{"sex": "Male", "case_id": [3, 7]} compiles to the set of criminal ids it
+selects; faiss_service turns that set into an IDSelectorBatch applied
+inside the FAISS scan, or scores a narrow selection exactly.
+
+Values are matched case-insensitively; lists are OR-ed within an attribute
+and attributes are AND-ed.
+"""
+
+import os
+import threading
+
+from typing import Callable, Container, Dict, List, Optional, Set
+
+
+# ============================================================================
+# FILTER STATE
+# ============================================================================
+
+FILTER_ATTRIBUTES = ("sex", "nationality", "status", "case_id")
+# attribute -> normalised value -> {criminal_id}
+FAISS_ATTRIBUTE_SETS: Dict[str, Dict[str, Set[str]]] = {attr: {} for attr in FILTER_ATTRIBUTES}
+# criminal_id -> attribute -> {normalised value}
+FAISS_ATTRIBUTES: Dict[str, Dict[str, Set[str]]] = {}
+# Guards the two maps above (kept apart from faiss_service._INDEX_LOCK so a
+# long build never stalls filter compilation on the request path)
+_FILTER_LOCK = threading.RLock()
+
+# Called with the criminal_id of every attribute write; snapshot_service
+# installs its journal tracking here (see set_write_hook)
+_ON_WRITE: Optional[Callable[[str], None]] = None
+
+
+def _reset_lock_after_fork():
+    """Fresh lock in a forked worker (one held by a master thread would never be released)."""
+    global _FILTER_LOCK
+    _FILTER_LOCK = threading.RLock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_lock_after_fork)
+
+
+def set_write_hook(on_write: Optional[Callable[[str], None]]):
+    """Install the callback told about every attribute write (None removes it)."""
+    global _ON_WRITE
+    _ON_WRITE = on_write
+
+
+def _touch(criminal_id: str):
+    if _ON_WRITE is not None:
+        _ON_WRITE(criminal_id)
+
+
+# ============================================================================
+# ATTRIBUTE WRITES
+# ============================================================================
+
+def _normalize_attr_value(value) -> str:
+    return str(value).strip().lower()
+
+
+def _as_value_set(values) -> Set[str]:
+    if values is None:
+        return set()
+    if isinstance(values, (list, tuple, set, frozenset)):
+        return {_normalize_attr_value(v) for v in values if v is not None and str(v).strip()}
+    return {_normalize_attr_value(values)} if str(values).strip() else set()
+
+
+def _unindex_attribute(criminal_id: str, attr: str):
+    for value in FAISS_ATTRIBUTES.get(criminal_id, {}).get(attr, ()):
+        members = FAISS_ATTRIBUTE_SETS[attr].get(value)
+        if members is not None:
+            members.discard(criminal_id)
+            if not members:
+                del FAISS_ATTRIBUTE_SETS[attr][value]
+
+
+def set_criminal_attributes(criminal_id: str, **attributes):
+    """
+    Set filterable attributes for a criminal (sex, nationality, status, case_id).
+
+    Only the attributes passed are replaced; case_id takes a list of case ids.
+    """
+    _touch(criminal_id)
+    with _FILTER_LOCK:
+        current = FAISS_ATTRIBUTES.setdefault(criminal_id, {})
+        for attr, values in attributes.items():
+            if attr not in FILTER_ATTRIBUTES:
+                raise ValueError(f"Unknown filter attribute: {attr}")
+            _unindex_attribute(criminal_id, attr)
+            current[attr] = _as_value_set(values)
+            for value in current[attr]:
+                FAISS_ATTRIBUTE_SETS[attr].setdefault(value, set()).add(criminal_id)
+
+
+def remove_criminal_attributes(criminal_id: str):
+    _touch(criminal_id)
+    with _FILTER_LOCK:
+        for attr in FILTER_ATTRIBUTES:
+            _unindex_attribute(criminal_id, attr)
+        FAISS_ATTRIBUTES.pop(criminal_id, None)
+
+
+def set_case_links(case_id, criminal_ids: List[str]):
+    """Replace the set of criminals linked to a case (empty list unlinks all)."""
+    key = _normalize_attr_value(case_id)
+    with _FILTER_LOCK:
+        for cid in list(FAISS_ATTRIBUTE_SETS["case_id"].get(key, ())):
+            cases = FAISS_ATTRIBUTES.get(cid, {}).get("case_id", set()) - {key}
+            set_criminal_attributes(cid, case_id=cases)
+        for cid in criminal_ids:
+            cases = FAISS_ATTRIBUTES.get(cid, {}).get("case_id", set()) | {key}
+            set_criminal_attributes(cid, case_id=cases)
+
+
+# ============================================================================
+# EXPORT / RESTORE (SNAPSHOTS)
+# ============================================================================
+
+def get_criminal_attributes(criminal_id: str) -> Dict[str, List[str]]:
+    """One criminal's attributes as {attr: sorted values} (JSON-ready)."""
+    with _FILTER_LOCK:
+        return {attr: sorted(values) for attr, values in FAISS_ATTRIBUTES.get(criminal_id, {}).items()}
+
+
+def export_attributes() -> Dict[str, Dict[str, List[str]]]:
+    """Every criminal's attributes as {criminal_id: {attr: sorted values}}."""
+    with _FILTER_LOCK:
+        return {
+            cid: {attr: sorted(values) for attr, values in attrs.items()}
+            for cid, attrs in FAISS_ATTRIBUTES.items()
+        }
+
+
+def restore_attributes(attributes: Dict[str, Dict[str, List[str]]]):
+    """Replace all attributes with an export_attributes() map (not reported as writes)."""
+    with _FILTER_LOCK:
+        for attr in FILTER_ATTRIBUTES:
+            FAISS_ATTRIBUTE_SETS[attr] = {}
+        FAISS_ATTRIBUTES.clear()
+        for cid, attrs in attributes.items():
+            current = FAISS_ATTRIBUTES.setdefault(cid, {})
+            for attr, values in attrs.items():
+                current[attr] = set(values)
+                for value in values:
+                    FAISS_ATTRIBUTE_SETS[attr].setdefault(value, set()).add(cid)
+
+
+# ============================================================================
+# FILTER COMPILATION
+# ============================================================================
+
+def compile_filter(filters: Optional[dict], live: Container[str] = None) -> Optional[Set[str]]:
+    """
+    Resolve a filter dict to the set of criminal_ids it selects, restricted
+    to those in `live` when given (faiss_service passes the embedding store).
+
+    Values may be scalars or lists (OR within an attribute); attributes are
+    AND-ed. Returns None for "no filter".
+    """
+    if not filters:
+        return None
+
+    selected: Optional[Set[str]] = None
+    with _FILTER_LOCK:
+        for attr, values in filters.items():
+            if attr not in FILTER_ATTRIBUTES:
+                raise ValueError(f"Unknown filter attribute: {attr}")
+            wanted = _as_value_set(values)
+            if not wanted:
+                continue
+            members: Set[str] = set()
+            for value in wanted:
+                members |= FAISS_ATTRIBUTE_SETS[attr].get(value, set())
+            selected = members if selected is None else selected & members
+            if not selected:
+                return set()
+        if selected is None:
+            return None
+        if live is None:
+            return set(selected)
+        return {cid for cid in selected if cid in live}
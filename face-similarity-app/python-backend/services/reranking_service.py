@@ -0,0 +1,350 @@
+"""
+Re-ranking Service — vectorised Stage-2 scoring for criminal search.
+
+Stage 1 (faiss_service) returns a shortlist of candidate ids with FAISS
+scores. This module turns that shortlist into the ranked, fully annotated
+match records returned by /api/criminals/search:
+
+  1. gather   → the candidates' rows of every registered model are gathered
+                from the embedding store in one export, with presence masks
+  2. score    → one matrix-vector product per model gives the calibrated
+                scores; per-model clamps and adaptive fusion are array ops
+  3. rank     → Stage-1 order and the final order come from stable argsorts,
+                so stage1_rank and percentile are positions, not list scans
+  4. annotate → z-scores, above-average flags, categories and display
+                values are computed for all candidates at once
+
+Models, weights, calibration and clamps all come from MODEL_REGISTRY, the
+same way faiss_service scores Stage 1. With the built-in two models:
+  Stage 1 : fused = w_ins·cal(cos_ins) + w_face·min(cal(cos_face), 0.875),
+            a missing vector on either side scoring the neutral 0.5; the
+            query of a missing model mirrors another of the same width.
+            Cache misses keep the FAISS scores.
+  Stage 2 : candidates with a cached vector of the primary (first
+            registered) model are re-scored with the un-mirrored query,
+            over the models where both sides are present, weights
+            renormalised — so without a Facenet pair the final score is the
+            InsightFace score alone. Everything else keeps Stage 1.
+"""
+
+import numpy as np
+from typing import Callable, Dict, List, Optional, Tuple
+
+from services.faiss_service import get_embedding_cache, get_model_registry
+
+
+# ============================================================================
+# CONFIGURATION
+# ============================================================================
+
+# (lower bound, category, confidence_level, confidence_score, match_quality);
+# a score falls in the first band it is strictly above.
+SIMILARITY_BANDS = (
+    (0.55, "HIGH",   "high_similarity",   85.0, "High similarity - Strong candidate for investigation"),
+    (0.40, "MEDIUM", "medium_similarity", 60.0, "Medium similarity - Possible match, worth investigating"),
+    (None, "LOW",    "low_similarity",    30.0, "Low similarity - Unlikely match"),
+)
+
+
+# ============================================================================
+# HELPERS
+# ============================================================================
+
+def _unit(vec) -> Optional[np.ndarray]:
+    """L2-normalised float32 copy of a query vector, or None."""
+    if vec is None:
+        return None
+    vec = np.asarray(vec, dtype=np.float32).ravel()
+    return vec / (np.linalg.norm(vec) + 1e-10)
+
+
+def _gather(criminal_ids: List[str]) -> Tuple[np.ndarray, Dict[str, Tuple[np.ndarray, np.ndarray]]]:
+    """
+    (cached mask, {model: (row-normalised (k, d) matrix, presence mask)}) for
+    the candidates, in order — one gather from the embedding store.
+    """
+    found, matrices = get_embedding_cache().export(criminal_ids)
+    position = {cid: i for i, cid in enumerate(found)}
+    rows     = np.array([position.get(cid, -1) for cid in criminal_ids], dtype=np.int64)
+    cached   = rows >= 0
+    rows     = np.where(cached, rows, 0)
+
+    gathered = {}
+    for model, (matrix, present) in matrices.items():
+        if len(found) == 0:
+            gathered[model] = (np.zeros((len(rows), matrix.shape[1]), dtype=np.float32),
+                               np.zeros(len(rows), dtype=bool))
+            continue
+        matrix = np.asarray(matrix, dtype=np.float32)[rows]
+        norms  = np.linalg.norm(matrix, axis=1, keepdims=True)
+        gathered[model] = (matrix / (norms + 1e-10), present[rows] & cached)
+    return cached, gathered
+
+
+def _calibrated(spec, matrix: np.ndarray, present: np.ndarray, query: Optional[np.ndarray]) -> np.ndarray:
+    """Calibrated, clamped cosine per row; 0.5 where either side is missing."""
+    if query is None or matrix.shape[1] == 0:
+        return np.full(len(present), 0.5)
+    raw = (matrix @ query).astype(np.float64)
+    return spec.cap(np.where(present, spec.calibrate(raw), 0.5))
+
+
+def _mirrored(queries: Dict[str, Optional[np.ndarray]], registry) -> Dict[str, Optional[np.ndarray]]:
+    """A model without a query borrows the first available one of the same width."""
+    mirrored = {}
+    for model, spec in registry.items():
+        q = queries[model]
+        if q is None:
+            q = next((other for other in queries.values()
+                      if other is not None and other.shape[0] == spec.dim), None)
+        mirrored[model] = q
+    return mirrored
+
+
+def _faiss_scores(search_results: List[dict], key: str) -> np.ndarray:
+    """Stage-1 FAISS scores as float64, None → NaN."""
+    return np.array(
+        [np.nan if r.get(key) is None else float(r[key]) for r in search_results],
+        dtype=np.float64,
+    )
+
+
+def _display(values: np.ndarray) -> np.ndarray:
+    """raw [0,1] → display percentage; NaN (missing) displays as 0."""
+    return np.clip(np.nan_to_num(values, nan=0.0) * 100.0, 0.0, 100.0)
+
+
+def _mean_present(values: np.ndarray) -> Optional[float]:
+    present = values[~np.isnan(values)]
+    return float(np.mean(present)) if present.size else None
+
+
+_DESCRIPTIONS = {
+    "insightface": "ArcFace model similarity",
+    "facenet":     "Facenet512 model similarity",
+}
+
+
+def _stat_key(model: str) -> str:
+    return "mean_arcface" if model == "insightface" else f"mean_{model}"
+
+
+def _explanation(final: float, per_model: Dict[str, float], geometric: float,
+                 raw_final: float, raw_per_model: Dict[str, float], z_score: float) -> dict:
+    explanation = {
+        "final_score": {
+            "value":       final,
+            "percentage":  f"{final:.1f}%",
+            "raw_value":   raw_final,
+            "description": "Two-stage re-ranking score: 60% embedding + 25% geometric + 15% region"
+        },
+        "embedding_fusion": {
+            "value":       final,
+            "percentage":  f"{final:.1f}%",
+            "raw_value":   raw_final,
+            "description": "Fused embedding similarity: Max(ArcFace, Facenet512)",
+            "weight":      "100%"
+        },
+    }
+    registry = get_model_registry()
+    for model, value in per_model.items():
+        explanation[f"{model}_similarity"] = {
+            "value":       value,
+            "percentage":  f"{value:.1f}%",
+            "raw_value":   raw_per_model[model],
+            "description": _DESCRIPTIONS.get(model, f"{registry[model].label} model similarity"),
+            "weight":      "Considered in Max Fusion"
+        }
+    explanation["geometric_similarity"] = {
+        "value":       geometric,
+        "percentage":  f"{geometric:.1f}%",
+        "raw_value":   0.0,
+        "description": "Facial structure and landmark similarity",
+        "weight":      "25%"
+    }
+    explanation["statistical_position"] = {
+        "z_score":     z_score,
+        "description": f"{'Above' if z_score > 0 else 'Below'} average by {abs(z_score):.2f} standard deviations"
+    }
+    return explanation
+
+
+# ============================================================================
+# RE-RANKING
+# ============================================================================
+
+def rerank_candidates(
+    query_embeddings: dict,
+    search_results: List[dict],
+    weights: Dict[str, float],
+    describe: Callable[[str], dict],
+    is_sketch: bool = False,
+) -> Tuple[List[dict], dict]:
+    """
+    Score, rank and annotate the Stage-1 shortlist in one vectorised pass.
+
+    Args:
+        query_embeddings: {model: ndarray|None} as extracted (un-mirrored);
+                          registered models left out count as missing
+        search_results:   Stage-1 candidates (criminal_id + FAISS scores)
+        weights:          {model: adaptive fusion weight}, as model_weights()
+        describe:         criminal_id → serialised "criminal" block
+        is_sketch:        only used in the model_used description
+
+    Returns:
+        (matches, distribution_stats) — matches sorted by final score with
+        every response field filled in; distribution_stats is {} when empty.
+    """
+    n = len(search_results)
+    if n == 0:
+        return [], {}
+
+    registry = get_model_registry()
+    models   = list(registry)
+    primary  = models[0]
+    w        = {model: float(weights[model]) for model in models}
+
+    ids = [r["criminal_id"] for r in search_results]
+    cached, gathered = _gather(ids)
+
+    # ── Stage 1: fused ranking (mirrored queries, FAISS scores on cache miss)
+    queries  = {model: _unit(query_embeddings.get(model)) for model in models}
+    mirrored = _mirrored(queries, registry)
+
+    cal = {
+        model: _calibrated(registry[model], *gathered[model], mirrored[model])
+        for model in models
+    }
+    s1 = {
+        model: np.where(cached, cal[model], _faiss_scores(search_results, f"{model}_similarity"))
+        for model in models
+    }
+    s1_fused = np.where(cached, sum(w[model] * cal[model] for model in models),
+                        _faiss_scores(search_results, "embedding_fusion"))
+
+    order1 = np.argsort(-s1_fused, kind="stable")
+    stage1_rank = np.empty(n, dtype=np.int64)
+    stage1_rank[order1] = np.arange(1, n + 1)
+
+    print(f"\n[STAGE 1 FUSED RANKING]")
+    for rank, i in enumerate(order1, 1):
+        parts = ", ".join(
+            f"{model}={s1[model][i]:.4f}" if not np.isnan(s1[model][i]) else f"{model}=N/A"
+            for model in models
+        )
+        print(f"  {rank}. {ids[i]}: fused={s1_fused[i]:.6f} ({parts})")
+
+    # ── Stage 2: re-score cache hits with the un-mirrored query ─────────────
+    # A model whose query was present already scored with it in Stage 1, so
+    # its calibrated score is reused; models with no pair drop out and the
+    # remaining weights are renormalised.
+    hit = cached & gathered[primary][1] & (queries[primary] is not None)
+    paired = {
+        model: hit & gathered[model][1] & (queries[model] is not None)
+        for model in models
+    }
+    weight_sum = sum(np.where(paired[model], w[model], 0.0) for model in models)
+    rescored   = sum(np.where(paired[model], w[model] * cal[model], 0.0) for model in models)
+    rescored   = np.divide(rescored, weight_sum, out=s1_fused.copy(), where=weight_sum > 0)
+
+    final = np.where(hit, rescored, s1_fused)
+    per_model = {
+        model: np.where(hit & ~paired[model], np.nan, s1[model])
+        for model in models
+    }
+    geometric = np.zeros(n)
+
+    print(f"\n[STAGE 2: RE-RANKING]")
+    print(f"  Re-ranked {n} candidates — {int(hit.sum())} from cached embeddings, "
+          f"{n - int(hit.sum())} kept their Stage 1 score")
+
+    order = order1[np.argsort(-final[order1], kind="stable")]
+    final = final[order]
+    per_model = {model: values[order] for model, values in per_model.items()}
+    stage1_rank, cached = stage1_rank[order], cached[order]
+    ids = [ids[i] for i in order]
+
+    # ── Distribution analysis ───────────────────────────────────────────────
+    mean = float(np.mean(final))
+    std  = float(np.std(final))
+    distribution_stats = {
+        "mean":                  mean,
+        "std_dev":               std,
+        "min":                   float(np.min(final)),
+        "max":                   float(np.max(final)),
+        "median":                float(np.median(final)),
+        "total_candidates":      n,
+        "mean_embedding_fusion": mean,
+        **{_stat_key(model): _mean_present(values) for model, values in per_model.items()},
+        "mean_geometric":        float(np.mean(geometric)),
+    }
+
+    z_scores   = (final - mean) / std if std > 0 else np.zeros(n)
+    above      = final > mean + std
+    percentile = np.arange(1, n + 1) / n * 100
+
+    thresholds = np.array([band[0] for band in SIMILARITY_BANDS[:-1]])
+    band_index = np.sum(final[:, None] <= thresholds[None, :], axis=1)
+
+    raw_final      = final
+    raw_per_model  = {model: np.nan_to_num(values, nan=0.0) for model, values in per_model.items()}
+    disp_final     = _display(final)
+    disp_per_model = {model: _display(values) for model, values in per_model.items()}
+    disp_geometric = _display(geometric)
+
+    model_used  = (f"{' + '.join(spec.label for spec in registry.values())} "
+                   f"(adaptive {'sketch' if is_sketch else 'photo'} weights "
+                   f"{'/'.join(f'{w[model]:.2f}' for model in models)}, calibrated)")
+    metric_used = "final = " + " + ".join(
+        f"{w[model]:.2f}*cal(cosine({model}))" if spec.clamp is None
+        else f"{w[model]:.2f}*min(cal(cosine({model})), {spec.clamp})"
+        for model, spec in registry.items()
+    )
+
+    # ── Records (only float() / dict construction left per candidate) ───────
+    matches = []
+    for i in range(n):
+        _, category, level, confidence, quality = SIMILARITY_BANDS[band_index[i]]
+        raw_score = float(raw_final[i])
+        raw_models  = {model: float(values[i]) for model, values in raw_per_model.items()}
+        disp_models = {model: float(values[i]) for model, values in disp_per_model.items()}
+        z_score = float(z_scores[i])
+        matches.append({
+            "criminal":                   describe(ids[i]),
+            "similarity_score":           float(disp_final[i]),
+            "embedding_fusion":           float(disp_final[i]),
+            "embedding_confidence":       1.0,
+            **{f"{model}_similarity": value for model, value in disp_models.items()},
+            "geometric_similarity":       float(disp_geometric[i]),
+            "distance":                   1.0 - raw_score,
+            "model_used":                 model_used,
+            "metric_used":                metric_used,
+            "is_cross_domain":            True,
+            "stage1_rank":                int(stage1_rank[i]),
+            "reranking_applied":          True,
+            "cache_hit":                  bool(cached[i]),
+            "statistical_analysis": {
+                "z_score":             z_score,
+                "above_average":       bool(above[i]),
+                "deviation_from_mean": raw_score - mean,
+                "percentile":          float(percentile[i]),
+            },
+            "similarity_category":        category,
+            "confidence_level":           level,
+            "confidence_score":           confidence,
+            "match_quality":              quality,
+            "raw_similarity_score":       raw_score,
+            "display_similarity":         float(disp_final[i]),
+            "raw_embedding_fusion":       raw_score,
+            **{f"raw_{model}_similarity": value for model, value in raw_models.items()},
+            "raw_geometric_similarity":   0.0,
+            "score_normalization": (
+                'No normalization applied. display_similarity = raw_similarity * 100.'
+            ),
+            "explanation": _explanation(
+                float(disp_final[i]), disp_models, float(disp_geometric[i]),
+                raw_score, raw_models, z_score,
+            ),
+        })
+
+    return matches, distribution_stats
@@ -0,0 +1,367 @@
+"""
+Shard Service — scatter-gather search over a gallery partitioned across shards.
+
+Each shard is a process that owns the criminals whose id hashes to it
+(shard_for) and runs the ordinary faiss_service stack — embedding store,
+FAISS indexes, metadata filters — over just that slice. ShardedGallery is
+the coordinator:
+  - writes (load / add / remove / attributes) go to the owning shard only
+  - a search is sent to every shard in parallel; each returns its own
+    top-k, and the union is re-fused with the usual weights and Facenet
+    clamp and cut to the global top-k. This is not exact: each shard fuses
+    the union of its per-model top_k*2 lists, with a neutral 0.5 for a model
+    that did not retrieve a criminal, so near the cut-off a criminal's score
+    can depend on which other criminals share its shard
+  - a shard that misses FAISS_SHARD_TIMEOUT, or is gone, is skipped and the
+    result is flagged partial instead of failing the query
+
+Transport is a multiprocessing Connection carrying (request_id, op, args):
+  - start_local_shards() spawns the shards on this host over pipes (the
+    stand-in used in development and tests)
+  - serve_shard() runs a shard on another node behind a
+    multiprocessing.connection.Listener; connect_shard() attaches to it
+
+The coordinator is a library API: app_v2 still serves its gallery from the
+in-process faiss_service. Build one explicitly, e.g.
+  ShardedGallery([connect_shard(i, addr) for i, addr in enumerate(nodes)])
+
+Remote transport unpickles what it receives, so it is only offered with a
+shared secret: serve_shard() and connect_shard() refuse to run without
+FAISS_SHARD_AUTHKEY, and a node binds to 127.0.0.1 unless told otherwise.
+
+Run a node:
+  FAISS_SHARD_AUTHKEY=... python -m services.shard_service --host 10.0.0.5 --port 7001
+"""
+
+import os
+import sys
+import time
+import heapq
+import hashlib
+import argparse
+import threading
+import traceback
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing.connection import Client, Listener
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from services import faiss_service, filter_service, snapshot_service
+
+
+# ============================================================================
+# CONFIGURATION
+# ============================================================================
+
+FAISS_SHARD_AUTHKEY = os.environ.get("FAISS_SHARD_AUTHKEY", "").encode()   # required for remote shards
+FAISS_SHARD_TIMEOUT = float(os.environ.get("FAISS_SHARD_TIMEOUT", "2.0"))   # seconds per search
+
+
+def shard_for(criminal_id: str, n_shards: int) -> int:
+    """Stable shard of a criminal (Python's hash() is salted per process)."""
+    digest = hashlib.md5(criminal_id.encode()).digest()
+    return int.from_bytes(digest[:8], "big") % n_shards
+
+
+# ============================================================================
+# SHARD WORKER
+# ============================================================================
+
+def _shard_load(entries: List[Tuple[str, np.ndarray, np.ndarray]]) -> int:
+    faiss_service.clear_embedding_cache()
+    for cid, ins, face in entries:
+        faiss_service.set_cached_embedding(cid, ins, face)
+    faiss_service.build_faiss_index()
+    return len(entries)
+
+
+def _shard_search(query_insightface, query_facenet, top_k, is_sketch, filters) -> List[dict]:
+    candidates, _ = faiss_service.search_top_k_candidates(
+        query_insightface, query_facenet, top_k=top_k, is_sketch=is_sketch, filters=filters
+    )
+    return candidates
+
+
+_SHARD_OPS = {
+    "load":       _shard_load,
+    "add":        faiss_service.add_embedding,
+    "remove":     faiss_service.remove_embedding,
+    "attributes": lambda cid, attributes: filter_service.set_criminal_attributes(cid, **attributes),
+    "case_links": filter_service.set_case_links,
+    "search":     _shard_search,
+    "stats":      faiss_service.get_faiss_index_stats,
+    "ping":       lambda: True,
+}
+
+
+def _shard_loop(conn):
+    """Serve requests on one connection until it closes or "stop" arrives."""
+    while True:
+        try:
+            req_id, op, args = conn.recv()
+        except (EOFError, OSError):
+            return
+        if op == "stop":
+            conn.send((req_id, True, None))
+            return
+        try:
+            conn.send((req_id, True, _SHARD_OPS[op](*args)))
+        except Exception as e:
+            traceback.print_exc()
+            conn.send((req_id, False, f"{type(e).__name__}: {e}"))
+
+
+def _shard_main(conn, shard_id: int):
+    """Entry point of a local shard process."""
+    # A shard serves its own slice, never the host's shared snapshot
+    snapshot_service.FAISS_SHARED_GALLERY = False
+    snapshot_service.FAISS_SNAPSHOT_DIR = "none"
+    print(f"[SHARD {shard_id}] Ready (pid={os.getpid()})", flush=True)
+    _shard_loop(conn)
+
+
+def _require_authkey(authkey: Optional[bytes]) -> bytes:
+    """The shared secret for a remote shard connection; there is no default."""
+    authkey = FAISS_SHARD_AUTHKEY if authkey is None else authkey
+    if not authkey:
+        raise RuntimeError(
+            "FAISS_SHARD_AUTHKEY is not set: remote shard connections carry pickled "
+            "messages and must be authenticated with a shared secret"
+        )
+    return authkey
+
+
+def serve_shard(address: Tuple[str, int], shard_id: int = 0, authkey: Optional[bytes] = None):
+    """Run a shard node: serve one coordinator connection at a time, forever."""
+    authkey = _require_authkey(authkey)
+    snapshot_service.FAISS_SHARED_GALLERY = False
+    snapshot_service.FAISS_SNAPSHOT_DIR = "none"
+    with Listener(address, authkey=authkey) as listener:
+        print(f"[SHARD {shard_id}] Listening on {address[0]}:{address[1]}", flush=True)
+        while True:
+            with listener.accept() as conn:
+                print(f"[SHARD {shard_id}] Coordinator connected from {listener.last_accepted}", flush=True)
+                _shard_loop(conn)
+
+
+# ============================================================================
+# COORDINATOR
+# ============================================================================
+
+class ShardClient:
+    """
+    Request/response channel to one shard.
+
+    One request is in flight per shard at a time. A reply that arrives after
+    its request timed out is recognised by its request id and discarded.
+    """
+
+    def __init__(self, shard_id: int, conn, process=None):
+        self.shard_id = shard_id
+        self.conn     = conn
+        self.process  = process
+        self._lock    = threading.Lock()
+        self._next_id = 0
+
+    def request(self, op: str, *args, timeout: Optional[float] = None):
+        """Run op on the shard; raises TimeoutError, ConnectionError or RuntimeError."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        if not self._lock.acquire(timeout=-1 if timeout is None else timeout):
+            raise TimeoutError(f"shard {self.shard_id} busy")
+        try:
+            self._next_id += 1
+            req_id = self._next_id
+            try:
+                self.conn.send((req_id, op, args))
+                while True:
+                    remaining = None if deadline is None else max(deadline - time.monotonic(), 0.0)
+                    if not self.conn.poll(remaining):
+                        raise TimeoutError(f"shard {self.shard_id} timed out on {op}")
+                    reply_id, ok, result = self.conn.recv()
+                    if reply_id == req_id:
+                        break
+            except TimeoutError:
+                raise
+            except (EOFError, OSError) as e:
+                raise ConnectionError(f"shard {self.shard_id} unavailable: {e}") from e
+        finally:
+            self._lock.release()
+        if not ok:
+            raise RuntimeError(f"shard {self.shard_id} {op} failed: {result}")
+        return result
+
+    def close(self):
+        try:
+            self.request("stop", timeout=1.0)
+        except (TimeoutError, ConnectionError, RuntimeError):
+            pass
+        self.conn.close()
+        if self.process is not None:
+            self.process.join(timeout=5)
+            if self.process.is_alive():
+                self.process.terminate()
+
+
+def start_local_shards(n_shards: int) -> List[ShardClient]:
+    """Spawn n_shards shard processes on this host, connected by pipes."""
+    ctx = multiprocessing.get_context("spawn")   # no inherited FAISS / ONNX thread pools
+    clients = []
+    for shard_id in range(n_shards):
+        parent, child = ctx.Pipe()
+        process = ctx.Process(
+            target=_shard_main, args=(child, shard_id), name=f"faiss-shard-{shard_id}", daemon=True
+        )
+        process.start()
+        child.close()
+        clients.append(ShardClient(shard_id, parent, process))
+    return clients
+
+
+def connect_shard(shard_id: int, address: Tuple[str, int], authkey: Optional[bytes] = None) -> ShardClient:
+    """Attach to a shard node started with serve_shard()."""
+    return ShardClient(shard_id, Client(address, authkey=_require_authkey(authkey)))
+
+
+class ShardedGallery:
+    """
+    Coordinator over N shards; criminal_id -> shard by shard_for().
+
+    Mirrors the faiss_service write / search API so callers can switch
+    between one process and a sharded gallery.
+    """
+
+    def __init__(self, clients: List[ShardClient], timeout: float = None):
+        if not clients:
+            raise ValueError("ShardedGallery needs at least one shard")
+        self.clients = clients
+        self.timeout = FAISS_SHARD_TIMEOUT if timeout is None else timeout
+        self._pool   = ThreadPoolExecutor(max_workers=len(clients), thread_name_prefix="shard-fanout")
+
+    @property
+    def n_shards(self) -> int:
+        return len(self.clients)
+
+    def owner(self, criminal_id: str) -> ShardClient:
+        return self.clients[shard_for(criminal_id, self.n_shards)]
+
+    def _fan_out(self, calls: Dict[int, tuple], timeout: Optional[float]) -> Tuple[Dict[int, object], List[int]]:
+        """Run (op, *args) on each listed shard in parallel; returns (results, failed shard ids)."""
+        futures = {
+            shard_id: self._pool.submit(self.clients[shard_id].request, *call, timeout=timeout)
+            for shard_id, call in calls.items()
+        }
+        results, failed = {}, []
+        for shard_id, future in futures.items():
+            try:
+                results[shard_id] = future.result()
+            except (TimeoutError, ConnectionError, RuntimeError) as e:
+                print(f"  [SHARD] {e}")
+                failed.append(shard_id)
+        return results, failed
+
+    # ── writes ──────────────────────────────────────────────────────────────
+
+    def load(self, entries: List[Tuple[str, np.ndarray, np.ndarray]]) -> int:
+        """Partition (criminal_id, insightface, facenet) rows and build every shard."""
+        parts: Dict[int, list] = {shard_id: [] for shard_id in range(self.n_shards)}
+        for cid, ins, face in entries:
+            parts[shard_for(cid, self.n_shards)].append((cid, ins, face))
+        results, failed = self._fan_out(
+            {shard_id: ("load", rows) for shard_id, rows in parts.items()}, timeout=None
+        )
+        if failed:
+            raise RuntimeError(f"Sharded load failed on shard(s) {failed}")
+        print(f"  [SHARD] Loaded {sum(results.values())} criminals across {self.n_shards} shards "
+              f"({', '.join(str(results[i]) for i in range(self.n_shards))})")
+        return sum(results.values())
+
+    def add_embedding(self, criminal_id: str, insightface_embedding, facenet_embedding=None):
+        self.owner(criminal_id).request("add", criminal_id, insightface_embedding, facenet_embedding)
+
+    def remove_embedding(self, criminal_id: str) -> bool:
+        return self.owner(criminal_id).request("remove", criminal_id)
+
+    def set_criminal_attributes(self, criminal_id: str, **attributes):
+        self.owner(criminal_id).request("attributes", criminal_id, attributes)
+
+    def set_case_links(self, case_id, criminal_ids: List[str]):
+        """Every shard gets its own members of the case (so stale links are cleared everywhere)."""
+        parts: Dict[int, list] = {shard_id: [] for shard_id in range(self.n_shards)}
+        for cid in criminal_ids:
+            parts[shard_for(cid, self.n_shards)].append(cid)
+        _, failed = self._fan_out(
+            {shard_id: ("case_links", case_id, cids) for shard_id, cids in parts.items()}, timeout=None
+        )
+        if failed:
+            raise RuntimeError(f"Case link update failed on shard(s) {failed}")
+
+    # ── search ──────────────────────────────────────────────────────────────
+
+    def search_top_k_candidates(
+        self,
+        query_insightface: np.ndarray,
+        query_facenet: np.ndarray = None,
+        top_k: int = 10,
+        is_sketch: bool = False,
+        filters: dict = None,
+        timeout: float = None,
+    ) -> Tuple[List[dict], dict]:
+        """
+        Global top-k across shards.
+
+        Returns (candidates, status) where status is
+        {"partial": bool, "shards": N, "answered": [...], "missing": [...]};
+        candidates come from the shards that answered in time.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        call = ("search", query_insightface, query_facenet, top_k, is_sketch, filters)
+        results, missing = self._fan_out(
+            {shard_id: call for shard_id in range(self.n_shards)}, timeout=timeout
+        )
+
+        weights = faiss_service.model_weights(is_sketch)
+        merged = []
+        for candidates in results.values():
+            for c in candidates:
+                c["embedding_fusion"] = faiss_service._fused_score(c, weights)
+                merged.append(c)
+        top = heapq.nlargest(top_k, merged, key=lambda c: c["embedding_fusion"])
+
+        status = {
+            "partial":  bool(missing),
+            "shards":   self.n_shards,
+            "answered": sorted(results),
+            "missing":  sorted(missing),
+        }
+        if missing:
+            print(f"  [SHARD] Partial result: shard(s) {status['missing']} missing, "
+                  f"{len(results)}/{self.n_shards} answered")
+        return top, status
+
+    def stats(self) -> Dict[int, Optional[dict]]:
+        results, _ = self._fan_out(
+            {shard_id: ("stats",) for shard_id in range(self.n_shards)}, timeout=self.timeout
+        )
+        return {shard_id: results.get(shard_id) for shard_id in range(self.n_shards)}
+
+    def close(self):
+        for client in self.clients:
+            client.close()
+        self._pool.shutdown(wait=False)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run one FAISS gallery shard node")
+    parser.add_argument("--host", default="127.0.0.1",
+                        help="interface to bind; use a private address reachable by the coordinator only")
+    parser.add_argument("--port", type=int, default=7001)
+    parser.add_argument("--shard-id", type=int, default=0)
+    opts = parser.parse_args()
+    try:
+        serve_shard((opts.host, opts.port), opts.shard_id)
+    except RuntimeError as e:
+        sys.exit(f"[SHARD] {e}")
+    except KeyboardInterrupt:
+        sys.exit(0)
@@ -0,0 +1,661 @@
+"""
+Snapshot Service — FAISS snapshot persistence and the shared multi-worker gallery.
+
+Snapshots (FAISS_SNAPSHOT_DIR env var):
+  The built indexes, label map and per-criminal content digests are written
+  to a versioned snapshot directory. At boot load_or_build_faiss_index()
+  memory-maps the snapshot when EMBEDDING_VERSION and the model file hash
+  still match, then replays only the criminals added, changed or removed
+  since it was written. The directory can be copied to a fresh node as-is.
+
+Shared gallery (FAISS_SHARED_GALLERY=1, gunicorn with several workers):
+  Snapshots also carry the embedding matrices (.npy) and filter attributes.
+  Every worker attaches the current snapshot read-only via mmap, so the
+  gallery is stored once per host; writes go through shared_gallery_write(),
+  which serialises writers on a file lock and journals the criminals they
+  touched. Other workers replay the journal (or re-attach once CURRENT
+  names a newer snapshot) before their next search.
+
+faiss_service stays the index and search layer: this module reads its
+published state and installs loaded indexes through it. On import it hooks
+sync_shared_gallery() into faiss_service searches and journal tracking into
+faiss_service / filter_service writes; both are no-ops unless
+FAISS_SHARED_GALLERY is on.
+"""
+
+import os
+import json
+import time
+import base64
+import shutil
+import hashlib
+import traceback
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+import numpy as np
+import faiss
+from typing import Dict, List, Tuple, Optional, Set
+
+from services import faiss_service, filter_service
+from services.faiss_service import EMBEDDING_CACHE
+
+try:
+    import fcntl
+except ImportError:   # Windows dev boxes run a single worker; no cross-process lock needed
+    fcntl = None
+
+
+# ============================================================================
+# SNAPSHOT CONFIGURATION
+# ============================================================================
+
+_BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FAISS_SNAPSHOT_DIR  = os.environ.get("FAISS_SNAPSHOT_DIR", os.path.join(_BACKEND_DIR, "faiss_snapshot"))
+FAISS_SNAPSHOT_KEEP = 2         # snapshot generations kept on disk
+SNAPSHOT_FORMAT     = 2         # 2: per-model delta indexes alongside the main ones
+_SNAPSHOT_CURRENT   = "CURRENT"  # pointer file naming the live snapshot directory
+_SNAPSHOT_MANIFEST  = "manifest.json"
+_SNAPSHOT_LOCK      = "writer.lock"
+
+# Multi-worker mode: every gunicorn worker serves the same on-disk snapshot
+# (indexes + embedding matrices memory-mapped, so stored once per host) and
+# re-attaches whenever CURRENT moves on.
+FAISS_SHARED_GALLERY = os.environ.get("FAISS_SHARED_GALLERY", "0") == "1"
+FAISS_SYNC_INTERVAL  = float(os.environ.get("FAISS_SYNC_INTERVAL", "1.0"))   # seconds between CURRENT checks
+_ATTACHED_SNAPSHOT: Optional[str] = None   # snapshot directory this process serves / last wrote
+_SNAPSHOT_MODEL_HASH = ""
+_LAST_SYNC_CHECK = 0.0
+
+# Writes between snapshots are appended to a journal in the live snapshot
+# directory (one JSON line per criminal touched: its vectors and attributes,
+# or null vectors for a removal). Workers replay it on sync; the writer that
+# takes it past FAISS_JOURNAL_COMPACT entries folds it into a new snapshot.
+FAISS_JOURNAL_COMPACT = int(os.environ.get("FAISS_JOURNAL_COMPACT", "256"))
+FAISS_JOURNAL_RETRIES = 3
+_SNAPSHOT_JOURNAL     = "journal.jsonl"
+_JOURNAL_OFFSET = 0        # bytes of the attached snapshot's journal applied here
+_JOURNAL_LENGTH = 0        # entries in that journal
+_JOURNAL_TOUCHED: Optional[Set[str]] = None   # criminals written inside shared_gallery_write()
+# Journal entries of writes this process could not publish: kept applied
+# locally across syncs and folded into a forced snapshot by the next write
+_UNPUBLISHED: Dict[str, dict] = {}
+
+
+# ============================================================================
+# SNAPSHOTS
+# ============================================================================
+
+def _embedding_digest(entry: dict) -> str:
+    """Content digest of one criminal's cached vectors."""
+    h = hashlib.sha1()
+    for model in faiss_service.EMBEDDING_MODELS:
+        vec = entry.get(model)
+        if vec is None:
+            h.update(b"-")
+        else:
+            h.update(np.ascontiguousarray(vec, dtype=np.float32).tobytes())
+    return h.hexdigest()
+
+
+def _gallery_digest(digests: Dict[str, str]) -> str:
+    h = hashlib.sha256()
+    for cid in sorted(digests):
+        h.update(f"{cid}:{digests[cid]};".encode())
+    return h.hexdigest()
+
+
+def _snapshot_enabled() -> bool:
+    return bool(FAISS_SNAPSHOT_DIR) and FAISS_SNAPSHOT_DIR.lower() != "none"
+
+
+def _current_snapshot_path() -> Optional[str]:
+    pointer = os.path.join(FAISS_SNAPSHOT_DIR, _SNAPSHOT_CURRENT)
+    if not os.path.isfile(pointer):
+        return None
+    with open(pointer) as f:
+        name = f.read().strip()
+    path = os.path.join(FAISS_SNAPSHOT_DIR, name)
+    return path if os.path.isdir(path) else None
+
+
+def _read_manifest(path: str) -> dict:
+    with open(os.path.join(path, _SNAPSHOT_MANIFEST)) as f:
+        return json.load(f)
+
+
+def _prune_snapshots(keep_name: str):
+    """Drop old snapshot generations, keeping the newest FAISS_SNAPSHOT_KEEP."""
+    names = sorted(
+        n for n in os.listdir(FAISS_SNAPSHOT_DIR)
+        if n.startswith("snap-") and os.path.isdir(os.path.join(FAISS_SNAPSHOT_DIR, n))
+    )
+    for name in names[:-FAISS_SNAPSHOT_KEEP]:
+        if name != keep_name:
+            shutil.rmtree(os.path.join(FAISS_SNAPSHOT_DIR, name), ignore_errors=True)
+
+
+def _write_gallery(
+    path: str,
+    ids: List[str],
+    matrices: Dict[str, Tuple[np.ndarray, np.ndarray]],
+) -> Dict[str, List[str]]:
+    """
+    Write one (N, d) .npy matrix per model straight from the store, rows in
+    `ids` order. Missing vectors are zero rows; returns the criminal ids
+    missing from each model.
+    """
+    missing = {}
+    for model in faiss_service.EMBEDDING_MODELS:
+        matrix, present = matrices[model]
+        np.save(os.path.join(path, f"{model}.npy"), np.ascontiguousarray(matrix))
+        missing[model] = [ids[row] for row in np.flatnonzero(~present)]
+    return missing
+
+
+def _read_gallery(path: str, manifest: dict) -> Tuple[List[str], Dict[str, Tuple[np.ndarray, np.ndarray]]]:
+    """(ids, {model: (memory-mapped matrix, present)}) for EmbeddingStore.attach()."""
+    ids = manifest["gallery_ids"]
+    missing = manifest.get("gallery_missing", {})
+    matrices = {}
+    for model in faiss_service.EMBEDDING_MODELS:
+        gone = set(missing.get(model, ()))
+        matrices[model] = (
+            np.load(os.path.join(path, f"{model}.npy"), mmap_mode="r"),
+            np.array([cid not in gone for cid in ids], dtype=bool),
+        )
+    return ids, matrices
+
+
+def save_faiss_snapshot(model_hash: str = "") -> bool:
+    """
+    Write the published indexes and label map to a new snapshot generation.
+
+    The IndexSnapshot is taken under the lock and serialized outside it; the
+    CURRENT pointer is swapped atomically once every file is on disk.
+    """
+    global _ATTACHED_SNAPSHOT, _JOURNAL_OFFSET, _JOURNAL_LENGTH
+
+    if not _snapshot_enabled():
+        return False
+
+    with faiss_service.index_lock():
+        if faiss_service.FAISS_INDEX_DIRTY or not faiss_service.is_faiss_index_ready():
+            return False
+        snap = faiss_service.get_index_snapshot()
+        gallery_ids, gallery = EMBEDDING_CACHE.export()
+        digests = {
+            cid: _embedding_digest(EMBEDDING_CACHE[cid])
+            for cid in snap.labels if cid in EMBEDDING_CACHE
+        }
+        attributes = filter_service.export_attributes()
+        manifest = {
+            "format":            SNAPSHOT_FORMAT,
+            "embedding_version": faiss_service.EMBEDDING_VERSION,
+            "models":            list(faiss_service.EMBEDDING_MODELS),
+            "model_hash":        model_hash,
+            "gallery_digest":    _gallery_digest(digests),
+            "index_type":        snap.kind,
+            "compression":       snap.compression,
+            "joint":             faiss_service.FAISS_JOINT_INDEX,
+            "trained_size":      snap.trained_size,
+            "recall":            dict(snap.recall),
+            "next_label":        faiss_service.get_next_label(),
+            "labels":            dict(snap.labels),
+            "tombstones":        sorted(snap.tombstones),
+            "digests":           digests,
+            "gallery_ids":       gallery_ids,
+            "attributes":        attributes,
+            "created_at":        datetime.now(timezone.utc).isoformat(),
+        }
+
+    try:
+        os.makedirs(FAISS_SNAPSHOT_DIR, exist_ok=True)
+        name = "snap-" + datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%f")
+        path = os.path.join(FAISS_SNAPSHOT_DIR, name)
+        os.makedirs(path)
+
+        # Published indexes are immutable, so they serialize safely without the lock
+        for model, index in snap.indexes.items():
+            faiss.write_index(index, os.path.join(path, f"{model}.index"))
+        for model, segments in snap.deltas.items():
+            if segments:
+                delta = segments[0] if len(segments) == 1 else faiss_service._merge_segments(segments)
+                faiss.write_index(delta, os.path.join(path, f"{model}.delta.index"))
+        manifest["gallery_missing"] = _write_gallery(path, gallery_ids, gallery)
+        with open(os.path.join(path, _SNAPSHOT_MANIFEST), "w") as f:
+            json.dump(manifest, f)
+
+        pointer_tmp = os.path.join(FAISS_SNAPSHOT_DIR, _SNAPSHOT_CURRENT + ".tmp")
+        with open(pointer_tmp, "w") as f:
+            f.write(name)
+        os.replace(pointer_tmp, os.path.join(FAISS_SNAPSHOT_DIR, _SNAPSHOT_CURRENT))
+
+        _ATTACHED_SNAPSHOT = name   # our own write is not news to this process
+        _JOURNAL_OFFSET = _JOURNAL_LENGTH = 0
+        _prune_snapshots(name)
+        print(f"  [SNAPSHOT] Saved {len(digests)} criminals -> {path}")
+        return True
+
+    except Exception as e:
+        print(f"[ERROR] FAISS snapshot save failed: {e}")
+        traceback.print_exc()
+        return False
+
+
+def _read_index(path: str) -> Tuple[Optional[faiss.Index], bool]:
+    """Read an index file memory-mapped, falling back to a regular read."""
+    if not os.path.isfile(path):
+        return None, False
+    try:
+        return faiss.read_index(path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY), True
+    except Exception as e:
+        print(f"  [SNAPSHOT] mmap read unsupported for {os.path.basename(path)} ({e}), reading into memory")
+        return faiss.read_index(path), False
+
+
+def _read_snapshot_indexes(path: str) -> Tuple[Dict[str, faiss.Index], Dict[str, tuple], bool]:
+    """(main indexes, deltas, any main index mmapped) stored in a snapshot directory."""
+    indexes, deltas, mmapped = {}, {}, False
+    for model in faiss_service._active_models():
+        index, model_mmapped = _read_index(os.path.join(path, f"{model}.index"))
+        if index is not None:
+            indexes[model] = index
+            mmapped = mmapped or model_mmapped
+        delta_path = os.path.join(path, f"{model}.delta.index")
+        if os.path.isfile(delta_path):
+            deltas[model] = (faiss.read_index(delta_path),)
+    return indexes, deltas, mmapped
+
+
+def _install_manifest(manifest: dict, indexes: dict, deltas: dict, mmapped: bool):
+    """Publish a snapshot's indexes and label map (caller holds the index lock)."""
+    faiss_service.install_snapshot_indexes(
+        {
+            "kind":        manifest["index_type"],
+            "compression": manifest["compression"],
+            **indexes,
+            "recall":      manifest.get("recall", {}),
+            "size":        manifest.get("trained_size", len(manifest["labels"])),
+            "mmapped":     mmapped,
+        },
+        {cid: int(label) for cid, label in manifest["labels"].items()},
+        {int(label) for label in manifest["tombstones"]},
+        deltas,
+        next_label=int(manifest["next_label"]),
+    )
+
+
+def load_faiss_snapshot(model_hash: str = "") -> bool:
+    """
+    Install the current snapshot and replay the delta against EMBEDDING_CACHE.
+
+    Returns False (leaving the index dirty) when there is no usable snapshot:
+    missing, different EMBEDDING_VERSION / model hash, or a layout that no
+    longer matches the FAISS_INDEX_TYPE / FAISS_COMPRESSION config.
+    """
+    if not _snapshot_enabled():
+        return False
+    path = _current_snapshot_path()
+    if path is None:
+        print("  [SNAPSHOT] No snapshot found")
+        return False
+
+    try:
+        manifest = _read_manifest(path)
+
+        if manifest.get("format") != SNAPSHOT_FORMAT:
+            print("  [SNAPSHOT] Format changed — ignoring snapshot")
+            return False
+        if manifest.get("embedding_version") != faiss_service.EMBEDDING_VERSION:
+            print(f"  [SNAPSHOT] Embedding version {manifest.get('embedding_version')} != "
+                  f"{faiss_service.EMBEDDING_VERSION} — ignoring snapshot")
+            return False
+        if model_hash and manifest.get("model_hash") and manifest["model_hash"] != model_hash:
+            print("  [SNAPSHOT] Model file hash changed — ignoring snapshot")
+            return False
+        models = list(faiss_service.EMBEDDING_MODELS)
+        if manifest.get("models", models) != models:
+            print(f"  [SNAPSHOT] Models {manifest['models']} != registry {models} — ignoring snapshot")
+            return False
+        layout = (manifest.get("index_type"), manifest.get("compression"))
+        if (layout != faiss_service._resolve_layout(len(manifest["labels"]))
+                or manifest.get("joint", False) != faiss_service.FAISS_JOINT_INDEX):
+            print(f"  [SNAPSHOT] Index layout {layout} no longer matches config — ignoring snapshot")
+            return False
+
+        indexes, deltas, mmapped = _read_snapshot_indexes(path)
+        if not indexes and not deltas:
+            print("  [SNAPSHOT] Snapshot has no index files — ignoring snapshot")
+            return False
+
+    except Exception as e:
+        print(f"[ERROR] FAISS snapshot load failed: {e}")
+        traceback.print_exc()
+        return False
+
+    snap_digests = manifest["digests"]
+
+    with faiss_service.index_lock():
+        _install_manifest(manifest, indexes, deltas, mmapped)
+
+        # Replay the delta between the snapshot and the current gallery
+        gone = [cid for cid in faiss_service.get_index_snapshot().labels if cid not in EMBEDDING_CACHE]
+        fresh, added, changed = [], 0, 0
+        for cid, entry in list(EMBEDDING_CACHE.items()):
+            digest = snap_digests.get(cid)
+            if digest is not None and digest == _embedding_digest(entry):
+                continue
+            if digest is None:
+                added += 1
+            else:
+                changed += 1
+            fresh.append(cid)
+        faiss_service.reindex_criminals(fresh, gone)
+        removed = len(gone)
+
+    print(f"  [SNAPSHOT] Loaded {os.path.basename(path)} "
+          f"({len(snap_digests)} criminals, mmap={mmapped})")
+    print(f"  [SNAPSHOT] Delta replayed: +{added} added, ~{changed} changed, -{removed} removed")
+    return True
+
+
+def load_or_build_faiss_index(model_hash: str = ""):
+    """
+    Startup entry point: load the snapshot and replay the delta, or do a full
+    build when no usable snapshot exists. A fresh snapshot is written whenever
+    the gallery differs from the one on disk.
+
+    With FAISS_SHARED_GALLERY the process then attaches to that snapshot, so
+    workers forked afterwards share its pages instead of heap copies.
+    """
+    global _SNAPSHOT_MODEL_HASH
+
+    print("\n" + "=" * 60)
+    print("LOADING FAISS INDEX SNAPSHOT")
+    print("=" * 60)
+    _SNAPSHOT_MODEL_HASH = model_hash
+
+    if not load_faiss_snapshot(model_hash):
+        faiss_service.build_faiss_index()
+        save_faiss_snapshot(model_hash)
+    else:
+        on_disk = _read_manifest(_current_snapshot_path()).get("gallery_digest")
+        with faiss_service.index_lock():
+            live = _gallery_digest({cid: _embedding_digest(e) for cid, e in list(EMBEDDING_CACHE.items())})
+        if live != on_disk or _read_journal(_current_snapshot_path(), 0)[0]:
+            save_faiss_snapshot(model_hash)   # also folds in the old snapshot's journal
+
+    if FAISS_SHARED_GALLERY:
+        attach_shared_gallery()
+    print("=" * 60 + "\n")
+
+
+# ============================================================================
+# SHARED GALLERY (MULTI-WORKER)
+# ============================================================================
+
+def attach_shared_gallery() -> bool:
+    """
+    Serve the current on-disk snapshot as-is, dropping this process's copies.
+
+    Indexes and embedding matrices are memory-mapped read-only, so every
+    worker attached to the same snapshot shares one copy in the page cache.
+    Filter attributes are restored from the manifest, then the snapshot's
+    journal is replayed on top: snapshot plus journal is the gallery.
+    """
+    global _ATTACHED_SNAPSHOT, _JOURNAL_OFFSET, _JOURNAL_LENGTH
+
+    if not _snapshot_enabled():
+        return False
+    path = _current_snapshot_path()
+    if path is None:
+        return False
+
+    try:
+        manifest = _read_manifest(path)
+        models = list(faiss_service.EMBEDDING_MODELS)
+        if (manifest.get("format") != SNAPSHOT_FORMAT
+                or manifest.get("embedding_version") != faiss_service.EMBEDDING_VERSION
+                or manifest.get("models", models) != models):
+            print("  [SHARED] Snapshot format / embedding version / models differ — not attaching")
+            return False
+        indexes, deltas, mmapped = _read_snapshot_indexes(path)
+        ids, matrices = _read_gallery(path, manifest)
+    except Exception as e:
+        print(f"[ERROR] Attaching shared FAISS snapshot failed: {e}")
+        traceback.print_exc()
+        return False
+
+    with faiss_service.index_lock():
+        faiss_service.attach_embedding_store(ids, matrices)
+        _install_manifest(manifest, indexes, deltas, mmapped)
+        _ATTACHED_SNAPSHOT = os.path.basename(path)
+
+    filter_service.restore_attributes(manifest.get("attributes", {}))
+
+    with faiss_service.index_lock():
+        _JOURNAL_OFFSET = _JOURNAL_LENGTH = 0
+        replayed = _replay_journal(path)
+        _reapply_unpublished()
+
+    print(f"  [SHARED] Attached {_ATTACHED_SNAPSHOT} ({len(ids)} criminals, mmap={mmapped}, "
+          f"journal={replayed})")
+    return True
+
+
+def sync_shared_gallery(force: bool = False) -> bool:
+    """
+    Catch up with writes published by other workers: re-attach when CURRENT
+    names a newer snapshot, otherwise replay new journal entries.
+
+    Checks at most once per FAISS_SYNC_INTERVAL unless forced. Returns True
+    if this process's gallery changed.
+    """
+    global _LAST_SYNC_CHECK
+
+    if not FAISS_SHARED_GALLERY or not _snapshot_enabled():
+        return False
+    now = time.monotonic()
+    if not force and now - _LAST_SYNC_CHECK < FAISS_SYNC_INTERVAL:
+        return False
+    _LAST_SYNC_CHECK = now
+
+    path = _current_snapshot_path()
+    if path is None:
+        return False
+    if os.path.basename(path) != _ATTACHED_SNAPSHOT:
+        return attach_shared_gallery()
+    with faiss_service.index_lock():
+        return _replay_journal(path) > 0
+
+
+class GalleryPublishError(RuntimeError):
+    """A shared-gallery write could not be made visible to the other workers."""
+
+
+def _journal_touch(criminal_id: str):
+    if _JOURNAL_TOUCHED is not None:
+        _JOURNAL_TOUCHED.add(criminal_id)
+
+
+def _journal_record(criminal_id: str) -> dict:
+    """Current state of one criminal as a journal entry (null vectors = removed)."""
+    entry = EMBEDDING_CACHE.get(criminal_id)
+    attributes = filter_service.get_criminal_attributes(criminal_id)
+    vectors = None
+    if entry is not None:
+        vectors = {
+            model: base64.b64encode(np.ascontiguousarray(vec, dtype=np.float32).tobytes()).decode("ascii")
+            for model, vec in entry.items() if vec is not None
+        }
+    return {"id": criminal_id, "vectors": vectors, "attributes": attributes}
+
+
+def _apply_journal_record(record: dict):
+    criminal_id = record["id"]
+    if record["vectors"] is None:
+        faiss_service.remove_embedding(criminal_id)
+    else:
+        vectors = {
+            model: np.frombuffer(base64.b64decode(data), dtype=np.float32)
+            for model, data in record["vectors"].items()
+        }
+        current = EMBEDDING_CACHE.get(criminal_id)
+        if current is None or _embedding_digest(current) != _embedding_digest(vectors):
+            faiss_service.add_embedding(
+                criminal_id,
+                vectors.pop("insightface", None),
+                vectors.pop("facenet", None),
+                **vectors,
+            )
+    filter_service.remove_criminal_attributes(criminal_id)
+    if record["attributes"]:
+        filter_service.set_criminal_attributes(criminal_id, **record["attributes"])
+
+
+def _read_journal(path: str, offset: int) -> Tuple[List[dict], int]:
+    """Complete journal entries after `offset`, and the offset past them."""
+    try:
+        with open(os.path.join(path, _SNAPSHOT_JOURNAL), "rb") as f:
+            f.seek(offset)
+            data = f.read()
+    except FileNotFoundError:
+        return [], offset
+    end = data.rfind(b"\n") + 1   # a torn last line is not an entry (yet)
+    return [json.loads(line) for line in data[:end].splitlines() if line.strip()], offset + end
+
+
+def _replay_journal(path: str) -> int:
+    """Apply journal entries this process has not seen yet (call under _INDEX_LOCK)."""
+    global _JOURNAL_OFFSET, _JOURNAL_LENGTH
+
+    records, _JOURNAL_OFFSET = _read_journal(path, _JOURNAL_OFFSET)
+    for record in records:
+        _UNPUBLISHED.pop(record["id"], None)   # a later write from another worker wins
+        _apply_journal_record(record)
+    _JOURNAL_LENGTH += len(records)
+    return len(records)
+
+
+def _reapply_unpublished():
+    """Put this process's unpublished writes back on top of a freshly attached gallery."""
+    for record in list(_UNPUBLISHED.values()):
+        _apply_journal_record(record)
+
+
+def _append_journal(path: str, records: List[dict]) -> int:
+    """
+    Append entries to the snapshot's journal and fsync; returns the new end
+    offset. Anything past _JOURNAL_OFFSET (a torn tail from a writer that
+    died mid-append) is cut off first, so entries always start on a line.
+    """
+    payload = "".join(json.dumps(record) + "\n" for record in records).encode()
+    fd = os.open(os.path.join(path, _SNAPSHOT_JOURNAL), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        if os.fstat(fd).st_size != _JOURNAL_OFFSET:
+            os.ftruncate(fd, _JOURNAL_OFFSET)
+        try:
+            view = memoryview(payload)
+            while view:
+                view = view[os.write(fd, view):]
+            os.fsync(fd)
+        except OSError:
+            os.ftruncate(fd, _JOURNAL_OFFSET)
+            raise
+    finally:
+        os.close(fd)
+    return _JOURNAL_OFFSET + len(payload)
+
+
+def _publish_shared_writes(criminal_ids: Set[str]):
+    """
+    Make a write block visible to the other workers: append the touched
+    criminals to the journal, or compact everything into a new snapshot once
+    the journal is long, there is no snapshot to journal against, or an
+    earlier write of this process was never published.
+
+    Raises GalleryPublishError if the write could not be published after
+    FAISS_JOURNAL_RETRIES attempts. Its entries then stay in _UNPUBLISHED
+    (still applied here) until a later write gets them out.
+    """
+    global _JOURNAL_OFFSET, _JOURNAL_LENGTH
+
+    criminal_ids = set(criminal_ids) | set(_UNPUBLISHED)
+    records = [_journal_record(cid) for cid in sorted(criminal_ids)]
+    path = _current_snapshot_path()
+    if path is None or _UNPUBLISHED or _JOURNAL_LENGTH + len(criminal_ids) > FAISS_JOURNAL_COMPACT:
+        if save_faiss_snapshot(_SNAPSHOT_MODEL_HASH):
+            _UNPUBLISHED.clear()
+            attach_shared_gallery()
+            return
+        if path is None:
+            _UNPUBLISHED.update((record["id"], record) for record in records)
+            raise GalleryPublishError(
+                f"Could not publish {len(criminal_ids)} gallery write(s): no snapshot to journal against"
+            )
+        print("[WARN] Journal compaction skipped (index not ready) — appending instead")
+
+    error = None
+    for attempt in range(FAISS_JOURNAL_RETRIES):
+        try:
+            _JOURNAL_OFFSET = _append_journal(path, records)
+            _JOURNAL_LENGTH += len(records)
+            _UNPUBLISHED.clear()
+            return
+        except OSError as e:
+            error = e
+            print(f"[WARN] Journal append failed (attempt {attempt + 1}/{FAISS_JOURNAL_RETRIES}): {e}")
+            time.sleep(0.05 * (attempt + 1))
+    _UNPUBLISHED.update((record["id"], record) for record in records)
+    raise GalleryPublishError(
+        f"Could not publish {len(criminal_ids)} gallery write(s) to {path}: {error}"
+    ) from error
+
+
+@contextmanager
+def shared_gallery_write():
+    """
+    Wrap a request's gallery writes (add / remove / attributes / case links).
+
+    With FAISS_SHARED_GALLERY on, writers in all workers are serialised by a
+    file lock: the block starts from the newest snapshot plus journal and
+    ends by journaling the criminals it touched, which the other workers
+    replay on their next search. A write that cannot be published raises
+    GalleryPublishError after the block has run: the change stays live in
+    this process and the next write publishes it with a fresh snapshot.
+    Otherwise this is a no-op.
+    """
+    global _JOURNAL_TOUCHED
+
+    if not (FAISS_SHARED_GALLERY and _snapshot_enabled()):
+        yield
+        return
+
+    os.makedirs(FAISS_SNAPSHOT_DIR, exist_ok=True)
+    with open(os.path.join(FAISS_SNAPSHOT_DIR, _SNAPSHOT_LOCK), "a") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            sync_shared_gallery(force=True)
+            _JOURNAL_TOUCHED = set()
+            try:
+                yield
+            finally:
+                touched, _JOURNAL_TOUCHED = _JOURNAL_TOUCHED, None
+                if touched:
+                    _publish_shared_writes(touched)
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+# ============================================================================
+# INDEX LAYER HOOKS
+# ============================================================================
+
+# Writes are tracked for the journal and searches sync first; both hooks
+# return straight away unless FAISS_SHARED_GALLERY is on
+faiss_service.set_write_hook(_journal_touch)
+faiss_service.set_search_hook(sync_shared_gallery)
+filter_service.set_write_hook(_journal_touch)
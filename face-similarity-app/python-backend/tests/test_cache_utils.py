@@ -0,0 +1,183 @@
+"""
+tests/test_cache_utils.py
+─────────────────────────
+Per-image embedding cache: byte-bounded LRU eviction, atomic field
+updates and hit/miss accounting.
+Pure in-memory — no DB rows or model weights involved.
+"""
+
+from __future__ import annotations
+
+import threading
+
+import numpy as np
+import pytest
+
+from utils import cache_utils
+
+
+def _entry(n_floats: int = 256, **extra) -> dict:
+    """One cache entry whose arrays take n_floats * 4 bytes."""
+    return {"insightface": np.zeros(n_floats, dtype=np.float32), **extra}
+
+
+@pytest.fixture()
+def cache(monkeypatch):
+    monkeypatch.setattr(cache_utils, "IMAGE_CACHE_MAX_BYTES", 3 * 1024)
+    cache_utils.clear_image_cache()
+    yield cache_utils
+    cache_utils.clear_image_cache()
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# Keys
+# ══════════════════════════════════════════════════════════════════════════════
+
+class TestImageCacheKey:
+
+    def test_key_covers_mode_params_and_model(self):
+        base = cache_utils.make_image_cache_key("abc", False, ("tta", "canny50-150"), "m1")
+        assert base != cache_utils.make_image_cache_key("abc", True, ("tta", "canny50-150"), "m1")
+        assert base != cache_utils.make_image_cache_key("abc", False, ("notta", "canny50-150"), "m1")
+        assert base != cache_utils.make_image_cache_key("abc", False, ("tta", "canny50-150"), "m2")
+        assert base != cache_utils.make_image_cache_key("abd", False, ("tta", "canny50-150"), "m1")
+        assert base == cache_utils.make_image_cache_key("abc", False, ("tta", "canny50-150"), "m1")
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# Byte-bounded LRU
+# ══════════════════════════════════════════════════════════════════════════════
+
+class TestByteBoundedLRU:
+
+    def test_entries_are_sized_by_their_arrays(self, cache):
+        cache.set_cached_image_entry("a", _entry(256, best_threshold=(50, 150)))
+        # 1024 bytes of array + 64 per scalar inside the tuple
+        assert cache.get_image_cache_stats()["bytes"] == 1024 + 2 * 64
+
+    def test_least_recently_used_is_evicted_first(self, cache):
+        for key in ("a", "b", "c"):
+            cache.set_cached_image_entry(key, _entry())
+        assert cache.get_image_cache_stats()["bytes"] == 3 * 1024
+
+        assert cache.get_cached_image_entry("a") is not None   # "b" is now the oldest
+        cache.set_cached_image_entry("d", _entry())
+
+        assert cache.get_cached_image_entry("b") is None
+        assert all(cache.get_cached_image_entry(k) is not None for k in ("a", "c", "d"))
+        assert cache.get_image_cache_stats()["bytes"] == 3 * 1024
+
+    def test_large_entry_evicts_several(self, cache):
+        for key in ("a", "b", "c"):
+            cache.set_cached_image_entry(key, _entry())
+        cache.set_cached_image_entry("big", _entry(512))
+
+        assert list(cache.IMAGE_EMBEDDING_CACHE) == ["c", "big"]
+        assert cache.get_image_cache_stats()["bytes"] == 3 * 1024
+
+    def test_entry_over_budget_is_not_stored(self, cache):
+        cache.set_cached_image_entry("a", _entry())
+        cache.set_cached_image_entry("huge", _entry(1024))
+
+        assert cache.get_cached_image_entry("huge") is None
+        assert cache.get_cached_image_entry("a") is not None
+
+    def test_replacing_a_key_re_accounts_its_size(self, cache):
+        cache.set_cached_image_entry("a", _entry(256))
+        cache.set_cached_image_entry("a", _entry(128))
+
+        stats = cache.get_image_cache_stats()
+        assert stats["size"] == 1
+        assert stats["bytes"] == 512
+
+    def test_hit_rate(self, cache):
+        cache.set_cached_image_entry("a", _entry())
+        cache.get_cached_image_entry("a")
+        cache.get_cached_image_entry("missing")
+
+        stats = cache.get_image_cache_stats()
+        assert (stats["hits"], stats["misses"], stats["hit_rate"]) == (1, 1, 0.5)
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# update_cached_image_entry
+# ══════════════════════════════════════════════════════════════════════════════
+
+class TestUpdateEntry:
+
+    def test_fields_are_added_and_bytes_re_accounted(self, cache):
+        cache.set_cached_image_entry("a", _entry(256, facenet=None))
+        assert cache.update_cached_image_entry("a", facenet=np.ones(128, dtype=np.float32))
+
+        entry = cache.get_cached_image_entry("a")
+        assert entry["facenet"].shape == (128,)
+        assert entry["insightface"].shape == (256,)
+        assert cache.get_image_cache_stats()["bytes"] == 1024 + 512
+
+    def test_update_marks_the_entry_recently_used(self, cache):
+        cache.set_cached_image_entry("a", _entry())
+        cache.set_cached_image_entry("b", _entry())
+        cache.update_cached_image_entry("a", regions={"eyes": np.zeros(64, dtype=np.float32)})
+
+        assert list(cache.IMAGE_EMBEDDING_CACHE) == ["b", "a"]
+
+    def test_update_can_trigger_eviction(self, cache):
+        for key in ("a", "b", "c"):
+            cache.set_cached_image_entry(key, _entry())
+        cache.update_cached_image_entry("a", facenet=np.zeros(128, dtype=np.float32))
+
+        assert cache.get_cached_image_entry("b") is None
+        assert cache.get_cached_image_entry("a")["facenet"] is not None
+
+    def test_evicted_entry_is_not_resurrected(self, cache):
+        assert not cache.update_cached_image_entry("gone", facenet=np.zeros(128, dtype=np.float32))
+        assert cache.get_image_cache_stats()["size"] == 0
+
+    def test_cached_dict_is_not_mutated(self, cache):
+        original = _entry(facenet=None)
+        cache.set_cached_image_entry("a", original)
+        cache.update_cached_image_entry("a", facenet=np.zeros(128, dtype=np.float32))
+
+        assert original["facenet"] is None
+
+    def test_update_that_no_longer_fits_keeps_the_entry(self, cache):
+        cache.set_cached_image_entry("a", _entry())
+        assert not cache.update_cached_image_entry("a", facenet=np.zeros(1024, dtype=np.float32))
+
+        assert "facenet" not in cache.get_cached_image_entry("a")
+        assert cache.get_image_cache_stats()["bytes"] == 1024
+
+    def test_merge_happens_under_the_lock(self, cache, monkeypatch):
+        held = []
+        sizing = cache._entry_nbytes
+
+        def recording(value):
+            held.append(cache._IMAGE_CACHE_LOCK.locked())
+            return sizing(value)
+
+        cache.set_cached_image_entry("a", _entry())
+        monkeypatch.setattr(cache, "_entry_nbytes", recording)
+        cache.update_cached_image_entry("a", facenet=np.zeros(16, dtype=np.float32))
+
+        assert held and all(held)
+
+    def test_concurrent_updates_keep_every_field(self, cache, monkeypatch):
+        monkeypatch.setattr(cache, "IMAGE_CACHE_MAX_BYTES", 1024 * 1024)
+        cache.set_cached_image_entry("a", _entry())
+        start = threading.Barrier(8)
+
+        def update(worker):
+            start.wait()
+            for i in range(50):
+                cache.update_cached_image_entry("a", **{f"w{worker}_{i}": np.zeros(4, dtype=np.float32)})
+
+        threads = [threading.Thread(target=update, args=(w,)) for w in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        entry = cache.get_cached_image_entry("a")
+        assert {f"w{w}_{i}" for w in range(8) for i in range(50)} <= set(entry)
+        assert cache.get_image_cache_stats()["bytes"] == cache._entry_nbytes(entry)
+
@@ -0,0 +1,309 @@
+"""
+tests/test_embedding_service.py
+───────────────────────────────
+Per-image extraction cache keys: everything that changes the stored
+embeddings (reference embedding for adaptive Canny, TTA, sketch/photo mode,
+Facenet input encoding, model weights) must change the key. Joining the
+concurrent Facenet request fills the result and the per-image cache.
+Batched TTA maps every augmentation back to its own face.
+Pure in-memory — no DB rows or model weights involved.
+"""
+
+from __future__ import annotations
+
+import threading
+from concurrent.futures import Future
+
+import cv2
+import numpy as np
+import pytest
+
+pytest.importorskip("requests")
+
+from services import embedding_service
+from utils import cache_utils
+from utils.image_context import ImageContext
+
+
+def _vec(seed: int, dim: int = 512) -> np.ndarray:
+    v = np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+    return v / np.linalg.norm(v)
+
+
+def _image(seed: int = 0) -> ImageContext:
+    img = np.random.default_rng(seed).integers(0, 256, size=(16, 16, 3), dtype=np.uint8)
+    ok, buf = cv2.imencode(".png", img)
+    assert ok
+    return ImageContext(buf.tobytes(), filename=f"img{seed}.png")
+
+
+@pytest.fixture()
+def service(monkeypatch):
+    monkeypatch.setattr(embedding_service, "get_model_file_hash", lambda: "a" * 64)
+    monkeypatch.setattr(embedding_service, "FACENET_WIRE_FORMAT", "jpeg")
+    monkeypatch.setattr(embedding_service, "FACENET_SHARED_DIR", None)
+    monkeypatch.setattr(embedding_service, "_RAW_PROTOCOL_OK", True)
+    return embedding_service
+
+
+@pytest.fixture()
+def image_cache():
+    cache_utils.clear_image_cache()
+    yield cache_utils
+    cache_utils.clear_image_cache()
+
+
+def _resolved(value) -> Future:
+    future = Future()
+    future.set_result(value)
+    return future
+
+
+def _extracted(facenet_future, from_cache=False, cache_key="key-1", use_tta=True) -> dict:
+    """extract_dual_embeddings(join_facenet=False) output with Facenet still in flight."""
+    return {
+        "success":         True,
+        "insightface":     _vec(10),
+        "facenet":         None,
+        "facenet_pending": facenet_future,
+        "aligned_face":    np.zeros((112, 112, 3), dtype=np.uint8),
+        "tta_applied":     use_tta,
+        "best_threshold":  (50, 150),
+        "cache_key":       cache_key,
+        "from_cache":      from_cache,
+    }
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# image_cache_key
+# ══════════════════════════════════════════════════════════════════════════════
+
+class TestImageCacheKey:
+
+    def test_same_arguments_same_key(self, service):
+        ref = _vec(1)
+        assert (service.image_cache_key(_image(), False, True, ref)
+                == service.image_cache_key(_image(), False, True, ref.copy()))
+
+    def test_reference_embedding_changes_adaptive_key(self, service):
+        img = _image()
+        k1 = service.image_cache_key(img, False, use_adaptive_canny=True, reference_embedding=_vec(1))
+        k2 = service.image_cache_key(img, False, use_adaptive_canny=True, reference_embedding=_vec(2))
+        fixed = service.image_cache_key(img, False, use_adaptive_canny=False, reference_embedding=_vec(1))
+        assert len({k1, k2, fixed}) == 3
+
+    def test_reference_is_ignored_without_adaptive_canny(self, service):
+        img = _image()
+        assert (service.image_cache_key(img, False, False, _vec(1))
+                == service.image_cache_key(img, False, False, _vec(2))
+                == service.image_cache_key(img, False, False, None))
+
+    def test_sketches_never_use_the_reference(self, service):
+        img = _image()
+        assert (service.image_cache_key(img, True, True, _vec(1))
+                == service.image_cache_key(img, True, True, _vec(2)))
+
+    def test_tta_changes_key(self, service):
+        img = _image()
+        assert (service.image_cache_key(img, False, use_tta=True)
+                != service.image_cache_key(img, False, use_tta=False))
+
+    def test_mode_changes_key(self, service):
+        img = _image()
+        assert service.image_cache_key(img, True) != service.image_cache_key(img, False)
+
+    def test_image_content_changes_key(self, service):
+        assert service.image_cache_key(_image(1), False) != service.image_cache_key(_image(2), False)
+
+    def test_facenet_encoding_changes_key(self, service, monkeypatch):
+        img = _image()
+        jpeg = service.image_cache_key(img, False)
+        monkeypatch.setattr(service, "FACENET_WIRE_FORMAT", "raw")
+        assert service.facenet_input_encoding() == "lossless"
+        assert service.image_cache_key(img, False) != jpeg
+
+    def test_model_weights_change_key(self, service, monkeypatch):
+        img = _image()
+        before = service.image_cache_key(img, False)
+        monkeypatch.setattr(service, "get_model_file_hash", lambda: "b" * 64)
+        assert service.image_cache_key(img, False) != before
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# join_dual_embeddings
+# ══════════════════════════════════════════════════════════════════════════════
+
+class TestJoinDualEmbeddings:
+
+    def test_insightface_is_cached_before_the_join(self, service, image_cache):
+        result = _extracted(Future())
+        service._store_extracted(result)
+
+        entry = image_cache.get_cached_image_entry("key-1")
+        np.testing.assert_array_equal(entry["insightface"], result["insightface"])
+        assert entry["facenet"] is None
+        assert entry["insightface"] is not result["insightface"]   # the cache holds its own copy
+
+    def test_fresh_result_is_filled_and_cached(self, service, image_cache):
+        facenet = _vec(20)
+        extracted = _extracted(_resolved(facenet))
+        service._store_extracted(extracted)
+        result = service.join_dual_embeddings(extracted)
+
+        assert result["facenet_pending"] is None
+        np.testing.assert_array_equal(result["facenet"], facenet)
+
+        entry = image_cache.get_cached_image_entry("key-1")
+        np.testing.assert_array_equal(entry["facenet"], facenet)
+        np.testing.assert_array_equal(entry["insightface"], result["insightface"])
+        assert entry["best_threshold"] == (50, 150)
+        assert entry["use_tta"] is True
+        assert entry["facenet"] is not result["facenet"]   # the cache holds its own copy
+
+    def test_facenet_down_still_caches_insightface(self, service, image_cache):
+        extracted = _extracted(_resolved(None))
+        service._store_extracted(extracted)
+        result = service.join_dual_embeddings(extracted)
+
+        assert result["facenet"] is None
+        entry = image_cache.get_cached_image_entry("key-1")
+        assert entry["facenet"] is None
+        assert entry["insightface"] is not None
+
+    def test_cached_result_gets_its_missing_facenet(self, service, image_cache):
+        image_cache.set_cached_image_entry("key-1", {
+            "aligned_face":   np.zeros((112, 112, 3), dtype=np.uint8),
+            "insightface":    _vec(10),
+            "facenet":        None,
+            "best_threshold": (50, 150),
+            "use_tta":        True,
+        })
+        facenet = _vec(21)
+        service.join_dual_embeddings(_extracted(_resolved(facenet), from_cache=True))
+
+        np.testing.assert_array_equal(image_cache.get_cached_image_entry("key-1")["facenet"], facenet)
+
+    @pytest.mark.parametrize("from_cache", [True, False])
+    def test_evicted_entry_is_not_re_stored(self, service, image_cache, from_cache):
+        service.join_dual_embeddings(_extracted(_resolved(_vec(21)), from_cache=from_cache))
+        assert image_cache.get_cached_image_entry("key-1") is None
+
+    def test_uncached_or_failed_results_are_not_stored(self, service, image_cache):
+        service.join_dual_embeddings(_extracted(_resolved(_vec(20)), cache_key=None))
+        failed = _extracted(_resolved(_vec(20)))
+        failed["success"] = False
+        service.join_dual_embeddings(failed)
+
+        assert image_cache.get_image_cache_stats()["size"] == 0
+
+    def test_without_pending_request_result_is_unchanged(self, service, image_cache):
+        result = _extracted(None)
+        assert service.join_dual_embeddings(result) is result
+        assert result["facenet"] is None
+        assert image_cache.get_image_cache_stats()["size"] == 0
+
+    def test_waits_for_the_in_flight_request(self, service, image_cache):
+        future = Future()
+        result = _extracted(future)
+        facenet = _vec(22)
+
+        threading.Timer(0.05, future.set_result, args=(facenet,)).start()
+        service.join_dual_embeddings(result)
+
+        np.testing.assert_array_equal(result["facenet"], facenet)
+
+    def test_cache_hit_without_facenet_retries_the_service(self, service, image_cache, monkeypatch):
+        submitted = []
+        monkeypatch.setattr(service, "submit_facenet_embedding",
+                            lambda face: submitted.append(face.shape) or _resolved(_vec(23)))
+        entry = {
+            "aligned_face":   np.zeros((112, 112, 3), dtype=np.uint8),
+            "insightface":    _vec(10),
+            "facenet":        None,
+            "best_threshold": (50, 150),
+            "use_tta":        True,
+        }
+        image_cache.set_cached_image_entry("key-1", entry)
+
+        result = service._result_from_cache(entry, {"facenet_pending": None}, "key-1")
+        assert submitted == [(112, 112, 3)]
+        service.join_dual_embeddings(result)
+
+        assert result["facenet"] is not None
+        assert image_cache.get_cached_image_entry("key-1")["facenet"] is not None
+
+
+    @pytest.mark.parametrize("use_tta", [True, False])
+    def test_cache_hit_reports_how_the_entry_was_extracted(self, service, image_cache, monkeypatch, use_tta):
+        monkeypatch.setattr(service, "submit_facenet_embedding", lambda face: _resolved(None))
+        service._store_extracted(_extracted(None, use_tta=use_tta))
+        entry = image_cache.get_cached_image_entry("key-1")
+
+        result = service._result_from_cache(entry, {"facenet_pending": None}, "key-1")
+        assert result["tta_applied"] is use_tta
+
+# ══════════════════════════════════════════════════════════════════════════════
+# extract_embeddings_with_tta
+# ══════════════════════════════════════════════════════════════════════════════
+
+def _unit(v: np.ndarray) -> np.ndarray:
+    return v / np.linalg.norm(v)
+
+
+@pytest.fixture()
+def tta(service, monkeypatch):
+    """
+    Faces are ints; face f has `counts[f]` augmentations, each embedding to
+    _vec(100 * f + idx) unless listed in `failed` (extraction returns None).
+    """
+    setup = {"counts": {}, "failed": set(), "batches": []}
+
+    def augment(face):
+        return [(face, idx) for idx in range(setup["counts"][face])]
+
+    def extract(flat):
+        setup["batches"].append(list(flat))
+        return [None if aug in setup["failed"] else _vec(100 * aug[0] + aug[1]) for aug in flat]
+
+    monkeypatch.setattr(service, "generate_tta_augmentations", augment)
+    monkeypatch.setattr(service, "_extract_insightface_batch", extract)
+    return setup
+
+
+class TestExtractEmbeddingsWithTta:
+
+    def test_all_augmentations_go_through_one_batch(self, service, tta):
+        tta["counts"] = {1: 3, 2: 3}
+        service.extract_embeddings_with_tta([1, 2], "InsightFace")
+
+        assert tta["batches"] == [[(1, 0), (1, 1), (1, 2), (2, 0), (2, 1), (2, 2)]]
+
+    def test_fewer_augmentations_keep_later_faces_aligned(self, service, tta):
+        # Face 2's flip and rotation were skipped: it has one augmentation, not three
+        tta["counts"] = {1: 3, 2: 1, 3: 2}
+        embs = service.extract_embeddings_with_tta([1, 2, 3], "InsightFace")
+
+        np.testing.assert_allclose(embs[0], _unit(_vec(100) + _vec(101) + _vec(102)), atol=1e-6)
+        np.testing.assert_allclose(embs[1], _vec(200), atol=1e-6)
+        np.testing.assert_allclose(embs[2], _unit(_vec(300) + _vec(301)), atol=1e-6)
+
+    def test_failed_augmentation_is_left_out_of_its_own_average_only(self, service, tta):
+        tta["counts"] = {1: 3, 2: 3}
+        tta["failed"] = {(1, 1)}
+        embs = service.extract_embeddings_with_tta([1, 2], "InsightFace")
+
+        np.testing.assert_allclose(embs[0], _unit(_vec(100) + _vec(102)), atol=1e-6)
+        np.testing.assert_allclose(embs[1], _unit(_vec(200) + _vec(201) + _vec(202)), atol=1e-6)
+
+    def test_face_whose_augmentations_all_fail_is_none(self, service, tta):
+        tta["counts"] = {1: 2, 2: 2, 3: 1}
+        tta["failed"] = {(2, 0), (2, 1)}
+        embs = service.extract_embeddings_with_tta([1, 2, 3], "InsightFace")
+
+        assert embs[1] is None
+        np.testing.assert_allclose(embs[2], _vec(300), atol=1e-6)
+
+    def test_other_models_are_rejected(self, service, tta):
+        with pytest.raises(ValueError):
+            service.extract_embeddings_with_tta([1], "Facenet")
+
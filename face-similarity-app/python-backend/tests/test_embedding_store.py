@@ -0,0 +1,122 @@
+"""
+tests/test_embedding_store.py
+─────────────────────────────
+EmbeddingStore: dict-like access over per-model matrices, append-only rows,
+zero-copy export, compaction, float16 storage and copy-on-write attach.
+Pure in-memory — a plain dict of dims stands in for the model registry.
+"""
+
+from __future__ import annotations
+
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from services.embedding_store import EmbeddingStore
+
+_REGISTRY = {"insightface": SimpleNamespace(dim=512), "facenet": SimpleNamespace(dim=512)}
+
+
+def _vec(seed: int, dim: int = 512) -> np.ndarray:
+    v = np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+    return v / np.linalg.norm(v)
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# Embedding store
+# ══════════════════════════════════════════════════════════════════════════════
+
+class TestEmbeddingStore:
+
+    def test_behaves_like_the_old_dict(self):
+        store = EmbeddingStore(_REGISTRY)
+        store.put("A", _vec(1), _vec(2))
+        store["B"] = {"insightface": _vec(3), "facenet": None}
+
+        assert len(store) == 2 and "A" in store and "C" not in store
+        assert list(store) == ["A", "B"]
+        np.testing.assert_array_equal(store["A"]["facenet"], _vec(2))
+        assert store.get("B")["facenet"] is None
+        assert store.get("C") is None
+        assert store.pop("A")["insightface"] is not None
+        assert "A" not in store and store.pop("A") is None
+
+    def test_replace_keeps_handed_out_views_intact(self):
+        store = EmbeddingStore(_REGISTRY)
+        store.put("A", _vec(1), _vec(2))
+        before = store["A"]["insightface"]
+        store.put("A", _vec(5), _vec(6))
+
+        np.testing.assert_array_equal(before, _vec(1))
+        np.testing.assert_array_equal(store["A"]["insightface"], _vec(5))
+        assert not before.flags.writeable
+        assert store.memory_stats()["tombstoned"] == 1
+
+    def test_export_is_a_view_until_something_is_removed(self):
+        store = EmbeddingStore(_REGISTRY)
+        for i in range(200):   # grows past the initial capacity
+            store.put(f"S{i:03d}", _vec(i), None if i % 4 == 0 else _vec(1000 + i))
+
+        ids, matrices = store.export()
+        matrix, present = matrices["insightface"]
+        assert ids == [f"S{i:03d}" for i in range(200)]
+        assert np.shares_memory(matrix, store._state.data["insightface"])
+        assert present.all() and matrices["facenet"][1].sum() == 150
+        np.testing.assert_array_equal(matrix[7], _vec(7))
+
+        store.remove("S007")
+        ids, matrices = store.export()
+        assert "S007" not in ids and len(ids) == 199
+        np.testing.assert_array_equal(matrices["insightface"][0][7], _vec(8))
+
+    def test_compacts_once_tombstones_dominate(self):
+        store = EmbeddingStore(_REGISTRY)
+        for i in range(300):
+            store.put(f"S{i:03d}", _vec(i), _vec(1000 + i))
+        for i in range(200):
+            store.remove(f"S{i:03d}")
+
+        stats = store.memory_stats()
+        assert stats["live"] == 100 and stats["tombstoned"] < 100
+        np.testing.assert_array_equal(store["S250"]["facenet"], _vec(1250))
+
+    def test_float16_halves_storage(self):
+        full, half = EmbeddingStore(_REGISTRY, "float32"), EmbeddingStore(_REGISTRY, "float16")
+        for store in (full, half):
+            for i in range(50):
+                store.put(f"S{i:03d}", _vec(i), _vec(1000 + i))
+
+        assert half.memory_stats()["bytes"] < 0.6 * full.memory_stats()["bytes"]
+        np.testing.assert_allclose(half["S010"]["insightface"], _vec(10), atol=1e-3)
+
+    def test_attached_read_only_matrices_copy_on_write(self):
+        matrix = np.stack([_vec(i) for i in range(3)])
+        matrix.flags.writeable = False
+        store = EmbeddingStore(_REGISTRY)
+        store.attach(["A", "B", "C"], {"insightface": (matrix, np.ones(3, dtype=bool))})
+
+        assert np.shares_memory(store["B"]["insightface"], matrix)
+        assert store["B"]["facenet"] is None
+        store.put("D", _vec(9), _vec(10))
+        np.testing.assert_array_equal(store["A"]["insightface"], _vec(0))
+        np.testing.assert_array_equal(store["D"]["facenet"], _vec(10))
+
+    def test_unknown_model_and_wrong_width_are_rejected(self):
+        store = EmbeddingStore(_REGISTRY)
+        with pytest.raises(ValueError):
+            store.put("A", _vec(1), arcface=_vec(2))
+        with pytest.raises(ValueError):
+            store.put("A", _vec(1, dim=128))
+        assert len(store) == 0
+
+    def test_layout_follows_the_registry(self):
+        registry = dict(_REGISTRY)
+        store = EmbeddingStore(registry)
+        registry["extra"] = SimpleNamespace(dim=128)
+        store.clear()
+        store.put("A", _vec(1), None, extra=_vec(2, dim=128))
+
+        assert store.models == ("insightface", "facenet", "extra")
+        np.testing.assert_array_equal(store["A"]["extra"], _vec(2, dim=128))
+        assert store.missing("facenet") == ["A"]
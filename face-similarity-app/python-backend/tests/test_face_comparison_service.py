@@ -0,0 +1,80 @@
+"""
+tests/test_face_comparison_service.py
+─────────────────────────────────────
+forensic_face_comparison() keeps image 1's Facenet request: when image 2
+fails or raises, image 1 is still joined so its cache entry gets Facenet.
+Pure in-memory — extraction is faked, no DB rows or model weights involved.
+"""
+
+from __future__ import annotations
+
+from concurrent.futures import Future
+
+import cv2
+import numpy as np
+import pytest
+
+pytest.importorskip("requests")
+
+from services import face_comparison_service
+from utils.image_context import ImageContext
+
+
+def _image(seed: int) -> ImageContext:
+    img = np.random.default_rng(seed).integers(0, 256, size=(16, 16, 3), dtype=np.uint8)
+    ok, buf = cv2.imencode(".png", img)
+    assert ok
+    return ImageContext(buf.tobytes(), filename=f"img{seed}.png")
+
+
+@pytest.fixture()
+def comparison(monkeypatch):
+    """Image 1 extracts with Facenet in flight; image 2 does whatever `setup['image2']` says."""
+    setup = {"image2": None, "joined": []}
+    embeddings1 = {
+        "success": True, "insightface": np.ones(512, dtype=np.float32), "facenet": None,
+        "facenet_pending": Future(), "cache_key": "key-1", "from_cache": False,
+    }
+
+    def extract(image, **kwargs):
+        if image.filename == "img1.png":
+            return embeddings1
+        if isinstance(setup["image2"], Exception):
+            raise setup["image2"]
+        return setup["image2"]
+
+    monkeypatch.setattr(face_comparison_service, "initialize_models", lambda: None)
+    monkeypatch.setattr(face_comparison_service, "is_sketch_image", lambda image: False)
+    monkeypatch.setattr(face_comparison_service, "extract_dual_embeddings", extract)
+    monkeypatch.setattr(face_comparison_service, "join_dual_embeddings",
+                        lambda result: setup["joined"].append(result) or result)
+    return setup, embeddings1
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# Image 2 failures
+# ══════════════════════════════════════════════════════════════════════════════
+
+class TestImageTwoFailure:
+
+    @pytest.mark.parametrize("image2", [
+        None,
+        {"success": False, "error": "Face detection failed"},
+    ])
+    def test_failed_image_two_still_joins_image_one(self, comparison, image2):
+        setup, embeddings1 = comparison
+        setup["image2"] = image2
+
+        result = face_comparison_service.forensic_face_comparison(_image(1), _image(2), use_cache=False)
+
+        assert result["error"] == "Failed to extract dual embeddings from image 2"
+        assert setup["joined"] == [embeddings1]
+
+    def test_raising_image_two_still_joins_image_one(self, comparison):
+        setup, embeddings1 = comparison
+        setup["image2"] = RuntimeError("detector crashed")
+
+        result = face_comparison_service.forensic_face_comparison(_image(1), _image(2), use_cache=False)
+
+        assert result["error"] == "detector crashed"
+        assert setup["joined"] == [embeddings1]
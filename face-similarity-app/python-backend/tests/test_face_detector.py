@@ -0,0 +1,240 @@
+"""
+tests/test_face_detector.py
+───────────────────────────
+Proxy-resolution detection: boxes found on the downscaled proxy must come
+back in full-resolution pixels, and min_size must be scaled onto the proxy.
+UltraFace outputs are thresholded, NMS'd, size-filtered and clipped to the
+image; a static batch dim gets a padded final chunk.
+Pure in-memory — a fake cascade and a fake session stand in for the models.
+"""
+
+from __future__ import annotations
+
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from models import face_detector
+
+
+class _FakeCascade:
+    """Returns fixed proxy boxes and records what detectMultiScale was called with."""
+
+    def __init__(self, boxes):
+        self.boxes = np.asarray(boxes, dtype=np.int32).reshape(-1, 4)
+        self.calls = []
+
+    def detectMultiScale(self, gray, scaleFactor, minNeighbors, minSize):
+        self.calls.append({"shape": gray.shape, "minSize": minSize})
+        return self.boxes
+
+
+@pytest.fixture()
+def cascade(monkeypatch):
+    fake = _FakeCascade([[100, 50, 40, 60]])
+    monkeypatch.setattr(face_detector, "_haar", lambda: fake)
+    monkeypatch.setattr(face_detector, "DETECT_MAX_SIDE", 800)
+    monkeypatch.setattr(face_detector, "DETECTOR_BACKEND", "haar")
+    return fake
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# Proxy scaling helpers
+# ══════════════════════════════════════════════════════════════════════════════
+
+class TestProxyScale:
+
+    def test_small_images_are_not_scaled(self, monkeypatch):
+        monkeypatch.setattr(face_detector, "DETECT_MAX_SIDE", 800)
+        assert face_detector._proxy_scale((600, 800, 3)) == 1.0
+
+    def test_longest_side_is_brought_to_max(self, monkeypatch):
+        monkeypatch.setattr(face_detector, "DETECT_MAX_SIDE", 800)
+        assert face_detector._proxy_scale((1600, 3200, 3)) == pytest.approx(0.25)
+
+    def test_zero_disables_the_proxy(self, monkeypatch):
+        monkeypatch.setattr(face_detector, "DETECT_MAX_SIDE", 0)
+        assert face_detector._proxy_scale((5000, 5000)) == 1.0
+
+
+class TestToFullResolution:
+
+    def test_boxes_are_scaled_up(self):
+        boxes = face_detector._to_full_resolution([[10, 20, 30, 40]], 0.5, (1000, 1000))
+        assert boxes.dtype == np.int32
+        assert boxes.tolist() == [[20, 40, 60, 80]]
+
+    def test_fractional_edges_round_outwards(self):
+        # x: 10 / 0.3 = 33.3 -> 33, x2: 20 / 0.3 = 66.7 -> 67
+        boxes = face_detector._to_full_resolution([[10, 10, 10, 10]], 0.3, (1000, 1000))
+        assert boxes.tolist() == [[33, 33, 34, 34]]
+
+    def test_boxes_are_clipped_to_the_image(self):
+        boxes = face_detector._to_full_resolution([[-5, 90, 120, 30]], 0.5, (200, 220))
+        x, y, w, h = boxes[0]
+        assert (x, y) == (0, 180)
+        assert x + w == 220
+        assert y + h == 200
+
+    def test_clipped_box_keeps_at_least_one_pixel(self):
+        boxes = face_detector._to_full_resolution([[500, 500, 10, 10]], 1.0, (100, 100))
+        assert boxes.tolist() == [[99, 99, 1, 1]]
+
+    def test_empty_input(self):
+        boxes = face_detector._to_full_resolution([], 0.5, (100, 100))
+        assert boxes.shape == (0, 4)
+
+
+class TestProxyMinSize:
+
+    def test_min_size_follows_the_proxy_scale(self):
+        assert face_detector._proxy_min_size((30, 30), 0.25) == (8, 8)
+
+    def test_tiny_min_size_stays_at_least_one(self):
+        assert face_detector._proxy_min_size((2, 2), 0.1) == (1, 1)
+
+    def test_zero_means_no_minimum(self):
+        assert face_detector._proxy_min_size((0, 0), 0.25) == (0, 0)
+
+    def test_unscaled_is_unchanged(self):
+        assert face_detector._proxy_min_size((30, 40), 1.0) == (30, 40)
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# Haar detection on the proxy
+# ══════════════════════════════════════════════════════════════════════════════
+
+class TestDetectOnProxy:
+
+    def test_large_image_is_detected_on_a_proxy(self, cascade):
+        img = np.zeros((1600, 3200, 3), dtype=np.uint8)
+        boxes = face_detector.detect_faces(img, min_size=(40, 40))
+
+        call = cascade.calls[0]
+        assert call["shape"] == (400, 800)
+        assert call["minSize"] == (10, 10)
+        assert boxes.tolist() == [[400, 200, 160, 240]]
+
+    def test_small_image_is_detected_at_full_resolution(self, cascade):
+        img = np.zeros((300, 400), dtype=np.uint8)
+        boxes = face_detector.detect_faces(img, min_size=(30, 30))
+
+        assert cascade.calls[0] == {"shape": (300, 400), "minSize": (30, 30)}
+        assert boxes.tolist() == [[100, 50, 40, 60]]
+
+    def test_batch_returns_one_result_per_image(self, cascade):
+        images = [np.zeros((300, 400), dtype=np.uint8), np.zeros((1600, 1600, 3), dtype=np.uint8)]
+        results = face_detector.detect_faces_batch(images, min_size=(0, 0))
+
+        assert len(results) == 2
+        assert [c["minSize"] for c in cascade.calls] == [(0, 0), (0, 0)]
+        assert results[1].tolist() == [[200, 100, 80, 120]]
+
+    def test_largest_face(self):
+        assert face_detector.largest_face(np.empty((0, 4))) is None
+        assert face_detector.largest_face([[0, 0, 10, 10], [5, 5, 20, 30], [1, 1, 25, 5]]) == (5, 5, 20, 30)
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# ONNX (UltraFace) decoding
+# ══════════════════════════════════════════════════════════════════════════════
+
+def _decode(rows, shape=(80, 160), min_size=(0, 0)):
+    """rows: (face score, x1, y1, x2, y2) with corners as fractions of the image (eighths stay exact)."""
+    rows = np.asarray(rows, dtype=np.float32).reshape(-1, 5)
+    scores = np.stack([1.0 - rows[:, 0], rows[:, 0]], axis=1)
+    return face_detector._decode_onnx(scores, rows[:, 1:], shape, min_size)
+
+
+@pytest.fixture()
+def onnx_thresholds(monkeypatch):
+    monkeypatch.setattr(face_detector, "ONNX_SCORE_THRESHOLD", 0.75)
+    monkeypatch.setattr(face_detector, "ONNX_NMS_THRESHOLD", 0.3)
+
+
+class TestDecodeOnnx:
+
+    def test_boxes_are_scaled_to_the_image(self, onnx_thresholds):
+        boxes = _decode([[0.9, 0.125, 0.25, 0.5, 0.75]])
+        assert boxes.dtype == np.int32
+        assert boxes.tolist() == [[20, 20, 60, 40]]
+
+    def test_scores_below_threshold_are_dropped(self, onnx_thresholds):
+        boxes = _decode([
+            [0.90, 0.125, 0.125, 0.375, 0.375],
+            [0.74, 0.625, 0.625, 0.875, 0.875],
+            [0.75, 0.625, 0.125, 0.875, 0.375],   # exactly at the threshold
+        ])
+        assert boxes.tolist() == [[20, 10, 40, 20], [100, 10, 40, 20]]
+
+    def test_nothing_above_threshold(self, onnx_thresholds):
+        assert _decode([[0.2, 0.125, 0.125, 0.375, 0.375]]).shape == (0, 4)
+        assert _decode([]).shape == (0, 4)
+
+    def test_overlapping_boxes_keep_the_most_confident(self, onnx_thresholds):
+        boxes = _decode([
+            [0.80, 0.125, 0.125, 0.5, 0.5],
+            [0.95, 0.125, 0.125, 0.625, 0.5],   # same face (IoU 0.75), higher score
+            [0.90, 0.75, 0.125, 0.875, 0.5],    # separate face
+        ])
+        assert boxes.tolist() == [[20, 10, 80, 30], [120, 10, 20, 30]]
+
+    def test_min_size_is_in_full_resolution_pixels(self, onnx_thresholds):
+        rows = [[0.9, 0.0, 0.0, 0.125, 0.625], [0.9, 0.5, 0.5, 1.0, 1.0]]   # 20x50 and 80x40 px
+        assert _decode(rows, min_size=(30, 30)).tolist() == [[80, 40, 80, 40]]
+        assert _decode(rows, min_size=(10, 45)).tolist() == [[0, 0, 20, 50]]
+
+    def test_boxes_outside_the_image_are_clipped(self, onnx_thresholds):
+        boxes = _decode([[0.9, -0.125, -0.25, 0.375, 0.5], [0.9, 0.75, 0.625, 1.25, 1.125]])
+        assert boxes.tolist() == [[0, 0, 60, 40], [120, 50, 40, 30]]
+
+
+class _FakeUltraFace:
+    """One face per image, placed at a fixed fraction; enforces a static batch dim."""
+
+    def __init__(self, fixed_batch=None):
+        self.fixed_batch = fixed_batch
+        self.runs = []
+
+    def run(self, outputs, feeds):
+        batch = feeds["input"]
+        if self.fixed_batch and len(batch) != self.fixed_batch:
+            raise ValueError(f"static batch dim {self.fixed_batch}, got {len(batch)}")
+        self.runs.append(len(batch))
+        scores = np.tile(np.array([[[0.05, 0.95]]], dtype=np.float32), (len(batch), 1, 1))
+        boxes = np.tile(np.array([[[0.25, 0.25, 0.75, 0.75]]], dtype=np.float32), (len(batch), 1, 1))
+        return [scores, boxes]
+
+
+def _onnx_record(fixed_batch=None):
+    session = _FakeUltraFace(fixed_batch)
+    return SimpleNamespace(session=session, input_name="input", sample_shape=(3, 24, 32), fixed_batch=fixed_batch)
+
+
+class TestDetectOnnxBatch:
+
+    def test_dynamic_batch_runs_once(self, onnx_thresholds):
+        record = _onnx_record()
+        images = [np.zeros((40, 40, 3), dtype=np.uint8) for _ in range(5)]
+        results = face_detector._detect_onnx_batch(record, images, (0, 0))
+
+        assert record.session.runs == [5]
+        assert len(results) == 5
+
+    def test_static_batch_pads_the_last_chunk(self, onnx_thresholds):
+        record = _onnx_record(fixed_batch=4)
+        images = [np.zeros((40 * (i + 1), 80, 3), dtype=np.uint8) for i in range(6)]
+        results = face_detector._detect_onnx_batch(record, images, (0, 0))
+
+        assert record.session.runs == [4, 4]
+        # Padding outputs are dropped; every image keeps its own scale
+        assert [r.tolist() for r in results] == [[[20, 10 * (i + 1), 40, 20 * (i + 1)]] for i in range(6)]
+
+    def test_static_batch_of_one(self, onnx_thresholds):
+        record = _onnx_record(fixed_batch=1)
+        images = [np.zeros((40, 40), dtype=np.uint8) for _ in range(3)]
+        results = face_detector._detect_onnx_batch(record, images, (0, 0))
+
+        assert record.session.runs == [1, 1, 1]
+        assert [r.tolist() for r in results] == [[[10, 10, 20, 20]]] * 3
@@ -0,0 +1,150 @@
+"""
+tests/test_facenet_service.py
+─────────────────────────────
+Facenet microservice /embedding/raw body decoding: raw pixels must match
+X-Image-Shape exactly, encoded bodies must decode, and shared-dir handoff
+names must stay inside FACENET_SHARED_DIR.
+Pure in-memory apart from a tmp_path shared dir — the Facenet model is never loaded.
+"""
+
+from __future__ import annotations
+
+import importlib.util
+import os
+
+import cv2
+import numpy as np
+import pytest
+
+pytest.importorskip("fastapi")
+pytest.importorskip("deepface")
+pytest.importorskip("uvicorn")
+
+from fastapi import HTTPException
+
+_MAIN = os.path.join(os.path.dirname(__file__), "..", "..", "facenet_service", "main.py")
+
+
+def _load_service():
+    spec = importlib.util.spec_from_file_location("facenet_service_main", _MAIN)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture(scope="module")
+def service():
+    return _load_service()
+
+
+@pytest.fixture()
+def shared_dir(service, tmp_path, monkeypatch):
+    monkeypatch.setattr(service, "SHARED_DIR", str(tmp_path))
+    return tmp_path
+
+
+def _face(h: int = 4, w: int = 5, c: int = 3) -> np.ndarray:
+    return np.arange(h * w * c, dtype=np.uint8).reshape(h, w, c)
+
+
+def _raw_headers(shape) -> dict:
+    return {"content-type": "application/octet-stream", "x-image-shape": ",".join(str(v) for v in shape)}
+
+
+def _status(service, body: bytes, headers: dict) -> int:
+    with pytest.raises(HTTPException) as exc:
+        service._decode_raw_request(body, headers)
+    return exc.value.status_code
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# Raw pixels
+# ══════════════════════════════════════════════════════════════════════════════
+
+class TestRawPixels:
+
+    def test_pixels_round_trip(self, service):
+        face = _face()
+        img = service._decode_raw_request(face.tobytes(), _raw_headers(face.shape))
+        np.testing.assert_array_equal(img, face)
+        assert img.flags.writeable
+
+    def test_grayscale_shape_is_accepted(self, service):
+        face = _face(c=1)[:, :, 0]
+        img = service._decode_raw_request(face.tobytes(), _raw_headers(face.shape))
+        assert img.shape == (4, 5)
+
+    def test_body_length_must_match_shape(self, service):
+        face = _face()
+        assert _status(service, face.tobytes()[:-1], _raw_headers(face.shape)) == 400
+        assert _status(service, face.tobytes() + b"\0", _raw_headers(face.shape)) == 400
+
+    @pytest.mark.parametrize("shape", ["", "4", "4,5,3,1", "4,x,3", "0,5,3", "-4,5,3"])
+    def test_malformed_shape_is_rejected(self, service, shape):
+        headers = {"content-type": "application/octet-stream", "x-image-shape": shape}
+        assert _status(service, _face().tobytes(), headers) == 400
+
+    def test_oversized_shape_is_rejected(self, service):
+        side = int(np.sqrt(service.MAX_RAW_PIXELS)) + 1
+        assert _status(service, b"", _raw_headers((side, side, 3))) == 400
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# Encoded bodies
+# ══════════════════════════════════════════════════════════════════════════════
+
+class TestEncodedBody:
+
+    def test_png_is_decoded_losslessly(self, service):
+        face = _face(16, 16)
+        ok, buf = cv2.imencode(".png", face)
+        assert ok
+        img = service._decode_raw_request(buf.tobytes(), {"content-type": "image/png"})
+        np.testing.assert_array_equal(img, face)
+
+    def test_undecodable_body_is_rejected(self, service):
+        assert _status(service, b"not a jpeg", {"content-type": "image/jpeg; charset=binary"}) == 400
+
+    def test_unknown_content_type_is_unsupported(self, service):
+        assert _status(service, b"{}", {"content-type": "application/json"}) == 415
+        assert _status(service, b"", {}) == 415
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# Shared-dir handoff
+# ══════════════════════════════════════════════════════════════════════════════
+
+class TestSharedDir:
+
+    def test_named_file_is_loaded(self, service, shared_dir):
+        face = _face()
+        np.save(shared_dir / "face-1.npy", face)
+        img = service._decode_raw_request(b"", {"x-image-name": "face-1.npy"})
+        np.testing.assert_array_equal(img, face)
+
+    @pytest.mark.parametrize("name", [
+        "../face-1.npy",
+        "sub/face-1.npy",
+        "/etc/passwd",
+        "face-1.txt",
+        "..",
+    ])
+    def test_path_traversal_is_rejected(self, service, shared_dir, name):
+        outside = shared_dir.parent / "face-1.npy"
+        np.save(outside, _face())
+        assert _status(service, b"", {"x-image-name": name}) == 400
+
+    def test_disabled_without_shared_dir(self, service, monkeypatch):
+        monkeypatch.setattr(service, "SHARED_DIR", None)
+        assert _status(service, b"", {"x-image-name": "face-1.npy"}) == 400
+
+    def test_missing_file_is_a_bad_request(self, service, shared_dir):
+        assert _status(service, b"", {"x-image-name": "missing.npy"}) == 400
+
+    def test_non_uint8_array_is_rejected(self, service, shared_dir):
+        np.save(shared_dir / "float.npy", _face().astype(np.float32))
+        assert _status(service, b"", {"x-image-name": "float.npy"}) == 400
+
+    def test_pickled_object_is_not_loaded(self, service, shared_dir):
+        np.save(shared_dir / "obj.npy", np.array([{"a": 1}], dtype=object), allow_pickle=True)
+        assert _status(service, b"", {"x-image-name": "obj.npy"}) == 400
@@ -0,0 +1,653 @@
+"""
+tests/test_faiss_service.py
+───────────────────────────
+FAISS service tests: incremental add/remove and compaction.
+Pure in-memory — no DB rows or model weights involved.
+"""
+
+from __future__ import annotations
+
+import threading
+
+import numpy as np
+import pytest
+
+from services import faiss_service, filter_service
+
+
+def _vec(seed: int, dim: int = 512) -> np.ndarray:
+    v = np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+    return v / np.linalg.norm(v)
+
+
+@pytest.fixture()
+def gallery():
+    """Fresh 20-identity gallery with built indexes."""
+    faiss_service.clear_embedding_cache()
+    for i in range(20):
+        faiss_service.set_cached_embedding(f"CR-FAISS-{i:03d}", _vec(i), _vec(1000 + i))
+    faiss_service.build_faiss_index()
+    yield
+    faiss_service.clear_embedding_cache()
+    faiss_service.build_faiss_index()
+
+
+def _top_id(query_seed: int) -> str:
+    candidates, used_faiss = faiss_service.search_top_k_candidates(
+        _vec(query_seed), _vec(1000 + query_seed), top_k=5
+    )
+    assert used_faiss
+    return candidates[0]["criminal_id"]
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# Incremental updates
+# ══════════════════════════════════════════════════════════════════════════════
+
+class TestIncrementalUpdates:
+
+    def test_add_embedding_is_searchable_without_rebuild(self, gallery):
+        faiss_service.add_embedding("CR-FAISS-NEW", _vec(500), _vec(1500))
+
+        assert not faiss_service.get_faiss_index_stats()["is_dirty"]
+        assert _top_id(500) == "CR-FAISS-NEW"
+
+    def test_remove_embedding_hides_criminal(self, gallery):
+        assert _top_id(3) == "CR-FAISS-003"
+
+        assert faiss_service.remove_embedding("CR-FAISS-003") is True
+        assert faiss_service.get_cached_embedding("CR-FAISS-003") is None
+
+        candidates, _ = faiss_service.search_top_k_candidates(_vec(3), _vec(1003), top_k=20)
+        assert "CR-FAISS-003" not in [c["criminal_id"] for c in candidates]
+        assert len(candidates) == 19
+
+    def test_remove_unknown_returns_false(self, gallery):
+        assert faiss_service.remove_embedding("CR-DOES-NOT-EXIST") is False
+
+    def test_re_adding_replaces_vectors(self, gallery):
+        faiss_service.add_embedding("CR-FAISS-004", _vec(777), _vec(1777))
+
+        assert _top_id(777) == "CR-FAISS-004"
+        assert faiss_service.get_faiss_index_stats()["criminal_ids_count"] == 20
+
+    def test_compaction_purges_tombstones(self, gallery):
+        for i in range(5):
+            faiss_service.remove_embedding(f"CR-FAISS-{i:03d}")
+        assert faiss_service.get_faiss_index_stats()["tombstones"] == 5
+
+        purged = faiss_service.compact_faiss_index()
+
+        stats = faiss_service.get_faiss_index_stats()
+        assert purged == 5
+        assert stats["tombstones"] == 0
+        assert stats["insightface_vectors"] == 15
+        assert stats["facenet_vectors"] == 15
+        assert _top_id(10) == "CR-FAISS-010"
+
+    def test_build_uses_store_rows_as_labels(self, gallery):
+        snap = faiss_service.get_index_snapshot()
+        ids, _ = faiss_service.get_embedding_cache().export()
+
+        assert snap.labels == {cid: label for label, cid in enumerate(ids)}
+        assert _top_id(9) == "CR-FAISS-009"
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# Vectorised linear fallback
+# ══════════════════════════════════════════════════════════════════════════════
+
+def _reference_scores(q_ins, q_face, cids, is_sketch):
+    queries = {"insightface": q_ins, "facenet": q_face}
+    weights = faiss_service.model_weights(is_sketch)
+    scored = [faiss_service._exact_fused_scores(cid, queries, weights) for cid in cids]
+    return sorted(scored, key=lambda c: c["embedding_fusion"], reverse=True)
+
+
+class TestLinearSearch:
+
+    @pytest.mark.parametrize("is_sketch", [False, True])
+    def test_matches_per_criminal_scoring(self, gallery, is_sketch):
+        faiss_service.set_cached_embedding("CR-FAISS-NOFACE", _vec(4) + 0.5 * _vec(5), None)
+        q_ins, q_face = _vec(4) + 0.3 * _vec(5), _vec(1004)
+
+        results = faiss_service.linear_search_embeddings(q_ins, q_face, top_k=8, is_sketch=is_sketch)
+
+        cids = list(faiss_service.get_embedding_cache())
+        expected = _reference_scores(q_ins, q_face, cids, is_sketch)[:8]
+        assert [c["criminal_id"] for c in results] == [c["criminal_id"] for c in expected]
+        for got, want in zip(results, expected):
+            assert got["embedding_fusion"] == pytest.approx(want["embedding_fusion"], abs=1e-6)
+            assert (got["facenet_similarity"] is None) == (want["facenet_similarity"] is None)
+
+    def test_subset_and_cache_writes(self, gallery):
+        subset = ["CR-FAISS-002", "CR-FAISS-009", "CR-DOES-NOT-EXIST"]
+        results = faiss_service.linear_search_embeddings(_vec(9), _vec(1009), subset, top_k=5)
+        assert [c["criminal_id"] for c in results] == ["CR-FAISS-009", "CR-FAISS-002"]
+
+        faiss_service.remove_embedding("CR-FAISS-009")
+        faiss_service.add_embedding("CR-FAISS-002", _vec(9), _vec(1009))
+        results = faiss_service.linear_search_embeddings(_vec(9), _vec(1009), subset, top_k=5)
+        assert [c["criminal_id"] for c in results] == ["CR-FAISS-002"]
+        assert results[0]["embedding_fusion"] == pytest.approx(0.5 * 1.0 + 0.5 * 0.875)
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# ANN index types
+# ══════════════════════════════════════════════════════════════════════════════
+
+def _clustered_gallery(n: int, dim: int = 512) -> np.ndarray:
+    rng = np.random.default_rng(42)
+    centers = rng.standard_normal((32, dim)).astype(np.float32)
+    rows = centers[rng.integers(0, 32, n)] + 0.3 * rng.standard_normal((n, dim)).astype(np.float32)
+    return rows / np.linalg.norm(rows, axis=1, keepdims=True)
+
+
+@pytest.fixture(params=["ivf", "hnsw"])
+def ann_gallery(request, monkeypatch):
+    """2000-identity gallery built with an ANN index type."""
+    monkeypatch.setattr(faiss_service, "FAISS_INDEX_TYPE", request.param)
+    faiss_service.clear_embedding_cache()
+    rows = _clustered_gallery(2000)
+    for i, row in enumerate(rows):
+        faiss_service.set_cached_embedding(f"CR-ANN-{i:04d}", row, row)
+    faiss_service.build_faiss_index()
+    yield request.param, rows
+    faiss_service.clear_embedding_cache()
+    faiss_service.build_faiss_index()
+
+
+class TestAnnIndexes:
+
+    def test_build_reports_kind_and_recall(self, ann_gallery):
+        kind, _ = ann_gallery
+        stats = faiss_service.get_faiss_index_stats()
+
+        assert stats["index_type"] == kind
+        assert stats["insightface_vectors"] == 2000
+        assert stats["recall_at_k"]["insightface"] >= 0.9
+
+    def test_self_query_finds_itself(self, ann_gallery):
+        _, rows = ann_gallery
+        candidates, used_faiss = faiss_service.search_top_k_candidates(rows[123], rows[123], top_k=5)
+
+        assert used_faiss
+        assert candidates[0]["criminal_id"] == "CR-ANN-0123"
+
+    def test_remove_then_compact(self, ann_gallery):
+        _, rows = ann_gallery
+        faiss_service.remove_embedding("CR-ANN-0123")
+        faiss_service.compact_faiss_index()
+
+        candidates, _ = faiss_service.search_top_k_candidates(rows[123], rows[123], top_k=5)
+        assert "CR-ANN-0123" not in [c["criminal_id"] for c in candidates]
+        assert faiss_service.get_faiss_index_stats()["tombstones"] == 0
+
+    def test_small_gallery_falls_back_to_flat(self, monkeypatch):
+        monkeypatch.setattr(faiss_service, "FAISS_INDEX_TYPE", "ivf")
+        assert faiss_service._resolve_index_kind(100) == "flat"
+        monkeypatch.setattr(faiss_service, "FAISS_INDEX_TYPE", "auto")
+        assert faiss_service._resolve_index_kind(faiss_service.FAISS_ANN_THRESHOLD) == faiss_service.FAISS_ANN_KIND
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# Compressed storage
+# ══════════════════════════════════════════════════════════════════════════════
+
+@pytest.fixture(params=["fp16", "sq8", "pq"])
+def compressed_gallery(request, monkeypatch):
+    """2000-identity gallery stored as compressed codes."""
+    monkeypatch.setattr(faiss_service, "FAISS_INDEX_TYPE", "flat")
+    monkeypatch.setattr(faiss_service, "FAISS_COMPRESSION", request.param)
+    faiss_service.clear_embedding_cache()
+    rows = _clustered_gallery(2000)
+    for i, row in enumerate(rows):
+        faiss_service.set_cached_embedding(f"CR-SQ-{i:04d}", row, row)
+    faiss_service.build_faiss_index()
+    yield request.param, rows
+    faiss_service.clear_embedding_cache()
+    faiss_service.build_faiss_index()
+
+
+class TestCompressedIndexes:
+
+    def test_build_reports_compression(self, compressed_gallery):
+        compression, _ = compressed_gallery
+        stats = faiss_service.get_faiss_index_stats()
+
+        assert stats["compression"] == compression
+        assert stats["index_type"] == ("ivf" if compression == "pq" else "flat")
+        assert stats["insightface_vectors"] == 2000
+
+    def test_shortlist_is_rescored_exactly(self, compressed_gallery):
+        compression, rows = compressed_gallery
+        candidates, used_faiss = faiss_service.search_top_k_candidates(rows[7], rows[7], top_k=5)
+
+        assert used_faiss
+        assert candidates[0]["criminal_id"] == "CR-SQ-0007"
+        # Exact float32 cosine of a vector with itself → calibrated 1.0
+        assert candidates[0]["insightface_similarity"] == pytest.approx(1.0, abs=1e-5)
+
+        exact = faiss_service.linear_search_embeddings(rows[7], rows[7], top_k=5)
+        got, want = [c["criminal_id"] for c in candidates], [c["criminal_id"] for c in exact]
+        if compression == "pq":
+            # IVF-PQ can miss neighbours outside the probed lists; scores that are returned are exact
+            assert len(set(got) & set(want)) >= 3
+        else:
+            assert got == want
+
+    def test_pq_needs_enough_vectors(self, monkeypatch):
+        monkeypatch.setattr(faiss_service, "FAISS_INDEX_TYPE", "flat")
+        monkeypatch.setattr(faiss_service, "FAISS_COMPRESSION", "pq")
+        assert faiss_service._resolve_layout(100) == ("flat", "sq8")
+        assert faiss_service._resolve_layout(5000) == ("ivf", "pq")
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# Joint index
+# ══════════════════════════════════════════════════════════════════════════════
+
+@pytest.fixture()
+def joint_gallery(monkeypatch):
+    """Gallery with correlated model vectors, built as one joint index."""
+    monkeypatch.setattr(faiss_service, "FAISS_JOINT_INDEX", True)
+    faiss_service.clear_embedding_cache()
+    for i in range(50):
+        face = _vec(1000 + i) + 0.8 * _vec(i)   # Facenet half loosely tracks InsightFace
+        faiss_service.set_cached_embedding(f"CR-JOINT-{i:03d}", _vec(i), face)
+    faiss_service.set_cached_embedding("CR-JOINT-NOFACE", _vec(600), None)
+    faiss_service.build_faiss_index()
+    yield
+    faiss_service.clear_embedding_cache()
+    faiss_service.build_faiss_index()
+
+
+class TestJointIndex:
+
+    def test_builds_single_index(self, joint_gallery):
+        stats = faiss_service.get_faiss_index_stats()
+
+        assert stats["joint_vectors"] == 51
+        assert stats["insightface_vectors"] == 0
+        assert stats["facenet_vectors"] == 0
+
+    @pytest.mark.parametrize("is_sketch", [False, True])
+    def test_matches_exact_linear_fusion(self, joint_gallery, is_sketch):
+        q_ins, q_face = _vec(5), _vec(1005) + 0.8 * _vec(5)
+
+        joint, used_faiss = faiss_service.search_top_k_candidates(q_ins, q_face, top_k=5, is_sketch=is_sketch)
+        exact = faiss_service.linear_search_embeddings(q_ins, q_face, top_k=5, is_sketch=is_sketch)
+
+        assert used_faiss
+        assert [c["criminal_id"] for c in joint] == [c["criminal_id"] for c in exact]
+        assert joint[0]["embedding_fusion"] == pytest.approx(exact[0]["embedding_fusion"], abs=1e-5)
+
+    def test_missing_facenet_half_is_neutral(self, joint_gallery):
+        candidates, _ = faiss_service.search_top_k_candidates(_vec(600), _vec(1600), top_k=3)
+
+        top = candidates[0]
+        assert top["criminal_id"] == "CR-JOINT-NOFACE"
+        assert top["facenet_similarity"] is None
+        assert top["embedding_fusion"] == pytest.approx(0.5 * 1.0 + 0.5 * 0.5, abs=1e-5)
+
+    def test_incremental_add(self, joint_gallery):
+        faiss_service.add_embedding("CR-JOINT-NEW", _vec(700), _vec(1700))
+
+        assert _top_id(700) == "CR-JOINT-NEW"
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# Batched search
+# ══════════════════════════════════════════════════════════════════════════════
+
+class TestBatchSearch:
+
+    def test_batch_matches_single_queries(self, gallery):
+        seeds = [2, 9, 15]
+        q_ins  = np.vstack([_vec(s) for s in seeds])
+        q_face = np.vstack([_vec(1000 + s) for s in seeds])
+
+        batch, used_faiss = faiss_service.search_top_k_candidates_batch(
+            q_ins, q_face, top_k=5, is_sketch=[True, False, True]
+        )
+
+        assert used_faiss
+        assert len(batch) == 3
+        for s, flag, results in zip(seeds, [True, False, True], batch):
+            single, _ = faiss_service.search_top_k_candidates(_vec(s), _vec(1000 + s), top_k=5, is_sketch=flag)
+            assert [c["criminal_id"] for c in results] == [c["criminal_id"] for c in single]
+            assert results[0]["embedding_fusion"] == pytest.approx(single[0]["embedding_fusion"])
+
+    def test_batch_joint_mode(self, joint_gallery):
+        q_ins  = np.vstack([_vec(3), _vec(4)])
+        q_face = np.vstack([_vec(1003) + 0.8 * _vec(3), _vec(1004) + 0.8 * _vec(4)])
+
+        batch, _ = faiss_service.search_top_k_candidates_batch(q_ins, q_face, top_k=3)
+
+        assert [results[0]["criminal_id"] for results in batch] == ["CR-JOINT-003", "CR-JOINT-004"]
+
+    def test_aggregate_rewards_consistent_hits(self):
+        batch = [
+            [{"criminal_id": "A", "embedding_fusion": 0.80}, {"criminal_id": "B", "embedding_fusion": 0.70}],
+            [{"criminal_id": "B", "embedding_fusion": 0.75}, {"criminal_id": "C", "embedding_fusion": 0.60}],
+            [{"criminal_id": "B", "embedding_fusion": 0.72}, {"criminal_id": "A", "embedding_fusion": 0.65}],
+        ]
+
+        ranking = faiss_service.aggregate_batch_candidates(batch, top_k=3)
+
+        assert [r["criminal_id"] for r in ranking] == ["B", "A", "C"]
+        assert ranking[0]["hits"] == 3
+        assert ranking[1]["query_ranks"] == [1, None, 2]
+        # A missed query 2 → contributes that query's cut-off 0.60
+        assert ranking[1]["aggregate_score"] == pytest.approx((0.80 + 0.60 + 0.65) / 3)
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# Metadata filters
+# ══════════════════════════════════════════════════════════════════════════════
+
+@pytest.fixture()
+def tagged_gallery(gallery):
+    """Gallery where even ids are Male, ids 0-4 are linked to case 7."""
+    for i in range(20):
+        filter_service.set_criminal_attributes(
+            f"CR-FAISS-{i:03d}",
+            sex="Male" if i % 2 == 0 else "Female",
+            nationality="Indian",
+            status="Wanted" if i < 10 else "Convicted",
+        )
+    filter_service.set_case_links(7, [f"CR-FAISS-{i:03d}" for i in range(5)])
+    yield
+    for i in range(20):
+        filter_service.remove_criminal_attributes(f"CR-FAISS-{i:03d}")
+
+
+class TestMetadataFilters:
+
+    def test_compile_filter_ands_attributes(self, tagged_gallery):
+        selected = filter_service.compile_filter({"sex": "male", "case_id": 7})
+        assert selected == {"CR-FAISS-000", "CR-FAISS-002", "CR-FAISS-004"}
+
+        assert filter_service.compile_filter({"status": ["wanted", "convicted"]}) == set(
+            f"CR-FAISS-{i:03d}" for i in range(20)
+        )
+        assert filter_service.compile_filter(None) is None
+
+    @pytest.mark.parametrize("brute_force", [2048, 0])
+    def test_filtered_search_only_returns_matches(self, tagged_gallery, monkeypatch, brute_force):
+        monkeypatch.setattr(faiss_service, "FAISS_FILTER_BRUTE_FORCE", brute_force)
+
+        # Query for a Female criminal while filtering on Male
+        candidates, used_faiss = faiss_service.search_top_k_candidates(
+            _vec(3), _vec(1003), top_k=5, filters={"sex": "Male"}
+        )
+
+        ids = [c["criminal_id"] for c in candidates]
+        assert len(ids) == 5
+        assert all(int(cid[-3:]) % 2 == 0 for cid in ids)
+        assert used_faiss == (brute_force == 0)
+
+    def test_filter_with_fewer_rows_than_top_k(self, tagged_gallery, monkeypatch):
+        monkeypatch.setattr(faiss_service, "FAISS_FILTER_BRUTE_FORCE", 0)
+        candidates, _ = faiss_service.search_top_k_candidates(
+            _vec(1), _vec(1001), top_k=10, filters={"case_id": 7, "sex": "Female"}
+        )
+        assert sorted(c["criminal_id"] for c in candidates) == ["CR-FAISS-001", "CR-FAISS-003"]
+
+    def test_attributes_follow_writes(self, tagged_gallery):
+        faiss_service.remove_embedding("CR-FAISS-002")
+        assert "CR-FAISS-002" not in (filter_service.compile_filter({"case_id": 7}) or set())
+
+        filter_service.set_case_links(7, ["CR-FAISS-010"])
+        assert filter_service.compile_filter({"case_id": 7}) == {"CR-FAISS-010"}
+
+    def test_empty_filter_result(self, tagged_gallery):
+        candidates, _ = faiss_service.search_top_k_candidates(
+            _vec(1), _vec(1001), top_k=5, filters={"nationality": "Nepali"}
+        )
+        assert candidates == []
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# Range search
+# ══════════════════════════════════════════════════════════════════════════════
+
+def _exhaustive_above(q_ins, q_face, threshold, is_sketch):
+    everything = faiss_service.linear_search_embeddings(q_ins, q_face, top_k=10_000, is_sketch=is_sketch)
+    return [c["criminal_id"] for c in everything if c["embedding_fusion"] >= threshold]
+
+
+class TestRangeSearch:
+
+    @pytest.mark.parametrize("is_sketch", [False, True])
+    def test_matches_exhaustive_threshold(self, gallery, is_sketch):
+        q_ins, q_face = _vec(4) + 0.3 * _vec(5), _vec(1004) + 0.3 * _vec(1005)
+        exhaustive = faiss_service.linear_search_embeddings(q_ins, q_face, top_k=20, is_sketch=is_sketch)
+        threshold = exhaustive[2]["embedding_fusion"] - 1e-6   # top 3 qualify
+
+        results, pruned = faiss_service.search_range_candidates(
+            q_ins, q_face, min_score=threshold, is_sketch=is_sketch
+        )
+
+        # Balanced photo weights leave the per-model bounds at <= 0 here, so
+        # only the sketch weighting actually prunes at this threshold
+        assert pruned == is_sketch
+        assert [c["criminal_id"] for c in results] == _exhaustive_above(q_ins, q_face, threshold, is_sketch)
+        assert len(results) == 3
+
+    def test_results_in_score_order_with_cap(self, gallery):
+        results, pruned = faiss_service.search_range_candidates(
+            _vec(4), _vec(1004), min_score=0.0, max_results=7
+        )
+
+        scores = [c["embedding_fusion"] for c in results]
+        assert len(scores) == 7
+        assert scores == sorted(scores, reverse=True)
+        assert pruned   # the cap cut qualifying candidates
+
+    def test_not_pruned_when_everything_qualifies_within_cap(self, gallery):
+        results, pruned = faiss_service.search_range_candidates(
+            _vec(4), _vec(1004), min_score=0.0, max_results=100
+        )
+
+        assert len(results) == faiss_service.get_cache_size()
+        assert not pruned
+
+    def test_high_threshold_returns_nothing(self, gallery):
+        results, _ = faiss_service.search_range_candidates(_vec(4), _vec(1004), min_score=0.99)
+        assert results == []
+
+    def test_joint_mode(self, joint_gallery):
+        q_ins, q_face = _vec(8), _vec(1008) + 0.8 * _vec(8)
+        exhaustive = faiss_service.linear_search_embeddings(q_ins, q_face, top_k=100)
+        threshold = exhaustive[1]["embedding_fusion"] - 1e-6
+
+        results, _ = faiss_service.search_range_candidates(q_ins, q_face, min_score=threshold)
+
+        assert [c["criminal_id"] for c in results] == [c["criminal_id"] for c in exhaustive[:2]]
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# Model registry
+# ══════════════════════════════════════════════════════════════════════════════
+
+@pytest.fixture()
+def three_model_gallery():
+    """The 20-identity gallery plus a registered 128-D sketch model (absent for every 5th)."""
+    faiss_service.clear_embedding_cache()
+    faiss_service.register_model(faiss_service.ModelSpec(
+        "sketchnet", 128, {"sketch": 0.4, "photo": 0.0}, label="SketchNet", clamp=0.9,
+    ))
+    for i in range(20):
+        faiss_service.set_cached_embedding(
+            f"CR-FAISS-{i:03d}", _vec(i), _vec(1000 + i),
+            sketchnet=None if i % 5 == 0 else _vec(5000 + i, 128),
+        )
+    faiss_service.build_faiss_index()
+    yield
+    faiss_service.clear_embedding_cache()
+    faiss_service.unregister_model("sketchnet")
+    faiss_service.build_faiss_index()
+
+
+class TestModelRegistry:
+
+    def test_builtin_weights(self):
+        assert faiss_service.model_weights(True) == {"insightface": 0.1, "facenet": 0.9}
+        assert faiss_service.model_weights(False) == {"insightface": 0.5, "facenet": 0.5}
+        assert faiss_service._model_weights(True) == (0.1, 0.9)
+
+    def test_embedding_version_tracks_model_hash(self):
+        fp32 = faiss_service.get_embedding_version("a" * 64)
+        int8 = faiss_service.get_embedding_version("b" * 64)
+        assert fp32 != int8
+        assert fp32.startswith(faiss_service.EMBEDDING_VERSION)
+        assert len(fp32) <= 50   # criminals.embedding_version column
+        assert faiss_service.get_embedding_version("") == faiss_service.EMBEDDING_VERSION
+
+    def test_registry_changes_need_empty_gallery(self, gallery):
+        spec = faiss_service.ModelSpec("late", 64, {"sketch": 0.1, "photo": 0.1})
+        with pytest.raises(RuntimeError):
+            faiss_service.register_model(spec)
+        with pytest.raises(ValueError):
+            faiss_service.set_cached_embedding("CR-BAD", _vec(1), _vec(2), late=_vec(3, 64))
+
+    def test_third_model_is_indexed_and_fused(self, three_model_gallery):
+        assert faiss_service.get_faiss_index_stats()["models"] == {
+            "insightface": 20, "facenet": 20, "sketchnet": 16,
+        }
+        extra = {"sketchnet": _vec(5007, 128)}
+        q_ins, q_face = _vec(3) + 0.8 * _vec(7), _vec(1003) + 0.8 * _vec(1007)
+
+        top, used_faiss = faiss_service.search_top_k_candidates(
+            q_ins, q_face, top_k=20, is_sketch=True, extra_queries=extra
+        )
+        exact = faiss_service.linear_search_embeddings(
+            q_ins, q_face, top_k=20, is_sketch=True, extra_queries=extra
+        )
+
+        assert used_faiss
+        assert [c["criminal_id"] for c in top] == [c["criminal_id"] for c in exact]
+        for got, want in zip(top, exact):
+            assert got["embedding_fusion"] == pytest.approx(want["embedding_fusion"], abs=1e-6)
+        # The sketch model's vote lifts CR-FAISS-007 past the closer InsightFace / Facenet match
+        assert top[0]["criminal_id"] == "CR-FAISS-007"
+        assert top[0]["sketchnet_similarity"] == pytest.approx(0.9)
+
+    def test_missing_vector_scores_neutral(self, three_model_gallery):
+        top, _ = faiss_service.search_top_k_candidates(
+            _vec(10), _vec(1010), top_k=1, is_sketch=True, extra_queries={"sketchnet": _vec(9, 128)}
+        )
+        assert top[0]["criminal_id"] == "CR-FAISS-010"
+        assert top[0]["sketchnet_similarity"] is None
+
+    def test_model_scans_run_concurrently(self, three_model_gallery, monkeypatch):
+        threads = {}
+        scan = faiss_service._search_single_index
+
+        def recording_scan(snap, query, top_k, model_label, *args):
+            threads[model_label] = threading.current_thread().name
+            return scan(snap, query, top_k, model_label, *args)
+
+        monkeypatch.setattr(faiss_service, "_search_single_index", recording_scan)
+        faiss_service.search_faiss_index(_vec(1), _vec(1001), extra_queries={"sketchnet": _vec(5001, 128)})
+
+        assert set(threads) == {"insightface", "facenet", "sketchnet"}
+        assert all(name.startswith("faiss-scan") for name in threads.values())
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# Snapshot swapping under concurrency
+# ══════════════════════════════════════════════════════════════════════════════
+
+class TestSnapshotSwap:
+
+    def test_held_snapshot_is_not_mutated_by_writes(self, gallery):
+        before = faiss_service.get_index_snapshot()
+        labels = dict(before.labels)
+
+        faiss_service.add_embedding("CR-FAISS-NEW", _vec(500), _vec(1500))
+        faiss_service.remove_embedding("CR-FAISS-001")
+        faiss_service.compact_faiss_index()
+
+        after = faiss_service.get_index_snapshot()
+        assert after.generation > before.generation
+        assert before.labels == labels and not before.tombstones
+        assert before.ntotal("insightface") == 20
+        assert "CR-FAISS-NEW" in after.labels and "CR-FAISS-001" not in after.labels
+
+    def test_delta_appends_never_copy_published_segments(self, gallery):
+        faiss_service.add_embedding("CR-FAISS-D000", _vec(4000), _vec(5000))
+        held = faiss_service.get_index_snapshot().deltas["insightface"]
+
+        for i in range(1, 100):
+            faiss_service.add_embedding(f"CR-FAISS-D{i:03d}", _vec(4000 + i), _vec(5000 + i))
+
+        segments = faiss_service.get_index_snapshot().deltas["insightface"]
+        assert held[0].ntotal == 1                      # the held snapshot is untouched
+        assert len(segments) == bin(100).count("1")     # 64 + 32 + 4: O(log n) segments
+        assert sum(seg.ntotal for seg in segments) == 100
+        assert _top_id(4000) == "CR-FAISS-D000" and _top_id(4099) == "CR-FAISS-D099"
+
+    def test_background_rebuild_discarded_when_labels_renumbered(self, gallery, monkeypatch):
+        real_build = faiss_service._build_indexes
+        calls = []
+
+        def build_then_relabel(*args, **kwargs):
+            built = real_build(*args, **kwargs)
+            if not calls:
+                calls.append(1)
+                # A full build lands while the background build runs: same
+                # criminals, labels renumbered in reverse order
+                faiss_service.clear_embedding_cache()
+                for i in reversed(range(20)):
+                    faiss_service.set_cached_embedding(f"CR-FAISS-{i:03d}", _vec(i), _vec(1000 + i))
+                faiss_service.build_faiss_index()
+            return built
+
+        monkeypatch.setattr(faiss_service, "_build_indexes", build_then_relabel)
+        faiss_service.rebuild_faiss_index_background()
+
+        assert faiss_service.get_index_snapshot().labels["CR-FAISS-019"] == 0
+        assert _top_id(0) == "CR-FAISS-000"
+        assert _top_id(19) == "CR-FAISS-019"
+
+    def test_dirty_index_rebuilds_off_the_request_path(self, gallery):
+        faiss_service.set_cached_embedding("CR-FAISS-LATE", _vec(600), _vec(1600))
+
+        candidates, used_faiss = faiss_service.search_top_k_candidates(_vec(600), _vec(1600), top_k=5)
+        assert used_faiss   # served from the previous snapshot
+        faiss_service._REBUILD_THREAD.join(timeout=30)
+
+        assert faiss_service.is_faiss_index_ready()
+        assert _top_id(600) == "CR-FAISS-LATE"
+
+    def test_searches_run_while_writers_swap(self, gallery):
+        errors, stop = [], threading.Event()
+
+        def reader(seed):
+            try:
+                while not stop.is_set():
+                    candidates, _ = faiss_service.search_top_k_candidates(
+                        _vec(seed), _vec(1000 + seed), top_k=5
+                    )
+                    ids = [c["criminal_id"] for c in candidates]
+                    assert len(ids) == len(set(ids)) and len(ids) == 5
+            except Exception as e:   # surfaced in the main thread
+                errors.append(e)
+
+        readers = [threading.Thread(target=reader, args=(seed,)) for seed in (10, 11, 12, 13)]
+        for t in readers:
+            t.start()
+        for i in range(40):
+            faiss_service.add_embedding(f"CR-FAISS-W{i:02d}", _vec(2000 + i), _vec(3000 + i))
+            faiss_service.remove_embedding(f"CR-FAISS-W{i:02d}")
+            if i % 10 == 9:
+                faiss_service.compact_faiss_index()
+        stop.set()
+        for t in readers:
+            t.join()
+
+        assert errors == []
+        assert _top_id(12) == "CR-FAISS-012"
+        assert faiss_service.get_faiss_index_stats()["criminal_ids_count"] == 20
@@ -0,0 +1,60 @@
+"""
+tests/test_file_utils.py
+────────────────────────
+Uploads are decoded in memory: read_upload_image never writes under
+temp_uploads, whether the bytes decode or not.
+Pure in-memory apart from a tmp_path temp_uploads dir — no DB rows or model weights involved.
+"""
+
+from __future__ import annotations
+
+import io
+
+import cv2
+import numpy as np
+import pytest
+
+from utils import file_utils
+
+
+class _Upload:
+    """Minimal stand-in for a werkzeug FileStorage."""
+
+    def __init__(self, data: bytes, filename: str):
+        self.stream = io.BytesIO(data)
+        self.filename = filename
+
+    def read(self) -> bytes:
+        return self.stream.read()
+
+
+@pytest.fixture()
+def temp_uploads(tmp_path, monkeypatch):
+    directory = tmp_path / "temp_uploads"
+    monkeypatch.setattr(file_utils, "TEMP_UPLOADS_DIR", None)
+    file_utils.set_temp_uploads_dir(str(directory))
+    return directory
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# read_upload_image
+# ══════════════════════════════════════════════════════════════════════════════
+
+class TestReadUploadImage:
+
+    def test_image_is_decoded_in_memory(self, temp_uploads):
+        img = np.random.default_rng(0).integers(0, 256, size=(24, 32, 3), dtype=np.uint8)
+        ok, buf = cv2.imencode(".png", img)
+        assert ok
+
+        ctx = file_utils.read_upload_image(_Upload(buf.tobytes(), "face.png"))
+
+        np.testing.assert_array_equal(ctx.bgr, img)
+        assert ctx.path is None
+        assert list(temp_uploads.iterdir()) == []
+
+    @pytest.mark.parametrize("data", [b"not an image", b"\xff\xd8\xff\xe0 truncated jpeg", b""])
+    def test_undecodable_upload_raises_and_writes_nothing(self, temp_uploads, data):
+        with pytest.raises(IOError, match="corrupted.png"):
+            file_utils.read_upload_image(_Upload(data, "corrupted.png"))
+        assert list(temp_uploads.iterdir()) == []
@@ -0,0 +1,103 @@
+"""
+tests/test_image_context.py
+───────────────────────────
+ImageContext: one read and one decode per image, derived values cached,
+and a content hash that matches the on-disk get_file_hash().
+Pure in-memory apart from a tmp_path file — no DB rows or model weights involved.
+"""
+
+from __future__ import annotations
+
+import cv2
+import numpy as np
+import pytest
+
+from utils import image_context
+from utils.file_utils import get_file_hash
+from utils.image_context import ImageContext
+
+
+def _png(seed: int = 0, size: int = 32) -> bytes:
+    rng = np.random.default_rng(seed)
+    img = rng.integers(0, 256, size=(size, size, 3), dtype=np.uint8)
+    ok, buf = cv2.imencode(".png", img)
+    assert ok
+    return buf.tobytes()
+
+
+@pytest.fixture()
+def decode_calls(monkeypatch):
+    calls = []
+    real = cv2.imdecode
+
+    def counting(buf, flags):
+        calls.append(flags)
+        return real(buf, flags)
+
+    monkeypatch.setattr(image_context.cv2, "imdecode", counting)
+    return calls
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# Decode once
+# ══════════════════════════════════════════════════════════════════════════════
+
+class TestDecodeOnce:
+
+    def test_bytes_are_decoded_once(self, decode_calls):
+        ctx = ImageContext(_png(), filename="probe.png")
+        for _ in range(3):
+            assert ctx.bgr.shape == (32, 32, 3)
+            _ = ctx.gray
+            _ = ctx.hash
+        assert len(decode_calls) == 1
+
+    def test_derived_values_are_cached(self):
+        ctx = ImageContext(_png())
+        assert ctx.gray is ctx.gray
+        assert ctx.gray.shape == (32, 32)
+        assert ctx.hash is ctx.hash
+
+    def test_of_passes_a_context_through(self, tmp_path, decode_calls):
+        path = tmp_path / "probe.png"
+        path.write_bytes(_png())
+
+        ctx = ImageContext.of(str(path))
+        assert ImageContext.of(ctx) is ctx
+        assert ctx.path == str(path)
+        assert ctx.filename == "probe.png"
+        assert len(decode_calls) == 1
+
+    def test_invalid_bytes_raise(self):
+        with pytest.raises(IOError):
+            ImageContext(b"not an image", filename="bad.jpg")
+        with pytest.raises(IOError):
+            ImageContext(b"")
+
+    def test_is_sketch_is_computed_once(self, monkeypatch):
+        sketch_mod = pytest.importorskip("preprocessing.sketch_photo_preprocess")
+        calls = []
+        monkeypatch.setattr(sketch_mod, "classify_sketch", lambda bgr, gray: calls.append(1) or True)
+
+        ctx = ImageContext(_png())
+        assert ctx.is_sketch and ctx.is_sketch
+        assert len(calls) == 1
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# Content hash
+# ══════════════════════════════════════════════════════════════════════════════
+
+class TestHash:
+
+    def test_hash_matches_get_file_hash(self, tmp_path):
+        data = _png(seed=3, size=256)
+        path = tmp_path / "suspect.png"
+        path.write_bytes(data)
+
+        assert ImageContext(data).hash == get_file_hash(str(path))
+        assert ImageContext.from_path(str(path)).hash == get_file_hash(str(path))
+
+    def test_hash_is_content_addressed(self):
+        assert ImageContext(_png(seed=1)).hash == ImageContext(_png(seed=1)).hash
+        assert ImageContext(_png(seed=1)).hash != ImageContext(_png(seed=2)).hash
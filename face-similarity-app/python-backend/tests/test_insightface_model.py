@@ -0,0 +1,317 @@
+"""
+tests/test_insightface_model.py
+───────────────────────────────
+Batched InsightFace extraction: MAX_BATCH chunking, one face per run on a
+static batch dim, output rows in input order, zero-norm rows left at zero,
+and batched output identical to per-face output. Unknown or unbuilt
+INSIGHTFACE_VARIANT values fall back to fp32. The optimised-graph cache
+is only reused while source weights, onnxruntime version and optimisation
+level all match.
+Pure in-memory apart from tmp_path model files — fakes stand in for onnxruntime.
+"""
+
+from __future__ import annotations
+
+import os
+import json
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from models import insightface_model, model_registry
+
+
+class _FakeArcFace:
+    """
+    Deterministic stand-in for w600k_r50: each sample's embedding is the
+    first 512 values of its own input, so a row can be traced back to its
+    face; a black crop embeds to the zero vector.
+    """
+
+    def __init__(self, batch_dim="N"):
+        self._input = SimpleNamespace(name="input.1", shape=[batch_dim, 3, 112, 112])
+        self.runs = []
+
+    def get_inputs(self):
+        return [self._input]
+
+    def get_outputs(self):
+        return [SimpleNamespace(name="683", shape=[self._input.shape[0], 512])]
+
+    def run(self, outputs, feeds):
+        batch = feeds["input.1"]
+        fixed = self._input.shape[0]
+        if isinstance(fixed, int) and batch.shape[0] != fixed:
+            raise ValueError(f"static batch dim {fixed}, got {batch.shape[0]}")
+        self.runs.append(batch.shape[0])
+        flat = batch.reshape(batch.shape[0], -1)[:, :512].copy()
+        flat[batch.reshape(batch.shape[0], -1).max(axis=1) < -0.99] = 0.0
+        return [flat]
+
+
+def _face(seed: int) -> np.ndarray:
+    return np.random.default_rng(seed).integers(0, 256, size=(112, 112, 3), dtype=np.uint8)
+
+
+@pytest.fixture()
+def arcface(monkeypatch):
+    """Register a fake session as the InsightFace model; returns a loader for it."""
+    model_registry.reset_after_fork()
+    monkeypatch.setattr(insightface_model, "_INSIGHTFACE_INITIALIZED", True)
+
+    def load(batch_dim="N"):
+        session = _FakeArcFace(batch_dim)
+        model_registry.load_session(insightface_model.REGISTRY_NAME, lambda: (session, "file"), (3, 112, 112))
+        return session
+
+    yield load
+    model_registry.reset_after_fork()
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# Batching
+# ══════════════════════════════════════════════════════════════════════════════
+
+class TestBatching:
+
+    def test_faces_are_chunked_at_max_batch(self, arcface, monkeypatch):
+        monkeypatch.setattr(insightface_model, "MAX_BATCH", 4)
+        session = arcface()
+
+        embs = insightface_model.extract_insightface_embeddings([_face(i) for i in range(10)])
+
+        assert session.runs == [4, 4, 2]
+        assert embs.shape == (10, 512) and embs.dtype == np.float32
+
+    def test_static_batch_dim_runs_one_face_at_a_time(self, arcface, monkeypatch):
+        monkeypatch.setattr(insightface_model, "MAX_BATCH", 4)
+        faces = [_face(i) for i in range(5)]
+        arcface()
+        dynamic = insightface_model.extract_insightface_embeddings(faces)
+
+        session = arcface(batch_dim=1)
+        static = insightface_model.extract_insightface_embeddings(faces)
+
+        assert session.runs == [1] * 5
+        np.testing.assert_array_equal(static, dynamic)
+
+    def test_batched_matches_per_face_in_order(self, arcface, monkeypatch):
+        monkeypatch.setattr(insightface_model, "MAX_BATCH", 3)
+        arcface()
+        faces = [_face(i) for i in range(7)]
+
+        batched = insightface_model.extract_insightface_embeddings(faces)
+        single = np.stack([insightface_model.extract_insightface_embedding(face) for face in faces])
+
+        np.testing.assert_allclose(batched, single, rtol=0, atol=1e-6)
+        assert len({row.tobytes() for row in batched}) == 7   # every face its own row
+        np.testing.assert_allclose(np.linalg.norm(batched, axis=1), 1.0, atol=1e-5)
+
+    def test_zero_norm_rows_stay_zero(self, arcface):
+        arcface()
+        faces = [_face(1), np.zeros((112, 112, 3), dtype=np.uint8), _face(2)]
+
+        embs = insightface_model.extract_insightface_embeddings(faces)
+
+        assert np.isfinite(embs).all()
+        assert not embs[1].any()
+        np.testing.assert_allclose(np.linalg.norm(embs[[0, 2]], axis=1), 1.0, atol=1e-5)
+
+    def test_empty_input(self, arcface):
+        session = arcface()
+        embs = insightface_model.extract_insightface_embeddings([])
+        assert embs.shape == (0, 512)
+        assert session.runs == []
+
+    def test_uninitialized_model_raises(self, arcface, monkeypatch):
+        arcface()
+        monkeypatch.setattr(insightface_model, "_INSIGHTFACE_INITIALIZED", False)
+        with pytest.raises(RuntimeError):
+            insightface_model.extract_insightface_embeddings([_face(0)])
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# Model variants
+# ══════════════════════════════════════════════════════════════════════════════
+
+@pytest.fixture()
+def weights(tmp_path, monkeypatch):
+    """fp32 weights in tmp_path; returns a writer for variant files."""
+    onnx = tmp_path / "w600k_r50.onnx"
+    onnx.write_bytes(b"weights-v1")
+    monkeypatch.setattr(insightface_model, "ONNX_PATH", str(onnx))
+    monkeypatch.setattr(insightface_model, "_ACTIVE_PATH", None)
+
+    def build(variant, data=b"quantised"):
+        path = tmp_path / f"w600k_r50.{variant}.onnx"
+        path.write_bytes(data)
+        return str(path)
+
+    return build
+
+
+class TestVariants:
+
+    def test_fp32_is_the_source_model(self, weights):
+        assert insightface_model.variant_path("fp32") == insightface_model.ONNX_PATH
+
+    @pytest.mark.parametrize("variant", ["fp16", "int8-dynamic", "int8-static"])
+    def test_variants_sit_next_to_the_source_model(self, weights, tmp_path, variant):
+        assert insightface_model.variant_path(variant) == str(tmp_path / f"w600k_r50.{variant}.onnx")
+
+    def test_unknown_variant_path_raises(self, weights):
+        with pytest.raises(ValueError):
+            insightface_model.variant_path("int4")
+
+    def test_built_variant_is_resolved(self, weights, monkeypatch):
+        path = weights("int8-static")
+        monkeypatch.setattr(insightface_model, "MODEL_VARIANT", "int8-static")
+        assert insightface_model._resolve_variant() == ("int8-static", path)
+        assert insightface_model.active_model_path() == path
+
+    def test_unknown_name_falls_back_to_fp32(self, weights, monkeypatch, capsys):
+        monkeypatch.setattr(insightface_model, "MODEL_VARIANT", "int4")
+        assert insightface_model._resolve_variant(verbose=True) == ("fp32", insightface_model.ONNX_PATH)
+        assert "Unknown INSIGHTFACE_VARIANT 'int4'" in capsys.readouterr().out
+
+    def test_unbuilt_variant_falls_back_to_fp32(self, weights, monkeypatch, capsys):
+        monkeypatch.setattr(insightface_model, "MODEL_VARIANT", "fp16")
+        assert insightface_model._resolve_variant(verbose=True) == ("fp32", insightface_model.ONNX_PATH)
+        assert "quantize_arcface.py build --variants fp16" in capsys.readouterr().out
+
+    def test_empty_variant_file_falls_back_to_fp32(self, weights, monkeypatch):
+        weights("int8-dynamic", data=b"")   # interrupted build
+        monkeypatch.setattr(insightface_model, "MODEL_VARIANT", "int8-dynamic")
+        assert insightface_model._resolve_variant() == ("fp32", insightface_model.ONNX_PATH)
+
+    def test_loaded_model_wins_over_the_setting(self, weights, monkeypatch):
+        path = weights("fp16")
+        monkeypatch.setattr(insightface_model, "_ACTIVE_PATH", path)
+        monkeypatch.setattr(insightface_model, "MODEL_VARIANT", "int8-static")
+        assert insightface_model.active_model_path() == path
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# Optimised graph cache
+# ══════════════════════════════════════════════════════════════════════════════
+
+class _FakeOrt:
+    """Just enough of the onnxruntime module for _create_session()."""
+
+    ExecutionMode = SimpleNamespace(ORT_PARALLEL="parallel", ORT_SEQUENTIAL="sequential")
+    GraphOptimizationLevel = SimpleNamespace(
+        ORT_DISABLE_ALL="disable", ORT_ENABLE_BASIC="basic",
+        ORT_ENABLE_EXTENDED="extended", ORT_ENABLE_ALL="all",
+    )
+
+    def __init__(self, version="1.17.0"):
+        self.__version__ = version
+        self.sessions = []   # (model path, graph optimisation level) per InferenceSession
+
+    class SessionOptions:
+        optimized_model_filepath = None
+
+    def InferenceSession(self, path, sess_options, providers):
+        self.sessions.append((os.path.basename(path), sess_options.graph_optimization_level))
+        if sess_options.optimized_model_filepath:   # ORT writes the optimised graph here
+            with open(sess_options.optimized_model_filepath, "wb") as f:
+                f.write(b"optimised:" + open(path, "rb").read())
+        return SimpleNamespace(path=path)
+
+
+@pytest.fixture()
+def model_dir(tmp_path, monkeypatch):
+    """fp32 weights in tmp_path with the optimised-graph cache on."""
+    onnx = tmp_path / "w600k_r50.onnx"
+    onnx.write_bytes(b"weights-v1")
+    monkeypatch.setattr(insightface_model, "ONNX_PATH", str(onnx))
+    monkeypatch.setattr(insightface_model, "MODEL_VARIANT", "fp32")
+    monkeypatch.setattr(insightface_model, "_ACTIVE_PATH", None)
+    monkeypatch.setattr(insightface_model, "ORT_CACHE_OPTIMIZED", True)
+    monkeypatch.setattr(insightface_model, "ORT_GRAPH_OPT", "all")
+    return tmp_path
+
+
+class TestOptimizedGraphCache:
+
+    def test_first_boot_optimises_and_caches(self, model_dir):
+        ort = _FakeOrt()
+        _, source = insightface_model._create_session(ort)
+
+        opt = model_dir / "w600k_r50.opt-all.onnx"
+        assert source == "optimized-now"
+        assert opt.read_bytes() == b"optimised:weights-v1"
+        assert json.loads((model_dir / "w600k_r50.opt-all.onnx.json").read_text()) == \
+            insightface_model._optimized_stamp(ort)
+        assert not [p for p in os.listdir(model_dir) if p.endswith(".tmp")]
+
+    def test_next_boot_loads_the_cached_graph_unoptimised(self, model_dir):
+        insightface_model._create_session(_FakeOrt())
+        ort = _FakeOrt()
+        _, source = insightface_model._create_session(ort)
+
+        assert source == "optimized-cache"
+        assert ort.sessions == [("w600k_r50.opt-all.onnx", "disable")]
+
+    def test_new_source_weights_invalidate_the_cache(self, model_dir):
+        ort = _FakeOrt()
+        insightface_model._create_session(ort)
+        assert insightface_model._optimized_cache_valid(ort)
+
+        (model_dir / "w600k_r50.onnx").write_bytes(b"weights-v2, retrained")
+        assert not insightface_model._optimized_cache_valid(ort)
+        _, source = insightface_model._create_session(ort)
+        assert source == "optimized-now"
+        assert (model_dir / "w600k_r50.opt-all.onnx").read_bytes() == b"optimised:weights-v2, retrained"
+
+    def test_onnxruntime_upgrade_invalidates_the_cache(self, model_dir):
+        insightface_model._create_session(_FakeOrt("1.17.0"))
+        assert not insightface_model._optimized_cache_valid(_FakeOrt("1.18.1"))
+
+    def test_graph_opt_level_change_invalidates_the_cache(self, model_dir, monkeypatch):
+        ort = _FakeOrt()
+        insightface_model._create_session(ort)
+        stamp = insightface_model._optimized_stamp(ort)
+
+        monkeypatch.setattr(insightface_model, "ORT_GRAPH_OPT", "basic")
+        assert insightface_model._optimized_stamp(ort) != stamp
+        assert not insightface_model._optimized_cache_valid(ort)
+
+        # A stamp written for another level is rejected even at the same path
+        (model_dir / "w600k_r50.opt-basic.onnx").write_bytes(b"optimised")
+        (model_dir / "w600k_r50.opt-basic.onnx.json").write_text(json.dumps(stamp))
+        assert not insightface_model._optimized_cache_valid(ort)
+
+    @pytest.mark.parametrize("damage", ["empty graph", "no stamp", "corrupt stamp"])
+    def test_damaged_cache_is_rejected(self, model_dir, damage):
+        ort = _FakeOrt()
+        insightface_model._create_session(ort)
+        opt = model_dir / "w600k_r50.opt-all.onnx"
+        if damage == "empty graph":
+            opt.write_bytes(b"")
+        elif damage == "no stamp":
+            os.remove(f"{opt}.json")
+        else:
+            (model_dir / "w600k_r50.opt-all.onnx.json").write_text("{not json")
+
+        assert not insightface_model._optimized_cache_valid(ort)
+
+    def test_temp_file_is_removed_when_the_rename_fails(self, model_dir, monkeypatch):
+        def failing_replace(src, dst):
+            raise OSError("read-only model dir")
+
+        monkeypatch.setattr(insightface_model.os, "replace", failing_replace)
+        session, source = insightface_model._create_session(_FakeOrt())
+
+        assert session is not None and source == "optimized-now"
+        assert sorted(os.listdir(model_dir)) == ["w600k_r50.onnx"]
+
+    def test_cache_off_uses_the_source_model(self, model_dir, monkeypatch):
+        monkeypatch.setattr(insightface_model, "ORT_CACHE_OPTIMIZED", False)
+        ort = _FakeOrt()
+        _, source = insightface_model._create_session(ort)
+
+        assert source == "source"
+        assert ort.sessions == [("w600k_r50.onnx", "all")]
+        assert sorted(os.listdir(model_dir)) == ["w600k_r50.onnx"]
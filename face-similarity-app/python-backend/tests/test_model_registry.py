@@ -0,0 +1,97 @@
+"""
+tests/test_model_registry.py
+────────────────────────────
+Model registry tests: one session per model, warmed in place.
+Pure in-memory — a fake session stands in for onnxruntime.
+"""
+
+from __future__ import annotations
+
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from models import model_registry
+
+
+class _FakeSession:
+    """Records the batch shapes it is run with; rejects other sizes on a static batch dim."""
+
+    def __init__(self, batch_dim="N", sample_shape=(3, 8, 8)):
+        self._input = SimpleNamespace(name="input", shape=[batch_dim, *sample_shape])
+        self.runs = []
+
+    def get_inputs(self):
+        return [self._input]
+
+    def get_outputs(self):
+        return [SimpleNamespace(name="output", shape=[self._input.shape[0], 4])]
+
+    def run(self, outputs, feeds):
+        batch = feeds["input"]
+        fixed = self._input.shape[0]
+        if isinstance(fixed, int) and batch.shape[0] != fixed:
+            raise ValueError(f"static batch dim {fixed}, got {batch.shape[0]}")
+        self.runs.append(batch.shape)
+        return [np.zeros((batch.shape[0], 4), dtype=np.float32)]
+
+
+@pytest.fixture()
+def registry():
+    model_registry.reset_after_fork()
+    yield model_registry
+    model_registry.reset_after_fork()
+
+
+def _load(registry, session, name="test-model"):
+    return registry.load_session(name, lambda: (session, "file"), (3, 8, 8))
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# Warmup
+# ══════════════════════════════════════════════════════════════════════════════
+
+class TestWarmup:
+
+    def test_dynamic_batch_warms_every_size_once(self, registry):
+        session = _FakeSession()
+        record = _load(registry, session)
+
+        warmed = registry.warmup("test-model", [1, 3, 4, 12, 3, 0])
+        assert sorted(warmed) == [1, 3, 4, 12]
+        assert [shape[0] for shape in session.runs] == [1, 3, 4, 12]
+        assert record.fixed_batch is None
+
+        assert registry.warmup("test-model", [1, 3, 4, 12]) == {}   # already warm
+        assert len(session.runs) == 4
+
+    def test_static_batch_dim_only_warms_that_size(self, registry):
+        session = _FakeSession(batch_dim=1)
+        record = _load(registry, session)
+
+        warmed = registry.warmup("test-model", [1, 3, 4, 12])
+        assert list(warmed) == [1]
+        assert session.runs == [(1, 3, 8, 8)]
+        assert record.fixed_batch == 1
+        assert record.stats()["input_shape"] == [1, 3, 8, 8]
+
+    def test_warmup_reuses_the_registered_session(self, registry):
+        session = _FakeSession()
+        _load(registry, session)
+        registry.warmup("test-model", [2])
+
+        assert registry.get_session("test-model") is session
+        assert registry.get_registry_stats()["models"]["test-model"]["warm"]
+
+    def test_unloaded_model_is_a_no_op(self, registry):
+        assert registry.warmup("missing", [1, 4]) == {}
+
+
+class TestRelease:
+
+    def test_release_drops_the_record(self, registry):
+        _load(registry, _FakeSession())
+        assert registry.release("test-model")
+        assert registry.get_record("test-model") is None
+        assert not registry.release("test-model")
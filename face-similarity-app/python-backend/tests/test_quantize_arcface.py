@@ -0,0 +1,82 @@
+"""
+tests/test_quantize_arcface.py
+──────────────────────────────
+Variant validation report: cosine drift against fp32 and rank agreement
+(top-1, top-k overlap, flip recall@1) on synthetic embeddings whose drift
+and top-1 changes are known in advance.
+Pure in-memory — no model files or onnxruntime sessions involved.
+"""
+
+from __future__ import annotations
+
+import numpy as np
+import pytest
+
+pytest.importorskip("requests")   # quantize_arcface imports embedding_service
+
+import quantize_arcface
+
+N = 8
+
+
+@pytest.fixture()
+def basis() -> np.ndarray:
+    """2N orthonormal 64-d rows: the first N are the faces, the rest are drift directions."""
+    q, _ = np.linalg.qr(np.random.default_rng(0).standard_normal((64, 2 * N)))
+    return q.T.astype(np.float32)
+
+
+def _run(gallery: np.ndarray, queries: np.ndarray) -> dict:
+    return {"gallery": {"photo": gallery, "sketch": gallery}, "queries": {"photo": queries, "sketch": queries}}
+
+
+@pytest.fixture()
+def fp32(basis) -> dict:
+    # A flipped face embeds exactly like its original, so fp32 recalls every one at rank 1
+    return _run(basis[:N], basis[:N].copy())
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# Accuracy report
+# ══════════════════════════════════════════════════════════════════════════════
+
+class TestAccuracyReport:
+
+    def test_identical_variant_agrees_everywhere(self, fp32):
+        report = quantize_arcface.accuracy_report(fp32, fp32, k=3, mode="photo")
+        assert report == {
+            "cosine_mean": 1.0, "cosine_p5": 1.0, "cosine_min": 1.0,
+            "top1_agreement": 1.0, "top3_overlap": 1.0, "flip_recall_at_1": 1.0,
+        }
+
+    def test_cosine_drift_is_measured_per_face(self, fp32, basis):
+        gallery = basis[:N].copy()
+        gallery[3] = 0.8 * basis[3] + 0.6 * basis[N + 3]   # cos(fp32, variant) = 0.8 for face 3
+        report = quantize_arcface.accuracy_report(fp32, _run(gallery, basis[:N]), k=3, mode="photo")
+
+        assert report["cosine_min"] == pytest.approx(0.8, abs=1e-4)
+        assert report["cosine_mean"] == pytest.approx((N - 1 + 0.8) / N, abs=1e-4)
+        assert report["cosine_p5"] < 1.0
+        # Drifted but still nearest to its own flip: ranking is unchanged
+        assert report["top1_agreement"] == 1.0
+        assert report["flip_recall_at_1"] == 1.0
+
+    def test_swapped_top1_is_counted(self, fp32, basis):
+        queries = basis[:N].copy()
+        queries[[0, 1]] = queries[[1, 0]]   # the variant ranks faces 0 and 1 the wrong way round
+        report = quantize_arcface.accuracy_report(fp32, _run(basis[:N], queries), k=1, mode="photo")
+
+        assert report["cosine_mean"] == pytest.approx(1.0)
+        assert report["top1_agreement"] == pytest.approx((N - 2) / N)
+        assert report["top1_overlap"] == pytest.approx((N - 2) / N)
+        assert report["flip_recall_at_1"] == pytest.approx((N - 2) / N)
+
+    def test_k_is_capped_at_the_gallery_size(self, fp32):
+        report = quantize_arcface.accuracy_report(fp32, fp32, k=50, mode="photo")
+        assert report[f"top{N}_overlap"] == 1.0
+
+    def test_modes_are_reported_separately(self, fp32, basis):
+        run = _run(basis[:N], basis[:N])
+        run["gallery"]["sketch"] = basis[N:]   # sketch mode drifted to orthogonal vectors
+        assert quantize_arcface.accuracy_report(fp32, run, k=3, mode="photo")["cosine_min"] == pytest.approx(1.0)
+        assert quantize_arcface.accuracy_report(fp32, run, k=3, mode="sketch")["cosine_mean"] == pytest.approx(0.0, abs=1e-5)
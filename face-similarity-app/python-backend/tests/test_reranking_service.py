@@ -0,0 +1,210 @@
+"""
+tests/test_reranking_service.py
+───────────────────────────────
+Stage-2 re-ranking tests: the vectorised pass must reproduce the original
+per-candidate scoring, ranking and annotation of search_criminals.
+Pure in-memory — no DB rows or model weights involved.
+"""
+
+from __future__ import annotations
+
+import numpy as np
+import pytest
+
+from services import faiss_service
+from services.reranking_service import rerank_candidates
+
+
+def _vec(seed: int, dim: int = 512) -> np.ndarray:
+    v = np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+    return v / np.linalg.norm(v)
+
+
+def _weights(w_ins: float, w_face: float) -> dict:
+    return {"insightface": w_ins, "facenet": w_face}
+
+
+def _describe(criminal_id: str) -> dict:
+    return {"criminal_id": criminal_id, "full_name": f"Name {criminal_id}"}
+
+
+@pytest.fixture()
+def cache():
+    """12 cached criminals; every third one has no Facenet vector."""
+    faiss_service.clear_embedding_cache()
+    for i in range(12):
+        face = None if i % 3 == 0 else _vec(1000 + i)
+        faiss_service.set_cached_embedding(f"CR-RR-{i:03d}", _vec(i), face)
+    yield
+    faiss_service.clear_embedding_cache()
+
+
+def _results(ids, seed: int = 7) -> list:
+    """Stage-1 shortlist with arbitrary FAISS scores (used on cache miss)."""
+    rng = np.random.default_rng(seed)
+    return [
+        {
+            "criminal_id":            cid,
+            "insightface_similarity": float(rng.uniform(0.3, 0.8)),
+            "facenet_similarity":     float(rng.uniform(0.3, 0.8)),
+            "embedding_fusion":       float(rng.uniform(0.3, 0.8)),
+        }
+        for cid in ids
+    ]
+
+
+def _reference(query, results, w_ins, w_face):
+    """The original two per-candidate loops of search_criminals."""
+    def cal(sim):
+        return (float(sim) + 1.0) / 2.0
+
+    def unit(v):
+        return v / (np.linalg.norm(v) + 1e-10)
+
+    q_ins, q_face = query["insightface"], query["facenet"]
+    m_ins  = q_ins if q_ins is not None else q_face
+    m_face = q_face if q_face is not None else q_ins
+
+    stage1 = []
+    for r in results:
+        cached = faiss_service.get_cached_embedding(r["criminal_id"])
+        if cached is not None:
+            s_ins = 0.5
+            if cached.get("insightface") is not None and m_ins is not None:
+                s_ins = cal(np.dot(unit(m_ins), unit(cached["insightface"])))
+            s_face = 0.5
+            if cached.get("facenet") is not None and m_face is not None:
+                s_face = min(cal(np.dot(unit(m_face), unit(cached["facenet"]))), 0.875)
+            fused = w_ins * s_ins + w_face * s_face
+        else:
+            s_ins, s_face, fused = (r["insightface_similarity"], r["facenet_similarity"],
+                                    r["embedding_fusion"])
+        stage1.append((r["criminal_id"], fused, s_ins, s_face))
+    stage1.sort(key=lambda c: c[1], reverse=True)
+
+    matches = []
+    for rank, (cid, fused, s_ins, s_face) in enumerate(stage1, 1):
+        cached = faiss_service.get_cached_embedding(cid)
+        if cached is not None and cached.get("insightface") is not None and q_ins is not None:
+            s_ins = cal(np.dot(unit(q_ins), unit(cached["insightface"])))
+            if q_face is not None and cached.get("facenet") is not None:
+                s_face = min(cal(np.dot(unit(q_face), unit(cached["facenet"]))), 0.875)
+                fused  = w_ins * s_ins + w_face * s_face
+            else:
+                s_face, fused = None, s_ins
+        matches.append({"criminal_id": cid, "score": fused, "ins": s_ins,
+                        "face": s_face, "stage1_rank": rank})
+    matches.sort(key=lambda m: m["score"], reverse=True)
+    return matches
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# Scoring and ranking
+# ══════════════════════════════════════════════════════════════════════════════
+
+class TestRerankScores:
+
+    @pytest.mark.parametrize("weights", [(0.1, 0.9), (0.5, 0.5)])
+    @pytest.mark.parametrize("missing", [None, "insightface", "facenet"])
+    def test_matches_per_candidate_loops(self, cache, weights, missing):
+        query = {"insightface": _vec(3) + 0.5 * _vec(50), "facenet": _vec(1004) + 0.5 * _vec(51)}
+        if missing:
+            query[missing] = None
+        ids = [f"CR-RR-{i:03d}" for i in range(12)] + ["CR-RR-MISS-1", "CR-RR-MISS-2"]
+        results = _results(ids)
+
+        matches, stats = rerank_candidates(query, results, _weights(*weights), _describe)
+        expected = _reference(query, results, *weights)
+
+        assert [m["criminal"]["criminal_id"] for m in matches] == [e["criminal_id"] for e in expected]
+        for m, e in zip(matches, expected):
+            assert m["raw_similarity_score"] == pytest.approx(e["score"], abs=1e-6)
+            assert m["raw_insightface_similarity"] == pytest.approx(e["ins"], abs=1e-6)
+            assert m["raw_facenet_similarity"] == pytest.approx(e["face"] or 0.0, abs=1e-6)
+            assert m["stage1_rank"] == e["stage1_rank"]
+            assert m["distance"] == pytest.approx(1.0 - e["score"], abs=1e-6)
+        assert stats["mean"] == pytest.approx(np.mean([e["score"] for e in expected]))
+
+    def test_cache_miss_keeps_faiss_scores(self, cache):
+        results = _results(["CR-RR-GONE"])
+        matches, _ = rerank_candidates({"insightface": _vec(1), "facenet": _vec(2)},
+                                       results, _weights(0.5, 0.5), _describe)
+
+        assert matches[0]["cache_hit"] is False
+        assert matches[0]["raw_similarity_score"] == pytest.approx(results[0]["embedding_fusion"])
+
+    def test_empty_shortlist(self, cache):
+        assert rerank_candidates({"insightface": _vec(1), "facenet": None}, [], _weights(0.5, 0.5), _describe) == ([], {})
+
+
+    def test_registered_models_are_fused(self, cache):
+        faiss_service.clear_embedding_cache()
+        faiss_service.register_model(faiss_service.ModelSpec(
+            "sketchnet", 128, {"sketch": 0.4, "photo": 0.0}, label="SketchNet", clamp=0.9,
+        ))
+        try:
+            for i in range(6):
+                faiss_service.set_cached_embedding(
+                    f"CR-RR-{i:03d}", _vec(i), _vec(1000 + i),
+                    sketchnet=None if i == 5 else _vec(5000 + i, 128),
+                )
+            query = {"insightface": _vec(3), "facenet": _vec(1003), "sketchnet": _vec(5003, 128)}
+            weights = {"insightface": 0.1, "facenet": 0.5, "sketchnet": 0.4}
+            ids = [f"CR-RR-{i:03d}" for i in range(6)]
+
+            matches, stats = rerank_candidates(query, _results(ids), weights, _describe, is_sketch=True)
+        finally:
+            faiss_service.clear_embedding_cache()
+            faiss_service.unregister_model("sketchnet")
+
+        def cal(a, b, clamp=1.0):
+            return min((float(np.dot(a, b)) + 1.0) / 2.0, clamp)
+
+        by_id = {m["criminal"]["criminal_id"]: m for m in matches}
+        assert matches[0]["criminal"]["criminal_id"] == "CR-RR-003"
+        top = by_id["CR-RR-003"]
+        expected = (0.1 * cal(_vec(3), _vec(3)) + 0.5 * cal(_vec(1003), _vec(1003), 0.875)
+                    + 0.4 * cal(_vec(5003, 128), _vec(5003, 128), 0.9))
+        assert top["raw_similarity_score"] == pytest.approx(expected, abs=1e-6)
+        assert top["raw_sketchnet_similarity"] == pytest.approx(0.9)
+        assert "sketchnet_similarity" in top["explanation"]
+        assert "mean_sketchnet" in stats
+        assert "0.40*min(cal(cosine(sketchnet)), 0.9)" in top["metric_used"]
+
+        # No SketchNet vector: that model drops out and the rest is renormalised
+        alone = by_id["CR-RR-005"]
+        expected = (0.1 * cal(_vec(3), _vec(5)) + 0.5 * cal(_vec(1003), _vec(1005), 0.875)) / 0.6
+        assert alone["raw_similarity_score"] == pytest.approx(expected, abs=1e-6)
+        assert alone["sketchnet_similarity"] == 0.0
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# Annotation
+# ══════════════════════════════════════════════════════════════════════════════
+
+class TestRerankAnnotation:
+
+    def test_statistics_follow_final_order(self, cache):
+        ids = [f"CR-RR-{i:03d}" for i in range(12)]
+        matches, stats = rerank_candidates({"insightface": _vec(5), "facenet": _vec(1005)},
+                                           _results(ids), _weights(0.5, 0.5), _describe)
+        scores = np.array([m["raw_similarity_score"] for m in matches])
+
+        assert list(scores) == sorted(scores, reverse=True)
+        assert stats["std_dev"] == pytest.approx(np.std(scores))
+        for pos, m in enumerate(matches, 1):
+            analysis = m["statistical_analysis"]
+            assert analysis["percentile"] == pytest.approx(pos / len(matches) * 100)
+            assert analysis["z_score"] == pytest.approx((scores[pos - 1] - scores.mean()) / scores.std())
+            assert m["similarity_score"] == pytest.approx(min(100.0, scores[pos - 1] * 100))
+
+    @pytest.mark.parametrize("score, category", [(0.9, "HIGH"), (0.55, "MEDIUM"), (0.45, "MEDIUM"), (0.40, "LOW")])
+    def test_category_bands(self, cache, score, category):
+        results = [{"criminal_id": "CR-RR-GONE", "insightface_similarity": score,
+                    "facenet_similarity": None, "embedding_fusion": score}]
+        matches, _ = rerank_candidates({"insightface": _vec(1), "facenet": _vec(2)},
+                                       results, _weights(0.5, 0.5), _describe)
+
+        assert matches[0]["similarity_category"] == category
+        assert matches[0]["statistical_analysis"]["z_score"] == 0.0
+        assert matches[0]["facenet_similarity"] == 0.0
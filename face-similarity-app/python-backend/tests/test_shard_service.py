@@ -0,0 +1,176 @@
+"""
+tests/test_shard_service.py
+───────────────────────────
+Sharded scatter-gather search over local shard processes.
+Pure in-memory — no DB rows or model weights involved.
+"""
+
+from __future__ import annotations
+
+import multiprocessing
+import time
+
+import numpy as np
+import pytest
+
+from services import faiss_service, shard_service
+from services.shard_service import ShardClient, ShardedGallery, shard_for, start_local_shards
+
+
+def _vec(seed: int, dim: int = 512) -> np.ndarray:
+    v = np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+    return v / np.linalg.norm(v)
+
+
+def _entries(n: int = 60) -> list:
+    return [
+        (f"CR-SHARD-{i:03d}", _vec(i), None if i % 7 == 0 else _vec(1000 + i))
+        for i in range(n)
+    ]
+
+
+@pytest.fixture(scope="module")
+def cluster():
+    """Three local shard processes holding a 60-identity gallery."""
+    gallery = ShardedGallery(start_local_shards(3), timeout=30.0)
+    gallery.load(_entries())
+    yield gallery
+    gallery.close()
+
+
+@pytest.fixture()
+def single_process():
+    """The same gallery in this process, scored exactly as the reference."""
+    faiss_service.clear_embedding_cache()
+    for cid, ins, face in _entries():
+        faiss_service.set_cached_embedding(cid, ins, face)
+    faiss_service.build_faiss_index()
+    yield
+    faiss_service.clear_embedding_cache()
+    faiss_service.build_faiss_index()
+
+
+def _stalled_shard(conn):
+    """Shard that accepts requests but never answers."""
+    while True:
+        try:
+            conn.recv()
+        except EOFError:
+            return
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# Partitioning
+# ══════════════════════════════════════════════════════════════════════════════
+
+class TestPartitioning:
+
+    def test_shard_is_stable_and_spread(self):
+        ids = [f"CR-{i:05d}" for i in range(3000)]
+        shards = [shard_for(cid, 4) for cid in ids]
+
+        assert shards == [shard_for(cid, 4) for cid in ids]
+        counts = np.bincount(shards, minlength=4)
+        assert counts.min() > 600
+
+    def test_load_spreads_gallery(self, cluster):
+        sizes = [s["cache_size"] for s in cluster.stats().values()]
+        assert sum(sizes) == 60 and min(sizes) > 0
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# Scatter-gather search
+# ══════════════════════════════════════════════════════════════════════════════
+
+class TestScatterGather:
+
+    @pytest.mark.parametrize("is_sketch", [False, True])
+    def test_matches_single_process_search(self, cluster, single_process, is_sketch):
+        # top_k covers a whole shard, so every shard's FAISS fusion is exact too
+        q_ins, q_face = _vec(5) + 0.4 * _vec(77), _vec(1005) + 0.4 * _vec(78)
+        expected = faiss_service.linear_search_embeddings(q_ins, q_face, top_k=30, is_sketch=is_sketch)
+        got, status = cluster.search_top_k_candidates(q_ins, q_face, top_k=30, is_sketch=is_sketch)
+
+        assert status == {"partial": False, "shards": 3, "answered": [0, 1, 2], "missing": []}
+        assert [c["criminal_id"] for c in got] == [c["criminal_id"] for c in expected]
+        for g, e in zip(got, expected):
+            assert g["embedding_fusion"] == pytest.approx(e["embedding_fusion"], abs=1e-6)
+
+    def test_writes_route_to_owning_shard(self, cluster):
+        cluster.add_embedding("CR-SHARD-NEW", _vec(500), _vec(1500))
+        top, _ = cluster.search_top_k_candidates(_vec(500), _vec(1500), top_k=3)
+        assert top[0]["criminal_id"] == "CR-SHARD-NEW"
+
+        owner = shard_for("CR-SHARD-NEW", 3)
+        assert cluster.stats()[owner]["cache_size"] > 0
+        assert cluster.remove_embedding("CR-SHARD-NEW") is True
+        top, _ = cluster.search_top_k_candidates(_vec(500), _vec(1500), top_k=3)
+        assert "CR-SHARD-NEW" not in [c["criminal_id"] for c in top]
+
+    def test_filters_apply_on_every_shard(self, cluster):
+        wanted = {"CR-SHARD-003", "CR-SHARD-020", "CR-SHARD-041"}
+        for cid in wanted:
+            cluster.set_criminal_attributes(cid, status="Wanted")
+
+        top, status = cluster.search_top_k_candidates(
+            _vec(3), _vec(1003), top_k=10, filters={"status": "Wanted"}
+        )
+        assert not status["partial"]
+        assert {c["criminal_id"] for c in top} == wanted
+        assert top[0]["criminal_id"] == "CR-SHARD-003"
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# Degraded shards
+# ══════════════════════════════════════════════════════════════════════════════
+
+class TestPartialResults:
+
+    def test_slow_shard_is_skipped(self, cluster):
+        ctx = multiprocessing.get_context("spawn")
+        parent, child = ctx.Pipe()
+        stalled = ctx.Process(target=_stalled_shard, args=(child,), daemon=True)
+        stalled.start()
+        degraded = ShardedGallery(cluster.clients + [ShardClient(3, parent, stalled)], timeout=0.5)
+
+        start = time.monotonic()
+        top, status = degraded.search_top_k_candidates(_vec(8), _vec(1008), top_k=5, timeout=0.5)
+
+        assert time.monotonic() - start < 5
+        assert status["partial"] and status["missing"] == [3]
+        assert len(top) == 5
+        stalled.terminate()
+        stalled.join()
+
+    def test_dead_shard_is_skipped(self):
+        gallery = ShardedGallery(start_local_shards(2), timeout=30.0)
+        try:
+            gallery.load(_entries(20))
+            gallery.clients[1].process.terminate()
+            gallery.clients[1].process.join()
+
+            top, status = gallery.search_top_k_candidates(_vec(4), _vec(1004), top_k=20)
+            assert status["partial"] and status["missing"] == [1]
+            assert top and all(shard_for(c["criminal_id"], 2) == 0 for c in top)
+        finally:
+            gallery.close()
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# Remote transport
+# ══════════════════════════════════════════════════════════════════════════════
+
+class TestRemoteAuth:
+
+    def test_remote_shards_refuse_to_run_without_authkey(self, monkeypatch):
+        monkeypatch.setattr(shard_service, "FAISS_SHARD_AUTHKEY", b"")
+        with pytest.raises(RuntimeError, match="FAISS_SHARD_AUTHKEY"):
+            shard_service.serve_shard(("127.0.0.1", 0))
+        with pytest.raises(RuntimeError, match="FAISS_SHARD_AUTHKEY"):
+            shard_service.connect_shard(0, ("127.0.0.1", 7001))
+
+    def test_explicit_authkey_is_used(self, monkeypatch):
+        monkeypatch.setattr(shard_service, "FAISS_SHARD_AUTHKEY", b"")
+        assert shard_service._require_authkey(b"secret") == b"secret"
+        monkeypatch.setattr(shard_service, "FAISS_SHARD_AUTHKEY", b"from-env")
+        assert shard_service._require_authkey(None) == b"from-env"
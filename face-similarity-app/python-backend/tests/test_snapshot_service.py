@@ -0,0 +1,281 @@
+"""
+tests/test_snapshot_service.py
+──────────────────────────────
+FAISS snapshots and the shared multi-worker gallery: save / load with delta
+replay, attach via mmap, journaled writes, compaction and unpublished writes.
+In-memory gallery plus a tmp_path snapshot directory — no DB rows or model
+weights involved.
+"""
+
+from __future__ import annotations
+
+import os
+import base64
+
+import numpy as np
+import pytest
+
+from services import faiss_service, filter_service, snapshot_service
+
+
+def _vec(seed: int, dim: int = 512) -> np.ndarray:
+    v = np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+    return v / np.linalg.norm(v)
+
+
+@pytest.fixture()
+def gallery():
+    """Fresh 20-identity gallery with built indexes."""
+    faiss_service.clear_embedding_cache()
+    for i in range(20):
+        faiss_service.set_cached_embedding(f"CR-FAISS-{i:03d}", _vec(i), _vec(1000 + i))
+    faiss_service.build_faiss_index()
+    yield
+    faiss_service.clear_embedding_cache()
+    faiss_service.build_faiss_index()
+
+
+def _top_id(query_seed: int) -> str:
+    candidates, used_faiss = faiss_service.search_top_k_candidates(
+        _vec(query_seed), _vec(1000 + query_seed), top_k=5
+    )
+    assert used_faiss
+    return candidates[0]["criminal_id"]
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# Snapshots
+# ══════════════════════════════════════════════════════════════════════════════
+
+@pytest.fixture()
+def snapshot_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(snapshot_service, "FAISS_SNAPSHOT_DIR", str(tmp_path / "snap"))
+    return tmp_path / "snap"
+
+
+def _reload_gallery(entries):
+    """Simulate a restart: repopulate the cache, then take the startup path."""
+    faiss_service.clear_embedding_cache()
+    for cid, ins, face in entries:
+        faiss_service.set_cached_embedding(cid, ins, face)
+
+
+class TestSnapshots:
+
+    def test_snapshot_round_trip_replays_delta(self, gallery, snapshot_dir):
+        assert snapshot_service.save_faiss_snapshot(model_hash="abc")
+
+        entries = [(f"CR-FAISS-{i:03d}", _vec(i), _vec(1000 + i)) for i in range(1, 20)]
+        entries[0] = ("CR-FAISS-001", _vec(901), _vec(1901))      # changed
+        entries.append(("CR-FAISS-NEW", _vec(500), _vec(1500)))   # added; 000 removed
+        _reload_gallery(entries)
+
+        assert snapshot_service.load_faiss_snapshot(model_hash="abc")
+
+        stats = faiss_service.get_faiss_index_stats()
+        assert not stats["is_dirty"]
+        assert stats["criminal_ids_count"] == 20
+        assert _top_id(500) == "CR-FAISS-NEW"
+        assert _top_id(901) == "CR-FAISS-001"
+        candidates, _ = faiss_service.search_top_k_candidates(_vec(0), _vec(1000), top_k=20)
+        assert "CR-FAISS-000" not in [c["criminal_id"] for c in candidates]
+
+    def test_model_hash_mismatch_forces_rebuild(self, gallery, snapshot_dir):
+        snapshot_service.save_faiss_snapshot(model_hash="abc")
+        _reload_gallery([(f"CR-FAISS-{i:03d}", _vec(i), _vec(1000 + i)) for i in range(20)])
+
+        assert not snapshot_service.load_faiss_snapshot(model_hash="def")
+        assert faiss_service.get_faiss_index_stats()["is_dirty"]
+
+    def test_load_or_build_writes_snapshot(self, snapshot_dir):
+        _reload_gallery([(f"CR-FAISS-{i:03d}", _vec(i), _vec(1000 + i)) for i in range(20)])
+
+        snapshot_service.load_or_build_faiss_index(model_hash="abc")
+
+        assert (snapshot_dir / "CURRENT").is_file()
+        assert _top_id(7) == "CR-FAISS-007"
+        faiss_service.clear_embedding_cache()
+
+
+@pytest.fixture()
+def shared_mode(snapshot_dir, monkeypatch):
+    monkeypatch.setattr(snapshot_service, "FAISS_SHARED_GALLERY", True)
+    monkeypatch.setattr(snapshot_service, "_ATTACHED_SNAPSHOT", None)
+    monkeypatch.setattr(snapshot_service, "_JOURNAL_OFFSET", 0)
+    monkeypatch.setattr(snapshot_service, "_JOURNAL_LENGTH", 0)
+    monkeypatch.setattr(snapshot_service, "_UNPUBLISHED", {})
+    return snapshot_dir
+
+
+def _journal_lines() -> int:
+    path = snapshot_service._current_snapshot_path()
+    journal = os.path.join(path, snapshot_service._SNAPSHOT_JOURNAL)
+    if not os.path.exists(journal):
+        return 0
+    with open(journal) as f:
+        return sum(1 for _ in f)
+
+
+class TestSharedGallery:
+
+    def test_attach_serves_gallery_from_mmap(self, gallery, shared_mode):
+        filter_service.set_criminal_attributes("CR-FAISS-007", sex="Female")
+        assert snapshot_service.save_faiss_snapshot()
+        faiss_service.clear_embedding_cache()   # another process: nothing in memory
+
+        assert snapshot_service.attach_shared_gallery()
+
+        entry = faiss_service.get_cached_embedding("CR-FAISS-007")
+        assert isinstance(entry["insightface"], np.memmap)
+        assert faiss_service.get_cache_size() == 20
+        assert _top_id(7) == "CR-FAISS-007"
+        assert filter_service.compile_filter({"sex": "female"}) == {"CR-FAISS-007"}
+
+    def test_stale_worker_syncs_after_another_workers_write(self, gallery, shared_mode):
+        snapshot_service.save_faiss_snapshot()
+        with snapshot_service.shared_gallery_write():
+            faiss_service.add_embedding("CR-FAISS-NEW", _vec(500), _vec(1500))
+            faiss_service.remove_embedding("CR-FAISS-003")
+
+        # Roll this process back to a pre-write view, as a sibling worker would have
+        faiss_service.clear_embedding_cache()
+        faiss_service.build_faiss_index()
+        snapshot_service._ATTACHED_SNAPSHOT = None
+
+        assert snapshot_service.sync_shared_gallery(force=True)
+        assert _top_id(500) == "CR-FAISS-NEW"
+        assert faiss_service.get_cached_embedding("CR-FAISS-003") is None
+        assert not snapshot_service.sync_shared_gallery(force=True)   # already current
+
+    def test_writes_are_journaled_not_resnapshotted(self, gallery, shared_mode):
+        snapshot_service.save_faiss_snapshot()
+        before = snapshot_service._current_snapshot_path()
+
+        with snapshot_service.shared_gallery_write():
+            faiss_service.add_embedding("CR-FAISS-NEW", _vec(500), _vec(1500))
+            filter_service.set_criminal_attributes("CR-FAISS-NEW", sex="Female")
+        with snapshot_service.shared_gallery_write():
+            faiss_service.remove_embedding("CR-FAISS-003")
+
+        assert snapshot_service._current_snapshot_path() == before
+        assert _journal_lines() == 2
+
+    def test_sibling_replays_journal_entries_incrementally(self, gallery, shared_mode):
+        snapshot_service.save_faiss_snapshot()
+        assert snapshot_service.attach_shared_gallery()
+        path = snapshot_service._current_snapshot_path()
+
+        # Entries appended by another worker, found on the next sync without re-attaching
+        new = {
+            "id": "CR-FAISS-NEW",
+            "vectors": {
+                "insightface": base64.b64encode(_vec(500).tobytes()).decode(),
+                "facenet": base64.b64encode(_vec(1500).tobytes()).decode(),
+            },
+            "attributes": {"sex": ["female"]},
+        }
+        gone = {"id": "CR-FAISS-003", "vectors": None, "attributes": {}}
+        snapshot_service._append_journal(path, [new, gone])
+
+        assert snapshot_service.sync_shared_gallery(force=True)
+        assert snapshot_service._ATTACHED_SNAPSHOT == os.path.basename(path)
+        assert _top_id(500) == "CR-FAISS-NEW"
+        assert faiss_service.get_cached_embedding("CR-FAISS-003") is None
+        assert "CR-FAISS-NEW" in filter_service.compile_filter({"sex": "female"})
+        assert not snapshot_service.sync_shared_gallery(force=True)
+
+    def test_long_journal_is_compacted_into_a_new_snapshot(self, gallery, shared_mode, monkeypatch):
+        monkeypatch.setattr(snapshot_service, "FAISS_JOURNAL_COMPACT", 2)
+        snapshot_service.save_faiss_snapshot()
+        before = snapshot_service._current_snapshot_path()
+
+        for i in range(3):
+            with snapshot_service.shared_gallery_write():
+                faiss_service.add_embedding(f"CR-FAISS-NEW{i}", _vec(500 + i), _vec(1500 + i))
+
+        assert snapshot_service._current_snapshot_path() != before
+        assert _journal_lines() == 0
+        assert faiss_service.get_cache_size() == 23
+
+    def test_write_with_dirty_index_is_still_published(self, gallery, shared_mode, monkeypatch):
+        snapshot_service.save_faiss_snapshot()
+        monkeypatch.setattr(faiss_service, "FAISS_INDEX_DIRTY", True)
+
+        with snapshot_service.shared_gallery_write():
+            faiss_service.add_embedding("CR-FAISS-NEW", _vec(500), _vec(1500))
+
+        assert _journal_lines() == 1
+
+    def test_failed_publish_is_raised(self, gallery, shared_mode, monkeypatch):
+        snapshot_service.save_faiss_snapshot()
+        calls = []
+
+        def failing_append(path, records):
+            calls.append(records)
+            raise OSError("disk full")
+
+        monkeypatch.setattr(snapshot_service, "_append_journal", failing_append)
+        monkeypatch.setattr(snapshot_service.time, "sleep", lambda s: None)
+
+        with pytest.raises(snapshot_service.GalleryPublishError):
+            with snapshot_service.shared_gallery_write():
+                faiss_service.add_embedding("CR-FAISS-NEW", _vec(500), _vec(1500))
+        assert len(calls) == snapshot_service.FAISS_JOURNAL_RETRIES
+
+    def test_unpublished_write_is_kept_and_forces_next_snapshot(self, gallery, shared_mode, monkeypatch):
+        snapshot_service.save_faiss_snapshot()
+        before = snapshot_service._current_snapshot_path()
+        real_append = snapshot_service._append_journal
+        disk_full = [True]
+
+        def flaky_append(path, records):
+            if disk_full[0]:
+                raise OSError("disk full")
+            return real_append(path, records)
+
+        monkeypatch.setattr(snapshot_service, "_append_journal", flaky_append)
+        monkeypatch.setattr(snapshot_service.time, "sleep", lambda s: None)
+
+        # Committed delete whose journal append fails: still gone in this worker
+        with pytest.raises(snapshot_service.GalleryPublishError):
+            with snapshot_service.shared_gallery_write():
+                faiss_service.remove_embedding("CR-FAISS-003")
+        assert set(snapshot_service._UNPUBLISHED) == {"CR-FAISS-003"}
+        snapshot_service.attach_shared_gallery()   # re-attaching must not bring it back
+        assert faiss_service.get_cached_embedding("CR-FAISS-003") is None
+
+        # The next write folds it into a new snapshot instead of journaling
+        disk_full[0] = False
+        with snapshot_service.shared_gallery_write():
+            faiss_service.add_embedding("CR-FAISS-NEW", _vec(500), _vec(1500))
+
+        assert snapshot_service._current_snapshot_path() != before
+        assert snapshot_service._UNPUBLISHED == {}
+        assert _journal_lines() == 0
+
+        # A sibling attaching now sees both writes
+        faiss_service.clear_embedding_cache()
+        assert snapshot_service.attach_shared_gallery()
+        assert faiss_service.get_cached_embedding("CR-FAISS-003") is None
+        assert _top_id(500) == "CR-FAISS-NEW"
+
+    def test_newer_journal_entry_replaces_unpublished_write(self, gallery, shared_mode):
+        snapshot_service.save_faiss_snapshot()
+        assert snapshot_service.attach_shared_gallery()
+        faiss_service.remove_embedding("CR-FAISS-003")
+        snapshot_service._UNPUBLISHED["CR-FAISS-003"] = snapshot_service._journal_record("CR-FAISS-003")
+
+        # Another worker re-added the criminal afterwards
+        readded = {
+            "id": "CR-FAISS-003",
+            "vectors": {
+                "insightface": base64.b64encode(_vec(3).tobytes()).decode(),
+                "facenet": base64.b64encode(_vec(1003).tobytes()).decode(),
+            },
+            "attributes": {},
+        }
+        snapshot_service._append_journal(snapshot_service._current_snapshot_path(), [readded])
+
+        assert snapshot_service.sync_shared_gallery(force=True)
+        assert snapshot_service._UNPUBLISHED == {}
+        assert faiss_service.get_cached_embedding("CR-FAISS-003") is not None
@@ -1,10 +1,23 @@
 """
 Caching utilities for result caching with LRU eviction policy
+
+Two layers:
+  RESULT_CACHE          complete comparison results, keyed by the image pair.
+  IMAGE_EMBEDDING_CACHE per-image extraction results (aligned face, InsightFace
+                        and Facenet embeddings, region embeddings), keyed by
+                        content hash + mode + preprocessing params + model
+                        version, bounded by total bytes rather than entry count.
+                        One sketch compared against many photos, or submitted
+                        to search again, is only extracted once.
 """
 
+import os
+import threading
 from collections import OrderedDict
 from typing import Optional
 
+import numpy as np
+
 # Global LRU cache for comparison results using OrderedDict
 # OrderedDict maintains insertion order and allows efficient reordering
 RESULT_CACHE = OrderedDict()
@@ -76,3 +89,154 @@ def get_cache_stats() -> dict:
         'oldest_key': list(RESULT_CACHE.keys())[0] if RESULT_CACHE else None,
         'newest_key': list(RESULT_CACHE.keys())[-1] if RESULT_CACHE else None
     }
+
+
+# ============================================================================
+# PER-IMAGE EMBEDDING CACHE (content-addressed, byte-bounded LRU)
+# ============================================================================
+
+IMAGE_EMBEDDING_CACHE = OrderedDict()   # key -> (entry dict, size in bytes)
+IMAGE_CACHE_MAX_BYTES = int(float(os.environ.get("IMAGE_EMBEDDING_CACHE_MB", "256")) * 1024 * 1024)
+_IMAGE_CACHE_BYTES = 0
+_IMAGE_CACHE_HITS = 0
+_IMAGE_CACHE_MISSES = 0
+_IMAGE_CACHE_LOCK = threading.Lock()
+
+
+def make_image_cache_key(image_hash: str, is_sketch: bool, params: tuple, model_version: str) -> str:
+    """
+    Build a per-image cache key.
+
+    Args:
+        image_hash: Content hash of the encoded image (ImageContext.hash)
+        is_sketch: Sketch/photo mode the image is processed in
+        params: Preprocessing parameters that change the output (TTA, Canny mode...)
+        model_version: Version of the weights producing the embeddings
+
+    Returns:
+        str: Cache key
+    """
+    mode = "sketch" if is_sketch else "photo"
+    return f"{image_hash}_{mode}_{'_'.join(str(p) for p in params)}_{model_version}"
+
+
+def _entry_nbytes(value) -> int:
+    """Approximate footprint of a cached entry (arrays dominate)."""
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, dict):
+        return sum(_entry_nbytes(v) for v in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(_entry_nbytes(v) for v in value)
+    return 64
+
+
+def get_cached_image_entry(cache_key: str) -> Optional[dict]:
+    """
+    Get a per-image entry and mark it as recently used (LRU)
+
+    The returned dict is shared with the cache - do not modify its arrays in
+    place; use update_cached_image_entry() to add fields.
+
+    Args:
+        cache_key: Key from make_image_cache_key()
+
+    Returns:
+        dict: Cached entry or None if not found
+    """
+    global _IMAGE_CACHE_HITS, _IMAGE_CACHE_MISSES
+
+    with _IMAGE_CACHE_LOCK:
+        item = IMAGE_EMBEDDING_CACHE.get(cache_key)
+        if item is None:
+            _IMAGE_CACHE_MISSES += 1
+            return None
+        IMAGE_EMBEDDING_CACHE.move_to_end(cache_key)
+        _IMAGE_CACHE_HITS += 1
+        return item[0]
+
+
+def _store_image_entry(cache_key: str, entry: dict, size: int):
+    """Insert / replace an entry and evict down to budget (caller holds _IMAGE_CACHE_LOCK)."""
+    global _IMAGE_CACHE_BYTES
+
+    old = IMAGE_EMBEDDING_CACHE.pop(cache_key, None)
+    if old is not None:
+        _IMAGE_CACHE_BYTES -= old[1]
+    IMAGE_EMBEDDING_CACHE[cache_key] = (entry, size)
+    _IMAGE_CACHE_BYTES += size
+
+    while _IMAGE_CACHE_BYTES > IMAGE_CACHE_MAX_BYTES:
+        evicted_key, (_, evicted_size) = IMAGE_EMBEDDING_CACHE.popitem(last=False)
+        _IMAGE_CACHE_BYTES -= evicted_size
+        print(f"[CACHE] Evicted image entry: {evicted_key[:50]}... ({evicted_size} bytes)")
+
+
+def set_cached_image_entry(cache_key: str, entry: dict):
+    """
+    Store a per-image entry, evicting least recently used entries until the
+    cache fits in IMAGE_CACHE_MAX_BYTES.
+
+    An entry larger than the whole budget is not stored.
+
+    Args:
+        cache_key: Key from make_image_cache_key()
+        entry: Extraction results for one image
+    """
+    size = _entry_nbytes(entry)
+    if size > IMAGE_CACHE_MAX_BYTES:
+        return
+    with _IMAGE_CACHE_LOCK:
+        _store_image_entry(cache_key, entry, size)
+
+
+def update_cached_image_entry(cache_key: str, **fields) -> bool:
+    """
+    Add fields (e.g. region embeddings) to an existing entry, re-accounting its size.
+
+    Read, merge and write happen under one lock hold, so concurrent updates
+    never drop each other's fields and an evicted entry is not brought back.
+
+    Returns:
+        bool: False if the entry has been evicted meanwhile (or would no longer fit)
+    """
+    with _IMAGE_CACHE_LOCK:
+        item = IMAGE_EMBEDDING_CACHE.get(cache_key)
+        if item is None:
+            return False
+        merged = {**item[0], **fields}
+        size = _entry_nbytes(merged)
+        if size > IMAGE_CACHE_MAX_BYTES:
+            return False
+        _store_image_entry(cache_key, merged, size)
+        return True
+
+
+def clear_image_cache():
+    """Clear all per-image entries"""
+    global _IMAGE_CACHE_BYTES, _IMAGE_CACHE_HITS, _IMAGE_CACHE_MISSES
+
+    with _IMAGE_CACHE_LOCK:
+        IMAGE_EMBEDDING_CACHE.clear()
+        _IMAGE_CACHE_BYTES = 0
+        _IMAGE_CACHE_HITS = 0
+        _IMAGE_CACHE_MISSES = 0
+
+
+def get_image_cache_stats() -> dict:
+    """
+    Get per-image cache statistics
+
+    Returns:
+        dict: Entry count, bytes used / budget and hit rate
+    """
+    lookups = _IMAGE_CACHE_HITS + _IMAGE_CACHE_MISSES
+    return {
+        'size': len(IMAGE_EMBEDDING_CACHE),
+        'bytes': _IMAGE_CACHE_BYTES,
+        'max_bytes': IMAGE_CACHE_MAX_BYTES,
+        'hits': _IMAGE_CACHE_HITS,
+        'misses': _IMAGE_CACHE_MISSES,
+        'hit_rate': round(_IMAGE_CACHE_HITS / lookups, 4) if lookups else 0.0,
+        'cache_type': 'LRU (byte-bounded)',
+    }
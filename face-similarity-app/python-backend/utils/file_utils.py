@@ -4,9 +4,10 @@ File handling utilities for temporary file management
 import os
 import uuid
 import hashlib
-import cv2
 from typing import Optional
 
+from utils.image_context import ImageContext
+
 
 # Temp uploads directory (will be set by app initialization)
 TEMP_UPLOADS_DIR = None
@@ -103,55 +104,21 @@ def get_file_hash(file_path: str) -> Optional[str]:
         return None
 
 
-def save_temp_file(file_storage) -> str:
+def read_upload_image(file_storage) -> ImageContext:
     """
-    Save uploaded file to temp_uploads folder
+    Decode an uploaded file in memory (no temp file)
+    
+    The upload bytes are decoded once with cv2.imdecode; the returned
+    ImageContext carries the bytes, the decoded image and (lazily)
+    grayscale, hash and sketch classification. Nothing touches disk.
     
     Args:
         file_storage: Flask FileStorage object
     
     Returns:
-        str: Path to saved file
-    """
-    filepath = generate_temp_filepath(original_filename=file_storage.filename, prefix='upload')
-    file_storage.save(filepath)
-    
-    # Validate file was saved
-    if not os.path.exists(filepath):
-        raise IOError(f"Failed to save uploaded file to: {filepath}")
+        ImageContext: Decoded upload (.path is None)
     
-    # Validate file can be read by cv2
-    test_img = cv2.imread(filepath)
-    if test_img is None:
-        cleanup_temp_file(filepath)
-        raise IOError(f"Uploaded file is corrupted or invalid format: {file_storage.filename}")
-    
-    return filepath
-
-
-def save_bytes_to_temp(data: bytes, original_filename: str) -> str:
+    Raises:
+        IOError: If the upload is not a decodable image
     """
-    Save bytes data to temp_uploads folder
-    
-    Args:
-        data: Image data as bytes
-        original_filename: Original filename (for extension)
-    
-    Returns:
-        str: Path to saved file
-    """
-    filepath = generate_temp_filepath(original_filename=original_filename, prefix='bytes')
-    with open(filepath, 'wb') as f:
-        f.write(data)
-    
-    # Validate file was saved
-    if not os.path.exists(filepath):
-        raise IOError(f"Failed to save bytes to file: {filepath}")
-    
-    # Validate file can be read by cv2
-    test_img = cv2.imread(filepath)
-    if test_img is None:
-        cleanup_temp_file(filepath)
-        raise IOError(f"Saved bytes data is corrupted or invalid format")
-    
-    return filepath
+    return ImageContext(file_storage.read(), filename=file_storage.filename)
@@ -0,0 +1,89 @@
+"""
+Decode-once image context for the comparison pipeline.
+
+One ImageContext is created per uploaded/loaded image and passed down through
+forensic_face_comparison(), extract_dual_embeddings() and the preprocessing
+helpers instead of a file path. The raw bytes are read once, decoded once,
+and the derived values (grayscale, content hash, sketch classification) are
+computed on first use and then reused by every later step.
+
+Functions that still take a path accept either; ImageContext.of() wraps a
+path so legacy callers keep working.
+"""
+import hashlib
+import os
+from typing import Optional
+
+import cv2
+import numpy as np
+
+
+class ImageContext:
+    """Raw bytes + decoded BGR image of one upload, with cached derived values."""
+
+    __slots__ = ("path", "filename", "_data", "_bgr", "_gray", "_hash", "_is_sketch")
+
+    def __init__(self, data: bytes, path: Optional[str] = None, filename: Optional[str] = None):
+        """
+        Args:
+            data: Encoded image bytes (JPEG/PNG/...)
+            path: Where the same bytes live on disk, if anywhere
+            filename: Original upload name (for logging)
+
+        Raises:
+            IOError: If the bytes cannot be decoded as an image
+        """
+        self.path = path
+        self.filename = filename or (os.path.basename(path) if path else "<memory>")
+        self._data = data
+        self._bgr = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR) if data else None
+        if self._bgr is None:
+            raise IOError(f"Image is corrupted or invalid format: {self.filename}")
+        self._gray = None
+        self._hash = None
+        self._is_sketch = None
+
+    @classmethod
+    def from_path(cls, path: str, filename: Optional[str] = None) -> "ImageContext":
+        """Read and decode a file once."""
+        with open(path, 'rb') as f:
+            return cls(f.read(), path=path, filename=filename)
+
+    @classmethod
+    def of(cls, image) -> "ImageContext":
+        """Return `image` if it already is a context, otherwise load it from its path."""
+        return image if isinstance(image, cls) else cls.from_path(image)
+
+    @property
+    def data(self) -> bytes:
+        return self._data
+
+    @property
+    def bgr(self) -> np.ndarray:
+        """Decoded uint8 BGR image (shared - copy before modifying in place)."""
+        return self._bgr
+
+    @property
+    def gray(self) -> np.ndarray:
+        if self._gray is None:
+            self._gray = cv2.cvtColor(self._bgr, cv2.COLOR_BGR2GRAY)
+        return self._gray
+
+    @property
+    def hash(self) -> str:
+        """MD5 of the raw bytes (same value get_file_hash() gives for the file)."""
+        if self._hash is None:
+            self._hash = hashlib.md5(self._data).hexdigest()
+        return self._hash
+
+    @property
+    def is_sketch(self) -> bool:
+        """Sketch/photo classification, computed once."""
+        if self._is_sketch is None:
+            from preprocessing.sketch_photo_preprocess import classify_sketch
+            self._is_sketch = classify_sketch(self._bgr, self.gray)
+        return self._is_sketch
+
+    def __repr__(self) -> str:
+        h, w = self._bgr.shape[:2]
+        return f"ImageContext({self.filename!r}, {w}x{h}, {len(self._data)} bytes)"